@@ -1,53 +1,63 @@
+import time
+TIEMPO_INICIO_SCRIPT = time.perf_counter() # Referencia para medir importaciones y primer render
+
 import streamlit as st
 import pandas as pd
 import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go 
 import io
 import json
 import re 
+import uuid
+import os
+import functools
+import logging
+import sqlite3
+
+# Motor de cálculo (constantes, BD de especies y fórmulas), compartido con la API HTTP (api_co2e.py)
+from motor_co2e import (
+    AGB_FACTOR_A, AGB_FACTOR_B, FACTOR_KG_A_TON, FACTOR_L_A_M3, PRECIO_AGUA_POR_M3, DENSIDADES_BASE,
+    fusionar_info_especies, get_co2e_total_seguro, get_costo_total_seguro, get_agua_total_seguro,
+    calcular_co2_arbol, calcular_co2_vectorizado, recalcular_inventario, calcular_potencial_maximo_lotes,
+    recalcular_inventario_por_bloques, estimar_co2e_muestra, estimar_co2e_restante,
+)
+from historial_inventario import HistorialInventario
+from indice_espacial import (
+    IndiceEspacial, NIVEL_MIN, NIVEL_MAX, agregar_celdas, sumar_celdas, coordenadas_validas, bbox_alrededor,
+)
+from trabajos_fondo import GestorTrabajos, TrabajoCancelado, COMPLETADO, ERROR
+from creditos_carbono import (
+    HORIZONTE_POR_DEFECTO, BUFFER_POOL_POR_DEFECTO, TASA_DESCUENTO_POR_DEFECTO, PERIODO_VERIFICACION_POR_DEFECTO,
+    ESCENARIOS_PRECIO_POR_DEFECTO, calcular_flujos_creditos,
+)
+from memoria_sesiones import RegistroMemoria
+from portafolio import ERRORES_ARCHIVO_PROYECTO, ResumenesPortafolio, serializar_proyecto, leer_proyecto, cobertura_huella
+from calidad_datos import COLUMNA_RESUMEN as COLUMNA_ALERTAS, evaluar_calidad_lotes, resumen_alertas
+from indice_especies import IndiceEspecies, leer_base_densidades, incorporar_base_densidades
+from muestreo_parcelas import CONFIANZA_POR_DEFECTO, REPLICAS_POR_DEFECTO, leer_parcelas, estimar_parcelas
+from tabla_virtual import IndiceTabla
+from cruce_neutralidad import proyectar_captura_proyecto, analizar_cruce
+from cache_disco import CacheDisco, clave_contenido
+from supervivencia import (
+    MORTALIDAD_ESTABLECIMIENTO_POR_DEFECTO, MORTALIDAD_ADULTA_POR_DEFECTO, ANIOS_ESTABLECIMIENTO, SIMULACIONES_POR_DEFECTO,
+    SEMILLA_POR_DEFECTO as SEMILLA_SUPERVIVENCIA, CUANTILES as CUANTILES_SUPERVIVENCIA, POLITICAS_REPOSICION, simular_supervivencia,
+)
+from proyectos_compartidos import ProyectoCompartido, cambios_especies, aplicar_cambios_especies
+from exportacion_excel import MODOS_EVIDENCIA, generar_excel_memoria
+from publicacion import construir_publicacion, guardar_publicacion, cargar_publicacion, especies_publicadas
+from balance_hidrico import (
+    NOMBRES_MESES, KC_POR_DEFECTO, EFICIENCIA_RIEGO_POR_DEFECTO,
+    leer_clima_mensual, deficit_por_sitio, asignar_sitios, demanda_mensual_lotes,
+)
+# plotly y xlsxwriter se importan de forma diferida dentro de las funciones que los usan
+# (ver "RENDIMIENTO DE ARRANQUE") para no cargarlos en páginas que no grafican ni exportan.
+
+TIEMPO_IMPORTACIONES = time.perf_counter() - TIEMPO_INICIO_SCRIPT
 
 # --- CONFIGURACIÓN INICIAL ---
 st.set_page_config(page_title="Plataforma de Gestión NBS", layout="wide", page_icon="🌳")
 
 # --- CONSTANTES GLOBALES Y BASES DE DATOS ---
-FACTOR_CARBONO = 0.47
-FACTOR_CO2E = 3.67
-FACTOR_BGB_SECO = 0.28
-AGB_FACTOR_A = 0.112
-AGB_FACTOR_B = 0.916
-FACTOR_KG_A_TON = 1000 # Constante para conversión
-
-# CONSTANTES PARA COSTOS 
-PRECIO_AGUA_POR_M3 = 3.0 # Precio fijo del m3 de agua en Perú (3 Soles)
-FACTOR_L_A_M3 = 1000 # 1 m3 = 1000 Litros
-
-# BASE DE DATOS INICIAL DE DENSIDADES, AGUA Y COSTO
-# [MODIFICACIÓN] Adición de DAP Máximo, Altura Máxima y Tiempo Máximo (bibliografía)
-DENSIDADES_BASE = {
-    # --- Especies Originales (Ajustadas a nuevos campos) ---
-    'Eucalipto Torrellana (Corymbia torelliana)': {'Densidad': 0.46, 'Agua_L_Anio': 1500, 'Precio_Plantón': 5.00, 'DAP_Max': 45.0, 'Altura_Max': 35.0, 'Tiempo_Max_Anios': 20}, 
-    'Majoe (Hibiscus tiliaceus)': {'Densidad': 0.57, 'Agua_L_Anio': 1200, 'Precio_Plantón': 5.00, 'DAP_Max': 25.0, 'Altura_Max': 15.0, 'Tiempo_Max_Anios': 15}, 
-    'Molle (Schinus molle)': {'Densidad': 0.44, 'Agua_L_Anio': 900, 'Precio_Plantón': 6.00, 'DAP_Max': 30.0, 'Altura_Max': 20.0, 'Tiempo_Max_Anios': 25},
-    'Algarrobo (Prosopis pallida)': {'Densidad': 0.53, 'Agua_L_Anio': 800, 'Precio_Plantón': 4.00, 'DAP_Max': 40.0, 'Altura_Max': 18.0, 'Tiempo_Max_Anios': 30},
-    
-    # --- [NUEVAS ESPECIES AGREGADAS DE LA TABLA] ---
-    # Usaremos Densidad Básica como Densidad (ρ) para el potencial
-    # Valores de Agua y Precio por defecto si no se indican.
-    # Eucalipto Torrellana (Corymbia torelliana) - Actualizado con la tabla (DAP, Altura, Tiempo)
-    
-    'Shaina (Colubrina glandulosa Perkins)': {'Densidad': 0.63, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 40.0, 'Altura_Max': 20.0, 'Tiempo_Max_Anios': 28},
-    'Limoncillo (Melicoccus bijugatus)': {'Densidad': 0.68, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 40.0, 'Altura_Max': 18.0, 'Tiempo_Max_Anios': 33},
-    'Capirona (Calycophyllum decorticáns)': {'Densidad': 0.78, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 38.0, 'Altura_Max': 25.0, 'Tiempo_Max_Anios': 23},
-    'Bolaina (Guazuma crinita)': {'Densidad': 0.48, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 25.0, 'Altura_Max': 20.0, 'Tiempo_Max_Anios': 10},
-    'Amasisa (Erythrina fusca)': {'Densidad': 0.38, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 33.0, 'Altura_Max': 15.0, 'Tiempo_Max_Anios': 15},
-    'Moena (Ocotea aciphylla)': {'Densidad': 0.58, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 65.0, 'Altura_Max': 33.0, 'Tiempo_Max_Anios': 45},
-    'Huayruro (Ormosia coccinea)': {'Densidad': 0.73, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 70.0, 'Altura_Max': 33.0, 'Tiempo_Max_Anios': 65},
-    'Paliperro (Miconia barbeyana Cogniaux)': {'Densidad': 0.58, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 40.0, 'Altura_Max': 20.0, 'Tiempo_Max_Anios': 28},
-    'Cedro (Cedrela odorata)': {'Densidad': 0.43, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 55.0, 'Altura_Max': 30.0, 'Tiempo_Max_Anios': 28},
-    'Guayacán (Guaiacum officinale)': {'Densidad': 0.54, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 45.0, 'Altura_Max': 12.0, 'Tiempo_Max_Anios': 60},
-}
-
+# (Factores de cálculo y DENSIDADES_BASE: ver motor_co2e.py)
 
 # HUELLA DE CARBONO CORPORATIVA POR SEDE (EN MILES DE tCO2e)
 HUELLA_CORPORATIVA = {
@@ -80,347 +90,1240 @@ HUELLA_CORPORATIVA = {
     # DISAC
     "DISAC Tarapoto": 0.708
 }
-
-# --- DEFINICIÓN DE TIPOS DE COLUMNAS ---
-df_columns_types = {
-    'Especie': str, 'Cantidad': int, 'DAP (cm)': float, 'Altura (m)': float, 
-    'Densidad (ρ)': float, 'Años Plantados': int, 'Consumo Agua Unitario (L/año)': float, 
-    'Precio Plantón Unitario (S/)': float, 
-    'Detalle Cálculo': str,
-    # 'Latitud' y 'Longitud' ELIMINADOS
+# Grupos de empresas de la huella corporativa (año de cruce por grupo)
+GRUPOS_HUELLA = {
+    "Cementos Pacasmayo S.A.A.": [
+        "Planta Pacasmayo", "Planta Piura", "Oficina Lima", "Cantera Tembladera", "Cantera Cerro Pintura",
+        "Cantera Virrilá", "Cantera Bayóvar 4", "Cantera Bayóvar 9", "Almacén Salaverry", "Almacén Piura",
+    ],
+    "Cementos Selva S.A.C.": ["Planta Rioja", "Cantera Tioyacu"],
+    "DINO S.R.L.": [
+        "DINO Cajamarca", "DINO Chiclayo", "DINO Chimbote", "DINO Moche", "DINO Piura",
+        "DINO Pacasmayo", "DINO Trujillo", "DINO Almacén Paita",
+    ],
+    "DISAC": ["DISAC Tarapoto"],
 }
-df_columns_numeric = ['Cantidad', 'DAP (cm)', 'Altura (m)', 'Densidad (ρ)', 'Años Plantados', 'Consumo Agua Unitario (L/año)', 'Precio Plantón Unitario (S/)'] 
+SIN_SEDE = "(Sin sede)"
 
-columnas_salida = ['Biomasa Lote (Ton)', 'Carbono Lote (Ton)', 'CO2e Lote (Ton)', 'Consumo Agua Total Lote (L)', 'Costo Total Lote (S/)'] 
 
 # --- FUNCIÓN CRÍTICA: DINÁMICA DE ESPECIES ---
+ESPECIE_MANUAL = 'Densidad/Datos Manuales'
+LIMITE_OPCIONES_ESPECIE = 200 # Con más especies, el selector del formulario pasa a búsqueda incremental
+FILAS_POR_PAGINA_ESPECIES = [50, 100, 500] # El editor del registro solo recibe la página o los resultados de la búsqueda
+# Valores de las columnas que una base de densidades no trae (editables en la sección 4)
+VALORES_POR_DEFECTO_IMPORTACION = {
+    'DAP (cm)': 5.0, 'Altura (m)': 5.0, 'Consumo Agua (L/año)': 0.0, 'Precio Plantón (S/)': 0.0,
+    'DAP Máximo (cm)': 20.0, 'Altura Máxima (m)': 10.0, 'Tiempo Máximo (años)': 10,
+}
+
 def get_current_species_info():
     """
     Genera un diccionario de información de especies (Densidad, Agua, Precio, Maximos) 
     fusionando las especies base con las especies añadidas/modificadas por el usuario.
+    Memorizado por versión de la BD de especies (puede tener decenas de miles de especies importadas).
     """
-    current_info = {
-        # [FIX: POTENCIAL MÁXIMO V2] Incluir los nuevos campos máximos
-        name: {
-            'Densidad': data['Densidad'], 
-            'Agua_L_Anio': data['Agua_L_Anio'], 
-            'Precio_Plantón': data['Precio_Plantón'],
-            'DAP_Max': data['DAP_Max'],
-            'Altura_Max': data['Altura_Max'],
-            'Tiempo_Max_Anios': data['Tiempo_Max_Anios']
-        }
-        for name, data in DENSIDADES_BASE.items()
-    }
-    
-    df_bd = st.session_state.get('especies_bd', pd.DataFrame())
-    if df_bd.empty:
-        # [FIX: POTENCIAL MÁXIMO V2] Defaults para datos manuales
-        current_info['Densidad/Datos Manuales'] = {'Densidad': 0.0, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 0.0, 'DAP_Max': 20.0, 'Altura_Max': 10.0, 'Tiempo_Max_Anios': 10}
-        return current_info
-        
-    df_unique_info = df_bd.drop_duplicates(subset=['Especie'], keep='last')
-    
-    for _, row in df_unique_info.iterrows():
-        especie_name = row['Especie']
-        
-        # Asegurar la conversión segura de los campos base
-        densidad_val = pd.to_numeric(row.get('Densidad (g/cm³)', 0.0), errors='coerce') 
-        agua_val = pd.to_numeric(row.get('Consumo Agua (L/año)', 0.0), errors='coerce')
-        precio_val = pd.to_numeric(row.get('Precio Plantón (S/)', 0.0), errors='coerce') 
-        
-        # [FIX: POTENCIAL MÁXIMO V2] Asegurar la conversión de los nuevos campos
-        dap_max_val = pd.to_numeric(row.get('DAP Máximo (cm)', 0.0), errors='coerce') 
-        altura_max_val = pd.to_numeric(row.get('Altura Máxima (m)', 0.0), errors='coerce')
-        tiempo_max_val = pd.to_numeric(row.get('Tiempo Máximo (años)', 0), errors='coerce')
-        
-        if pd.notna(densidad_val) and densidad_val > 0:
-            current_info[especie_name] = {
-                'Densidad': densidad_val,
-                'Agua_L_Anio': agua_val if pd.notna(agua_val) and agua_val >= 0 else 0.0,
-                'Precio_Plantón': precio_val if pd.notna(precio_val) and precio_val >= 0 else 0.0,
-                # New fields
-                'DAP_Max': dap_max_val if pd.notna(dap_max_val) and dap_max_val >= 0 else 0.0,
-                'Altura_Max': altura_max_val if pd.notna(altura_max_val) and altura_max_val >= 0 else 0.0,
-                'Tiempo_Max_Anios': int(tiempo_max_val) if pd.notna(tiempo_max_val) and tiempo_max_val >= 0 else 0,
-            }
-    
-    # [FIX: POTENCIAL MÁXIMO V2] Defaults para datos manuales
-    current_info['Densidad/Datos Manuales'] = {'Densidad': 0.0, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 0.0, 'DAP_Max': 20.0, 'Altura_Max': 10.0, 'Tiempo_Max_Anios': 10}
-    
-    return current_info
-
-
-# --- FUNCIONES DE CÁLCULO Y MANEJO DE INVENTARIO ---
-
-def get_co2e_total_seguro(df):
-    """Calcula la suma total de CO2e capturado."""
-    if df.empty or 'CO2e Lote (Ton)' not in df.columns:
-        return 0.0
-    return df['CO2e Lote (Ton)'].sum()
+    version = st.session_state.get('especies_version', 0)
+    cache = st.session_state.get('cache_especies_info')
+    if cache is None or cache['version'] != version:
+        cache = {'version': version, 'info': fusionar_info_especies(st.session_state.get('especies_bd', pd.DataFrame()))}
+        st.session_state.cache_especies_info = cache
+    return cache['info']
+
+
+def clave_especies_sesion():
+    """Huella de contenido de la información de especies (caché en disco), memorizada por versión."""
+    info = get_current_species_info()
+    cache = st.session_state.cache_especies_info
+    if 'clave' not in cache:
+        cache['clave'] = clave_contenido('especies', info)
+    return cache['clave']
+
+
+def obtener_indice_especies():
+    """Índice de nombres (científicos, comunes y sinónimos) del registro, memorizado por versión de la BD de especies."""
+    version = st.session_state.get('especies_version', 0)
+    cache = st.session_state.get('cache_indice_especies')
+    if cache is None or cache['version'] != version:
+        indice = IndiceEspecies(get_current_species_info().keys(), st.session_state.get('especies_alias', {}))
+        cache = {'version': version, 'indice': indice}
+        st.session_state.cache_indice_especies = cache
+    return cache['indice']
+
+
+def opciones_especie(current_species_info, consulta):
+    """
+    Opciones del selector de especie del formulario. Con un registro grande solo se envían las
+    sugerencias de la búsqueda (o las especies base si no hay búsqueda) y la especie seleccionada.
+    """
+    if len(current_species_info) <= LIMITE_OPCIONES_ESPECIE:
+        return list(current_species_info.keys())
+    opciones = obtener_indice_especies().buscar(consulta) if consulta else list(DENSIDADES_BASE.keys())
+    seleccionada = st.session_state.get('especie_seleccionada')
+    if seleccionada in current_species_info and seleccionada not in opciones:
+        opciones.append(seleccionada) # Se conserva la selección actual (después de las sugerencias)
+    return [especie for especie in opciones if especie != ESPECIE_MANUAL] + [ESPECIE_MANUAL]
 
-def get_costo_total_seguro(df):
-    """Calcula la suma total del costo del proyecto."""
-    if df.empty or 'Costo Total Lote (S/)' not in df.columns:
-        return 0.0
-    return df['Costo Total Lote (S/)'].sum()
 
-def get_agua_total_seguro(df):
-    """Calcula la suma total de consumo de agua (Anual)."""
-    if df.empty or 'Consumo Agua Total Lote (L)' not in df.columns:
-        return 0.0
-    return df['Consumo Agua Total Lote (L)'].sum()
+# --- CACHÉ DE RESULTADOS EN DISCO ---
+@st.cache_resource(show_spinner=False)
+def obtener_cache_disco():
+    """Caché en disco del proceso (directorio y límite: ver cache_disco.py); la comparten los procesos del servidor."""
+    return CacheDisco()
 
 
-# --- MODIFICACIÓN CLAVE: calcular_co2_arbol para retornar JSON de detalle ---
-def calcular_co2_arbol(rho, dap_cm, altura_m):
+def clave_lotes(inventario_list):
     """
-    Calcula la biomasa, carbono y CO2e por árbol en KILOGRAMOS 
-    y genera un diccionario de detalle con fórmulas para su posterior uso en Excel.
+    Huella de contenido de una lista de lotes. La del inventario de la sesión se memoriza por
+    versión: con cientos de miles de lotes serializarla cuesta casi un segundo.
     """
-    
-    # 1. Validación de entradas
-    if rho <= 0 or dap_cm <= 0 or altura_m <= 0:
-        detalle = {
-            "ERROR": "Valores de entrada (DAP, Altura o Densidad) deben ser mayores a cero para el cálculo."
-        }
-        return 0.0, 0.0, 0.0, 0.0, json.dumps(detalle)
-        
-    # Calcular AGB (Above-Ground Biomass) en kg
-    # Fórmula: AGB = AGB_FACTOR_A × (ρ × D² × H)^AGB_FACTOR_B (Chave et al. 2014)
-    # rho: Densidad (g/cm³), dap_cm: Diámetro (cm), altura_m: Altura (m)
-    agb_kg = AGB_FACTOR_A * ((rho * (dap_cm**2) * altura_m)**AGB_FACTOR_B)
-    
-    # Calcular BGB (Below-Ground Biomass) en kg
-    bgb_kg = agb_kg * FACTOR_BGB_SECO
-    
-    # Biomasa total (AGB + BGB)
-    biomasa_total = agb_kg + bgb_kg
-    
-    # Carbono total
-    carbono_total = biomasa_total * FACTOR_CARBONO
-    
-    # CO2 equivalente
-    co2e_total = carbono_total * FACTOR_CO2E
-    
-    # Generación del detalle técnico como diccionario para convertir a JSON
-    detalle_calculo = {
-        "Inputs": [
-            {"Métrica": "Densidad (ρ)", "Valor": rho, "Unidad": "g/cm³"},
-            {"Métrica": "DAP (D)", "Valor": dap_cm, "Unidad": "cm"},
-            {"Métrica": "Altura (H)", "Valor": altura_m, "Unidad": "m"}
-        ],
-        "AGB_Aerea_kg": [
-            {"Paso": "Fórmula (Chave et al. 2014)", "Ecuación": f"AGB = {AGB_FACTOR_A} × (ρ × D² × H)^{AGB_FACTOR_B}"},
-            {"Paso": "Sustitución", "Ecuación": f"AGB = {AGB_FACTOR_A:.3f} × ({rho:.3f} × {dap_cm:.2f}² × {altura_m:.2f})^{AGB_FACTOR_B:.3f}"},
-            {"Paso": "Resultado AGB", "Valor": agb_kg, "Unidad": "kg"}
-        ],
-        "BGB_Subterranea_kg": [
-            {"Paso": "Fórmula", "Ecuación": f"BGB = AGB × {FACTOR_BGB_SECO}"},
-            {"Paso": "Sustitución", "Ecuación": f"BGB = {agb_kg:.4f} × {FACTOR_BGB_SECO}"},
-            {"Paso": "Resultado BGB", "Valor": bgb_kg, "Unidad": "kg"}
-        ],
-        "Biomasa_Total_kg": [
-            {"Paso": "Fórmula", "Ecuación": "Biomasa Total = AGB + BGB"},
-            {"Paso": "Resultado Biomasa Total", "Valor": biomasa_total, "Unidad": "kg"}
-        ],
-        "Carbono_kg": [
-            {"Paso": "Fórmula", "Ecuación": f"Carbono = Biomasa Total × {FACTOR_CARBONO}"},
-            {"Paso": "Sustitución", "Ecuación": f"Carbono = {biomasa_total:.4f} × {FACTOR_CARBONO}"},
-            {"Paso": "Resultado Carbono", "Valor": carbono_total, "Unidad": "kg"}
-        ],
-        "CO2e_kg": [
-            {"Paso": "Fórmula", "Ecuación": f"CO2e = Carbono × {FACTOR_CO2E}"},
-            {"Paso": "Sustitución", "Ecuación": f"CO2e = {carbono_total:.4f} × {FACTOR_CO2E}"},
-            {"Paso": "Resultado CO2e (Unitario)", "Valor": co2e_total, "Unidad": "kg"}
-        ]
-    }
-    
-    return agb_kg, bgb_kg, biomasa_total, co2e_total, json.dumps(detalle_calculo)
+    if inventario_list is not st.session_state.get('inventario_list'):
+        return clave_contenido('lotes', inventario_list)
+    cache = st.session_state.get('cache_clave_lotes')
+    if cache is None or cache['version'] != st.session_state.inventario_version:
+        cache = {'version': st.session_state.inventario_version, 'clave': clave_contenido('lotes', inventario_list)}
+        st.session_state.cache_clave_lotes = cache
+    return cache['clave']
 
 
 # --- FUNCIÓN DE RECÁLCULO SEGURO (CRÍTICA) ---
-def recalcular_inventario_completo(inventario_list):
+LOTES_RECALCULO_PROGRESIVO = 100_000 # Desde aquí, con al_avanzar, el recálculo va por bloques mostrando totales aproximados
+
+def recalcular_inventario_completo(inventario_list, al_avanzar=None):
     """
-    Toma la lista de entradas (List[Dict]) y genera un DataFrame completo y limpio, 
-    incluyendo CO2e, Consumo de Agua y Costo Total (Plantones + Agua Acumulada).
+    Recalcula el inventario con el motor (motor_co2e.recalcular_inventario) aplicando
+    la opción de Riego Controlado de la sesión. Con un clima mensual cargado, el agua de
+    cada lote proviene del balance hídrico (ver "BALANCE HÍDRICO MENSUAL").
+    El resultado del inventario de la sesión se memoriza por (versión, cálculo del agua), y
+    cualquier lista (también los estados del historial) por contenido en la caché en disco:
+    un proyecto ya calculado se abre, incluso tras reiniciar el servidor, leyendo el disco.
+    Con `al_avanzar` (ver motor_co2e.recalcular_inventario_por_bloques) y un inventario grande,
+    primero se informa el total estimado con una muestra y luego el avance de cada bloque.
     """
+    es_inventario_sesion = inventario_list is st.session_state.get('inventario_list')
+    if es_inventario_sesion:
+        version = (st.session_state.inventario_version, clave_calculo_agua())
+        cache = st.session_state.get('cache_inventario_completo')
+        if cache is not None and cache['version'] == version:
+            return cache['df']
+        df = recalcular_lotes_anexados(inventario_list, cache) if cache is not None and cache['version'][1] == version[1] else None
+        if df is not None:
+            # La clave en disco se calcula solo si se pide (clave_inventario_sesion): cuesta más que los lotes nuevos
+            st.session_state.cache_inventario_completo = {'version': version, 'df': df, 'clave': None}
+            return df
+
+    riego_activado, agua_anual_lote_l = agua_de_lotes(inventario_list)
     if not inventario_list:
-        # Crear un DF vacío con todas las columnas esperadas
-        all_cols = list(df_columns_types.keys()) + columnas_salida
-        dtype_map = {**df_columns_types, **dict.fromkeys(columnas_salida, float)}
-        dtype_map = {k: v for k, v in dtype_map.items() if k in all_cols}
-        return pd.DataFrame(columns=all_cols).astype(dtype_map)
+        clave = None
+        df = recalcular_inventario(inventario_list, riego_activado=riego_activado, agua_anual_lote_l=agua_anual_lote_l)
+    else:
+        progresivo = al_avanzar is not None and len(inventario_list) >= LOTES_RECALCULO_PROGRESIVO
+        if progresivo:
+            # La estimación se muestra antes de calcular la clave y de leer el disco (ambos tardan con muchos lotes)
+            muestra = estimar_co2e_muestra(inventario_list)
+            al_avanzar(0, len(inventario_list), 0.0, estimar_co2e_restante(muestra, 0, len(inventario_list)))
+        clave = clave_contenido('inventario', clave_lotes(inventario_list), riego_activado, agua_anual_lote_l)
+        if progresivo:
+            constructor = lambda: recalcular_por_bloques_reanudable(inventario_list, clave, riego_activado, agua_anual_lote_l, al_avanzar, muestra)
+        else:
+            constructor = lambda: recalcular_inventario(inventario_list, riego_activado=riego_activado, agua_anual_lote_l=agua_anual_lote_l)
+        df = obtener_cache_disco().memorizar(clave, constructor, tipo='inventario', en_segundo_plano=True)
+    if es_inventario_sesion:
+        st.session_state.cache_inventario_completo = {'version': version, 'df': df, 'clave': clave}
+    return df
 
 
-    # 1. Crear DF base
-    df_base = pd.DataFrame(inventario_list)
-    df_calculado = df_base.copy()
-    
-    # [FIX: CORRECCIÓN DE ERROR JSON] Eliminamos la columna Detalle Cálculo del input (si existe) 
-    # para asegurar que siempre se use la nueva cadena JSON calculada y evitar TypeErrors de valores NaN/None.
-    if 'Detalle Cálculo' in df_calculado.columns:
-        df_calculado = df_calculado.drop(columns=['Detalle Cálculo'])
-    
-    # 2. FIX CRÍTICO: Asegurar que todas las columnas de entrada requeridas existan
-    required_input_cols = [col for col in df_columns_types.keys() if col != 'Detalle Cálculo'] # Excluimos Detalle Cálculo
-    for col in required_input_cols:
-        if col not in df_calculado.columns:
-            if df_columns_types[col] == str:
-                default_val = ""
-            elif df_columns_types[col] == int:
-                default_val = 0
-            else: # float
-                default_val = 0.0
-            df_calculado[col] = default_val
-    
-    # 3. Asegurar que todas las columnas numéricas sean números
-    for col in df_columns_numeric:
-        df_calculado[col] = pd.to_numeric(df_calculado[col], errors='coerce').fillna(0)
-    
-    resultados_calculo = []
-    
-    # --- Lógica de Riego Controlado (Checkbox) ---
+def agua_de_lotes(inventario_list):
+    """(riego activado, agua anual por lote del balance hídrico o None) con la configuración de la sesión."""
     riego_activado = st.session_state.get('riego_controlado_check', False)
-    
-    for _, row in df_calculado.iterrows():
-        rho = row['Densidad (ρ)']
-        dap = row['DAP (cm)'] # <<< Usamos el DAP MEDIDO
-        altura = row['Altura (m)'] # <<< Usamos la Altura MEDIDA
-        cantidad = row['Cantidad']
-        consumo_agua_uni_base = row['Consumo Agua Unitario (L/año)'] 
-        precio_planton_uni = row['Precio Plantón Unitario (S/)'] 
-        años_plantados = row['Años Plantados'] 
-
-        # 1. Cálculo de CO2e (Biomasa, Carbono, CO2e por árbol en kg)
-        _, _, biomasa_uni_kg, co2e_uni_kg, detalle = calcular_co2_arbol(rho, dap, altura)
-        
-        # 2. Conversión a TONELADAS y Lote
-        biomasa_lote_ton = (biomasa_uni_kg * cantidad) / FACTOR_KG_A_TON
-        carbono_lote_ton = (biomasa_uni_kg * FACTOR_CARBONO * cantidad) / FACTOR_KG_A_TON
-        co2e_lote_ton = (co2e_uni_kg * cantidad) / FACTOR_KG_A_TON
+    if riego_activado and balance_hidrico_activo():
+        if inventario_list is st.session_state.get('inventario_list'):
+            return riego_activado, obtener_demanda_inventario()['demanda'].sum(axis=1)
+        return riego_activado, demanda_mensual_inventario(inventario_list)[0].sum(axis=1)
+    return riego_activado, None
 
-        # 3. Costo y Agua
-        costo_planton_lote = cantidad * precio_planton_uni
-        
-        # --- LÓGICA DE RIEGO CONDICIONAL ---
-        if riego_activado:
-            consumo_agua_uni = consumo_agua_uni_base
-            años_para_costo = años_plantados
-        else:
-            # Si el riego no está activado, el consumo de agua y su costo son CERO.
-            consumo_agua_uni = 0.0
-            años_para_costo = 0 
-            
-        consumo_agua_lote_l = cantidad * consumo_agua_uni
-        
-        # Calcular el costo de agua por UN AÑO (operación anual)
-        volumen_agua_lote_m3_anual = consumo_agua_lote_l / FACTOR_L_A_M3
-        costo_agua_anual_lote = volumen_agua_lote_m3_anual * PRECIO_AGUA_POR_M3
-        
-        # Costo de agua acumulado: Costo Anual * Años Plantados (solo si riego_activado)
-        costo_agua_acumulado_lote = costo_agua_anual_lote * años_para_costo
-        
-        # Costo total = Costo Plantones (Inversión Inicial) + Costo Agua (Operación Acumulada)
-        costo_total_lote = costo_planton_lote + costo_agua_acumulado_lote
-        # --- FIN DE LÓGICA DE RIEGO CONDICIONAL ---
-        
-        resultados_calculo.append({
-            'Biomasa Lote (Ton)': biomasa_lote_ton,
-            'Carbono Lote (Ton)': carbono_lote_ton,
-            'CO2e Lote (Ton)': co2e_lote_ton,
-            'Consumo Agua Total Lote (L)': consumo_agua_lote_l,
-            'Costo Total Lote (S/)': costo_total_lote, 
-            'Detalle Cálculo': detalle # JSON string
-        })
 
-    # 4. Unir los resultados
-    df_resultados = pd.DataFrame(resultados_calculo)
-    df_final = pd.concat([df_calculado.reset_index(drop=True), df_resultados], axis=1)
-    
-    # 5. Aplicar tipos de datos para las columnas de salida
-    dtype_map = {col: float for col in columnas_salida if col in df_final.columns}
-    df_final = df_final.astype(dtype_map)
+def recalcular_lotes_anexados(inventario_list, cache):
+    """
+    Si desde el resultado memorizado solo se anexaron lotes (los del formulario o los de otros
+    coordinadores de un proyecto compartido), calcula únicamente los nuevos y los une al resultado
+    anterior. Retorna None si cambió algún lote anterior: hay que recalcular todo.
+    """
+    calculados = len(cache['df'])
+    desde = indice_modificado_desde(cache['version'][0])
+    if calculados == 0 or desde is None or desde < calculados or len(inventario_list) < calculados:
+        return None
+    nuevos = inventario_list[calculados:]
+    if not nuevos:
+        return cache['df']
+    riego_activado, agua_anual_lote_l = agua_de_lotes(nuevos)
+    df_nuevos = recalcular_inventario(nuevos, riego_activado=riego_activado, agua_anual_lote_l=agua_anual_lote_l)
+    return pd.concat([cache['df'], df_nuevos], ignore_index=True)
+
+
+def clave_inventario_sesion():
+    """Clave de contenido del inventario de la sesión (la de su resultado en la caché en disco)."""
+    df = recalcular_inventario_completo(st.session_state.inventario_list)
+    cache = st.session_state.cache_inventario_completo
+    if cache['clave'] is None and st.session_state.inventario_list:
+        riego_activado = st.session_state.get('riego_controlado_check', False)
+        agua_anual_lote_l = df['Consumo Agua Total Lote (L)'].to_numpy() if riego_activado and balance_hidrico_activo() else None
+        cache['clave'] = clave_contenido('inventario', clave_lotes(st.session_state.inventario_list), riego_activado, agua_anual_lote_l)
+    return cache['clave']
+
+
+def avance_recalculo_en(metrica, barra):
+    """al_avanzar que dibuja el total aproximado en la métrica del sidebar y el avance en la página."""
+    def al_avanzar(procesados, total, co2e_exacto, co2e_estimado):
+        metrica.metric("CO2e Inventario (Progreso)", f"≈ {co2e_estimado:,.2f} Ton", help="Estimación: el cálculo exacto sigue en curso.")
+        barra.progress(
+            procesados / total,
+            text=f"Calculando el inventario: {procesados:,} de {total:,} lotes · CO2e ≈ {co2e_estimado:,.2f} Ton "
+                 f"(exacto en los lotes ya calculados: {co2e_exacto:,.2f} Ton)"
+        )
+    return al_avanzar
+
+
+def recalcular_por_bloques_reanudable(inventario_list, clave, riego_activado, agua_anual_lote_l, al_avanzar, muestra):
+    """
+    Recálculo por bloques cuyos bloques terminados quedan en la sesión bajo la clave de contenido:
+    una interacción del usuario interrumpe el cálculo (Streamlit lanza su excepción en el siguiente
+    al_avanzar) y, si el inventario no cambió, el rerun continúa desde el bloque pendiente.
+    Un resultado parcial nunca se memoriza como inventario completo.
+    """
+    parcial = st.session_state.get('cache_recalculo_parcial')
+    if parcial is None or parcial['clave'] != clave:
+        parcial = {'clave': clave, 'estado': {}}
+        st.session_state.cache_recalculo_parcial = parcial
+    df = recalcular_inventario_por_bloques(
+        inventario_list, riego_activado=riego_activado, agua_anual_lote_l=agua_anual_lote_l,
+        al_avanzar=al_avanzar, estado=parcial['estado'], muestra=muestra
+    )
+    st.session_state.cache_recalculo_parcial = None
+    return df
+
+
+# --- BALANCE HÍDRICO MENSUAL (RIEGO) ---
+def balance_hidrico_activo():
+    return st.session_state.get('clima_mensual') is not None and st.session_state.get('balance_activo', True)
+
+
+def clave_calculo_agua():
+    """Todo lo que determina el agua y el costo del inventario; forma parte de las claves de caché."""
+    riego = st.session_state.get('riego_controlado_check', False)
+    if not (riego and balance_hidrico_activo()):
+        return riego
+    return (riego, st.session_state.clima_version, st.session_state.balance_kc,
+            st.session_state.balance_eficiencia, st.session_state.balance_sitio_defecto)
+
 
-    return df_final
+def obtener_deficit_por_sitio():
+    """Lámina de riego mensual por sitio (sitios × 12), memorizada por (clima, Kc, eficiencia)."""
+    clave = (st.session_state.clima_version, st.session_state.balance_kc, st.session_state.balance_eficiencia)
+    cache = st.session_state.get('cache_deficit_sitios')
+    if cache is None or cache[0] != clave:
+        cache = (clave, deficit_por_sitio(st.session_state.clima_mensual, st.session_state.balance_kc, st.session_state.balance_eficiencia))
+        st.session_state.cache_deficit_sitios = cache
+    return cache[1]
 
 
-# [FIX: POTENCIAL MÁXIMO V2] Función modificada para usar valores max de la especie
-def calcular_potencial_maximo_lotes(inventario_list, current_species_info):
+def demanda_mensual_inventario(inventario_list):
     """
-    Calcula el CO2e potencial máximo utilizando los valores máximos de DAP y Altura 
-    propios de cada especie en los lotes del inventario.
+    Demanda de riego (L) de la lista de lotes con el clima y los parámetros de la sesión.
+    Retorna (demanda lotes × 12, índice de sitio de cada lote).
     """
-    if not inventario_list:
-        return pd.DataFrame()
+    df = pd.DataFrame(inventario_list, columns=['Cantidad', 'DAP (cm)', 'Latitud', 'Longitud']).apply(pd.to_numeric, errors='coerce')
+    indices_sitio = asignar_sitios(df['Latitud'], df['Longitud'], st.session_state.clima_mensual, st.session_state.balance_sitio_defecto)
+    demanda = demanda_mensual_lotes(df['Cantidad'].fillna(0), df['DAP (cm)'].fillna(0), indices_sitio, obtener_deficit_por_sitio())
+    return demanda, indices_sitio
 
-    df_base = pd.DataFrame(inventario_list)
-    df_potencial = df_base.copy()
-    
-    # Asegurar la conversión segura de columnas requeridas
-    for col in ['Cantidad', 'Densidad (ρ)']:
-        df_potencial[col] = pd.to_numeric(df_potencial[col], errors='coerce').fillna(0)
-    
-    resultados_calculo = []
-    
-    for _, row in df_potencial.iterrows():
-        especie = row['Especie']
-        cantidad = row['Cantidad']
-        
-        # Obtener los valores máximos de la especie
-        info = current_species_info.get(especie)
-        
-        rho = 0.0
-        dap = 0.0
-        altura = 0.0
-        tiempo_max = 0
-        co2e_lote_ton = 0.0
-        detalle = ""
-
-        # --- Lógica de Asignación de Valores Máximos ---
-        if info and especie != 'Densidad/Datos Manuales':
-            rho = info['Densidad']
-            dap = info['DAP_Max']
-            altura = info['Altura_Max']
-            tiempo_max = info['Tiempo_Max_Anios']
-        elif especie == 'Densidad/Datos Manuales':
-            # Para datos manuales, usar DAP/Altura máxima por defecto si la densidad es válida
-            info_manual = current_species_info.get('Densidad/Datos Manuales', {'Densidad': 0.0, 'DAP_Max': 0.0, 'Altura_Max': 0.0, 'Tiempo_Max_Anios': 0})
-            rho = row['Densidad (ρ)'] if row['Densidad (ρ)'] > 0 else info_manual['Densidad']
-            dap = info_manual['DAP_Max']
-            altura = info_manual['Altura_Max']
-            tiempo_max = info_manual['Tiempo_Max_Anios']
+
+def obtener_demanda_inventario():
+    """
+    Demanda mensual e índices de sitio del inventario de la sesión (demanda_mensual_inventario),
+    memorizados por versión del inventario y del cálculo del agua. La tabla por lote
+    ('indice_lotes', un IndiceTabla) se construye al mostrarla por primera vez.
+    """
+    version = (st.session_state.inventario_version, st.session_state.clima_version, st.session_state.balance_kc,
+               st.session_state.balance_eficiencia, st.session_state.balance_sitio_defecto)
+    cache = st.session_state.get('cache_demanda_inventario')
+    if cache is None or cache['version'] != version:
+        demanda, indices_sitio = demanda_mensual_inventario(st.session_state.inventario_list)
+        cache = {'version': version, 'demanda': demanda, 'indices_sitio': indices_sitio, 'indice_lotes': None}
+        st.session_state.cache_demanda_inventario = cache
+    return cache
+
+
+# --- MODO CENSO POR ÁRBOL (MEDICIONES INDIVIDUALES) ---
+# Columnas mínimas del archivo de censo. 'Lote', 'Años Plantados', 'Latitud' y 'Longitud' son opcionales.
+CENSO_COLUMNAS_REQUERIDAS = ['Especie', 'DAP (cm)', 'Altura (m)']
+TAMANO_BLOQUE_CENSO = 250_000 # Filas leídas por bloque (acota la memoria)
+ANCHO_CLASE_DIAMETRICA = 10 # Ancho por defecto de la clase diamétrica (cm)
+HISTOGRAMA_DAP_MAX_CM = 200 # Bins de 1 cm para la distribución de DAP
+HISTOGRAMA_ALTURA_MAX_M = 80 # Bins de 1 m para la distribución de Altura
+# Archivos muy grandes leídos directamente del servidor (censo, parcelas): solo dentro de este
+# directorio. Sin NBS_DIRECTORIO_DATOS la opción no se muestra y solo se admite la carga del archivo.
+DIRECTORIO_DATOS_SERVIDOR = os.environ.get('NBS_DIRECTORIO_DATOS') or None
+
+def ruta_datos_servidor(nombre):
+    """
+    Ruta de `nombre` (relativa a DIRECTORIO_DATOS_SERVIDOR) si es un archivo dentro de ese
+    directorio. Lanza ValueError si sale de él (rutas absolutas, '..', enlaces) o no existe.
+    """
+    if DIRECTORIO_DATOS_SERVIDOR is None:
+        raise ValueError("la lectura de archivos del servidor no está habilitada (NBS_DIRECTORIO_DATOS)")
+    base = os.path.realpath(DIRECTORIO_DATOS_SERVIDOR)
+    ruta = os.path.realpath(os.path.join(base, nombre))
+    if os.path.commonpath([base, ruta]) != base:
+        raise ValueError(f"'{nombre}' está fuera del directorio de datos del servidor")
+    if not os.path.isfile(ruta):
+        raise ValueError(f"no existe el archivo '{nombre}' en el directorio de datos del servidor")
+    return ruta
+
+
+def fuente_archivo_datos(archivo, nombre_servidor):
+    """
+    Fuente de lectura: el archivo cargado o, si no hay, el archivo del servidor. Si no hay ninguno
+    o el nombre no es válido muestra el error y retorna None.
+    """
+    if archivo is not None:
+        return io.BytesIO(archivo.getvalue())
+    nombre = (nombre_servidor or '').strip()
+    if not nombre:
+        st.error("Seleccione un archivo CSV" + (" o indique el nombre de un archivo del servidor." if DIRECTORIO_DATOS_SERVIDOR else "."))
+        return None
+    try:
+        return ruta_datos_servidor(nombre)
+    except ValueError as e:
+        st.error(f"❌ {e}")
+        return None
+
+
+def etiqueta_clase_diametrica(indice_clase, ancho_clase):
+    """Etiqueta legible de una clase diamétrica, p. ej. '10-20 cm'."""
+    inicio = int(indice_clase) * ancho_clase
+    return f"{inicio}-{inicio + ancho_clase} cm"
+
+
+def bloques_csv_con_avance(fuente, tamano_bloque):
+    """
+    Itera los bloques de un CSV (ruta o archivo binario) junto con la fracción de bytes ya leídos
+    del archivo (None si su tamaño no se conoce), para reportar el avance real de la lectura.
+    """
+    archivo = fuente if hasattr(fuente, 'read') else open(fuente, 'rb')
+    try:
+        total_bytes = archivo.seek(0, os.SEEK_END)
+        archivo.seek(0)
+        for bloque in pd.read_csv(archivo, chunksize=tamano_bloque):
+            yield bloque, (min(archivo.tell() / total_bytes, 1.0) if total_bytes else None)
+    finally:
+        if archivo is not fuente:
+            archivo.close()
+
+
+def procesar_censo_por_bloques(fuente, current_species_info, ancho_clase=ANCHO_CLASE_DIAMETRICA, tamano_bloque=TAMANO_BLOQUE_CENSO, on_progreso=None, cancelado=None, indice_especies=None):
+    """
+    Lee un censo de árboles individuales (CSV) por bloques y calcula el CO2e de cada árbol
+    de forma vectorizada. Solo se conservan acumuladores por (Lote, Especie, Clase DAP) y
+    los histogramas de distribución, de modo que la memoria no depende del número de árboles.
+    Con `indice_especies`, los nombres que no están en el registro se resuelven por sinónimo o
+    coincidencia difusa (una vez por nombre distinto) antes de buscar su densidad.
+
+    Retorna un diccionario con la tabla de clases, los histogramas y los conteos de control.
+    `on_progreso(filas_leidas, fraccion)` recibe el avance tras cada bloque (fracción de bytes leídos).
+    Si `cancelado()` retorna True entre bloques, lanza TrabajoCancelado.
+    """
+    densidades = {nombre: info['Densidad'] for nombre, info in current_species_info.items() if info['Densidad'] > 0}
+    precios = {nombre: info['Precio_Plantón'] for nombre, info in current_species_info.items()}
+
+    acumulado = None
+    celdas_geo = None # Agregados por tesela fina (índice espacial), si el censo trae coordenadas
+    hist_dap = np.zeros(HISTOGRAMA_DAP_MAX_CM + 1, dtype=np.int64)
+    hist_altura = np.zeros(HISTOGRAMA_ALTURA_MAX_M + 1, dtype=np.int64)
+    filas_leidas = 0
+    filas_descartadas = 0
+    especies_no_reconocidas = {}
+    especies_resueltas = {} # Nombre del archivo -> especie del registro (None si no se resolvió)
+
+    for bloque, fraccion_leida in bloques_csv_con_avance(fuente, tamano_bloque):
+        if cancelado is not None and cancelado():
+            raise TrabajoCancelado()
+        faltantes = [col for col in CENSO_COLUMNAS_REQUERIDAS if col not in bloque.columns]
+        if faltantes:
+            raise ValueError(f"El archivo de censo no contiene las columnas requeridas: {', '.join(faltantes)}")
+
+        filas_leidas += len(bloque)
+        if on_progreso is not None:
+            on_progreso(filas_leidas, fraccion_leida)
+
+        especie = bloque['Especie'].astype(str).str.strip()
+        if indice_especies is not None:
+            nuevas = [nombre for nombre in especie.unique() if nombre not in densidades and nombre not in especies_resueltas]
+            for nombre, (destino, _) in indice_especies.resolver_nombres(nuevas).items():
+                especies_resueltas[nombre] = destino if destino in densidades else None
+            especie = especie.map({nombre: destino for nombre, destino in especies_resueltas.items() if destino}).fillna(especie)
+        dap = pd.to_numeric(bloque['DAP (cm)'], errors='coerce').to_numpy(dtype=float)
+        altura = pd.to_numeric(bloque['Altura (m)'], errors='coerce').to_numpy(dtype=float)
+        rho = especie.map(densidades).to_numpy(dtype=float)
+
+        if 'Lote' in bloque.columns:
+            lote = bloque['Lote'].fillna('Sin Lote').astype(str).str.strip()
         else:
-            # Caso de especie no encontrada/datos inconsistentes. Usar DAP/Altura Medidos, pero es menos potencial
-            rho = row['Densidad (ρ)']
-            dap = row['DAP (cm)']
-            altura = row['Altura (m)']
-            tiempo_max = 0
-        
-        
-        if dap <= 0 or altura <= 0 or rho <= 0 or cantidad <= 0:
-            co2e_lote_ton = 0.0
-            detalle = "ERROR: Valores DAP/Altura/Densidad/Cantidad deben ser > 0 para el cálculo potencial."
+            lote = pd.Series('Censo', index=bloque.index)
+
+        if 'Años Plantados' in bloque.columns:
+            anios = pd.to_numeric(bloque['Años Plantados'], errors='coerce').fillna(0).to_numpy(dtype=float)
         else:
-             # 1. Cálculo de CO2e (Biomasa, Carbono, CO2e por árbol en kg)
-             _, _, _, co2e_uni_kg, detalle = calcular_co2_arbol(rho, dap, altura)
-             
-             # 2. Conversión a TONELADAS y Lote
-             co2e_lote_ton = (co2e_uni_kg * cantidad) / FACTOR_KG_A_TON
+            anios = np.zeros(len(bloque))
 
-        
-        resultados_calculo.append({
+        if 'Latitud' in bloque.columns and 'Longitud' in bloque.columns:
+            lat = pd.to_numeric(bloque['Latitud'], errors='coerce').to_numpy(dtype=float)
+            lon = pd.to_numeric(bloque['Longitud'], errors='coerce').to_numpy(dtype=float)
+        else:
+            lat = lon = np.full(len(bloque), np.nan)
+
+        # Registrar especies desconocidas (sin densidad en la BD actual)
+        sin_densidad = np.isnan(rho)
+        if sin_densidad.any():
+            for nombre, conteo in especie[sin_densidad].value_counts().items():
+                especies_no_reconocidas[nombre] = especies_no_reconocidas.get(nombre, 0) + int(conteo)
+
+        validos = ~sin_densidad & (dap > 0) & (altura > 0)
+        filas_descartadas += int((~validos).sum())
+        if not validos.any():
+            continue
+
+        dap_v, altura_v, rho_v = dap[validos], altura[validos], rho[validos]
+        agb_kg, _, biomasa_kg, co2e_kg = calcular_co2_vectorizado(rho_v, dap_v, altura_v)
+
+        # Distribuciones (bins de 1 cm / 1 m; el último bin acumula los valores mayores)
+        hist_dap += np.bincount(np.minimum(dap_v, HISTOGRAMA_DAP_MAX_CM).astype(np.int64), minlength=HISTOGRAMA_DAP_MAX_CM + 1)
+        hist_altura += np.bincount(np.minimum(altura_v, HISTOGRAMA_ALTURA_MAX_M).astype(np.int64), minlength=HISTOGRAMA_ALTURA_MAX_M + 1)
+
+        lat_v, lon_v = lat[validos], lon[validos]
+        geo_v = coordenadas_validas(lat_v, lon_v)
+        if geo_v.any():
+            precio_v = especie.map(precios).to_numpy(dtype=float)[validos]
+            celdas_geo = sumar_celdas(celdas_geo, agregar_celdas(lat_v, lon_v, np.ones(len(lat_v)), co2e_kg / FACTOR_KG_A_TON, precio_v))
+
+        df_bloque = pd.DataFrame({
+            'Lote': lote.to_numpy()[validos],
+            'Especie': especie.to_numpy()[validos],
+            'Clase': (dap_v // ancho_clase).astype(np.int64),
+            'Árboles': 1,
+            'Suma DAP': dap_v,
+            'Suma Altura': altura_v,
+            'Suma Años': anios[validos],
+            'Suma AGB (kg)': agb_kg,
+            'Suma Biomasa (kg)': biomasa_kg,
+            'Suma CO2e (kg)': co2e_kg,
+            'Árboles Geo': geo_v.astype(np.int64),
+            'Suma Lat': np.where(geo_v, lat_v, 0.0),
+            'Suma Lon': np.where(geo_v, lon_v, 0.0),
+        })
+        parcial = df_bloque.groupby(['Lote', 'Especie', 'Clase']).sum()
+        acumulado = parcial if acumulado is None else acumulado.add(parcial, fill_value=0)
+
+    if acumulado is None:
+        df_clases = pd.DataFrame(columns=['Lote', 'Especie', 'Clase', 'Clase DAP', 'Árboles', 'DAP Medio (cm)', 'Altura Media (m)', 'Años Plantados', 'Densidad (ρ)', 'AGB Medio (kg)', 'Biomasa (Ton)', 'CO2e (Ton)', 'Latitud', 'Longitud'])
+    else:
+        df_clases = acumulado.reset_index()
+        n = df_clases['Árboles']
+        df_clases['Clase DAP'] = [etiqueta_clase_diametrica(c, ancho_clase) for c in df_clases['Clase']]
+        df_clases['DAP Medio (cm)'] = df_clases['Suma DAP'] / n
+        df_clases['Altura Media (m)'] = df_clases['Suma Altura'] / n
+        df_clases['Años Plantados'] = (df_clases['Suma Años'] / n).round().astype(int)
+        df_clases['Densidad (ρ)'] = df_clases['Especie'].map(densidades)
+        df_clases['AGB Medio (kg)'] = df_clases['Suma AGB (kg)'] / n
+        df_clases['Biomasa (Ton)'] = df_clases['Suma Biomasa (kg)'] / FACTOR_KG_A_TON
+        df_clases['CO2e (Ton)'] = df_clases['Suma CO2e (kg)'] / FACTOR_KG_A_TON
+        df_clases['Árboles'] = n.astype(int)
+        # Centroide de los árboles geolocalizados del grupo (NaN si ninguno tiene coordenadas)
+        n_geo = df_clases['Árboles Geo'].where(df_clases['Árboles Geo'] > 0)
+        df_clases['Latitud'] = df_clases['Suma Lat'] / n_geo
+        df_clases['Longitud'] = df_clases['Suma Lon'] / n_geo
+        df_clases = df_clases.drop(columns=['Suma DAP', 'Suma Altura', 'Suma Años', 'Suma AGB (kg)', 'Suma Biomasa (kg)', 'Suma CO2e (kg)', 'Árboles Geo', 'Suma Lat', 'Suma Lon'])
+
+    return {
+        'clases': df_clases,
+        'hist_dap': hist_dap,
+        'hist_altura': hist_altura,
+        'filas_leidas': filas_leidas,
+        'filas_descartadas': filas_descartadas,
+        'especies_no_reconocidas': especies_no_reconocidas,
+        'especies_resueltas': {nombre: destino for nombre, destino in especies_resueltas.items() if destino},
+        'ancho_clase': ancho_clase,
+        'indice_espacial': IndiceEspacial(celdas_geo) if celdas_geo is not None else None,
+    }
+
+
+def lotes_desde_clases_censo(df_clases, current_species_info):
+    """
+    Convierte la tabla agregada del censo en entradas de inventario (mismo esquema que agregar_lote).
+
+    Cada (Lote, Especie, Clase DAP) se convierte en un lote con la Altura media y un DAP
+    equivalente: el diámetro que, con la fórmula de Chave, reproduce la biomasa MEDIA del grupo.
+    Así el CO2e del lote calculado por recalcular_inventario_completo coincide con la suma
+    del CO2e de los árboles individuales (la fórmula no es lineal en el DAP).
+    """
+    lotes = []
+    for _, row in df_clases.iterrows():
+        especie = row['Especie']
+        info = current_species_info.get(especie, {})
+        rho = float(row['Densidad (ρ)'])
+        altura = float(row['Altura Media (m)'])
+
+        # Invertir AGB = A × (ρ × D² × H)^B para obtener el D equivalente
+        termino_eq = (row['AGB Medio (kg)'] / AGB_FACTOR_A) ** (1 / AGB_FACTOR_B)
+        dap_equivalente = float(np.sqrt(termino_eq / (rho * altura)))
+
+        _, _, _, _, detalle_calculo = calcular_co2_arbol(rho, dap_equivalente, altura)
+
+        lotes.append({
             'Especie': especie,
-            'Cantidad': cantidad,
+            'Cantidad': int(row['Árboles']),
+            'DAP (cm)': dap_equivalente,
+            'Altura (m)': altura,
             'Densidad (ρ)': rho,
-            'DAP Potencial (cm)': dap,
-            'Altura Potencial (m)': altura,
-            'Tiempo Máximo (años)': tiempo_max, # Nuevo campo
-            'CO2e Lote Potencial (Ton)': co2e_lote_ton,
-            'Detalle Cálculo': detalle # JSON string
+            'Años Plantados': int(row['Años Plantados']),
+            'Consumo Agua Unitario (L/año)': float(info.get('Agua_L_Anio', 0.0)),
+            'Precio Plantón Unitario (S/)': float(info.get('Precio_Plantón', 0.0)),
+            'Detalle Cálculo': detalle_calculo,
+            'Latitud': float(row.get('Latitud', np.nan)),
+            'Longitud': float(row.get('Longitud', np.nan)),
         })
+    return lotes
+
+
+# --- CAMPAÑAS DE MEDICIÓN (SERIE TEMPORAL POR LOTE) ---
+# Almacén columnar indexado por (ID Lote, Fecha). El CO2e de cada medición se calcula
+# una sola vez al registrarla; los incrementos y la serie del proyecto son diferencias vectorizadas.
+MEDICIONES_INDICE = ['ID Lote', 'Fecha']
+MEDICIONES_COLUMNAS = ['Cantidad', 'DAP (cm)', 'Altura (m)', 'Densidad (ρ)', 'Años Plantados', 'CO2e Lote (Ton)']
+DIAS_POR_ANIO = 365.25
 
-    df_resultados = pd.DataFrame(resultados_calculo)
-    return df_resultados
+def crear_almacen_mediciones():
+    """Crea un almacén de mediciones vacío con índice (ID Lote, Fecha)."""
+    indice = pd.MultiIndex.from_arrays([pd.Series(dtype=str), pd.Series(dtype='datetime64[ns]')], names=MEDICIONES_INDICE)
+    return pd.DataFrame({col: pd.Series(dtype=float) for col in MEDICIONES_COLUMNAS}, index=indice)
+
+
+def preparar_mediciones(df_nuevas):
+    """
+    Normaliza mediciones nuevas (columnas: ID Lote, Fecha, Cantidad, DAP (cm), Altura (m), Densidad (ρ), Años Plantados)
+    al esquema del almacén y calcula su CO2e (solo el de las filas nuevas).
+    """
+    nuevas = df_nuevas.copy()
+    nuevas['Fecha'] = pd.to_datetime(nuevas['Fecha']).astype('datetime64[ns]').dt.normalize()
+    nuevas['ID Lote'] = nuevas['ID Lote'].astype(str)
+    for col in ['Cantidad', 'DAP (cm)', 'Altura (m)', 'Densidad (ρ)', 'Años Plantados']:
+        nuevas[col] = pd.to_numeric(nuevas[col], errors='coerce').fillna(0).astype(float)
+
+    _, _, _, co2e_uni_kg = calcular_co2_vectorizado(nuevas['Densidad (ρ)'], nuevas['DAP (cm)'], nuevas['Altura (m)'])
+    nuevas['CO2e Lote (Ton)'] = co2e_uni_kg * nuevas['Cantidad'].to_numpy() / FACTOR_KG_A_TON
+
+    nuevas = nuevas.set_index(MEDICIONES_INDICE)[MEDICIONES_COLUMNAS]
+    return nuevas[~nuevas.index.duplicated(keep='last')]
+
+
+def aplicar_mediciones(almacen, agregadas, quitadas):
+    """Quita del almacén las filas de `quitadas` (por índice) y anexa las de `agregadas`."""
+    if len(quitadas):
+        almacen = almacen.drop(index=quitadas.index)
+    if len(agregadas):
+        almacen = pd.concat([almacen, agregadas]).sort_index()
+    return almacen
+
+
+def operacion_mediciones(almacen, df_nuevas):
+    """
+    Operación ('mediciones', agregadas, quitadas) del historial del inventario para incorporar
+    mediciones nuevas. Una medición con el mismo (ID Lote, Fecha) reemplaza a la anterior.
+    """
+    agregadas = preparar_mediciones(df_nuevas) if not df_nuevas.empty else almacen.iloc[:0]
+    return ('mediciones', agregadas, almacen[almacen.index.isin(agregadas.index)])
+
+
+def calcular_incrementos_campanas(almacen):
+    """
+    Diferencias entre campañas consecutivas de cada lote: incremento de CO2e,
+    crecimiento de DAP y Altura, y tasas anualizadas. La primera medición de cada lote queda en NaN.
+    """
+    if almacen.empty:
+        return pd.DataFrame()
+
+    por_lote = almacen.groupby(level='ID Lote')
+    delta = por_lote[['Cantidad', 'DAP (cm)', 'Altura (m)', 'CO2e Lote (Ton)']].diff()
+    fechas = almacen.index.get_level_values('Fecha').to_series(index=almacen.index)
+    dias = fechas.groupby(level='ID Lote').diff().dt.days.astype(float)
+    anios = (dias / DIAS_POR_ANIO).where(dias > 0)
+
+    return pd.DataFrame({
+        'CO2e Lote (Ton)': almacen['CO2e Lote (Ton)'],
+        'Días desde Campaña Anterior': dias,
+        'Δ Árboles': delta['Cantidad'],
+        'Δ DAP (cm)': delta['DAP (cm)'],
+        'Δ Altura (m)': delta['Altura (m)'],
+        'Captura Campaña (tCO2e)': delta['CO2e Lote (Ton)'],
+        'Crecimiento DAP (cm/año)': delta['DAP (cm)'] / anios,
+        'Crecimiento Altura (m/año)': delta['Altura (m)'] / anios,
+        'Captura Anualizada (tCO2e/año)': delta['CO2e Lote (Ton)'] / anios,
+    })
+
+
+def serie_captura_proyecto(almacen):
+    """
+    CO2e total del proyecto en cada fecha de campaña. Cada lote aporta su última medición
+    conocida a esa fecha (arrastre hacia adelante); antes de su primera medición aporta 0.
+    """
+    if almacen.empty:
+        return pd.DataFrame(columns=['Fecha', 'CO2e Proyecto (Ton)', 'Captura Campaña (tCO2e)'])
+
+    matriz = almacen['CO2e Lote (Ton)'].unstack(level='ID Lote').sort_index()
+    totales = matriz.ffill().fillna(0.0).sum(axis=1)
+    serie = pd.DataFrame({'CO2e Proyecto (Ton)': totales})
+    serie['Captura Campaña (tCO2e)'] = serie['CO2e Proyecto (Ton)'].diff().fillna(serie['CO2e Proyecto (Ton)'])
+    return serie.rename_axis('Fecha').reset_index()
+
+
+# --- AGREGADOS POR ESPECIE Y CACHÉ DE FIGURAS ---
+# Columna del agregado -> columna del inventario que se suma
+COLUMNAS_AGREGADO_ESPECIE = {
+    'Total_CO2e_Ton': 'CO2e Lote (Ton)',
+    'Total_Costo_S': 'Costo Total Lote (S/)',
+    'Consumo_Agua_Total_L': 'Consumo Agua Total Lote (L)',
+    'Conteo_Arboles': 'Cantidad',
+}
+LIMITE_LOG_CAMBIOS = 500 # Cambios recordados para la actualización incremental
+UMBRAL_PUNTOS_WEBGL = 5_000 # A partir de aquí las series/dispersión usan trazas WebGL
+MAX_PUNTOS_SERIE = 2_000 # Puntos enviados al navegador tras el submuestreo
+
+def agrupar_por_especie(df_lotes):
+    """Suma por especie de las columnas de COLUMNAS_AGREGADO_ESPECIE."""
+    return df_lotes.groupby('Especie').agg(
+        **{destino: (origen, 'sum') for destino, origen in COLUMNAS_AGREGADO_ESPECIE.items()}
+    )
+
+
+def actualizar_agregado_especie(agregado, df_salientes, df_entrantes):
+    """
+    Actualiza un agregado por especie restando las contribuciones de los lotes salientes
+    y sumando las de los entrantes. Las especies que quedan sin árboles se eliminan.
+    """
+    if not df_salientes.empty:
+        agregado = agregado.sub(agrupar_por_especie(df_salientes), fill_value=0)
+    if not df_entrantes.empty:
+        agregado = agregado.add(agrupar_por_especie(df_entrantes), fill_value=0)
+    return agregado[agregado['Conteo_Arboles'] > 0]
+
+
+def reducir_serie_minmax(x, y, max_puntos=MAX_PUNTOS_SERIE):
+    """
+    Submuestreo en el servidor para series largas: divide la serie en cubetas y conserva
+    el mínimo y el máximo de cada una, preservando picos y valles. Retorna (x, y) reducidos.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    if n <= max_puntos:
+        return x, y
+
+    n_cubetas = max(max_puntos // 2, 1)
+    limites = np.linspace(0, n, n_cubetas + 1).astype(int)
+    inicios = limites[:-1]
+    # argmin/argmax por cubeta con reduceat sobre los índices ordenados de cada cubeta
+    minimos = np.minimum.reduceat(y, inicios)
+    maximos = np.maximum.reduceat(y, inicios)
+    cubeta = np.repeat(np.arange(n_cubetas), np.diff(limites))
+    es_min = y == minimos[cubeta]
+    es_max = y == maximos[cubeta]
+    idx_min = np.flatnonzero(es_min)[np.unique(cubeta[es_min], return_index=True)[1]]
+    idx_max = np.flatnonzero(es_max)[np.unique(cubeta[es_max], return_index=True)[1]]
+    seleccion = np.union1d(idx_min, idx_max)
+    return x[seleccion], y[seleccion]
+
+
+def figura_serie_temporal(x, y, titulo, nombre_x, nombre_y):
+    """Línea temporal; con muchos puntos usa Scattergl y submuestreo min-max en el servidor."""
+    import plotly.graph_objects as go
+    if len(y) > UMBRAL_PUNTOS_WEBGL:
+        x, y = reducir_serie_minmax(x, y)
+        traza = go.Scattergl(x=x, y=y, mode='lines', name=nombre_y)
+    else:
+        traza = go.Scatter(x=x, y=y, mode='lines+markers', name=nombre_y)
+    fig = go.Figure(data=[traza])
+    fig.update_layout(title_text=titulo, xaxis_title=nombre_x, yaxis_title=nombre_y)
+    return fig
+
+
+def marcar_inventario_modificado(desde_indice):
+    """
+    Registra una modificación del inventario a partir de la posición `desde_indice`
+    (los lotes anteriores no cambiaron). Invalida los agregados y figuras dependientes.
+    """
+    st.session_state.inventario_version += 1
+    log = st.session_state.inventario_cambios
+    log.append((st.session_state.inventario_version, desde_indice))
+    del log[:-LIMITE_LOG_CAMBIOS]
+
+
+def indice_modificado_desde(version):
+    """
+    Menor posición de lote modificada después de `version`, o None si el log ya no
+    cubre ese rango (en ese caso hay que recalcular todo).
+    """
+    log = st.session_state.inventario_cambios
+    if version == st.session_state.inventario_version:
+        return len(st.session_state.inventario_list)
+    if not log or log[0][0] > version + 1:
+        return None
+    return min(desde for v, desde in log if v > version)
+
+
+def obtener_agregados_especie(df_inventario_completo):
+    """
+    Agregados por especie del inventario, mantenidos de forma incremental: solo se
+    reagrupan los lotes a partir de la primera posición modificada desde la última versión.
+    Retorna (agregado, version) donde `version` identifica el contenido para la caché de figuras.
+    """
+    agua = clave_calculo_agua()
+    version = st.session_state.inventario_version
+    cache = st.session_state.get('cache_agregados_especie')
+    cols_lote = ['Especie'] + list(COLUMNAS_AGREGADO_ESPECIE.values())
+    df_lotes = df_inventario_completo[cols_lote] if not df_inventario_completo.empty else pd.DataFrame(columns=cols_lote)
+
+    if cache is not None and cache['agua'] == agua and cache['version'] == version:
+        return cache['agregado'], (version, agua)
+
+    desde = None
+    if cache is not None and cache['agua'] == agua:
+        desde = indice_modificado_desde(cache['version'])
+
+    if desde is None:
+        agregado = agrupar_por_especie(df_lotes)
+    else:
+        agregado = actualizar_agregado_especie(cache['agregado'], cache['lotes'].iloc[desde:], df_lotes.iloc[desde:])
+
+    st.session_state.cache_agregados_especie = {'version': version, 'agua': agua, 'agregado': agregado, 'lotes': df_lotes}
+    return agregado, (version, agua)
+
+
+def calcular_potencial_agrupado(inventario_list, current_species_info):
+    df_potencial = calcular_potencial_maximo_lotes(inventario_list, current_species_info)
+    df_agrupado = df_potencial.groupby('Especie').agg(
+        Total_Cantidad=('Cantidad', 'sum'),
+        Total_CO2e_Potencial=('CO2e Lote Potencial (Ton)', 'sum'),
+        DAP_Max=('DAP Potencial (cm)', 'first'), # Usar el DAP Máximo de la especie
+        Altura_Max=('Altura Potencial (m)', 'first'), # Usar la Altura Máxima de la especie
+        Tiempo_Max=('Tiempo Máximo (años)', 'first') # Nuevo campo
+    ).reset_index()
+    return df_potencial, df_agrupado
+
+
+def obtener_potencial_por_especie(current_species_info):
+    """
+    Potencial máximo por lote y su agrupación por especie, memorizados por
+    (versión del inventario, versión de la BD de especies) y, por contenido, en la caché en disco.
+    Retorna (df_potencial, df_agrupado, version).
+    """
+    version = (st.session_state.inventario_version, st.session_state.especies_version)
+    cache = st.session_state.get('cache_potencial')
+    if cache is None or cache['version'] != version:
+        df_potencial, df_agrupado = obtener_cache_disco().memorizar(
+            clave_contenido('potencial', clave_lotes(st.session_state.inventario_list), clave_especies_sesion()),
+            lambda: calcular_potencial_agrupado(st.session_state.inventario_list, current_species_info),
+            tipo='agregados', en_segundo_plano=True
+        )
+        cache = {'version': version, 'potencial': df_potencial, 'agrupado': df_agrupado}
+        st.session_state.cache_potencial = cache
+    return cache['potencial'], cache['agrupado'], version
+
+
+def obtener_calidad_inventario(df_inventario_completo):
+    """
+    Alertas de calidad de cada lote (calidad_datos.evaluar_calidad_lotes), memorizadas por
+    (versión del inventario, versión de la BD de especies): dependen de los máximos de cada especie.
+    """
+    version = (st.session_state.inventario_version, st.session_state.especies_version)
+    cache = st.session_state.get('cache_calidad')
+    if cache is None or cache['version'] != version:
+        cache = {'version': version, 'calidad': evaluar_calidad_lotes(df_inventario_completo, get_current_species_info())}
+        st.session_state.cache_calidad = cache
+    return cache['calidad']
+
+
+def obtener_tabla_inventario(df_inventario_completo):
+    """
+    Índice de la tabla del inventario (tabla_virtual.IndiceTabla) con la columna de alertas de calidad,
+    memorizado por versión: ordenar, filtrar o cambiar de página no vuelve a copiar el inventario.
+    """
+    version = (st.session_state.inventario_version, st.session_state.especies_version, clave_calculo_agua())
+    cache = st.session_state.get('cache_tabla_inventario')
+    if cache is None or cache['version'] != version:
+        df_tabla = df_inventario_completo.drop(columns=[col for col in ['Detalle Cálculo'] if col in df_inventario_completo.columns])
+        df_tabla[COLUMNA_ALERTAS] = obtener_calidad_inventario(df_inventario_completo)[COLUMNA_ALERTAS].to_numpy()
+        cache = {'version': version, 'indice': IndiceTabla(df_tabla, columnas_busqueda=['Especie', 'ID Lote'])}
+        st.session_state.cache_tabla_inventario = cache
+    return cache['indice']
+
+
+def construir_figura_especie(nombre, df_graficos):
+    """Gráficos por especie del Visor de Gráficos (también los usa el tablero publicado)."""
+    import plotly.express as px
+    if nombre == 'fig_costo':
+        return px.bar(df_graficos, x='Especie', y='Total_Costo_S', title='Costo Total (Acumulado) por Especie (Soles)', color='Total_Costo_S', color_continuous_scale=px.colors.sequential.Sunset)
+    if nombre == 'fig_agua':
+        return px.bar(df_graficos, x='Especie', y='Consumo_Agua_Total_L', title='Consumo Agua Anual por Especie (Litros)', color='Consumo_Agua_Total_L', color_continuous_scale=px.colors.sequential.Agsunset)
+    if nombre == 'fig_co2e':
+        return px.bar(df_graficos, x='Especie', y='Total_CO2e_Ton', title='CO2e Capturado por Especie (Ton)', color='Total_CO2e_Ton', color_continuous_scale=px.colors.sequential.Viridis)
+    return px.pie(df_graficos, values='Conteo_Arboles', names='Especie', title='Conteo de Árboles por Especie', hole=0.3, color_discrete_sequence=px.colors.sequential.Plasma)
+
+
+def obtener_figura(nombre, version, constructor):
+    """
+    Devuelve la figura `nombre` memorizada para `version`; solo se reconstruye
+    (llamando a `constructor`) cuando cambian los datos de los que depende.
+    """
+    cache = st.session_state.setdefault('cache_figuras', {})
+    entrada = cache.get(nombre)
+    if entrada is None or entrada[0] != version:
+        entrada = (version, constructor())
+        cache[nombre] = entrada
+    return entrada[1]
+
+
+# --- RENDIMIENTO DE ARRANQUE ---
+
+@st.cache_data(show_spinner=False)
+def construir_especies_bd_base():
+    """Tabla de especies inicial (DENSIDADES_BASE). Memorizada por proceso; st.cache_data entrega una copia por llamada."""
+    # [MODIFICACIÓN] Ahora incluye todas las especies de DENSIDADES_BASE
+    df_cols = ['Especie', 'DAP (cm)', 'Altura (m)', 'Consumo Agua (L/año)', 'Densidad (g/cm³)', 'Precio Plantón (S/)', 'DAP Máximo (cm)', 'Altura Máxima (m)', 'Tiempo Máximo (años)'] 
+    data_rows = [
+        # Se usa una DAP y Altura inicial baja (5.0) para el campo de 'progresos' 
+        # de la tabla de gestión, pero se usan los valores de DENSIDADES_BASE para el potencial
+        (name, 5.0, 5.0, data['Agua_L_Anio'], data['Densidad'], data['Precio_Plantón'], data['DAP_Max'], data['Altura_Max'], data['Tiempo_Max_Anios']) 
+        for name, data in DENSIDADES_BASE.items()
+    ]
+    return pd.DataFrame(data_rows, columns=df_cols)
+
+
+@st.cache_resource(show_spinner=False)
+def registro_arranque_proceso():
+    """Métricas del arranque en frío del proceso: se crean en la primera ejecución del script tras iniciar el servidor."""
+    return {'importaciones_s': TIEMPO_IMPORTACIONES, 'primer_render_s': None}
+
+
+LOGGER_ARRANQUE = logging.getLogger(__name__) # Nivel DEBUG: no escribe en la salida del servidor por defecto
+
+
+def registrar_tiempos_arranque():
+    """
+    Registra (en el log de depuración y en la sesión) el tiempo de importaciones y de render del arranque en frío
+    del proceso y de la primera ejecución de cada sesión, para detectar regresiones de arranque.
+    Retorna la duración total de la ejecución actual en segundos.
+    """
+    duracion = time.perf_counter() - TIEMPO_INICIO_SCRIPT
+    proceso = registro_arranque_proceso()
+    if proceso['primer_render_s'] is None:
+        proceso['primer_render_s'] = duracion
+        LOGGER_ARRANQUE.debug("[arranque] Proceso en frío: importaciones %.3f s | primer render %.3f s", proceso['importaciones_s'], duracion)
+    if 'metricas_arranque' not in st.session_state:
+        st.session_state.metricas_arranque = {'importaciones_s': TIEMPO_IMPORTACIONES, 'primer_render_s': duracion}
+        LOGGER_ARRANQUE.debug("[arranque] Nueva sesión: importaciones %.3f s | primer render %.3f s", TIEMPO_IMPORTACIONES, duracion)
+    return duracion
+
+
+def render_tiempos_arranque(duracion_actual):
+    """Panel del sidebar con los tiempos de arranque (proceso y sesión) y de la ejecución actual."""
+    proceso = registro_arranque_proceso()
+    sesion = st.session_state.metricas_arranque
+    with st.sidebar.expander("⏱️ Tiempos de Arranque"):
+        st.caption(f"Proceso (frío): importaciones {proceso['importaciones_s']:.3f} s · primer render {proceso['primer_render_s']:.3f} s")
+        st.caption(f"Sesión: importaciones {sesion['importaciones_s']:.3f} s · primer render {sesion['primer_render_s']:.3f} s")
+        st.caption(f"Ejecución actual: {duracion_actual:.3f} s")
+
+
+# --- MEMORIA POR SESIÓN (CONTABILIDAD Y DESCARGA A DISCO) ---
+
+@st.cache_resource(show_spinner=False)
+def obtener_registro_memoria():
+    """Registro de memoria del proceso (presupuesto y directorio: ver memoria_sesiones.py)."""
+    from streamlit.runtime import Runtime
+
+    def sesion_activa(id_sesion):
+        return not Runtime.exists() or Runtime.instance().is_active_session(id_sesion)
+
+    return RegistroMemoria(sesion_activa=sesion_activa)
+
+
+def contexto_sesion():
+    """(ID de sesión, estado de sesión subyacente) de la ejecución actual; None fuera de Streamlit."""
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+    ctx = get_script_run_ctx()
+    return None if ctx is None else (ctx.session_id, ctx.session_state)
+
+
+def restaurar_sesion_desde_disco():
+    """Vuelve a cargar el estado de la sesión si fue descargado a disco por inactividad."""
+    contexto = contexto_sesion()
+    if contexto is not None and obtener_registro_memoria().restaurar(*contexto):
+        st.toast("Sesión restaurada desde disco.", icon="💾")
+
+
+def con_estado_en_memoria(funcion):
+    """
+    Decorador de callbacks de widgets: se ejecutan antes que el script (y que su restauración),
+    por lo que restauran la sesión desde disco antes de leer su estado.
+    """
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        restaurar_sesion_desde_disco()
+        return funcion(*args, **kwargs)
+    return envoltura
+
+
+def registrar_memoria_sesion():
+    """Mide la sesión al final de la ejecución y aplica el presupuesto de memoria del proceso."""
+    contexto = contexto_sesion()
+    if contexto is not None:
+        obtener_registro_memoria().finalizar(*contexto, contexto[1].filtered_state)
+
+
+def render_panel_memoria():
+    """Panel del sidebar: memoria de la sesión por clave y sesiones más grandes del proceso."""
+    contexto = contexto_sesion()
+    if contexto is None:
+        return
+    registro = obtener_registro_memoria()
+    with st.sidebar.expander("🧠 Uso de Memoria"):
+        tamanos = registro.tamanos_de(contexto[0])
+        st.caption(
+            f"Esta sesión: {sum(tamanos.values()) / 1024 ** 2:,.1f} MB · Proceso: {registro.total_en_memoria() / 1024 ** 2:,.1f} MB "
+            f"de {registro.presupuesto_bytes / 1024 ** 2:,.0f} MB"
+        )
+        df_claves = pd.DataFrame({'Clave': list(tamanos)[:8], 'MB': [v / 1024 ** 2 for v in list(tamanos.values())[:8]]})
+        st.dataframe(df_claves, hide_index=True, use_container_width=True, column_config={'MB': st.column_config.NumberColumn(format="%.2f")})
+        st.caption("Sesiones más grandes")
+        st.dataframe(
+            registro.tabla_sesiones().head(10), hide_index=True, use_container_width=True,
+            column_config={col: st.column_config.NumberColumn(format="%.1f") for col in ['Memoria (MB)', 'En Disco (MB)', 'Inactiva (min)']}
+        )
+        cache_disco = obtener_cache_disco().estadisticas()
+        st.caption(
+            f"Caché de resultados en disco: {cache_disco['entradas']:,} resultados · {cache_disco['bytes'] / 1024 ** 2:,.1f} MB "
+            f"de {cache_disco['limite_bytes'] / 1024 ** 2:,.0f} MB · {cache_disco['aciertos']:,} aciertos / {cache_disco['fallos']:,} fallos en este proceso"
+        )
+
+
+# --- TRABAJOS EN SEGUNDO PLANO ---
+
+INTERVALO_SONDEO_TRABAJOS_S = 1.0 # Frecuencia de actualización del panel de trabajos en curso
+
+@st.cache_resource(show_spinner=False)
+def obtener_gestor_trabajos():
+    """Pool de trabajos del proceso (compartido por las sesiones; cada sesión solo ve los suyos)."""
+    return GestorTrabajos()
+
+
+def trabajo_generar_excel(ctx, df_inventario, proyecto, hectareas, total_arboles, total_co2e_ton, total_agua_l, total_costo, df_historial=None, df_resumen_calidad=None, cache=None, clave_cache=None, modo_evidencia='hojas'):
+    """Trabajo: exportación Excel de la memoria de cálculo (no accede a st.session_state). Se guarda en `cache` con `clave_cache`."""
+    datos = generar_excel_memoria(
+        df_inventario, proyecto, hectareas, total_arboles, total_co2e_ton, total_agua_l, total_costo,
+        df_historial=df_historial, df_resumen_calidad=df_resumen_calidad, on_progreso=ctx.reportar, cancelado=ctx.cancelado,
+        modo_evidencia=modo_evidencia
+    )
+    if cache is not None:
+        cache.guardar(clave_cache, datos, 'exportacion')
+    return datos
+
+
+def trabajo_procesar_censo(ctx, fuente, current_species_info, ancho_clase, indice_especies=None):
+    """Trabajo: procesamiento por bloques de un censo por árbol (avance por bytes leídos; el total de filas no se conoce de antemano)."""
+    return procesar_censo_por_bloques(
+        fuente, current_species_info, ancho_clase=ancho_clase, indice_especies=indice_especies,
+        on_progreso=lambda filas, fraccion: ctx.reportar(fraccion, f"{filas:,.0f} árboles leídos"),
+        cancelado=ctx.cancelado
+    )
+
+
+def trabajo_estimar_parcelas(ctx, fuente, current_species_info, hectareas, confianza, n_replicas, indice_especies=None):
+    """Trabajo: estimación por parcelas de muestreo (el bootstrap se reparte en un pool de procesos)."""
+    return estimar_parcelas(
+        leer_parcelas(fuente), current_species_info, hectareas, confianza=confianza, n_replicas=n_replicas,
+        indice_especies=indice_especies,
+        on_progreso=lambda fraccion: ctx.reportar(fraccion, "Remuestreo bootstrap"),
+        cancelado=ctx.cancelado
+    )
+
+
+def trabajo_simular_supervivencia(ctx, df_inventario, current_species_info, tasas_mortalidad, politica, horizonte, n_simulaciones, semilla, cantidad_es_plantada, cache=None, clave_cache=None):
+    """Trabajo: simulación de supervivencia y reposición (las simulaciones se reparten en un pool de procesos)."""
+    resultado = simular_supervivencia(
+        df_inventario, current_species_info, tasas_mortalidad, politica, horizonte=horizonte,
+        n_simulaciones=n_simulaciones, semilla=semilla, cantidad_es_plantada=cantidad_es_plantada,
+        on_progreso=lambda fraccion: ctx.reportar(fraccion, "Simulando supervivencia"),
+        cancelado=ctx.cancelado
+    )
+    if cache is not None:
+        cache.guardar(clave_cache, resultado, 'supervivencia')
+    return resultado
+
+
+def enviar_trabajo(tipo, funcion, *args, descripcion='', version=None, **kwargs):
+    """Envía un trabajo al gestor y lo registra en la sesión con su tipo (para aplicar el resultado al recogerlo)."""
+    id_trabajo = obtener_gestor_trabajos().enviar(
+        funcion, *args, descripcion=descripcion, propietario=st.session_state.id_sesion_trabajos, **kwargs
+    )
+    st.session_state.trabajos_sesion[id_trabajo] = {'tipo': tipo, 'version': version, 'descripcion': descripcion}
+    return id_trabajo
+
+
+def trabajo_activo(tipo):
+    """ID del trabajo sin recoger de este tipo en la sesión, o None."""
+    for id_trabajo, meta in st.session_state.trabajos_sesion.items():
+        if meta['tipo'] == tipo:
+            return id_trabajo
+    return None
+
+
+def recoger_trabajos_finalizados():
+    """Aplica a la sesión los resultados de sus trabajos finalizados. Retorna True si recogió alguno."""
+    gestor = obtener_gestor_trabajos()
+    recogidos = False
+    for id_trabajo, meta in list(st.session_state.trabajos_sesion.items()):
+        trabajo = gestor.obtener(id_trabajo)
+        if trabajo is None:
+            # Resultado expirado o proceso reiniciado: se olvida el trabajo
+            del st.session_state.trabajos_sesion[id_trabajo]
+            recogidos = True
+            continue
+        if not trabajo.finalizado:
+            continue
+        gestor.recoger(id_trabajo)
+        del st.session_state.trabajos_sesion[id_trabajo]
+        recogidos = True
+
+        if trabajo.estado == COMPLETADO:
+            if meta['tipo'] == 'excel':
+                st.session_state.excel_generado = {'version': meta['version'], 'data': trabajo.resultado}
+            elif meta['tipo'] == 'censo':
+                st.session_state.censo_resultado = trabajo.resultado
+                st.session_state.censo_version += 1
+            elif meta['tipo'] == 'parcelas':
+                st.session_state.estimacion_parcelas = trabajo.resultado
+                st.session_state.parcelas_version += 1
+            elif meta['tipo'] == 'supervivencia':
+                st.session_state.simulacion_supervivencia = trabajo.resultado
+                st.session_state.supervivencia_version += 1
+        elif trabajo.estado == ERROR:
+            st.session_state.avisos_trabajos.append(f"❌ {meta['descripcion']}: {trabajo.error}")
+        else:
+            st.session_state.avisos_trabajos.append(f"⏹️ {meta['descripcion']}: cancelado.")
+    return recogidos
+
+
+@st.fragment(run_every=INTERVALO_SONDEO_TRABAJOS_S)
+def render_trabajos_en_curso():
+    """Panel del sidebar con el avance de los trabajos de la sesión; solo este fragmento se re-ejecuta al sondear."""
+    restaurar_sesion_desde_disco() # Las re-ejecuciones del fragmento no pasan por main_app
+    if recoger_trabajos_finalizados():
+        st.rerun()
+
+    gestor = obtener_gestor_trabajos()
+    st.subheader("⏳ Trabajos en Segundo Plano")
+    for id_trabajo, meta in st.session_state.trabajos_sesion.items():
+        trabajo = gestor.obtener(id_trabajo)
+        if trabajo is None:
+            continue
+        texto = f"{meta['descripcion']} — {trabajo.mensaje or trabajo.estado}"
+        if trabajo.progreso is None:
+            st.caption(f"🔄 {texto}")
+        else:
+            st.progress(min(max(trabajo.progreso, 0.0), 1.0), text=texto)
+        if trabajo.contexto.cancelado():
+            st.caption("Cancelando...")
+        elif st.button("Cancelar", key=f"cancelar_trabajo_{id_trabajo}"):
+            gestor.cancelar(id_trabajo)
+    registrar_memoria_sesion()
+
+
+def render_avisos_trabajos():
+    """Muestra los avisos (errores/cancelaciones) de los trabajos recogidos hasta que el usuario los descarta."""
+    if not st.session_state.avisos_trabajos:
+        return
+    for aviso in st.session_state.avisos_trabajos:
+        st.warning(aviso)
+    if st.button("Descartar avisos", key="descartar_avisos_trabajos"):
+        st.session_state.avisos_trabajos = []
+        st.rerun()
+
+
+# --- PROYECTO COMPARTIDO (VARIOS COORDINADORES) ---
+# Los lotes añadidos y las especies editadas se acumulan en la sesión y se escriben por lotes al
+# sincronizar (cada rerun y cada INTERVALO_SINCRONIZACION_S); lo que escriben los demás llega como
+# lotes anexados, de modo que los totales se actualizan sin recalcular el inventario completo.
+INTERVALO_SINCRONIZACION_S = 3.0
+
+@st.cache_resource(show_spinner=False)
+def obtener_proyecto_compartido(nombre):
+    """Base del proyecto compartido (ver proyectos_compartidos.py), una instancia por proceso."""
+    return ProyectoCompartido(nombre)
+
+
+def codigo_coordinador(autor):
+    """Prefijo de los ID de lote del coordinador: evita que dos coordinadores generen el mismo ID."""
+    return re.sub(r'[^0-9A-Za-z]+', '', autor).upper()[:8] or 'C'
+
+
+def encolar_lotes_compartidos(lotes):
+    if st.session_state.compartido_proyecto:
+        st.session_state.compartido_pendientes['lotes'].extend(lotes)
+
+
+def encolar_especies_compartidas(cambios):
+    """Encola ediciones de especies con la versión que la sesión vio (la primera, si ya había una pendiente)."""
+    pendientes = st.session_state.compartido_pendientes['especies']
+    versiones = st.session_state.compartido_versiones_especies
+    for especie, datos in cambios.items():
+        version_vista = pendientes[especie][1] if especie in pendientes else versiones.get(especie, 0)
+        pendientes[especie] = (datos, version_vista)
+
+
+def aplicar_lotes_remotos(lotes):
+    """Anexa al inventario los lotes de otros coordinadores (un evento del historial, sin volver a compartirlos)."""
+    for lote in lotes:
+        _, _, _, _, lote['Detalle Cálculo'] = calcular_co2_arbol(lote['Densidad (ρ)'], lote['DAP (cm)'], lote['Altura (m)'])
+    patron = re.compile(rf"{re.escape(codigo_coordinador(st.session_state.compartido_autor))}-L-(\d+)")
+    numeros = [int(m.group(1)) for lote in lotes if (m := patron.fullmatch(str(lote['ID Lote'])))]
+    st.session_state.siguiente_id_lote = max([st.session_state.siguiente_id_lote] + [n + 1 for n in numeros])
+    registrar_cambio_inventario(
+        f"Sincronizar '{st.session_state.compartido_proyecto}' ({len(lotes)} lotes de otros coordinadores)",
+        [('insertar', len(st.session_state.inventario_list), tuple(lotes)), operacion_medicion_inicial(lotes)],
+        compartir=False
+    )
+
+
+def sincronizar_proyecto_compartido():
+    """
+    Escribe los cambios pendientes de la sesión (una transacción corta por bloque) y trae lo que
+    escribieron los demás desde la última sincronización. Retorna True si cambió el estado local.
+    """
+    nombre = st.session_state.compartido_proyecto
+    if not nombre:
+        return False
+    proyecto = obtener_proyecto_compartido(nombre)
+    sesion = st.session_state.id_sesion_trabajos
+    versiones = st.session_state.compartido_versiones_especies
+    pendientes = st.session_state.compartido_pendientes
+    try:
+        if pendientes['lotes'] or pendientes['especies']:
+            resultado = proyecto.escribir(pendientes['lotes'], pendientes['especies'], autor=st.session_state.compartido_autor, sesion=sesion)
+            st.session_state.compartido_pendientes = {'lotes': [], 'especies': {}}
+            versiones.update(resultado['especies'])
+            for conflicto in resultado['conflictos']:
+                detalle = "queda solo en esta sesión" if conflicto['tipo'] == 'lote' else "se conserva el valor del proyecto"
+                st.session_state.compartido_conflictos.append(f"{conflicto['tipo'].capitalize()} {conflicto['clave']}: {conflicto['motivo']}; {detalle}.")
+        cambios = proyecto.cambios_desde(st.session_state.compartido_secuencia)
+    except sqlite3.Error as e:
+        print(f"Error al sincronizar el proyecto compartido '{nombre}': {e}") # Los pendientes se reintentan en la próxima sincronización
+        return False
+
+    st.session_state.compartido_secuencia = cambios['secuencia']
+    st.session_state.compartido_sincronizado = time.time()
+    lotes_ajenos = [lote for sesion_lote, _, lote in cambios['lotes'] if sesion_lote != sesion]
+    especies_ajenas = {}
+    for especie, datos, version, sesion_especie in cambios['especies']:
+        versiones[especie] = version
+        if sesion_especie != sesion:
+            especies_ajenas[especie] = datos
+    if lotes_ajenos:
+        aplicar_lotes_remotos(lotes_ajenos)
+    if especies_ajenas:
+        st.session_state.especies_bd = aplicar_cambios_especies(st.session_state.especies_bd, especies_ajenas)
+        st.session_state.especies_version += 1
+    return bool(lotes_ajenos or especies_ajenas)
+
+
+@con_estado_en_memoria
+def unirse_proyecto_compartido():
+    """Conecta la sesión a un proyecto compartido e incorpora los lotes y especies que ya tiene."""
+    nombre = (st.session_state.get('compartido_nombre_input') or '').strip()
+    autor = (st.session_state.get('compartido_autor_input') or '').strip()
+    if not nombre or not autor:
+        st.warning("Ingrese el nombre del proyecto compartido y su nombre de coordinador.")
+        return
+    st.session_state.compartido_proyecto = nombre
+    st.session_state.compartido_autor = autor
+    st.session_state.compartido_secuencia = 0
+    st.session_state.compartido_versiones_especies = {}
+    st.session_state.compartido_pendientes = {'lotes': [], 'especies': {}}
+    lotes_antes = len(st.session_state.inventario_list)
+    sincronizar_proyecto_compartido()
+    st.session_state.proyecto = nombre # Callback: se ejecuta antes de los widgets
+    st.success(f"Unido a '{nombre}': {len(st.session_state.inventario_list) - lotes_antes:,} lotes del proyecto incorporados.")
+
+
+@con_estado_en_memoria
+def salir_proyecto_compartido():
+    """Escribe los cambios pendientes y desconecta la sesión (su inventario queda como copia local)."""
+    sincronizar_proyecto_compartido()
+    if st.session_state.compartido_pendientes['lotes'] or st.session_state.compartido_pendientes['especies']:
+        st.error("No se pudieron escribir los cambios pendientes en el proyecto compartido; inténtelo de nuevo.")
+        return
+    st.session_state.compartido_proyecto = None
+
+
+@st.fragment(run_every=INTERVALO_SINCRONIZACION_S)
+def render_sincronizacion_compartida():
+    """Estado del proyecto compartido en el sidebar; el fragmento sincroniza periódicamente aunque no haya interacción."""
+    restaurar_sesion_desde_disco() # Las re-ejecuciones del fragmento no pasan por main_app
+    if sincronizar_proyecto_compartido():
+        st.rerun() # Hay lotes o especies de otros coordinadores: se actualizan los totales
+    pendientes = st.session_state.compartido_pendientes
+    texto = f"👥 **{st.session_state.compartido_proyecto}** ({st.session_state.compartido_autor})"
+    if pendientes['lotes'] or pendientes['especies']:
+        texto += f" · {len(pendientes['lotes']) + len(pendientes['especies']):,} cambios por escribir"
+    elif st.session_state.compartido_sincronizado is not None:
+        texto += f" · sincronizado {time.strftime('%H:%M:%S', time.localtime(st.session_state.compartido_sincronizado))}"
+    st.caption(texto)
+    if st.session_state.compartido_conflictos:
+        st.caption(f"⚠️ {len(st.session_state.compartido_conflictos)} conflictos (ver sección 1)")
+    registrar_memoria_sesion()
+
+
+def render_proyecto_compartido():
+    """Unirse a un proyecto compartido, su estado por coordinador y los conflictos de escritura."""
+    nombre = st.session_state.compartido_proyecto
+    with st.expander("👥 Proyecto Compartido (varios coordinadores)", expanded=bool(nombre or st.session_state.compartido_conflictos)):
+        if not nombre:
+            st.caption(
+                "Los coordinadores unidos al mismo proyecto ven los lotes que añaden los demás y comparten la tabla "
+                "de especies (sección 4). Los lotes que ya están en esta sesión no se comparten; los que añada "
+                "después sí. Eliminar, editar o deshacer afecta solo a esta sesión."
+            )
+            col_nombre, col_autor = st.columns(2)
+            col_nombre.text_input("Proyecto compartido", key='compartido_nombre_input', placeholder="Ej: Reforestación Bosque Seco 2024")
+            col_autor.text_input("Coordinador", key='compartido_autor_input', placeholder="Nombre o código (prefijo de los ID de sus lotes)")
+            st.button("🔗 Unirse al Proyecto", on_click=unirse_proyecto_compartido)
+        else:
+            resumen = obtener_proyecto_compartido(nombre).resumen()
+            pendientes = st.session_state.compartido_pendientes
+            col_lotes, col_coord, col_pend = st.columns(3)
+            col_lotes.metric("Lotes en el Proyecto", f"{resumen['lotes']:,}")
+            col_coord.metric("Coordinadores", f"{len(resumen['por_autor']):,}")
+            col_pend.metric("Cambios por Escribir", f"{len(pendientes['lotes']) + len(pendientes['especies']):,}")
+            if resumen['por_autor']:
+                st.dataframe(
+                    pd.DataFrame(list(resumen['por_autor'].items()), columns=['Coordinador', 'Lotes']),
+                    hide_index=True, use_container_width=True
+                )
+            st.button("⏏️ Salir del Proyecto Compartido", on_click=salir_proyecto_compartido)
+        for conflicto in st.session_state.compartido_conflictos:
+            st.warning(conflicto)
+        if st.session_state.compartido_conflictos and st.button("Descartar conflictos", key='descartar_conflictos_compartido'):
+            st.session_state.compartido_conflictos = []
+            st.rerun()
 
 
 # --- MANEJO DE ESTADO DE SESIÓN Y UTILIDADES ---
@@ -431,23 +1334,77 @@ def inicializar_estado_de_sesion():
     if 'inventario_list' not in st.session_state:
         st.session_state.inventario_list = []
     if 'especies_bd' not in st.session_state:
-        # [MODIFICACIÓN] Ahora incluye todas las especies de DENSIDADES_BASE
-        df_cols = ['Especie', 'DAP (cm)', 'Altura (m)', 'Consumo Agua (L/año)', 'Densidad (g/cm³)', 'Precio Plantón (S/)', 'DAP Máximo (cm)', 'Altura Máxima (m)', 'Tiempo Máximo (años)'] 
-        data_rows = [
-            # Se usa una DAP y Altura inicial baja (5.0) para el campo de 'progresos' 
-            # de la tabla de gestión, pero se usan los valores de DENSIDADES_BASE para el potencial
-            (name, 5.0, 5.0, data['Agua_L_Anio'], data['Densidad'], data['Precio_Plantón'], data['DAP_Max'], data['Altura_Max'], data['Tiempo_Max_Anios']) 
-            for name, data in DENSIDADES_BASE.items()
-        ]
-        df_bd_inicial = pd.DataFrame(data_rows, columns=df_cols)
-        st.session_state.especies_bd = df_bd_inicial
+        # La tabla base se construye una vez por proceso; cada sesión recibe su propia copia
+        st.session_state.especies_bd = construir_especies_bd_base()
     if 'proyecto' not in st.session_state:
         st.session_state.proyecto = "Proyecto Reforestación CPSSA"
     if 'hectareas' not in st.session_state:
         st.session_state.hectareas = 0.0
+    if 'sede_proyecto' not in st.session_state:
+        st.session_state.sede_proyecto = SIN_SEDE
+    # Datos del proyecto: son claves de widgets de la sección 1, que Streamlit borra al cambiar de página;
+    # reasignarlas en cada ejecución las conserva (las usan también las secciones 8 y 9)
+    for clave in ('proyecto', 'hectareas', 'sede_proyecto'):
+        st.session_state[clave] = st.session_state[clave]
     # --- NUEVA VARIABLE DE SESIÓN ---
     if 'riego_controlado_check' not in st.session_state:
         st.session_state.riego_controlado_check = False
+    if 'censo_resultado' not in st.session_state:
+        st.session_state.censo_resultado = None
+        st.session_state.censo_version = 0
+    if 'estimacion_parcelas' not in st.session_state:
+        st.session_state.estimacion_parcelas = None
+        st.session_state.parcelas_version = 0
+    if 'simulacion_supervivencia' not in st.session_state:
+        st.session_state.simulacion_supervivencia = None
+        st.session_state.supervivencia_version = 0
+    # --- VERSIONES PARA AGREGADOS Y FIGURAS EN CACHÉ ---
+    if 'inventario_version' not in st.session_state:
+        st.session_state.inventario_version = 0
+        st.session_state.inventario_cambios = []
+    if 'especies_version' not in st.session_state:
+        st.session_state.especies_version = 0
+    if 'especies_alias' not in st.session_state:
+        st.session_state.especies_alias = {} # Especie -> nombres alternativos (sinónimos importados)
+    # --- CAMPAÑAS DE MEDICIÓN ---
+    if 'siguiente_id_lote' not in st.session_state:
+        st.session_state.siguiente_id_lote = 1
+    if 'mediciones' not in st.session_state:
+        st.session_state.mediciones = crear_almacen_mediciones()
+        st.session_state.mediciones_version = 0
+    # --- BALANCE HÍDRICO MENSUAL ---
+    if 'clima_mensual' not in st.session_state:
+        st.session_state.clima_mensual = None
+        st.session_state.clima_version = 0
+        st.session_state.balance_kc = KC_POR_DEFECTO
+        st.session_state.balance_eficiencia = EFICIENCIA_RIEGO_POR_DEFECTO
+        st.session_state.balance_sitio_defecto = None
+        st.session_state.balance_activo = True
+    # --- PROYECTO COMPARTIDO ---
+    if 'compartido_proyecto' not in st.session_state:
+        st.session_state.compartido_proyecto = None
+        st.session_state.compartido_autor = ''
+        st.session_state.compartido_secuencia = 0 # Última secuencia del proyecto incorporada a la sesión
+        st.session_state.compartido_versiones_especies = {}
+        st.session_state.compartido_pendientes = {'lotes': [], 'especies': {}}
+        st.session_state.compartido_conflictos = []
+        st.session_state.compartido_sincronizado = None
+    # --- TRABAJOS EN SEGUNDO PLANO ---
+    if 'id_sesion_trabajos' not in st.session_state:
+        st.session_state.id_sesion_trabajos = uuid.uuid4().hex
+        st.session_state.trabajos_sesion = {}
+        st.session_state.avisos_trabajos = []
+    # Lotes de sesiones anteriores sin ID estable
+    lotes_sin_id = [lote for lote in st.session_state.inventario_list if not lote.get('ID Lote')]
+    if lotes_sin_id:
+        for lote in lotes_sin_id:
+            lote['ID Lote'] = generar_id_lote()
+        _, agregadas, quitadas = operacion_medicion_inicial(lotes_sin_id)
+        st.session_state.mediciones = aplicar_mediciones(st.session_state.mediciones, agregadas, quitadas)
+        st.session_state.mediciones_version += 1
+    # --- HISTORIAL DE CAMBIOS (DESHACER/REHACER Y AUDITORÍA) ---
+    if 'historial_inventario' not in st.session_state:
+        st.session_state.historial_inventario = HistorialInventario(st.session_state.inventario_list)
         
     # Inicialización de inputs del formulario
     # Se usa la primera clave para evitar errores si la lista cambia
@@ -464,13 +1421,133 @@ def inicializar_estado_de_sesion():
 
 def reiniciar_app_completo():
     """Borra completamente todos los elementos del estado de sesión (CRÍTICO PARA ARREGLAR CORRUPCIONES)."""
+    for id_trabajo in st.session_state.get('trabajos_sesion', {}):
+        obtener_gestor_trabajos().cancelar(id_trabajo)
     keys_to_delete = list(st.session_state.keys())
     for key in keys_to_delete:
         del st.session_state[key]
     st.rerun() 
 
-# ... (agregar_lote, deshacer_ultimo_lote, limpiar_inventario se mantienen sin cambios mayores)
 
+def generar_id_lote():
+    """
+    Genera un identificador estable y único (dentro de la sesión) para un nuevo lote. En un
+    proyecto compartido lleva el código del coordinador, único entre los coordinadores.
+    """
+    prefijo = f"{codigo_coordinador(st.session_state.compartido_autor)}-" if st.session_state.get('compartido_proyecto') else ''
+    id_lote = f"{prefijo}L-{st.session_state.siguiente_id_lote:04d}"
+    st.session_state.siguiente_id_lote += 1
+    return id_lote
+
+
+def operacion_medicion_inicial(lotes, fecha=None):
+    """Operación del historial que registra la medición con la que se crean los lotes como su primera campaña."""
+    fecha = pd.Timestamp.today().normalize() if fecha is None else fecha
+    df_nuevas = pd.DataFrame([
+        {
+            'ID Lote': lote['ID Lote'],
+            'Fecha': fecha,
+            'Cantidad': lote['Cantidad'],
+            'DAP (cm)': lote['DAP (cm)'],
+            'Altura (m)': lote['Altura (m)'],
+            'Densidad (ρ)': lote['Densidad (ρ)'],
+            'Años Plantados': lote['Años Plantados'],
+        }
+        for lote in lotes
+    ])
+    return operacion_mediciones(st.session_state.mediciones, df_nuevas)
+
+
+def aplicar_efectos_evento(evento):
+    """
+    Sincroniza lo que depende del inventario tras aplicar un evento del historial: versión y
+    posición modificada (agregados/figuras) y almacén de mediciones.
+    """
+    posiciones = [op[1] for op in evento['operaciones'] if op[0] != 'mediciones']
+    if posiciones:
+        marcar_inventario_modificado(min(posiciones))
+    for op in evento['operaciones']:
+        if op[0] == 'mediciones':
+            st.session_state.mediciones = aplicar_mediciones(st.session_state.mediciones, op[1], op[2])
+            st.session_state.mediciones_version += 1
+
+
+def registrar_cambio_inventario(accion, operaciones, compartir=True):
+    """
+    Aplica un cambio al inventario registrándolo en el historial (deshacer/rehacer y auditoría).
+    Con un proyecto compartido, los lotes insertados se encolan para escribirlos en el proyecto.
+    """
+    evento = st.session_state.historial_inventario.registrar(st.session_state.inventario_list, accion, operaciones)
+    aplicar_efectos_evento(evento)
+    if compartir:
+        encolar_lotes_compartidos([lote for op in operaciones if op[0] == 'insertar' for lote in op[2]])
+    return evento
+
+
+def registrar_campana(df_campana):
+    """
+    Registra una campaña (una o varias mediciones con columnas ID Lote, Fecha, Cantidad, DAP (cm), Altura (m))
+    y actualiza el estado actual de cada lote con su medición más reciente.
+    Retorna la cantidad de mediciones registradas.
+    """
+    lotes_por_id = {lote['ID Lote']: lote for lote in st.session_state.inventario_list}
+    df_campana = df_campana[df_campana['ID Lote'].astype(str).isin(lotes_por_id)].copy()
+    if df_campana.empty:
+        return 0
+
+    df_campana['ID Lote'] = df_campana['ID Lote'].astype(str)
+    df_campana['Fecha'] = pd.to_datetime(df_campana['Fecha']).astype('datetime64[ns]').dt.normalize()
+    df_campana['Densidad (ρ)'] = df_campana['ID Lote'].map(lambda id_lote: lotes_por_id[id_lote]['Densidad (ρ)'])
+
+    # La edad en cada campaña avanza con el tiempo transcurrido desde la primera medición del lote
+    primeras = st.session_state.mediciones.reset_index('Fecha').groupby(level='ID Lote')[['Fecha', 'Años Plantados']].first()
+    fecha_base = df_campana['ID Lote'].map(primeras['Fecha']).fillna(df_campana['Fecha'])
+    anios_base = df_campana['ID Lote'].map(primeras['Años Plantados']).fillna(df_campana['ID Lote'].map(lambda id_lote: lotes_por_id[id_lote]['Años Plantados']))
+    df_campana['Años Plantados'] = (anios_base + ((df_campana['Fecha'] - fecha_base).dt.days / DIAS_POR_ANIO).round()).clip(lower=0)
+
+    almacen = st.session_state.mediciones
+    op_mediciones = operacion_mediciones(almacen, df_campana)
+
+    # El lote refleja siempre su última medición (se reemplaza por un dict nuevo: el historial conserva el anterior)
+    afectados = df_campana['ID Lote'].unique()
+    sub = aplicar_mediciones(almacen.loc[almacen.index.get_level_values('ID Lote').isin(afectados)], op_mediciones[1], op_mediciones[2])
+    ultimas = sub.groupby(level='ID Lote').tail(1).reset_index('Fecha')
+    posiciones = {lote['ID Lote']: i for i, lote in enumerate(st.session_state.inventario_list)}
+
+    reemplazos = []
+    for id_lote, ultima in ultimas.iterrows():
+        antes = lotes_por_id[id_lote]
+        despues = dict(antes)
+        despues['Años Plantados'] = int(ultima['Años Plantados'])
+        despues['Cantidad'] = int(ultima['Cantidad'])
+        despues['DAP (cm)'] = float(ultima['DAP (cm)'])
+        despues['Altura (m)'] = float(ultima['Altura (m)'])
+        _, _, _, _, despues['Detalle Cálculo'] = calcular_co2_arbol(despues['Densidad (ρ)'], despues['DAP (cm)'], despues['Altura (m)'])
+        reemplazos.append(('reemplazar', posiciones[id_lote], antes, despues))
+
+    registrar_cambio_inventario(f"Campaña de medición ({len(df_campana)} mediciones)", reemplazos + [op_mediciones])
+    return len(df_campana)
+
+
+def obtener_analisis_campanas():
+    """
+    Retorna (incrementos, serie del proyecto) memorizados por versión del almacén,
+    para no recorrer todo el historial en cada rerun.
+    """
+    version = st.session_state.mediciones_version
+    cache = st.session_state.get('cache_campanas')
+    if cache is None or cache['version'] != version:
+        almacen = st.session_state.mediciones
+        cache = {
+            'version': version,
+            'incrementos': calcular_incrementos_campanas(almacen),
+            'serie': serie_captura_proyecto(almacen),
+        }
+        st.session_state.cache_campanas = cache
+    return cache['incrementos'], cache['serie']
+
+
+@con_estado_en_memoria
 def agregar_lote():
     """Añade un lote al inventario basado en los valores de los inputs."""
     current_species_info = get_current_species_info()
@@ -481,6 +1558,8 @@ def agregar_lote():
     altura = float(st.session_state.altura_slider)
     años = st.session_state.anios_plantados_input
     precio_planton_unitario = st.session_state.precio_planton_input 
+    latitud = st.session_state.get('latitud_input')
+    longitud = st.session_state.get('longitud_input')
     
     rho = 0.0
     consumo_agua_unitario = 0.0
@@ -496,10 +1575,14 @@ def agregar_lote():
     if cantidad <= 0 or dap <= 0 or altura <= 0 or rho <= 0 or años < 0 or consumo_agua_unitario < 0 or precio_planton_unitario < 0:
         st.error("Por favor, asegúrate de que Cantidad, DAP, Altura y Densidad sean mayores a cero, y los valores de Años, Agua y Precio sean mayores o iguales a cero.")
         return
+    if (latitud is None) != (longitud is None):
+        st.error("Ingrese Latitud y Longitud juntas (o deje ambas vacías).")
+        return
 
     _, _, _, _, detalle_calculo = calcular_co2_arbol(rho, dap, altura)
     
     nuevo_lote = {
+        'ID Lote': generar_id_lote(),
         'Especie': especie,
         'Cantidad': int(cantidad),
         'DAP (cm)': float(dap), 
@@ -509,114 +1592,127 @@ def agregar_lote():
         'Consumo Agua Unitario (L/año)': float(consumo_agua_unitario),
         'Precio Plantón Unitario (S/)': float(precio_planton_unitario), 
         'Detalle Cálculo': detalle_calculo, # JSON string
+        'Latitud': float(latitud) if latitud is not None else np.nan,
+        'Longitud': float(longitud) if longitud is not None else np.nan,
     }
     
-    st.session_state.inventario_list.append(nuevo_lote)
-    st.success(f"Lote de {cantidad} árboles de {especie} añadido.")
+    registrar_cambio_inventario(
+        f"Añadir lote {nuevo_lote['ID Lote']}",
+        [('insertar', len(st.session_state.inventario_list), (nuevo_lote,)), operacion_medicion_inicial([nuevo_lote])]
+    )
+    st.success(f"Lote {nuevo_lote['ID Lote']} de {cantidad} árboles de {especie} añadido.")
 
 
-def deshacer_ultimo_lote():
-    """Elimina el último lote añadido."""
-    if st.session_state.inventario_list:
-        st.session_state.inventario_list.pop()
-        st.success("Último lote eliminado.")
-    else:
-        st.warning("El inventario está vacío.")
+@con_estado_en_memoria
+def deshacer_cambio():
+    """Revierte el último cambio del inventario (sin límite de pasos)."""
+    evento = st.session_state.historial_inventario.deshacer(st.session_state.inventario_list)
+    if evento is None:
+        st.warning("No hay cambios para deshacer.")
+        return
+    aplicar_efectos_evento(evento)
+    st.success(f"{evento['accion']}: cambio revertido.")
+
+
+@con_estado_en_memoria
+def rehacer_cambio():
+    """Vuelve a aplicar el último cambio deshecho."""
+    evento = st.session_state.historial_inventario.rehacer(st.session_state.inventario_list)
+    if evento is None:
+        st.warning("No hay cambios para rehacer.")
+        return
+    aplicar_efectos_evento(evento)
+    st.success(f"{evento['accion']}: cambio aplicado de nuevo.")
+
+
+@con_estado_en_memoria
+def eliminar_lote(id_lote):
+    """Elimina un lote (y sus mediciones) del inventario."""
+    posiciones = [i for i, lote in enumerate(st.session_state.inventario_list) if lote.get('ID Lote') == id_lote]
+    if not posiciones:
+        st.warning(f"El lote {id_lote} no existe en el inventario.")
+        return
+    posicion = posiciones[0]
+    almacen = st.session_state.mediciones
+    filas_lote = almacen[almacen.index.get_level_values('ID Lote') == id_lote]
+    registrar_cambio_inventario(
+        f"Eliminar lote {id_lote}",
+        [('quitar', posicion, (st.session_state.inventario_list[posicion],)), ('mediciones', almacen.iloc[:0], filas_lote)]
+    )
+    st.success(f"Lote {id_lote} eliminado.")
 
+
+@con_estado_en_memoria
 def limpiar_inventario():
-    """Limpia todo el inventario."""
-    st.session_state.inventario_list = []
+    """Limpia todo el inventario (el cambio puede deshacerse)."""
+    if not st.session_state.inventario_list:
+        st.warning("El inventario está vacío.")
+        return
+    almacen = st.session_state.mediciones
+    registrar_cambio_inventario(
+        "Limpiar inventario",
+        [('quitar', 0, tuple(st.session_state.inventario_list)), ('mediciones', almacen.iloc[:0], almacen)]
+    )
     st.success("Inventario completamente limpiado.")
 
 
-# --- MODIFICACIÓN CLAVE: generar_excel_memoria para incluir hojas de detalle ---
-# (Se mantiene la lógica para incluir detalle JSON en el Excel)
-def generar_excel_memoria(df_inventario, proyecto, hectareas, total_arboles, total_co2e_ton, total_agua_l, total_costo):
-    """Genera el archivo Excel en memoria con el resumen, el inventario detallado y el detalle de cálculo."""
-    output = io.BytesIO()
-    writer = pd.ExcelWriter(output, engine='xlsxwriter')
-    
-    # 1. Preparar Inventario Detallado (sin Detalle Cálculo JSON)
-    cols_to_drop = ['Detalle Cálculo']
-    df_inventario_download = df_inventario.drop(columns=cols_to_drop, errors='ignore')
-    df_inventario_download.to_excel(writer, sheet_name='1_Inventario Detallado', index=False)
-    
-    # 2. Resumen del Proyecto
-    df_resumen = pd.DataFrame({
-        'Métrica': ['Proyecto', 'Fecha', 'Hectáreas (ha)', 'Total Árboles', 'CO2e Total (Ton)', 'CO2e Total (Kg)', 'Agua Total Anual (L)', 'Costo Total Acumulado (S/)'], 
-        'Valor': [ 
-            proyecto if proyecto else "Sin Nombre", 
-            str(pd.Timestamp.today().normalize().date()), 
-            f"{hectareas:.1f}", 
-            f"{total_arboles:.0f}", 
-            f"{total_co2e_ton:.2f}", 
-            f"{total_co2e_ton * FACTOR_KG_A_TON:.2f}", 
-            f"{total_agua_l:,.0f}", 
-            f"S/{total_costo:,.2f}" 
-        ]
-    })
-    df_resumen.to_excel(writer, sheet_name='2_Resumen Proyecto', index=False)
-    
-    # 3. Detalle de Cálculo (Evidencia) - Una hoja por lote
-    
-    for i, row in df_inventario.iterrows():
-        try:
-            detalle_json = row['Detalle Cálculo']
-            
-            # Si el detalle es NaN o no es string (error de migración de sesión), lo saltamos
-            if not isinstance(detalle_json, str):
-                continue
-                
-            detalle_dict = json.loads(detalle_json)
-            
-            # Crear un DataFrame para el detalle de este lote
-            data_lote = []
-            
-            # Estructurar los inputs
-            for item in detalle_dict.get('Inputs', []):
-                data_lote.append(['INPUT', item['Métrica'], item['Valor'], item['Unidad'], ''])
-                
-            # Estructurar los pasos de cálculo
-            orden = ['AGB_Aerea_kg', 'BGB_Subterranea_kg', 'Biomasa_Total_kg', 'Carbono_kg', 'CO2e_kg']
-            seccion_nombres = {
-                'AGB_Aerea_kg': '1. Biomasa Aérea (AGB)', 
-                'BGB_Subterranea_kg': '2. Biomasa Subterránea (BGB)',
-                'Biomasa_Total_kg': '3. Biomasa Total', 
-                'Carbono_kg': '4. Carbono Capturado',
-                'CO2e_kg': '5. CO2 Equivalente Capturado'
-            }
-            
-            for key in orden:
-                data_lote.append([seccion_nombres[key], '---', '---', '---', '---']) # Separador
-                for item in detalle_dict.get(key, []):
-                    paso = item.get('Paso', '')
-                    ecuacion = item.get('Ecuación', item.get('Fórmula', ''))
-                    valor = item.get('Valor', '')
-                    unidad = item.get('Unidad', '')
-                    
-                    if valor != '':
-                        data_lote.append([seccion_nombres[key], paso, valor, unidad, ''])
-                    elif ecuacion != '':
-                        data_lote.append([seccion_nombres[key], paso, 'ECUACIÓN/SUSTITUCIÓN', '', ecuacion])
-            
-            df_detalle = pd.DataFrame(data_lote, columns=['Sección', 'Métrica/Paso', 'Valor', 'Unidad', 'Ecuación/Detalle'])
-            
-            sheet_name = f'3_Detalle_Lote_{i+1}'
-            if len(sheet_name) > 31: # Límite de nombre de hoja de Excel
-                sheet_name = f'3_Detalle_{i+1}'
-            
-            df_detalle.to_excel(writer, sheet_name=sheet_name, index=False)
-            
-        except json.JSONDecodeError:
-            print(f"Error al decodificar JSON para el lote {i+1}. El lote tiene datos incorrectos.")
-            continue
-        except Exception as e:
-            print(f"Error inesperado al generar hoja de detalle para el lote {i+1}: {e}")
-            continue
+def preparar_archivo_proyecto(df_inventario_completo):
+    """Función (para st.download_button) que genera el archivo del proyecto con el estado actual de la sesión."""
+    sede = st.session_state.sede_proyecto
+    riego = st.session_state.riego_controlado_check
+    agua_anual_lote_l = df_inventario_completo['Consumo Agua Total Lote (L)'].to_numpy() if riego and balance_hidrico_activo() else None
+    argumentos = (
+        st.session_state.proyecto, st.session_state.hectareas, riego, tuple(st.session_state.inventario_list),
+        st.session_state.mediciones, None if sede == SIN_SEDE else sede, agua_anual_lote_l
+    )
+    return lambda: serializar_proyecto(*argumentos)
+
+
+@con_estado_en_memoria
+def abrir_proyecto():
+    """Reemplaza el inventario y las campañas de la sesión por los del archivo de proyecto (el cambio puede deshacerse)."""
+    archivo = st.session_state.get('proyecto_archivo')
+    if archivo is None:
+        st.warning("Seleccione un archivo de proyecto (.json).")
+        return
+    try:
+        datos = leer_proyecto(archivo.getvalue())
+        df_mediciones = pd.DataFrame(datos['mediciones'])
+        mediciones_archivo = preparar_mediciones(df_mediciones) if not df_mediciones.empty else None
+    except ERRORES_ARCHIVO_PROYECTO as e:
+        st.error(f"❌ No se pudo abrir el proyecto: {str(e) or type(e).__name__}")
+        return
+
+    lotes = tuple(datos['lotes'])
+    for lote in lotes:
+        if not lote.get('ID Lote'):
+            lote['ID Lote'] = generar_id_lote()
+    numeros = [int(m.group(1)) for lote in lotes if (m := re.fullmatch(r'L-(\d+)', str(lote['ID Lote'])))]
+    st.session_state.siguiente_id_lote = max([st.session_state.siguiente_id_lote] + [n + 1 for n in numeros])
+
+    almacen = st.session_state.mediciones
+    if mediciones_archivo is not None:
+        agregadas = mediciones_archivo
+    elif lotes:
+        agregadas = operacion_medicion_inicial(lotes)[1]
+    else:
+        agregadas = almacen.iloc[:0]
+
+    operaciones = []
+    if st.session_state.inventario_list:
+        operaciones.append(('quitar', 0, tuple(st.session_state.inventario_list)))
+    if lotes:
+        operaciones.append(('insertar', 0, lotes))
+    operaciones.append(('mediciones', agregadas, almacen))
+    nombre = datos.get('proyecto') or archivo.name
+    registrar_cambio_inventario(f"Abrir proyecto '{nombre}'", operaciones)
 
-    writer.close()
-    processed_data = output.getvalue()
-    return processed_data
+    # Se ejecuta como callback (antes de los widgets), por lo que puede fijar sus valores
+    st.session_state.proyecto = datos.get('proyecto') or ''
+    st.session_state.hectareas = datos['hectareas']
+    st.session_state.riego_controlado_check = datos['riego']
+    st.session_state.sede_proyecto = datos['sede'] if datos.get('sede') in HUELLA_CORPORATIVA else SIN_SEDE
+    st.success(f"Proyecto '{nombre}' abierto: {len(lotes)} lotes.")
 
 
 # --- FUNCIÓN NUEVA: EQUIVALENCIAS AMBIENTALES ---
@@ -662,6 +1758,41 @@ def render_equivalencias_ambientales(co2e_ton):
 
 
 # --- FUNCIONES DE VISUALIZACIÓN ---
+FILAS_POR_PAGINA_INVENTARIO = [100, 500, 1000, 5000]
+# Formato numérico en la configuración de columnas (el navegador formatea solo las celdas visibles;
+# ',' agrupa los miles como el formato '{:,.2f}' de la tabla anterior)
+FORMATO_COLUMNAS_INVENTARIO = {
+    'DAP (cm)': st.column_config.NumberColumn(format="%,.2f"),
+    'Altura (m)': st.column_config.NumberColumn(format="%,.2f"),
+    'Densidad (ρ)': st.column_config.NumberColumn(format="%,.3f"),
+    'Consumo Agua Unitario (L/año)': st.column_config.NumberColumn(format="%,.0f"),
+    'Precio Plantón Unitario (S/)': st.column_config.NumberColumn(format="S/%,.2f"),
+    'Biomasa Lote (Ton)': st.column_config.NumberColumn(format="%,.2f"),
+    'Carbono Lote (Ton)': st.column_config.NumberColumn(format="%,.2f"),
+    'CO2e Lote (Ton)': st.column_config.NumberColumn(format="%,.2f"),
+    'Consumo Agua Total Lote (L)': st.column_config.NumberColumn(format="%,.0f"),
+    'Costo Total Lote (S/)': st.column_config.NumberColumn(format="S/%,.2f"),
+}
+
+def render_tabla_paginada(indice_tabla, clave, columnas=None, column_config=None):
+    """
+    Tabla de lotes de un IndiceTabla con búsqueda y paginación (como la tabla del inventario):
+    solo la página visible se envía al navegador. `clave` distingue los widgets de cada tabla.
+    """
+    col_buscar, col_filas = st.columns([3, 1])
+    texto_busqueda = col_buscar.text_input("🔎 Buscar (Especie o ID Lote)", key=f'{clave}_buscar')
+    filas_pagina = col_filas.selectbox("Filas por página", FILAS_POR_PAGINA_INVENTARIO, key=f'{clave}_filas')
+    posiciones = indice_tabla.posiciones(texto=texto_busqueda)
+    total_paginas = max(1, -(-len(posiciones) // filas_pagina))
+    if st.session_state.get(f'{clave}_pagina', 1) > total_paginas:
+        st.session_state[f'{clave}_pagina'] = total_paginas
+    col_pagina, col_rango = st.columns([1, 3])
+    pagina = col_pagina.number_input(f"Página (de {total_paginas:,})", min_value=1, max_value=total_paginas, step=1, key=f'{clave}_pagina')
+    inicio = (pagina - 1) * filas_pagina
+    df_pagina = indice_tabla.ventana(posiciones, inicio, filas_pagina, columnas=columnas)
+    col_rango.caption(f"Lotes {min(inicio + 1, len(posiciones)):,}–{inicio + len(df_pagina):,} de {len(posiciones):,}")
+    st.dataframe(df_pagina, hide_index=True, use_container_width=True, column_config=column_config)
+
 
 def render_calculadora_y_graficos():
     """Función principal para la sección de cálculo y gráficos del progreso actual."""
@@ -685,16 +1816,24 @@ def render_calculadora_y_graficos():
 
     # --- INFORMACIÓN DEL PROYECTO ---
     st.subheader("📋 Información del Proyecto")
-    col_proj, col_hectareas = st.columns([2, 1])
+    col_proj, col_hectareas, col_sede = st.columns([2, 1, 1])
     with col_proj:
         st.text_input("Nombre del Proyecto (Opcional)", value=st.session_state.proyecto, placeholder="Ej: Reforestación Bosque Seco 2024", key='proyecto')
     with col_hectareas:
         st.number_input("Hectáreas (ha)", min_value=0.0, value=st.session_state.hectareas, step=0.1, key='hectareas', help="Dejar en 0 si no se aplica o no se conoce el dato.")
+    with col_sede:
+        opciones_sede = [SIN_SEDE] + list(HUELLA_CORPORATIVA.keys())
+        st.selectbox("Sede que compensa (Opcional)", opciones_sede, index=opciones_sede.index(st.session_state.sede_proyecto), key='sede_proyecto', help="Usada por el Portafolio (sección 8) para la cobertura de la Huella Corporativa.")
+
+    with st.expander("📂 Abrir Proyecto Guardado"):
+        st.file_uploader("Archivo de proyecto (.json)", type=['json'], key='proyecto_archivo')
+        st.button("📂 Abrir Proyecto", on_click=abrir_proyecto, help="Reemplaza el inventario y las campañas de la sesión por los del archivo (puede deshacerse).")
+    render_proyecto_compartido()
     
     st.divider()
 
     # --- NAVEGACIÓN POR PESTAÑAS ---
-    tab1, tab2, tab3, tab4 = st.tabs(["➕ Datos y Registro", "📈 Visor de Gráficos", "🔬 Detalle Técnico", "🌍 Equivalencias Ambientales"])
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(["➕ Datos y Registro", "📈 Visor de Gráficos", "🔬 Detalle Técnico", "🌍 Equivalencias Ambientales", "📅 Campañas de Medición", "🧾 Historial de Cambios", "💧 Balance Hídrico"])
     
     with tab1:
         st.markdown("## Registro de Lotes📝")
@@ -702,11 +1841,18 @@ def render_calculadora_y_graficos():
 
         with col_form:
             st.markdown("### Datos del Nuevo Lote")
+            consulta_especie = ''
+            if len(current_species_info) > LIMITE_OPCIONES_ESPECIE:
+                # Fuera del formulario: la búsqueda actualiza las opciones sin enviar el lote
+                consulta_especie = st.text_input(
+                    f"🔎 Buscar especie ({len(current_species_info):,} en el registro)", key='busqueda_especie',
+                    placeholder="Nombre científico, común o sinónimo (admite errores de tipeo)"
+                )
             with st.form("form_lote", clear_on_submit=True):
                 
                 # 1. Especie, Cantidad y Precio Plantón
                 col_esp, col_cant, col_precio_pl = st.columns(3)
-                especie_keys = list(current_species_info.keys())
+                especie_keys = opciones_especie(current_species_info, consulta_especie)
                 especie_sel = col_esp.selectbox(
                     "Especie Forestal:", 
                     options=especie_keys,
@@ -778,6 +1924,11 @@ def render_calculadora_y_graficos():
                     agua_info = current_species_info[especie_sel]['Agua_L_Anio']
                     info_agua_str = f"| Agua: **{agua_info} L/año**." if riego_controlado else "."
                     st.info(f"Usando valores por defecto para {especie_sel}: Densidad: **{densidad_info} g/cm³** {info_agua_str}")
+
+                # 5. Ubicación (opcional): ubica el lote en el mapa de captura (sección 6)
+                col_lat, col_lon = st.columns(2)
+                col_lat.number_input("Latitud (opcional)", min_value=-90.0, max_value=90.0, value=None, step=0.0001, format="%.5f", key='latitud_input', placeholder="Ej: -5.19450")
+                col_lon.number_input("Longitud (opcional)", min_value=-180.0, max_value=180.0, value=None, step=0.0001, format="%.5f", key='longitud_input', placeholder="Ej: -80.63280")
                     
                 st.form_submit_button("➕ Añadir Lote al Inventario", on_click=agregar_lote)
 
@@ -793,31 +1944,75 @@ def render_calculadora_y_graficos():
             st.metric(costo_label, f"S/{costo_proyecto_total:,.2f}") 
             
             # Etiqueta adaptada para reflejar el consumo anual
-            agua_label = "💧 Consumo Agua Total (Anual) L"
+            agua_label = "💧 Consumo Agua Total (Anual, Balance Hídrico) L" if riego_controlado and balance_hidrico_activo() else "💧 Consumo Agua Total (Anual) L"
             st.metric(agua_label, f"{agua_proyecto_total:,.0f} Litros")
             
+            historial = st.session_state.historial_inventario
+            col_deshacer, col_rehacer, col_limpiar = st.columns(3)
+            col_deshacer.button("↩️ Deshacer", on_click=deshacer_cambio, disabled=not historial.puede_deshacer, help="Revierte el último cambio del inventario (añadir, importar, campaña, eliminar o limpiar).")
+            col_rehacer.button("↪️ Rehacer", on_click=rehacer_cambio, disabled=not historial.puede_rehacer, help="Vuelve a aplicar el último cambio deshecho.")
+            col_limpiar.button("🗑️ Limpiar Inventario Total", on_click=limpiar_inventario, disabled=not st.session_state.inventario_list, help="Elimina todas las entradas y reinicia el cálculo (puede deshacerse).")
+
             if total_arboles_registrados > 0:
-                col_deshacer, col_limpiar = st.columns(2)
-                col_deshacer.button("↩️ Deshacer Último Lote", on_click=deshacer_ultimo_lote, help="Elimina la última fila añadida a la tabla.")
-                col_limpiar.button("🗑️ Limpiar Inventario Total", on_click=limpiar_inventario, help="Elimina todas las entradas y reinicia el cálculo.")
-                
-                col_excel, _ = st.columns([1, 4])
-                excel_data = generar_excel_memoria(
-                    df_inventario_completo.copy(), 
-                    st.session_state.proyecto, 
-                    st.session_state.hectareas, 
-                    total_arboles_registrados, 
-                    co2e_proyecto_ton, 
-                    agua_proyecto_total, 
-                    costo_proyecto_total
+                # El Excel (y xlsxwriter) solo se genera a pedido y se conserva mientras el inventario no cambie
+                col_excel, col_guardar, col_publicar, col_modo = st.columns([1, 1, 1, 2])
+                modo_evidencia = col_modo.selectbox(
+                    "Evidencia del cálculo en el Excel", list(MODOS_EVIDENCIA), format_func=MODOS_EVIDENCIA.get, key='modo_evidencia_excel',
+                    help="Las fórmulas vivas referencian una hoja de parámetros (el auditor puede recalcular en Excel) y generan un archivo mucho más liviano con muchos lotes distintos."
                 )
-                col_excel.download_button(
-                    label="📥 Descargar Excel",
-                    data=excel_data,
-                    file_name=f'Reporte_CO2e_NBS_{pd.Timestamp.today().strftime("%Y%m%d")}.xlsx',
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    help="Genera un archivo Excel con el resumen, el detalle de cada lote y la evidencia del cálculo."
+                version_excel = (st.session_state.inventario_version, st.session_state.especies_version, clave_calculo_agua(), st.session_state.proyecto, st.session_state.hectareas, modo_evidencia)
+                excel_cache = st.session_state.get('excel_generado')
+                # El archivo se genera solo al hacer clic (datos fijados al momento del render)
+                col_guardar.download_button(
+                    label="💾 Guardar Proyecto",
+                    data=preparar_archivo_proyecto(df_inventario_completo),
+                    file_name=f'Proyecto_NBS_{re.sub(r"[^A-Za-z0-9_-]+", "_", st.session_state.proyecto or "sin_nombre")}.json',
+                    mime="application/json",
+                    help="Guarda el inventario, las campañas y los datos del proyecto en un archivo que puede abrirse de nuevo o sumarse al Portafolio (sección 8)."
                 )
+                if col_publicar.button("📢 Publicar Tablero", help="Congela los totales, los gráficos por especie y el GAP actuales en un tablero de solo lectura para compartir."):
+                    st.session_state.publicacion_id = publicar_tablero(df_inventario_completo)
+                if st.session_state.get('publicacion_id'):
+                    st.caption(f"📢 Tablero publicado (solo lectura): [abrir](?publicacion={st.session_state.publicacion_id}) · comparta la dirección de la app con `?publicacion={st.session_state.publicacion_id}`")
+                if excel_cache is None or excel_cache['version'] != version_excel:
+                    if trabajo_activo('excel') is not None:
+                        col_excel.info("⏳ Generando Excel en segundo plano (avance en la barra lateral).")
+                    elif col_excel.button("📄 Preparar Excel", help="Genera un archivo Excel con el resumen, el detalle de cada lote y la evidencia del cálculo en el modo elegido."):
+                        # Se genera en segundo plano: la página sigue respondiendo y el trabajo no se reinicia con los clics
+                        df_calidad = obtener_calidad_inventario(df_inventario_completo)
+                        df_historial = historial.tabla_auditoria()
+                        df_resumen_calidad = resumen_alertas(df_calidad)
+                        cache_disco = obtener_cache_disco()
+                        clave_excel = clave_contenido(
+                            'excel', clave_inventario_sesion(), clave_especies_sesion(),
+                            st.session_state.proyecto, st.session_state.hectareas, df_historial, df_resumen_calidad, modo_evidencia
+                        )
+                        datos_excel = cache_disco.obtener(clave_excel)
+                        if datos_excel is not None: # Ya generado (en esta u otra sesión, o antes de un reinicio)
+                            st.session_state.excel_generado = {'version': version_excel, 'data': datos_excel}
+                        else:
+                            enviar_trabajo(
+                                'excel', trabajo_generar_excel,
+                                df_inventario_completo.assign(**{COLUMNA_ALERTAS: df_calidad[COLUMNA_ALERTAS]}), 
+                                st.session_state.proyecto, 
+                                st.session_state.hectareas, 
+                                total_arboles_registrados, 
+                                co2e_proyecto_ton, 
+                                agua_proyecto_total, 
+                                costo_proyecto_total,
+                                df_historial=df_historial, df_resumen_calidad=df_resumen_calidad,
+                                cache=cache_disco, clave_cache=clave_excel, modo_evidencia=modo_evidencia,
+                                descripcion="Exportación Excel", version=version_excel
+                            )
+                        st.rerun()
+                else:
+                    col_excel.download_button(
+                        label="📥 Descargar Excel",
+                        data=excel_cache['data'],
+                        file_name=f'Reporte_CO2e_NBS_{pd.Timestamp.today().strftime("%Y%m%d")}.xlsx',
+                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                        help="Genera un archivo Excel con el resumen, el detalle de cada lote y la evidencia del cálculo en el modo elegido."
+                    )
 
         st.markdown("---")
         st.subheader("Inventario Detallado (Lotes)")
@@ -825,25 +2020,47 @@ def render_calculadora_y_graficos():
         if df_inventario_completo.empty:
             st.info("No hay lotes registrados. Use el formulario superior para empezar.")
         else:
-            # Se excluye solo la columna 'Detalle Cálculo' de la visualización
-            cols_to_drop = [col for col in ['Detalle Cálculo'] if col in df_inventario_completo.columns]
-            df_mostrar = df_inventario_completo.drop(columns=cols_to_drop)
-            
-            st.dataframe(
-                df_mostrar.style.format({
-                    'DAP (cm)': '{:,.2f}',
-                    'Altura (m)': '{:,.2f}',
-                    'Densidad (ρ)': '{:,.3f}',
-                    'Consumo Agua Unitario (L/año)': '{:,.0f}',
-                    'Precio Plantón Unitario (S/)': 'S/{:,.2f}',
-                    'Biomasa Lote (Ton)': '{:,.2f}',
-                    'Carbono Lote (Ton)': '{:,.2f}',
-                    'CO2e Lote (Ton)': '{:,.2f}',
-                    'Consumo Agua Total Lote (L)': '{:,.0f}',
-                    'Costo Total Lote (S/)': 'S/{:,.2f}',
-                }),
-                use_container_width=True
+            # Control de calidad: alertas por lote (relación altura-DAP, máximos, crecimiento y atípicos)
+            df_calidad = obtener_calidad_inventario(df_inventario_completo)
+            con_alertas = (df_calidad['Código Alertas'] > 0).to_numpy()
+            solo_alertas = False
+            if con_alertas.any():
+                st.warning(f"⚠️ {int(con_alertas.sum()):,} de {len(df_calidad):,} lotes tienen alertas de calidad (columna '{COLUMNA_ALERTAS}'). Revise sus mediciones: un error de DAP o altura infla el CO₂e.")
+                col_resumen_alertas, col_filtro_alertas = st.columns([2, 1])
+                with col_resumen_alertas.expander("Resumen de alertas"):
+                    st.dataframe(resumen_alertas(df_calidad), hide_index=True, use_container_width=True)
+                solo_alertas = col_filtro_alertas.checkbox("Mostrar solo lotes con alertas", key='solo_lotes_con_alertas')
+
+            # Tabla virtualizada: orden y filtro en el servidor; solo la página visible se envía al navegador
+            indice_tabla = obtener_tabla_inventario(df_inventario_completo)
+            col_buscar, col_orden, col_sentido, col_filas = st.columns([2, 2, 1, 1])
+            texto_busqueda = col_buscar.text_input("🔎 Buscar (Especie o ID Lote)", key='tabla_inventario_buscar')
+            columna_orden = col_orden.selectbox(
+                "Ordenar por", [None] + list(indice_tabla.df.columns),
+                format_func=lambda col: "(orden de registro)" if col is None else col, key='tabla_inventario_orden'
             )
+            descendente = col_sentido.toggle("Descendente", key='tabla_inventario_descendente')
+            filas_pagina = col_filas.selectbox("Filas por página", FILAS_POR_PAGINA_INVENTARIO, index=1, key='tabla_inventario_filas')
+
+            posiciones = indice_tabla.posiciones(columna_orden, descendente, texto_busqueda, mascara=con_alertas if solo_alertas else None)
+            total_paginas = max(1, -(-len(posiciones) // filas_pagina))
+            if st.session_state.get('tabla_inventario_pagina', 1) > total_paginas:
+                st.session_state.tabla_inventario_pagina = total_paginas
+            col_pagina, col_rango = st.columns([1, 3])
+            pagina = col_pagina.number_input(f"Página (de {total_paginas:,})", min_value=1, max_value=total_paginas, step=1, key='tabla_inventario_pagina')
+            inicio = (pagina - 1) * filas_pagina
+            df_pagina = indice_tabla.ventana(posiciones, inicio, filas_pagina)
+            filtrado_txt = f" (filtrados de {len(indice_tabla):,})" if len(posiciones) != len(indice_tabla) else ""
+            col_rango.caption(f"Lotes {min(inicio + 1, len(posiciones)):,}–{inicio + len(df_pagina):,} de {len(posiciones):,}{filtrado_txt}")
+
+            st.dataframe(df_pagina, hide_index=True, use_container_width=True, column_config=FORMATO_COLUMNAS_INVENTARIO)
+
+            col_id_eliminar, col_eliminar, _ = st.columns([1, 1, 3])
+            id_eliminar = col_id_eliminar.selectbox(
+                "Lote a eliminar (de la página visible)", df_pagina['ID Lote'].tolist(),
+                key='id_lote_eliminar', label_visibility="collapsed"
+            )
+            col_eliminar.button("➖ Eliminar Lote", on_click=eliminar_lote, args=(id_eliminar,), help="Elimina el lote seleccionado y sus mediciones (puede deshacerse).")
 
     with tab2:
         # Gráficos (Se mantiene igual, solo usa el DF recalculado)
@@ -851,35 +2068,32 @@ def render_calculadora_y_graficos():
         if df_inventario_completo.empty:
             st.warning("No hay datos en el inventario para generar gráficos.")
         else:
-            df_graficos = df_inventario_completo.groupby('Especie').agg(
-                Total_CO2e_Ton=('CO2e Lote (Ton)', 'sum'),
-                Total_Costo_S=('Costo Total Lote (S/)', 'sum'),
-                Consumo_Agua_Total_L=('Consumo Agua Total Lote (L)', 'sum'),
-                Conteo_Arboles=('Cantidad', 'sum')
-            ).reset_index()
+            # Agregados incrementales y figuras memorizadas por versión del agregado
+            agregado_especie, version_agregado = obtener_agregados_especie(df_inventario_completo)
+            df_graficos = agregado_especie.reset_index()
 
             st.subheader("Análisis de Costos y Riego")
             col_costo, col_agua = st.columns(2)
             
             with col_costo:
-                fig_costo = px.bar(df_graficos, x='Especie', y='Total_Costo_S', title='Costo Total (Acumulado) por Especie (Soles)', color='Total_Costo_S', color_continuous_scale=px.colors.sequential.Sunset)
-                col_costo.plotly_chart(fig_costo, use_container_width=True)
+                fig_costo = obtener_figura('fig_costo', version_agregado, lambda: construir_figura_especie('fig_costo', df_graficos))
+                col_costo.plotly_chart(fig_costo, use_container_width=True, key='graf_costo')
             
             with col_agua:
-                fig_agua = px.bar(df_graficos, x='Especie', y='Consumo_Agua_Total_L', title='Consumo Agua Anual por Especie (Litros)', color='Consumo_Agua_Total_L', color_continuous_scale=px.colors.sequential.Agsunset)
-                col_agua.plotly_chart(fig_agua, use_container_width=True)
+                fig_agua = obtener_figura('fig_agua', version_agregado, lambda: construir_figura_especie('fig_agua', df_graficos))
+                col_agua.plotly_chart(fig_agua, use_container_width=True, key='graf_agua')
                 
             st.markdown("---")
             st.subheader("Análisis de Captura de Carbono")
             col_graf1, col_graf2 = st.columns(2)
             
-            fig_co2e = px.bar(df_graficos, x='Especie', y='Total_CO2e_Ton', title='CO2e Capturado por Especie (Ton)', color='Total_CO2e_Ton', color_continuous_scale=px.colors.sequential.Viridis)
-            fig_arboles = px.pie(df_graficos, values='Conteo_Arboles', names='Especie', title='Conteo de Árboles por Especie', hole=0.3, color_discrete_sequence=px.colors.sequential.Plasma)
+            fig_co2e = obtener_figura('fig_co2e', version_agregado, lambda: construir_figura_especie('fig_co2e', df_graficos))
+            fig_arboles = obtener_figura('fig_arboles', version_agregado, lambda: construir_figura_especie('fig_arboles', df_graficos))
             
             with col_graf1:
-                st.plotly_chart(fig_co2e, use_container_width=True)
+                st.plotly_chart(fig_co2e, use_container_width=True, key='graf_co2e')
             with col_graf2:
-                st.plotly_chart(fig_arboles, use_container_width=True)
+                st.plotly_chart(fig_arboles, use_container_width=True, key='graf_arboles')
 
 
     # --- MODIFICACIÓN CLAVE: Detalle Técnico (Ahora muestra la tabla de resumen del JSON) ---
@@ -900,7 +2114,7 @@ def render_calculadora_y_graficos():
             detalle_json = fila_lote['Detalle Cálculo']
             
             st.markdown(f"### Resumen de Fórmulas y Evidencia para {lote_seleccionado}")
-            st.info("⚠️ Para el detalle completo con todas las fórmulas de sustitución, **descargue el archivo Excel** (Sección 1) que incluye una hoja por lote con la evidencia del cálculo de biomasa y carbono.")
+            st.info("⚠️ Para el detalle completo con todas las fórmulas de sustitución, **descargue el archivo Excel** (Sección 1) que incluye la evidencia del cálculo de biomasa y carbono (una hoja por cada combinación distinta de datos, o una fila por lote con fórmulas vivas que referencian la hoja de parámetros).")
             
             try:
                 # [FIX: CORRECCIÓN DE ERROR JSON] Se verifica que el dato sea string antes de cargar el JSON.
@@ -941,6 +2155,280 @@ def render_calculadora_y_graficos():
         # Equivalencias Ambientales (Se mantiene igual)
         render_equivalencias_ambientales(co2e_proyecto_ton)
 
+    with tab5:
+        render_campanas_medicion()
+
+    with tab6:
+        render_historial_cambios()
+
+    with tab7:
+        render_balance_hidrico()
+
+
+@con_estado_en_memoria
+def agregar_medicion_campana(id_lote):
+    """Registra la medición del formulario de campañas para el lote indicado."""
+    df_campana = pd.DataFrame([{
+        'ID Lote': id_lote,
+        'Fecha': st.session_state[f'campana_fecha_{id_lote}'],
+        'Cantidad': st.session_state[f'campana_cantidad_{id_lote}'],
+        'DAP (cm)': st.session_state[f'campana_dap_{id_lote}'],
+        'Altura (m)': st.session_state[f'campana_altura_{id_lote}'],
+    }])
+    if (df_campana[['Cantidad', 'DAP (cm)', 'Altura (m)']] <= 0).any(axis=None):
+        st.error("Cantidad, DAP y Altura de la medición deben ser mayores a cero.")
+        return
+    registrar_campana(df_campana)
+    st.success(f"Medición del {st.session_state[f'campana_fecha_{id_lote}']} registrada para el lote {id_lote}.")
+
+
+def render_campanas_medicion():
+    """Pestaña de campañas: registro de mediciones repetidas y evolución de la captura en el tiempo."""
+    st.markdown("## 📅 Campañas de Medición por Lote")
+
+    if not st.session_state.inventario_list:
+        st.warning("No hay lotes registrados. Cada lote añadido registra automáticamente su primera medición.")
+        return
+
+    lotes_por_id = {lote['ID Lote']: lote for lote in st.session_state.inventario_list}
+
+    col_form, col_masivo = st.columns(2)
+    with col_form:
+        st.markdown("### Nueva Medición")
+        id_sel = st.selectbox(
+            "Lote:",
+            options=list(lotes_por_id.keys()),
+            format_func=lambda id_lote: f"{id_lote}: {lotes_por_id[id_lote]['Especie']}",
+            key='campana_lote_sel'
+        )
+        lote_sel = lotes_por_id[id_sel]
+        # Las claves incluyen el ID para que los valores por defecto sigan al lote seleccionado
+        with st.form("form_campana", clear_on_submit=False):
+            st.date_input("Fecha de la Campaña", value=pd.Timestamp.today().date(), key=f'campana_fecha_{id_sel}')
+            col_cant, col_dap, col_alt = st.columns(3)
+            col_cant.number_input("Árboles Vivos", min_value=0, value=int(lote_sel['Cantidad']), step=1, key=f'campana_cantidad_{id_sel}')
+            col_dap.number_input("DAP medido (cm)", min_value=0.0, value=float(lote_sel['DAP (cm)']), step=0.5, key=f'campana_dap_{id_sel}')
+            col_alt.number_input("Altura medida (m)", min_value=0.0, value=float(lote_sel['Altura (m)']), step=0.5, key=f'campana_altura_{id_sel}')
+            st.form_submit_button("➕ Registrar Medición", on_click=agregar_medicion_campana, args=(id_sel,))
+
+    with col_masivo:
+        st.markdown("### Carga Masiva de Campaña")
+        archivo = st.file_uploader(
+            "CSV con columnas ID Lote, Fecha, Cantidad, DAP (cm), Altura (m)",
+            type=['csv'],
+            key='campana_archivo'
+        )
+        if archivo is not None and st.button("📥 Registrar Campaña"):
+            try:
+                df_campana = pd.read_csv(archivo)
+                faltantes = [col for col in ['ID Lote', 'Fecha', 'Cantidad', 'DAP (cm)', 'Altura (m)'] if col not in df_campana.columns]
+                if faltantes:
+                    st.error(f"Faltan columnas: {', '.join(faltantes)}")
+                else:
+                    registradas = registrar_campana(df_campana)
+                    st.success(f"{registradas:,} mediciones registradas ({len(df_campana) - registradas:,} con ID de lote desconocido fueron omitidas).")
+            except (ValueError, pd.errors.ParserError) as e:
+                st.error(f"No se pudo leer la campaña: {e}")
+
+    df_incrementos, df_serie = obtener_analisis_campanas()
+
+    st.markdown("---")
+    st.subheader("Captura de CO₂e del Proyecto en el Tiempo")
+    if len(df_serie) < 2:
+        st.info("Registre al menos una segunda campaña para ver la evolución de la captura.")
+    else:
+        version = st.session_state.mediciones_version
+        col_stock, col_captura = st.columns(2)
+        fig_stock = obtener_figura('fig_campanas_stock', version, lambda: figura_serie_temporal(
+            df_serie['Fecha'], df_serie['CO2e Proyecto (Ton)'], 'CO2e Acumulado del Proyecto por Campaña (Ton)', 'Fecha', 'CO2e Proyecto (Ton)'
+        ))
+        col_stock.plotly_chart(fig_stock, use_container_width=True, key='graf_campanas_stock')
+        fig_captura = obtener_figura('fig_campanas_captura', version, lambda: figura_serie_temporal(
+            df_serie['Fecha'], df_serie['Captura Campaña (tCO2e)'], 'Captura Neta entre Campañas (tCO2e)', 'Fecha', 'Captura Campaña (tCO2e)'
+        ))
+        col_captura.plotly_chart(fig_captura, use_container_width=True, key='graf_campanas_captura')
+
+    st.subheader(f"Historial e Incrementos del Lote {id_sel}")
+    if id_sel in df_incrementos.index.get_level_values('ID Lote'):
+        df_lote = df_incrementos.xs(id_sel, level='ID Lote').reset_index()
+        df_lote['Fecha'] = df_lote['Fecha'].dt.date
+        st.dataframe(
+            df_lote,
+            use_container_width=True,
+            hide_index=True,
+            column_config={col: st.column_config.NumberColumn(format="%.3f") for col in df_lote.columns if col not in ('Fecha', 'Días desde Campaña Anterior', 'Δ Árboles')}
+        )
+
+
+COLUMNAS_ESTADO_HISTORIAL = ['ID Lote', 'Especie', 'Cantidad', 'DAP (cm)', 'Altura (m)', 'Años Plantados', 'CO2e Lote (Ton)']
+
+def estado_historial_en(historial, evento, calcular=False):
+    """
+    Inventario calculado tras el evento `evento` y su IndiceTabla. El último evento es el inventario
+    de la sesión (se reutiliza su resultado memorizado); otro evento se reconstruye y recalcula solo
+    con `calcular=True` y queda memorizado en la sesión por evento. Retorna None si aún no se calculó.
+    """
+    es_ultimo = evento == historial.ultimo_evento
+    version = (evento, st.session_state.especies_version, clave_calculo_agua(), st.session_state.inventario_version if es_ultimo else None)
+    cache = st.session_state.get('cache_historial_estado')
+    if cache is not None and cache['historial'] is historial and cache['version'] == version:
+        return cache
+    if es_ultimo:
+        df_estado = recalcular_inventario_completo(st.session_state.inventario_list)
+    elif calcular:
+        df_estado = recalcular_inventario_completo(historial.estado_en(evento))
+    else:
+        return None
+    cache = {'historial': historial, 'version': version, 'indice': IndiceTabla(df_estado, columnas_busqueda=['Especie', 'ID Lote'])}
+    st.session_state.cache_historial_estado = cache
+    return cache
+
+
+def render_historial_cambios():
+    """Traza de auditoría de los cambios del inventario y consulta del estado en cualquier evento."""
+    historial = st.session_state.historial_inventario
+    st.markdown("## 🧾 Historial de Cambios del Inventario")
+    st.caption(
+        "Cada cambio (añadir, importar, campañas, eliminar, limpiar, deshacer y rehacer) se anexa a este registro, "
+        "que nunca se reescribe. Se incluye en el Excel como traza de auditoría para la verificación."
+    )
+    if not historial.eventos:
+        st.info("Aún no hay cambios registrados en esta sesión.")
+        return
+
+    st.dataframe(historial.tabla_auditoria().iloc[::-1], hide_index=True, use_container_width=True)
+
+    st.subheader("Estado del Inventario en un Evento")
+    if st.session_state.get('historial_evento_consulta') == st.session_state.get('historial_ultimo_evento_mostrado'):
+        st.session_state.historial_evento_consulta = historial.ultimo_evento # Sigue al último evento si el usuario no eligió otro
+    st.session_state.historial_ultimo_evento_mostrado = historial.ultimo_evento
+    evento = int(st.number_input(
+        "Estado tras el evento N° (0 = inicio de la sesión)",
+        min_value=0, max_value=historial.ultimo_evento, step=1, key='historial_evento_consulta'
+    ))
+    estado = estado_historial_en(historial, evento)
+    if estado is None:
+        st.info(f"El estado tras el evento N° {evento:,} se reconstruye y recalcula a partir del historial.")
+        if st.button("🔄 Calcular el estado del evento", key='historial_calcular_estado'):
+            estado = estado_historial_en(historial, evento, calcular=True)
+    if estado is None:
+        return
+
+    df_estado = estado['indice'].df
+    col_lotes, col_arboles, col_co2e = st.columns(3)
+    col_lotes.metric("📦 Lotes", f"{len(df_estado):,.0f}")
+    col_arboles.metric("🌳 Árboles", f"{df_estado['Cantidad'].sum() if not df_estado.empty else 0:,.0f}")
+    col_co2e.metric("🌱 CO₂e (Ton)", f"{get_co2e_total_seguro(df_estado):,.2f}")
+    if not df_estado.empty:
+        render_tabla_paginada(
+            estado['indice'], 'historial_estado', columnas=COLUMNAS_ESTADO_HISTORIAL,
+            column_config={'CO2e Lote (Ton)': st.column_config.NumberColumn(format="%,.2f")}
+        )
+
+
+@con_estado_en_memoria
+def actualizar_parametros_balance():
+    """Copia los parámetros del balance antes del rerun, para que las métricas superiores ya los usen."""
+    st.session_state.balance_sitio_defecto = st.session_state.balance_sitio_input
+    st.session_state.balance_kc = st.session_state.balance_kc_input
+    st.session_state.balance_eficiencia = st.session_state.balance_eficiencia_input
+    st.session_state.balance_activo = st.session_state.balance_activo_input
+
+
+def render_balance_hidrico():
+    """Carga del clima mensual por sitio y demanda/costo de riego mensual de los lotes."""
+    st.markdown("## 💧 Balance Hídrico Mensual del Riego")
+    st.caption(
+        "Cargue un CSV de clima local con una fila por sitio y mes: **Sitio**, **Mes** (1-12) o **Fecha**, "
+        "**Precipitación (mm)** y **ETo (mm)** (opcionales: **Latitud** y **Longitud** de la estación). "
+        "La demanda de cada lote es Kc × ETo menos la lluvia efectiva, sobre el área de copa (según el DAP) y dividida "
+        "por la eficiencia de riego. Con el riego activado, reemplaza el consumo anual fijo por especie en los totales, "
+        "gráficos y costos. Los lotes geolocalizados usan la estación más cercana; el resto, el sitio por defecto."
+    )
+
+    col_archivo, col_acciones = st.columns([2, 1])
+    archivo = col_archivo.file_uploader("Clima mensual por sitio (CSV)", type=['csv'], key='clima_archivo')
+    if col_acciones.button("📥 Cargar Clima", disabled=archivo is None):
+        try:
+            clima = leer_clima_mensual(io.BytesIO(archivo.getvalue()))
+        except (ValueError, pd.errors.ParserError, UnicodeDecodeError) as e:
+            st.error(f"❌ No se pudo leer el archivo de clima: {e}")
+        else:
+            st.session_state.clima_mensual = clima
+            st.session_state.clima_version += 1
+            st.session_state.balance_sitio_defecto = clima['sitios'][0]
+            st.rerun()
+
+    clima = st.session_state.clima_mensual
+    if clima is None:
+        st.info("Sin clima cargado: el consumo de agua usa la cifra anual fija por especie (Consumo Agua Unitario).")
+        return
+    if col_acciones.button("🗑️ Quitar Clima", help="Vuelve al consumo anual fijo por especie."):
+        st.session_state.clima_mensual = None
+        st.session_state.clima_version += 1
+        st.rerun()
+
+    col_sitio, col_kc, col_eficiencia, col_activo = st.columns(4)
+    col_sitio.selectbox(
+        "Sitio por defecto (lotes sin coordenadas)", clima['sitios'], index=clima['sitios'].index(st.session_state.balance_sitio_defecto),
+        key='balance_sitio_input', on_change=actualizar_parametros_balance
+    )
+    col_kc.number_input("Coeficiente de cultivo (Kc)", min_value=0.1, max_value=1.5, value=float(st.session_state.balance_kc), step=0.05, key='balance_kc_input', on_change=actualizar_parametros_balance)
+    col_eficiencia.number_input("Eficiencia de riego", min_value=0.3, max_value=1.0, value=float(st.session_state.balance_eficiencia), step=0.05, key='balance_eficiencia_input', on_change=actualizar_parametros_balance)
+    col_activo.checkbox("Usar en totales y costos", value=st.session_state.balance_activo, key='balance_activo_input', on_change=actualizar_parametros_balance)
+
+    if not st.session_state.riego_controlado_check:
+        st.warning("⚠️ El riego controlado está desactivado: la simulación se muestra, pero no se suma a los costos del proyecto.")
+
+    import plotly.express as px
+
+    version_clima = (st.session_state.clima_version, st.session_state.balance_kc, st.session_state.balance_eficiencia)
+    deficit = obtener_deficit_por_sitio()
+    df_deficit = pd.DataFrame(deficit, index=clima['sitios'], columns=NOMBRES_MESES).rename_axis('Sitio').reset_index().melt(id_vars='Sitio', var_name='Mes', value_name='Lámina (mm)')
+    fig_deficit = obtener_figura('fig_balance_sitios', version_clima, lambda: px.line(df_deficit, x='Mes', y='Lámina (mm)', color='Sitio', markers=True, title='Lámina de Riego Mensual por Sitio (mm = L/m² de copa)'))
+    st.plotly_chart(fig_deficit, use_container_width=True, key='graf_balance_sitios')
+
+    if not st.session_state.inventario_list:
+        st.info("Registre lotes para simular su demanda de riego.")
+        return
+
+    demanda_inventario = obtener_demanda_inventario()
+    demanda = demanda_inventario['demanda']
+    demanda_mes_m3 = demanda.sum(axis=0) / FACTOR_L_A_M3
+    costo_mes = demanda_mes_m3 * PRECIO_AGUA_POR_M3
+
+    col_volumen, col_costo, col_pico = st.columns(3)
+    col_volumen.metric("💧 Demanda Anual", f"{demanda_mes_m3.sum():,.1f} m³")
+    col_costo.metric("💰 Costo Anual del Agua", f"S/{costo_mes.sum():,.2f}")
+    col_pico.metric("📅 Mes de Mayor Demanda", NOMBRES_MESES[int(np.argmax(demanda_mes_m3))], delta=f"{demanda_mes_m3.max():,.1f} m³", delta_color="off")
+
+    version_demanda = (st.session_state.inventario_version, version_clima, st.session_state.balance_sitio_defecto)
+    df_mensual = pd.DataFrame({'Mes': NOMBRES_MESES, 'Demanda (m³)': demanda_mes_m3, 'Costo (S/)': costo_mes})
+    fig_mensual = obtener_figura('fig_balance_mensual', version_demanda, lambda: px.bar(df_mensual, x='Mes', y='Demanda (m³)', hover_data={'Costo (S/)': ':,.2f'}, title='Demanda y Costo de Riego Mensual del Inventario', color='Costo (S/)', color_continuous_scale=px.colors.sequential.Blues))
+    st.plotly_chart(fig_mensual, use_container_width=True, key='graf_balance_mensual')
+
+    st.subheader("Demanda Anual por Lote")
+    if demanda_inventario['indice_lotes'] is None:
+        lotes = st.session_state.inventario_list
+        demanda_anual_m3 = demanda.sum(axis=1) / FACTOR_L_A_M3
+        df_lotes = pd.DataFrame({
+            'ID Lote': [lote.get('ID Lote', '') for lote in lotes],
+            'Especie': [lote.get('Especie', '') for lote in lotes],
+            'Sitio': np.asarray(clima['sitios'], dtype=object)[demanda_inventario['indices_sitio']],
+            'Cantidad': [lote.get('Cantidad', 0) for lote in lotes],
+            'Demanda Anual (m³)': demanda_anual_m3,
+            'Mes Pico': np.asarray(NOMBRES_MESES, dtype=object)[demanda.argmax(axis=1)] if len(demanda) else [],
+            'Costo Anual (S/)': demanda_anual_m3 * PRECIO_AGUA_POR_M3,
+        })
+        demanda_inventario['indice_lotes'] = IndiceTabla(df_lotes, columnas_busqueda=['Especie', 'ID Lote'])
+    render_tabla_paginada(
+        demanda_inventario['indice_lotes'], 'balance_lotes',
+        column_config={
+            'Demanda Anual (m³)': st.column_config.NumberColumn(format="%,.2f"),
+            'Costo Anual (S/)': st.column_config.NumberColumn(format="%,.2f"),
+        }
+    )
+
 
 # [FIX: POTENCIAL MÁXIMO V2] Función principal de Potencial Máximo, usando datos de la especie
 def render_potencial_maximo():
@@ -956,8 +2444,8 @@ def render_potencial_maximo():
         st.warning("No hay lotes registrados en el inventario (Sección 1) para calcular el potencial máximo.")
         return
 
-    # Se ejecuta el cálculo usando los datos máximos de CADA especie en el inventario
-    df_potencial = calcular_potencial_maximo_lotes(st.session_state.inventario_list, current_species_info)
+    # Se ejecuta el cálculo usando los datos máximos de CADA especie en el inventario (memorizado por versión)
+    df_potencial, df_agrupado, version_potencial = obtener_potencial_por_especie(current_species_info)
     
     co2e_potencial_total = df_potencial['CO2e Lote Potencial (Ton)'].sum()
     co2e_progreso_total = get_co2e_total_seguro(df_inventario_progreso)
@@ -981,15 +2469,6 @@ def render_potencial_maximo():
     st.markdown("---")
     st.subheader("Detalle del Potencial Máximo por Especie")
 
-    # Agrupar por especie para el detalle y la gráfica
-    df_agrupado = df_potencial.groupby('Especie').agg(
-        Total_Cantidad=('Cantidad', 'sum'),
-        Total_CO2e_Potencial=('CO2e Lote Potencial (Ton)', 'sum'),
-        DAP_Max=('DAP Potencial (cm)', 'first'), # Usar el DAP Máximo de la especie
-        Altura_Max=('Altura Potencial (m)', 'first'), # Usar la Altura Máxima de la especie
-        Tiempo_Max=('Tiempo Máximo (años)', 'first') # Nuevo campo
-    ).reset_index()
-
     # Se excluye 'Detalle Cálculo' de la visualización principal
     cols_to_show = ['Especie', 'Total_Cantidad', 'DAP_Max', 'Altura_Max', 'Tiempo_Max', 'Total_CO2e_Potencial']
     df_mostrar = df_agrupado[cols_to_show].rename(columns={
@@ -1020,32 +2499,42 @@ def render_potencial_maximo():
     if df_grafico.empty:
         st.warning("No hay datos suficientes (Tiempo Máximo o CO2e Potencial > 0) para generar la gráfica.")
     else:
-        # Usamos la Cantidad Total como color/tamaño para añadir otra dimensión al análisis
-        fig = px.scatter(
-            df_grafico,
-            x='Tiempo_Max',
-            y='Total_CO2e_Potencial',
-            size='Total_Cantidad', # El tamaño del punto refleja la cantidad de árboles
-            color='DAP_Max', # El color refleja el DAP máximo
-            hover_name='Especie',
-            text='Especie', # Mostrar el nombre de la especie en el gráfico
-            title='Potencial Máximo de Captura de CO₂e por Especie y Tiempo de Madurez',
-            labels={
-                'Tiempo_Max': 'Tiempo Máximo de Crecimiento (Años)',
-                'Total_CO2e_Potencial': 'CO₂e Potencial Total (Ton)',
-                'DAP_Max': 'DAP Máximo (cm)'
-            }
-        )
-        
-        # Ajustes de layout para mejor lectura de las etiquetas de texto
-        fig.update_traces(textposition='top center')
-        fig.update_layout(height=500)
-        
-        st.plotly_chart(fig, use_container_width=True)
+        fig = obtener_figura('fig_potencial', version_potencial, lambda: construir_figura_potencial(df_grafico))
+        st.plotly_chart(fig, use_container_width=True, key='graf_potencial')
 
     render_equivalencias_ambientales(co2e_potencial_total)
 
 
+def construir_figura_potencial(df_grafico):
+    """Dispersión Potencial vs. Tiempo Máximo por especie (WebGL y sin etiquetas si hay muchas especies)."""
+    import plotly.express as px
+
+    muchos_puntos = len(df_grafico) > UMBRAL_PUNTOS_WEBGL
+    # Usamos la Cantidad Total como color/tamaño para añadir otra dimensión al análisis
+    fig = px.scatter(
+        df_grafico,
+        x='Tiempo_Max',
+        y='Total_CO2e_Potencial',
+        size='Total_Cantidad', # El tamaño del punto refleja la cantidad de árboles
+        color='DAP_Max', # El color refleja el DAP máximo
+        hover_name='Especie',
+        text=None if muchos_puntos else 'Especie', # Mostrar el nombre de la especie en el gráfico
+        render_mode='webgl' if muchos_puntos else 'auto',
+        title='Potencial Máximo de Captura de CO₂e por Especie y Tiempo de Madurez',
+        labels={
+            'Tiempo_Max': 'Tiempo Máximo de Crecimiento (Años)',
+            'Total_CO2e_Potencial': 'CO₂e Potencial Total (Ton)',
+            'DAP_Max': 'DAP Máximo (cm)'
+        }
+    )
+    
+    # Ajustes de layout para mejor lectura de las etiquetas de texto
+    if not muchos_puntos:
+        fig.update_traces(textposition='top center')
+    fig.update_layout(height=500)
+    return fig
+
+
 def render_gap_cpassa():
     """Análisis de brecha (GAP) entre la captura del proyecto y la Huella de Carbono Corporativa (HCC)."""
     st.title("3. GAP (Análisis de Brecha) vs. Huella Corporativa (CPSSA)")
@@ -1054,16 +2543,117 @@ def render_gap_cpassa():
     co2e_proyecto_ton = get_co2e_total_seguro(df_inventario_completo)
     
     co2e_proyecto_miles_ton = co2e_proyecto_ton / 1000.0
-    
+    intervalo_miles = None
+
+    estimacion = st.session_state.estimacion_parcelas
+    if estimacion is not None:
+        fuente = st.radio(
+            "Captura usada en el análisis",
+            ["Inventario de lotes (sección 1)", "Estimación por parcelas (sección 9, con intervalo de confianza)"],
+            horizontal=True, key='gap_fuente_captura'
+        )
+        if fuente.startswith("Estimación"):
+            total = estimacion['total']
+            co2e_proyecto_miles_ton = total['co2e_ton'] / 1000.0
+            intervalo_miles = (total['ic_inferior'] / 1000.0, total['ic_superior'] / 1000.0)
+
     if co2e_proyecto_miles_ton <= 0:
         st.warning("⚠️ El inventario del proyecto debe tener CO2e registrado (sección 1) para realizar este análisis.")
         return
-        
+    render_analisis_gap(co2e_proyecto_miles_ton, HUELLA_CORPORATIVA, intervalo_miles=intervalo_miles)
+
+    if not df_inventario_completo.empty:
+        st.markdown("---")
+        render_cruce_neutralidad(df_inventario_completo)
+
+
+def obtener_cruce_neutralidad(df_inventario_completo, horizonte, tasas_grupo):
+    """
+    Captura proyectada del proyecto (memorizada por versión del inventario, de la BD de especies y
+    horizonte) y cruce por sede y grupo (memorizado además por las tasas). Retorna (resultado, clave).
+    """
+    clave_captura = (st.session_state.inventario_version, st.session_state.especies_version, horizonte)
+    cache = st.session_state.get('cache_cruce')
+    if cache is None or cache['clave_captura'] != clave_captura:
+        captura = proyectar_captura_proyecto(df_inventario_completo, get_current_species_info(), horizonte)
+        cache = {'clave_captura': clave_captura, 'captura': captura, 'clave': None}
+        st.session_state.cache_cruce = cache
+    clave = (clave_captura, tuple(tasas_grupo.items()))
+    if cache['clave'] != clave:
+        cache['resultado'] = analizar_cruce(cache['captura'], HUELLA_CORPORATIVA, GRUPOS_HUELLA, tasas_grupo, pd.Timestamp.today().year)
+        cache['clave'] = clave
+    return {'captura': cache['captura'], **cache['resultado']}, clave
+
+
+def construir_figura_cruce(resultado, anio_inicial, sedes_extra):
+    """Captura acumulada del proyecto frente a las emisiones anuales de cada grupo (y sedes elegidas), escala logarítmica."""
+    import plotly.graph_objects as go
+
+    anios = anio_inicial + np.arange(len(resultado['captura']))
+    fig = go.Figure()
+    fig.add_trace(go.Scatter(x=anios, y=resultado['captura'], name='Captura del Proyecto', mode='lines', line=dict(color='green', width=4)))
+    for nombre, emisiones in zip(resultado['grupos']['Grupo'], resultado['emisiones_grupos']):
+        fig.add_trace(go.Scatter(x=anios, y=emisiones, name=f'Grupo: {nombre}', mode='lines', line=dict(dash='dash')))
+    df_sedes = resultado['sedes'].set_index('Sede')
+    for sede in sedes_extra:
+        fila = df_sedes.loc[sede]
+        emisiones = fila['Emisiones Año 0 (tCO2e)'] * (1 + fila['Tasa Anual (%)'] / 100) ** np.arange(len(anios))
+        fig.add_trace(go.Scatter(x=anios, y=emisiones, name=f'Sede: {sede}', mode='lines', line=dict(dash='dot')))
+    fig.update_layout(title='Captura Acumulada vs. Emisiones Anuales (tCO₂e, escala log)', xaxis_title='Año', yaxis_title='tCO₂e', yaxis_type='log')
+    return fig
+
+
+def render_cruce_neutralidad(df_inventario_completo):
+    """Año en que la captura acumulada del proyecto alcanza las emisiones anuales de cada sede y grupo."""
+    st.subheader("📅 Proyección y Año de Cruce (Carbono Neutralidad)")
+    st.caption(
+        "La captura crece con el modelo de la sección 7 (DAP y Altura hasta los máximos de la especie); las emisiones de cada "
+        "sede varían con la tasa anual de su grupo. El año de cruce es el primero en que la captura acumulada alcanza las "
+        "emisiones anuales; 'Se Mantiene' indica si la cobertura se sostiene hasta el final del horizonte."
+    )
+    col_horizonte, col_tasas = st.columns([1, 2])
+    horizonte = col_horizonte.number_input("Horizonte (años)", min_value=1, max_value=100, value=HORIZONTE_POR_DEFECTO, step=1, key='cruce_horizonte')
+    with col_tasas:
+        df_tasas = st.data_editor(
+            pd.DataFrame({'Grupo': list(GRUPOS_HUELLA.keys()), 'Variación Anual de Emisiones (%)': 0.0}),
+            disabled=['Grupo'], hide_index=True, use_container_width=True, key='cruce_tasas',
+            column_config={'Variación Anual de Emisiones (%)': st.column_config.NumberColumn(min_value=-100.0, max_value=100.0, step=0.5, format="%.1f")},
+        )
+    tasas_grupo = {fila['Grupo']: float(fila['Variación Anual de Emisiones (%)'] or 0.0) / 100 for _, fila in df_tasas.iterrows()}
+
+    resultado, clave = obtener_cruce_neutralidad(df_inventario_completo, int(horizonte), tasas_grupo)
+    anio_inicial = pd.Timestamp.today().year
+    formato = {
+        col: st.column_config.NumberColumn(format="%.2f")
+        for col in ['Emisiones Año 0 (tCO2e)', f'Emisiones Año {int(horizonte)} (tCO2e)', 'Cobertura Hoy (%)', 'Cobertura Horizonte (%)', 'Tasa Anual (%)']
+    }
+
+    st.markdown("##### Por Grupo de Empresas")
+    df_grupos = resultado['grupos']
+    columnas_metricas = st.columns(len(df_grupos))
+    for col, fila in zip(columnas_metricas, df_grupos.to_dict('records')):
+        texto = "sin cruce en el horizonte" if pd.isna(fila['Año Calendario']) else f"cruce en {fila['Año Calendario']} (año {fila['Año de Cruce']})"
+        col.metric(fila['Grupo'], f"{fila['Cobertura Hoy (%)']:,.2f}% hoy", delta=texto, delta_color="off")
+    st.dataframe(df_grupos, hide_index=True, use_container_width=True, column_config=formato)
+
+    sedes_extra = st.multiselect("Sedes a graficar (además de los grupos)", list(HUELLA_CORPORATIVA.keys()), key='cruce_sedes_grafico')
+    fig_cruce = obtener_figura('fig_cruce', (clave, tuple(sedes_extra)), lambda: construir_figura_cruce(resultado, anio_inicial, sedes_extra))
+    st.plotly_chart(fig_cruce, use_container_width=True, key='graf_cruce')
+
+    with st.expander(f"Por Sede ({len(resultado['sedes'])})"):
+        st.dataframe(resultado['sedes'], hide_index=True, use_container_width=True, column_config=formato)
+
+
+def render_analisis_gap(co2e_proyecto_miles_ton, huella_corporativa, intervalo_miles=None):
+    """
+    Selección de sede, brecha y embudo del GAP (también lo usa el tablero publicado). Si la captura
+    es una estimación, `intervalo_miles` es su intervalo de confianza (inferior, superior) en miles de tCO2e.
+    """
     st.subheader("Selección de Sede y Análisis")
     
-    sede_sel = st.selectbox("Seleccione la Sede (Huella Corporativa)", list(HUELLA_CORPORATIVA.keys()))
+    sede_sel = st.selectbox("Seleccione la Sede (Huella Corporativa)", list(huella_corporativa.keys()))
     
-    emisiones_sede_miles_ton = HUELLA_CORPORATIVA[sede_sel]
+    emisiones_sede_miles_ton = huella_corporativa[sede_sel]
     
     st.markdown("---")
     
@@ -1074,6 +2664,8 @@ def render_gap_cpassa():
         
     with col_proyecto:
         st.metric("Captura de CO₂e del Proyecto (Miles de Ton CO2e)", f"{co2e_proyecto_miles_ton:,.2f} Miles tCO₂e")
+        if intervalo_miles is not None:
+            st.caption(f"Estimación por parcelas · intervalo de confianza: {intervalo_miles[0]:,.2f} – {intervalo_miles[1]:,.2f} Miles tCO₂e")
 
     st.markdown("---")
     
@@ -1093,6 +2685,19 @@ def render_gap_cpassa():
         st.warning(f"⚠️ Su captura de carbono actual cubre el **{porcentaje_compensado:,.2f}%** de las emisiones de **{sede_sel}**. Se requiere una captura adicional de **{brecha_miles_ton:,.2f} Miles tCO₂e** para compensar totalmente.")
     elif brecha_miles_ton <= 0:
         st.success(f"✅ ¡Felicidades! La captura de carbono del proyecto **supera** las emisiones de **{sede_sel}** en **{-brecha_miles_ton:,.2f} Miles tCO₂e**.")
+
+    if intervalo_miles is not None:
+        brecha_min, brecha_max = emisiones_sede_miles_ton - intervalo_miles[1], emisiones_sede_miles_ton - intervalo_miles[0]
+        if emisiones_sede_miles_ton > 0:
+            compensado_min, compensado_max = intervalo_miles[0] / emisiones_sede_miles_ton * 100, intervalo_miles[1] / emisiones_sede_miles_ton * 100
+        else:
+            compensado_min = compensado_max = 0.0
+        st.info(
+            f"📏 Con el intervalo de confianza de la estimación, la brecha está entre **{brecha_min:,.2f}** y **{brecha_max:,.2f} Miles tCO₂e** "
+            f"(compensado entre **{compensado_min:,.2f}%** y **{compensado_max:,.2f}%**)."
+        )
+        if brecha_min <= 0 < brecha_max:
+            st.warning("⚠️ El intervalo incluye la compensación total: con la precisión actual del muestreo no puede afirmarse que la sede quede compensada. Aumente el número de parcelas para reducir el error.")
         
     # Se utiliza Plotly Go para un Funnel más visual
     data_funnel = [
@@ -1111,6 +2716,8 @@ def render_gap_cpassa():
         values = [emisiones_sede_miles_ton, co2e_proyecto_miles_ton]
         colors = ['red', 'green']
     
+    import plotly.graph_objects as go
+
     fig_gap = go.Figure(data=[go.Funnel(
         y=labels,
         x=values,
@@ -1132,15 +2739,27 @@ def render_gestion_especie():
     st.title("4. Gestión de Datos de Especies y Factores")
     st.warning("⚠️ **¡Advertencia!** Modificar estos valores alterará todos los cálculos de captura en los lotes existentes que usen la especie modificada.")
 
-    df_actual = st.session_state.especies_bd.copy().set_index('Especie')
-    
+    render_importacion_densidades()
+
     st.markdown("### Tabla de Coeficientes y Datos Históricos (Edición)")
+    df_bd = st.session_state.especies_bd
+    posiciones, descripcion = posiciones_registro_visibles(df_bd)
+    st.caption(descripcion)
+    if posiciones is None:
+        return
+
+    df_actual = df_bd.iloc[posiciones].set_index('Especie')
+    alias = st.session_state.especies_alias
+    df_actual.insert(0, 'Sinónimos', ["; ".join(alias.get(especie, [])) for especie in df_actual.index])
 
     df_edit = st.data_editor(
         df_actual,
         use_container_width=True,
         num_rows="dynamic",
-        key="data_editor_especies",
+        disabled=['Sinónimos'],
+        # La clave cambia con la ventana: las ediciones pendientes no se aplican a otras filas
+        key=(f"data_editor_especies_{st.session_state.especies_version}_{st.session_state.busqueda_registro}"
+             f"_{st.session_state.get('registro_especies_pagina', 1)}_{st.session_state.registro_especies_filas}"),
         column_config={
             "Precio Plantón (S/)": st.column_config.NumberColumn("Precio Plantón (S/)", format="%.2f", help="Costo unitario de compra o producción del plantón.", min_value=0.0), 
             "DAP (cm)": st.column_config.NumberColumn("DAP (cm)", format="%.2f", help="Diámetro a la altura del pecho", min_value=0.0),
@@ -1155,22 +2774,896 @@ def render_gestion_especie():
     )
     
     if st.button("💾 Guardar Cambios en la BD Histórica"):
-        df_edit_clean = df_edit.reset_index()
+        df_edit_clean = reemplazar_filas_registro(df_bd, posiciones, df_edit.drop(columns='Sinónimos').reset_index())
         
         if df_edit_clean['Especie'].duplicated().any():
             st.error("Error: Las especies no pueden tener nombres duplicados. Por favor, corrija los nombres.")
         else:
+            if st.session_state.compartido_proyecto:
+                encolar_especies_compartidas(cambios_especies(st.session_state.especies_bd, df_edit_clean))
             st.session_state.especies_bd = df_edit_clean
+            st.session_state.especies_version += 1
             st.success("✅ Datos de especies actualizados correctamente. Los cálculos se actualizarán al volver a la sección 1.")
-            st.rerun() 
+            st.rerun()
+
+
+def posiciones_registro_visibles(df_bd):
+    """
+    Posiciones (ordenadas) de las filas del registro que se muestran en el editor: los resultados
+    de la búsqueda del índice de especies o, sin búsqueda, la página seleccionada (None si la
+    búsqueda no tiene coincidencias). Retorna también el texto que describe la ventana visible.
+    """
+    col_buscar, col_filas, col_pagina = st.columns([3, 1, 1])
+    consulta = col_buscar.text_input(f"🔎 Buscar en el registro ({len(df_bd):,} especies)", key='busqueda_registro', placeholder="Nombre científico, común o sinónimo")
+    filas_pagina = col_filas.selectbox("Filas por página", FILAS_POR_PAGINA_ESPECIES, index=1, key='registro_especies_filas')
+    if consulta:
+        coincidencias = obtener_indice_especies().buscar(consulta, limite=filas_pagina)
+        posiciones = pd.Index(df_bd['Especie']).get_indexer(coincidencias)
+        posiciones = np.sort(posiciones[posiciones >= 0])
+        if len(posiciones) == 0:
+            return None, "Sin coincidencias en el registro."
+        return posiciones, f"{len(posiciones):,} coincidencias para '{consulta}' (máximo {filas_pagina:,})."
+
+    total_paginas = max(1, -(-len(df_bd) // filas_pagina))
+    if st.session_state.get('registro_especies_pagina', 1) > total_paginas:
+        st.session_state.registro_especies_pagina = total_paginas
+    pagina = col_pagina.number_input(f"Página (de {total_paginas:,})", min_value=1, max_value=total_paginas, step=1, key='registro_especies_pagina')
+    inicio = (pagina - 1) * filas_pagina
+    posiciones = np.arange(inicio, min(inicio + filas_pagina, len(df_bd)))
+    if len(posiciones) == 0:
+        return posiciones, "El registro de especies está vacío."
+    return posiciones, f"Especies {inicio + 1:,}–{inicio + len(posiciones):,} de {len(df_bd):,}."
+
+
+def reemplazar_filas_registro(df_bd, posiciones, df_editado):
+    """
+    Registro completo con las filas de `posiciones` reemplazadas por las filas editadas (incluidas
+    las añadidas o eliminadas en el editor), en el lugar de la primera fila visible.
+    """
+    resto = df_bd.drop(index=df_bd.index[posiciones])
+    corte = int(posiciones[0]) if len(posiciones) else len(resto) # Las filas anteriores a la primera visible no se tocan
+    return pd.concat([resto.iloc[:corte], df_editado[df_bd.columns], resto.iloc[corte:]], ignore_index=True)
+
+
+def render_importacion_densidades():
+    """Importación de una base externa de densidades de la madera al registro de especies."""
+    with st.expander("📥 Importar Base de Densidades de la Madera (CSV)"):
+        st.caption(
+            "Una fila por medición o por especie con **Nombre Científico** (o Especie / Binomial) y **Densidad (g/cm³)** "
+            "(o la columna de *wood density* de la Global Wood Density Database); opcionales: **Nombre Común** y "
+            "**Sinónimos** (separados por ';'). Las mediciones de una misma especie se promedian. Las especies ya "
+            "registradas no se modifican: sus sinónimos se añaden a la búsqueda."
+        )
+        archivo = st.file_uploader("Base de densidades (CSV)", type=['csv'], key='densidades_archivo')
+        st.markdown("##### Valores para las columnas que la base no trae")
+        col_agua, col_precio, col_dap, col_altura, col_tiempo = st.columns(5)
+        valores = dict(VALORES_POR_DEFECTO_IMPORTACION)
+        valores['Consumo Agua (L/año)'] = col_agua.number_input("Agua (L/año)", min_value=0.0, value=float(valores['Consumo Agua (L/año)']), step=100.0, key='importacion_agua')
+        valores['Precio Plantón (S/)'] = col_precio.number_input("Precio Plantón (S/)", min_value=0.0, value=float(valores['Precio Plantón (S/)']), step=0.5, key='importacion_precio')
+        valores['DAP Máximo (cm)'] = col_dap.number_input("DAP Máximo (cm)", min_value=0.0, value=float(valores['DAP Máximo (cm)']), step=1.0, key='importacion_dap_max')
+        valores['Altura Máxima (m)'] = col_altura.number_input("Altura Máxima (m)", min_value=0.0, value=float(valores['Altura Máxima (m)']), step=1.0, key='importacion_altura_max')
+        valores['Tiempo Máximo (años)'] = col_tiempo.number_input("Tiempo Máximo (años)", min_value=0, value=int(valores['Tiempo Máximo (años)']), step=1, key='importacion_tiempo_max')
+
+        if st.button("📥 Importar Especies", disabled=archivo is None):
+            try:
+                base, descartadas = leer_base_densidades(io.BytesIO(archivo.getvalue()))
+            except (ValueError, pd.errors.ParserError, UnicodeDecodeError) as e:
+                print(f"Error al importar la base de densidades: {e}")
+                st.error(f"No se pudo leer la base de densidades: {e}")
+            else:
+                df_bd, alias_nuevos, nuevas, existentes = incorporar_base_densidades(
+                    st.session_state.especies_bd, base, obtener_indice_especies(), valores
+                )
+                alias = st.session_state.especies_alias
+                for especie, nombres in alias_nuevos.items():
+                    alias[especie] = list(dict.fromkeys(alias.get(especie, []) + nombres))
+                st.session_state.especies_bd = df_bd
+                st.session_state.especies_version += 1
+                st.success(
+                    f"✅ {nuevas:,} especies añadidas al registro; {existentes:,} ya estaban registradas (se añadieron sus sinónimos). "
+                    f"{descartadas:,} filas descartadas por nombre o densidad no válidos."
+                )
+
+
+@con_estado_en_memoria
+def incorporar_lotes_censo():
+    """Añade al inventario los lotes agregados del último censo procesado."""
+    resultado = st.session_state.get('censo_resultado')
+    if not resultado or resultado['clases'].empty:
+        st.warning("No hay un censo procesado para incorporar.")
+        return
+    lotes = lotes_desde_clases_censo(resultado['clases'], get_current_species_info())
+    for lote in lotes:
+        lote['ID Lote'] = generar_id_lote()
+    registrar_cambio_inventario(
+        f"Importar censo ({len(lotes)} lotes)",
+        [('insertar', len(st.session_state.inventario_list), tuple(lotes)), operacion_medicion_inicial(lotes)]
+    )
+    st.session_state.censo_resultado = None
+    st.success(f"{len(lotes)} lotes agregados del censo añadidos al inventario.")
+
+
+def construir_figuras_censo(resultado):
+    """Figuras de distribución del censo: árboles por clase diamétrica, histograma de DAP y de Altura."""
+    import plotly.express as px
+
+    df_clases = resultado['clases']
+    df_por_clase = df_clases.groupby(['Clase', 'Clase DAP', 'Especie'], as_index=False)['Árboles'].sum().sort_values('Clase')
+    fig_clases = px.bar(df_por_clase, x='Clase DAP', y='Árboles', color='Especie', title='Árboles por Clase Diamétrica')
+
+    df_hist_dap = pd.DataFrame({'DAP (cm)': np.arange(len(resultado['hist_dap'])), 'Árboles': resultado['hist_dap']})
+    df_hist_dap = df_hist_dap[df_hist_dap['Árboles'] > 0]
+    fig_dap = px.bar(df_hist_dap, x='DAP (cm)', y='Árboles', title='Distribución de DAP (bins de 1 cm)')
+
+    df_hist_altura = pd.DataFrame({'Altura (m)': np.arange(len(resultado['hist_altura'])), 'Árboles': resultado['hist_altura']})
+    df_hist_altura = df_hist_altura[df_hist_altura['Árboles'] > 0]
+    fig_altura = px.bar(df_hist_altura, x='Altura (m)', y='Árboles', title='Distribución de Altura (bins de 1 m)')
+
+    return fig_clases, fig_dap, fig_altura
+
+
+def render_censo_arboles():
+    """Modo censo: ingesta de mediciones individuales, agregación por lote y clase diamétrica."""
+    st.title("5. Censo por Árbol (Mediciones Individuales) 🌲")
+    st.info(
+        "Cargue un archivo CSV con una fila por árbol y las columnas **Especie**, **DAP (cm)** y **Altura (m)** "
+        "(opcionales: **Lote** y **Años Plantados**). El archivo se procesa por bloques, por lo que admite "
+        "millones de árboles. El resultado se agrega por lote y clase diamétrica y puede incorporarse al inventario "
+        "de la sección 1."
+    )
+
+    col_archivo, col_config = st.columns([2, 1])
+    with col_archivo:
+        archivo = st.file_uploader("Archivo de censo (CSV)", type=['csv'], key='censo_archivo')
+        ruta_local = st.text_input(
+            "...o nombre del archivo en el directorio de datos del servidor (archivos muy grandes)", value="", key='censo_ruta_local'
+        ) if DIRECTORIO_DATOS_SERVIDOR else None
+    with col_config:
+        ancho_clase = st.number_input("Ancho de clase diamétrica (cm)", min_value=1, max_value=50, value=ANCHO_CLASE_DIAMETRICA, step=1, key='censo_ancho_clase')
+
+    if trabajo_activo('censo') is not None:
+        st.info("⏳ Procesando el censo en segundo plano (avance en la barra lateral). Puede seguir usando la aplicación.")
+    elif st.button("⚙️ Procesar Censo", type="primary"):
+        fuente = fuente_archivo_datos(archivo, ruta_local)
+        if fuente is not None:
+            enviar_trabajo(
+                'censo', trabajo_procesar_censo, fuente, get_current_species_info(), int(ancho_clase),
+                indice_especies=obtener_indice_especies(), descripcion="Procesamiento del censo"
+            )
+            st.rerun()
+
+    resultado = st.session_state.get('censo_resultado')
+    if not resultado:
+        return
+
+    df_clases = resultado['clases']
+    st.markdown("---")
+    st.subheader("Resumen del Censo")
+
+    col_leidos, col_validos, col_co2e = st.columns(3)
+    arboles_validos = int(df_clases['Árboles'].sum()) if not df_clases.empty else 0
+    col_leidos.metric("🧾 Filas Leídas", f"{resultado['filas_leidas']:,.0f}")
+    col_validos.metric("🌳 Árboles Válidos", f"{arboles_validos:,.0f}", delta=f"-{resultado['filas_descartadas']:,.0f} descartados", delta_color="off")
+    col_co2e.metric("🌱 CO₂e Censo (Suma por Árbol)", f"{df_clases['CO2e (Ton)'].sum() if not df_clases.empty else 0.0:,.2f} Toneladas")
+
+    if resultado['especies_no_reconocidas']:
+        especies_txt = ", ".join(f"{nombre} ({conteo:,})" for nombre, conteo in resultado['especies_no_reconocidas'].items())
+        st.warning(f"⚠️ Especies sin densidad en la BD (árboles descartados): {especies_txt}. Regístrelas en la sección 4.")
+    if resultado.get('especies_resueltas'):
+        with st.expander(f"🔤 Nombres de especie resueltos por sinónimo o similitud ({len(resultado['especies_resueltas']):,})"):
+            st.dataframe(
+                pd.DataFrame(list(resultado['especies_resueltas'].items()), columns=['Nombre en el Archivo', 'Especie del Registro']),
+                hide_index=True, use_container_width=True
+            )
+
+    if df_clases.empty:
+        st.warning("El censo no contiene árboles válidos.")
+        return
+
+    st.subheader("Agregado por Lote y Clase Diamétrica")
+    st.dataframe(
+        df_clases.drop(columns=['Clase', 'AGB Medio (kg)']),
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            'DAP Medio (cm)': st.column_config.NumberColumn(format="%.2f"),
+            'Altura Media (m)': st.column_config.NumberColumn(format="%.2f"),
+            'Densidad (ρ)': st.column_config.NumberColumn(format="%.3f"),
+            'Biomasa (Ton)': st.column_config.NumberColumn(format="%.3f"),
+            'CO2e (Ton)': st.column_config.NumberColumn(format="%.3f"),
+        }
+    )
+
+    st.subheader("Distribuciones")
+    col_clases, col_dap, col_altura = st.columns(3)
+
+    fig_clases, fig_dap, fig_altura = obtener_figura('figs_censo', st.session_state.censo_version, lambda: construir_figuras_censo(resultado))
+    col_clases.plotly_chart(fig_clases, use_container_width=True, key='graf_censo_clases')
+    col_dap.plotly_chart(fig_dap, use_container_width=True, key='graf_censo_dap')
+    col_altura.plotly_chart(fig_altura, use_container_width=True, key='graf_censo_altura')
+
+    st.markdown("---")
+    st.caption(
+        "Cada (Lote, Especie, Clase DAP) se incorpora como un lote con la altura media y un **DAP equivalente**, "
+        "de modo que el CO₂e del lote coincide con la suma del CO₂e de sus árboles."
+    )
+    st.button(f"➕ Incorporar {len(df_clases)} Lotes al Inventario", on_click=incorporar_lotes_censo, type="primary")
+
+
+# --- MAPA DE CAPTURA (ÍNDICE ESPACIAL POR TESELAS) ---
+# Zonas predefinidas del mapa: (latitud centro, longitud centro, ancho de la vista en km)
+ZONAS_MAPA = {
+    "Todas las sedes": (-6.30, -78.90, 700.0),
+    "Piura": (-5.19, -80.63, 60.0),
+    "Pacasmayo": (-7.40, -79.57, 60.0),
+    "Rioja": (-6.06, -77.17, 60.0),
+}
+MAX_CLUSTERS_MAPA = 1500 # Máximo de teselas (clusters) dibujadas en la vista
+
+def obtener_indice_inventario(df_inventario_completo):
+    """Índice espacial de los lotes geolocalizados, memorizado por versión del inventario y cálculo de agua (el costo depende del riego)."""
+    clave = (st.session_state.inventario_version, clave_calculo_agua())
+    cache = st.session_state.get('cache_indice_espacial')
+    if cache is None or cache['clave'] != clave:
+        df = df_inventario_completo
+        cache = {
+            'clave': clave,
+            'indice': IndiceEspacial.desde_puntos(df['Latitud'], df['Longitud'], df['Cantidad'], df['CO2e Lote (Ton)'], df['Costo Total Lote (S/)']),
+        }
+        st.session_state.cache_indice_espacial = cache
+    return cache['indice']
+
+
+@con_estado_en_memoria
+def aplicar_zona_mapa():
+    """Centra la vista del mapa en la zona seleccionada."""
+    lat, lon, ancho = ZONAS_MAPA[st.session_state.mapa_zona]
+    st.session_state.mapa_lat = lat
+    st.session_state.mapa_lon = lon
+    st.session_state.mapa_ancho_km = ancho
+
+
+def construir_mapa_clusters(df_teselas, lat, lon, ancho_km):
+    """Mapa de clusters (una burbuja por tesela, tamaño según CO2e) centrado en la vista."""
+    import plotly.graph_objects as go
+
+    co2e = df_teselas['CO2e (Ton)'].to_numpy()
+    maximo = co2e.max() if len(co2e) and co2e.max() > 0 else 1.0
+    texto = [
+        f"{arboles:,.0f} árboles · {puntos:,.0f} puntos<br>{c:,.2f} tCO₂e · S/{costo:,.2f}"
+        for arboles, puntos, c, costo in zip(df_teselas['Árboles'], df_teselas['Puntos'], co2e, df_teselas['Costo (S/)'])
+    ]
+    fig = go.Figure(go.Scattermap(
+        lat=df_teselas['Latitud'],
+        lon=df_teselas['Longitud'],
+        mode='markers',
+        marker=dict(size=6 + 34 * np.sqrt(co2e / maximo), color=co2e, colorscale='Greens', showscale=True, colorbar=dict(title='tCO₂e')),
+        text=texto,
+        hoverinfo='text',
+    ))
+    zoom = float(np.clip(np.log2(40075 * np.cos(np.radians(lat)) / max(ancho_km, 0.1)) + 1, 0, 20))
+    fig.update_layout(
+        map=dict(style='open-street-map', center=dict(lat=lat, lon=lon), zoom=zoom),
+        margin=dict(l=0, r=0, t=0, b=0),
+        height=600,
+    )
+    return fig
+
+
+def render_mapa_captura():
+    """Mapa de captura por teselas: clusters pre-agregados de lotes o árboles geolocalizados."""
+    st.title("6. Mapa de Captura de CO₂e 🗺️")
+    st.info(
+        "El mapa dibuja clusters pre-agregados por tesela (no puntos individuales): solo se consultan las teselas "
+        "de la vista actual, al nivel de detalle que mantiene el mapa fluido. Registre coordenadas en los lotes "
+        "(sección 1) o cargue un censo con columnas **Latitud** y **Longitud** (sección 5)."
+    )
+
+    fuentes = {"Inventario (lotes)": obtener_indice_inventario(recalcular_inventario_completo(st.session_state.inventario_list))}
+    resultado_censo = st.session_state.get('censo_resultado')
+    if resultado_censo and resultado_censo.get('indice_espacial') is not None:
+        fuentes["Censo (árboles)"] = resultado_censo['indice_espacial']
+
+    if 'mapa_zona' not in st.session_state:
+        st.session_state.mapa_zona = "Todas las sedes"
+        aplicar_zona_mapa()
+
+    col_fuente, col_zona, col_nivel = st.columns(3)
+    fuente = col_fuente.radio("Fuente", list(fuentes.keys()), key='mapa_fuente', horizontal=True)
+    col_zona.selectbox("Zona", list(ZONAS_MAPA.keys()), key='mapa_zona', on_change=aplicar_zona_mapa)
+    nivel_sel = col_nivel.select_slider("Nivel de detalle", options=["Automático"] + list(range(NIVEL_MIN, NIVEL_MAX + 1)), key='mapa_nivel')
+
+    col_lat, col_lon, col_ancho = st.columns(3)
+    lat = col_lat.number_input("Latitud centro", min_value=-90.0, max_value=90.0, step=0.01, format="%.4f", key='mapa_lat')
+    lon = col_lon.number_input("Longitud centro", min_value=-180.0, max_value=180.0, step=0.01, format="%.4f", key='mapa_lon')
+    ancho_km = col_ancho.number_input("Ancho de la vista (km)", min_value=0.5, max_value=5000.0, step=10.0, key='mapa_ancho_km')
+
+    indice = fuentes[fuente]
+    if indice.vacio:
+        st.warning(f"La fuente '{fuente}' no tiene puntos con coordenadas válidas.")
+        return
+
+    # Solo se consultan las teselas visibles; el nivel se limita para no superar MAX_CLUSTERS_MAPA clusters
+    bbox = bbox_alrededor(lat, lon, ancho_km)
+    nivel_max_vista = indice.nivel_para(*bbox, MAX_CLUSTERS_MAPA)
+    nivel = nivel_max_vista if nivel_sel == "Automático" else min(nivel_sel, nivel_max_vista)
+    if nivel_sel != "Automático" and nivel_sel > nivel_max_vista:
+        st.caption(f"El nivel {nivel_sel} superaría {MAX_CLUSTERS_MAPA:,} clusters en esta vista; se usa el nivel {nivel}.")
+    df_teselas = indice.teselas(nivel, *bbox)
+
+    col_clusters, col_arboles, col_co2e, col_costo = st.columns(4)
+    col_clusters.metric("🔵 Clusters en Vista", f"{len(df_teselas):,} (nivel {nivel})")
+    col_arboles.metric("🌳 Árboles en Vista", f"{df_teselas['Árboles'].sum():,.0f}")
+    col_co2e.metric("🌱 CO₂e en Vista", f"{df_teselas['CO2e (Ton)'].sum():,.2f} Ton")
+    col_costo.metric("💰 Costo en Vista", f"S/{df_teselas['Costo (S/)'].sum():,.2f}")
+
+    if df_teselas.empty:
+        st.info("No hay puntos en la vista actual. Cambie la zona o amplíe el ancho de la vista.")
+    else:
+        version_mapa = (fuente, st.session_state.inventario_version, st.session_state.censo_version, clave_calculo_agua(), nivel, bbox)
+        fig = obtener_figura('fig_mapa', version_mapa, lambda: construir_mapa_clusters(df_teselas, lat, lon, ancho_km))
+        st.plotly_chart(fig, use_container_width=True, key='graf_mapa_captura')
+
+    with st.expander("📍 Consulta por Radio"):
+        col_rlat, col_rlon, col_radio = st.columns(3)
+        r_lat = col_rlat.number_input("Latitud", min_value=-90.0, max_value=90.0, value=float(lat), step=0.01, format="%.4f", key='mapa_radio_lat')
+        r_lon = col_rlon.number_input("Longitud", min_value=-180.0, max_value=180.0, value=float(lon), step=0.01, format="%.4f", key='mapa_radio_lon')
+        radio_km = col_radio.number_input("Radio (km)", min_value=0.1, max_value=2000.0, value=10.0, step=1.0, key='mapa_radio_km')
+        totales = indice.consultar_radio(r_lat, r_lon, radio_km)
+        col_r1, col_r2, col_r3 = st.columns(3)
+        col_r1.metric("🌳 Árboles", f"{totales['Árboles']:,.0f}")
+        col_r2.metric("🌱 CO₂e", f"{totales['CO2e (Ton)']:,.2f} Ton")
+        col_r3.metric("💰 Costo", f"S/{totales['Costo (S/)']:,.2f}")
+        st.caption(f"Resolución: teselas de nivel {NIVEL_MAX} (≈150 m); cuenta cada tesela cuyo centroide está dentro del radio.")
+
+
+# --- CRÉDITOS DE CARBONO Y VAN ---
+FILAS_LOTES_CREDITOS = 1000 # Lotes mostrados en la tabla por lote (el resultado completo queda en la sesión)
+
+def obtener_flujos_creditos(df_inventario_completo, parametros, escenarios):
+    """
+    Calendario de créditos, flujos y VAN (creditos_carbono.calcular_flujos_creditos), memorizado por
+    versión del inventario, de la BD de especies, del cálculo de agua y por los parámetros financieros.
+    """
+    clave = (st.session_state.inventario_version, st.session_state.especies_version, clave_calculo_agua(), parametros, tuple(escenarios.items()))
+    cache = st.session_state.get('cache_creditos')
+    if cache is None or cache['clave'] != clave:
+        horizonte, buffer_pool, periodo, tasa, incluir_plantones = parametros
+        resultado = calcular_flujos_creditos(
+            df_inventario_completo, get_current_species_info(), horizonte=horizonte, buffer_pool=buffer_pool,
+            periodo_verificacion=periodo, tasa_descuento=tasa, escenarios=escenarios, incluir_plantones=incluir_plantones
+        )
+        cache = {'clave': clave, 'resultado': resultado}
+        st.session_state.cache_creditos = cache
+    return cache['resultado'], clave
+
+
+def escenarios_desde_tabla(df_escenarios):
+    """Escenarios de precio válidos de la tabla editable: {nombre: (precio inicial, crecimiento anual)}."""
+    escenarios = {}
+    for fila in df_escenarios.itertuples(index=False):
+        nombre, precio, crecimiento = str(fila[0] or '').strip(), pd.to_numeric(fila[1], errors='coerce'), pd.to_numeric(fila[2], errors='coerce')
+        if nombre and nombre not in escenarios and pd.notna(precio) and precio >= 0:
+            escenarios[nombre] = (float(precio), float(crecimiento) / 100 if pd.notna(crecimiento) else 0.0)
+    return escenarios
+
+
+def construir_figura_creditos(df_anual):
+    """Créditos emitidos por año (barras) y VAN acumulado por escenario (líneas, eje secundario)."""
+    import plotly.graph_objects as go
+
+    df_emision = df_anual.drop_duplicates('Año')
+    fig = go.Figure()
+    fig.add_trace(go.Bar(x=df_emision['Año'], y=df_emision['Créditos Emitidos (tCO2e)'], name='Créditos Emitidos (tCO2e)', marker_color='#2E8B57'))
+    for escenario, df_escenario in df_anual.groupby('Escenario', sort=False):
+        fig.add_trace(go.Scatter(x=df_escenario['Año'], y=df_escenario['VAN Acumulado (S/)'], name=f'VAN Acumulado {escenario}', mode='lines', yaxis='y2'))
+    fig.update_layout(
+        title='Calendario de Emisión de Créditos y VAN Acumulado',
+        xaxis_title='Año del Proyecto',
+        yaxis=dict(title='Créditos (tCO2e)'),
+        yaxis2=dict(title='VAN Acumulado (S/)', overlaying='y', side='right'),
+        legend=dict(orientation='h', y=-0.2),
+    )
+    return fig
+
+
+def render_creditos_van():
+    """Calendario de créditos emitibles, flujos de caja y VAN del inventario por escenario de precio."""
+    st.title("7. Créditos de Carbono y VAN 💹")
+    st.info(
+        "Proyecta el crecimiento de cada lote desde su medición actual hasta los máximos de su especie "
+        "(DAP, Altura y Tiempo Máximo, sección 4), descuenta el buffer pool y emite los créditos netos en cada "
+        "verificación. Los costos son los plantones (año 0) y el agua anual del inventario (según el riego de la sección 1)."
+    )
+
+    col_horizonte, col_buffer, col_periodo, col_tasa = st.columns(4)
+    horizonte = col_horizonte.number_input("Horizonte (años)", min_value=1, max_value=100, value=HORIZONTE_POR_DEFECTO, step=1, key='creditos_horizonte')
+    buffer_pct = col_buffer.number_input("Buffer pool (%)", min_value=0.0, max_value=100.0, value=BUFFER_POOL_POR_DEFECTO * 100, step=1.0, key='creditos_buffer')
+    periodo = col_periodo.number_input("Verificación cada (años)", min_value=1, max_value=100, value=PERIODO_VERIFICACION_POR_DEFECTO, step=1, key='creditos_periodo')
+    tasa_pct = col_tasa.number_input("Tasa de descuento (%)", min_value=0.0, max_value=50.0, value=TASA_DESCUENTO_POR_DEFECTO * 100, step=0.5, key='creditos_tasa')
+    incluir_plantones = st.checkbox("Incluir la inversión en plantones en el año 0", value=True, key='creditos_plantones')
+
+    st.markdown("##### Escenarios de Precio del Crédito")
+    df_escenarios = st.data_editor(
+        pd.DataFrame(
+            [(nombre, precio, crecimiento * 100) for nombre, (precio, crecimiento) in ESCENARIOS_PRECIO_POR_DEFECTO.items()],
+            columns=['Escenario', 'Precio Inicial (S/ por tCO2e)', 'Crecimiento Anual (%)']
+        ),
+        num_rows="dynamic",
+        hide_index=True,
+        use_container_width=True,
+        key='creditos_escenarios',
+    )
+    escenarios = escenarios_desde_tabla(df_escenarios)
+
+    df_inventario_completo = recalcular_inventario_completo(st.session_state.inventario_list)
+    if df_inventario_completo.empty:
+        st.warning("Registre lotes en la sección 1 para proyectar sus créditos.")
+        return
+    if not escenarios:
+        st.warning("Defina al menos un escenario de precio con nombre y precio inicial.")
+        return
+
+    parametros = (int(horizonte), buffer_pct / 100, int(periodo), tasa_pct / 100, incluir_plantones)
+    resultado, version = obtener_flujos_creditos(df_inventario_completo, parametros, escenarios)
+    df_resumen, df_anual = resultado['resumen'], resultado['anual']
+
+    st.markdown("---")
+    st.subheader("Resumen por Escenario")
+    columnas_metricas = st.columns(len(df_resumen))
+    for col, fila in zip(columnas_metricas, df_resumen.itertuples(index=False)):
+        recuperacion = "sin recuperación en el horizonte" if pd.isna(fila[5]) else f"recuperación en el año {fila[5]}"
+        col.metric(f"💰 VAN {fila[0]}", f"S/{fila[4]:,.0f}", delta=recuperacion, delta_color="off")
+    st.dataframe(
+        df_resumen, hide_index=True, use_container_width=True,
+        column_config={col: st.column_config.NumberColumn(format="%.2f") for col in ['Créditos Emitidos (tCO2e)', 'Ingresos (S/)', 'Costos (S/)', 'VAN (S/)']}
+    )
+
+    fig = obtener_figura('fig_creditos', version, lambda: construir_figura_creditos(df_anual))
+    st.plotly_chart(fig, use_container_width=True, key='graf_creditos')
+
+    st.subheader("Flujo Anual")
+    escenario = st.selectbox("Escenario", list(escenarios.keys()), key='creditos_escenario_tabla')
+    st.dataframe(
+        df_anual[df_anual['Escenario'] == escenario].drop(columns='Escenario'),
+        hide_index=True, use_container_width=True,
+        column_config={col: st.column_config.NumberColumn(format="%.2f") for col in df_anual.columns if col not in ('Escenario', 'Año')}
+    )
+
+    with st.expander("📦 Créditos y VAN por Lote"):
+        df_lotes = resultado['lotes']
+        st.dataframe(df_lotes.head(FILAS_LOTES_CREDITOS), hide_index=True, use_container_width=True)
+        if len(df_lotes) > FILAS_LOTES_CREDITOS:
+            st.caption(f"Se muestran los primeros {FILAS_LOTES_CREDITOS:,} de {len(df_lotes):,} lotes.")
+
+
+# --- PORTAFOLIO DE PROYECTOS ---
+@st.cache_resource(show_spinner=False)
+def obtener_resumenes_portafolio():
+    """Resúmenes por proyecto y pool de procesos, compartidos por todas las sesiones (el resumen depende solo del archivo)."""
+    return ResumenesPortafolio(cache_disco=obtener_cache_disco())
+
+
+def leer_archivos_portafolio(subidos, carpeta):
+    """Lista de (nombre, contenido) de los archivos subidos y de los .json de la carpeta local."""
+    archivos = [(archivo.name, archivo.getvalue()) for archivo in subidos or []]
+    if carpeta:
+        if not os.path.isdir(carpeta):
+            raise ValueError(f"La carpeta '{carpeta}' no existe en el servidor.")
+        for nombre in sorted(os.listdir(carpeta)):
+            if nombre.lower().endswith('.json'):
+                with open(os.path.join(carpeta, nombre), 'rb') as f:
+                    archivos.append((nombre, f.read()))
+    return archivos
+
+
+def render_portafolio():
+    """Totales de un portafolio de proyectos guardados y cobertura de la Huella Corporativa."""
+    st.title("8. Portafolio de Proyectos 🗂️")
+    st.info(
+        "Cargue archivos de proyecto (.json, botón **💾 Guardar Proyecto** de la sección 1) o indique una carpeta del "
+        "servidor. Cada proyecto se calcula con el motor en paralelo (un proceso por núcleo) y su resumen se memoriza "
+        "por contenido: al volver a abrir el portafolio solo se recalculan los archivos nuevos o modificados."
+    )
+
+    col_archivos, col_carpeta = st.columns([2, 1])
+    subidos = col_archivos.file_uploader("Archivos de proyecto (.json)", type=['json'], accept_multiple_files=True, key='portafolio_archivos')
+    carpeta = col_carpeta.text_input("...o carpeta local con archivos .json", value="", key='portafolio_carpeta').strip()
+
+    if st.button("📊 Abrir Portafolio", type="primary"):
+        try:
+            archivos = leer_archivos_portafolio(subidos, carpeta)
+        except (ValueError, OSError) as e:
+            st.error(f"❌ {e}")
+            archivos = None
+        if archivos == []:
+            st.error("Seleccione archivos de proyecto o indique una carpeta con archivos .json.")
+        elif archivos:
+            barra = st.progress(0.0, text="Calculando proyectos...")
+            inicio = time.perf_counter()
+            df_resumen, recalculados = obtener_resumenes_portafolio().resumir(archivos, on_progreso=lambda p: barra.progress(p, text="Calculando proyectos..."))
+            barra.empty()
+            st.session_state.portafolio_resultado = {'resumen': df_resumen, 'recalculados': recalculados, 'duracion': time.perf_counter() - inicio}
+            st.session_state.portafolio_version = st.session_state.get('portafolio_version', 0) + 1
+
+    resultado = st.session_state.get('portafolio_resultado')
+    if not resultado:
+        return
+
+    df_resumen = resultado['resumen']
+    errores = df_resumen[df_resumen['Error'].notna()]
+    validos = df_resumen[df_resumen['Error'].isna()].drop(columns='Error')
+    st.caption(
+        f"{len(df_resumen)} archivos en {resultado['duracion']:.2f} s "
+        f"({resultado['recalculados']} recalculados, el resto desde la caché)."
+    )
+    if not errores.empty:
+        st.warning("⚠️ Archivos no válidos: " + "; ".join(f"{fila['Archivo']} ({fila['Error']})" for _, fila in errores.iterrows()))
+    if validos.empty:
+        return
+
+    huella_total = sum(HUELLA_CORPORATIVA.values())
+    co2e_total = validos['CO2e (Ton)'].sum()
+    col_proyectos, col_arboles, col_co2e, col_cobertura = st.columns(4)
+    col_proyectos.metric("🗂️ Proyectos", f"{len(validos):,}", delta=f"{validos['Hectáreas'].sum():,.1f} ha", delta_color="off")
+    col_arboles.metric("🌳 Árboles", f"{validos['Árboles'].sum():,.0f}")
+    col_co2e.metric("🌱 CO₂e del Portafolio", f"{co2e_total:,.2f} Ton")
+    col_cobertura.metric("🏭 Cobertura de la Huella Corporativa", f"{co2e_total / 1000 / huella_total * 100:,.2f}%")
+    col_agua, col_costo, _, _ = st.columns(4)
+    col_agua.metric("💧 Agua Anual", f"{validos['Agua Anual (L)'].sum():,.0f} L")
+    col_costo.metric("💰 Costo Total", f"S/{validos['Costo (S/)'].sum():,.2f}")
+
+    st.subheader("Proyectos")
+    st.dataframe(
+        validos, hide_index=True, use_container_width=True,
+        column_config={col: st.column_config.NumberColumn(format="%.2f") for col in ['Hectáreas', 'CO2e (Ton)', 'Costo (S/)']}
+    )
+
+    import plotly.express as px
+
+    version = st.session_state.portafolio_version
+    df_grafico = validos.nlargest(30, 'CO2e (Ton)')
+    fig_proyectos = obtener_figura('fig_portafolio', version, lambda: px.bar(df_grafico, x='Proyecto', y='CO2e (Ton)', color='Sede', hover_data=['Archivo', 'Árboles', 'Costo (S/)'], title='CO₂e por Proyecto (30 mayores)'))
+    st.plotly_chart(fig_proyectos, use_container_width=True, key='graf_portafolio')
+
+    st.subheader("Cobertura de la Huella Corporativa por Sede")
+    df_cobertura = cobertura_huella(validos, HUELLA_CORPORATIVA)
+    st.dataframe(
+        df_cobertura, hide_index=True, use_container_width=True,
+        column_config={
+            'Huella (Miles tCO2e)': st.column_config.NumberColumn(format="%.3f"),
+            'Captura (Miles tCO2e)': st.column_config.NumberColumn(format="%.3f"),
+            'Compensado (%)': st.column_config.ProgressColumn(format="%.2f%%", min_value=0, max_value=100),
+        }
+    )
+    sin_sede = validos['Sede'].eq('').sum()
+    if sin_sede:
+        st.caption(f"{sin_sede} proyectos sin sede asignada cuentan en la cobertura total, pero no en la tabla por sede.")
+
+
+# --- ESTIMACIÓN POR PARCELAS DE MUESTREO ---
+NIVELES_CONFIANZA = [0.90, 0.95, 0.99]
+
+def construir_figuras_parcelas(estimacion):
+    """Distribución bootstrap del total y CO2e por especie con su intervalo de confianza."""
+    import plotly.express as px
+    import plotly.graph_objects as go
+
+    total = estimacion['total']
+    fig_bootstrap = px.histogram(x=estimacion['replicas_total'], nbins=60, title='Distribución Bootstrap del CO₂e Total')
+    fig_bootstrap.update_layout(xaxis_title='CO₂e Total (Ton)', yaxis_title='Réplicas', showlegend=False)
+    for valor, color in [(total['ic_boot_inferior'], 'red'), (total['co2e_ton'], 'green'), (total['ic_boot_superior'], 'red')]:
+        fig_bootstrap.add_vline(x=valor, line_dash='dash', line_color=color)
+
+    df_especie = estimacion['por_especie'].head(30)
+    fig_especies = go.Figure(go.Bar(
+        x=df_especie['Especie'], y=df_especie['CO2e Total (Ton)'],
+        error_y=dict(
+            type='data', symmetric=False,
+            array=df_especie['IC Superior (Ton)'] - df_especie['CO2e Total (Ton)'],
+            arrayminus=df_especie['CO2e Total (Ton)'] - df_especie['IC Inferior (Ton)'],
+        ),
+        marker_color='green'
+    ))
+    fig_especies.update_layout(title='CO₂e Estimado por Especie (con IC)', xaxis_title='Especie', yaxis_title='CO₂e Total (Ton)')
+    return fig_bootstrap, fig_especies
+
+
+def render_estimacion_parcelas():
+    """Extrapolación de parcelas de muestreo a las hectáreas del proyecto con error estándar e IC."""
+    st.title("9. Estimación por Parcelas de Muestreo 📐")
+    st.info(
+        "Cargue un archivo CSV con una fila por árbol medido en parcelas y las columnas **Parcela**, **Área Parcela (m²)**, "
+        "**Especie**, **DAP (cm)** y **Altura (m)** (opcionales: **Estrato** —sitio—, **Árboles** y **Área Estrato (ha)**). "
+        "El CO₂e por hectárea de cada parcela se extrapola a las hectáreas del proyecto con un estimador estratificado "
+        "(error estándar e intervalo de confianza) y un bootstrap de las parcelas calculado en paralelo."
+    )
+
+    col_archivo, col_config = st.columns([2, 1])
+    with col_archivo:
+        archivo = st.file_uploader("Archivo de parcelas (CSV)", type=['csv'], key='parcelas_archivo')
+        ruta_local = st.text_input(
+            "...o nombre del archivo en el directorio de datos del servidor", value="", key='parcelas_ruta_local'
+        ) if DIRECTORIO_DATOS_SERVIDOR else None
+    with col_config:
+        confianza = st.selectbox("Nivel de confianza", NIVELES_CONFIANZA, index=NIVELES_CONFIANZA.index(CONFIANZA_POR_DEFECTO), format_func=lambda c: f"{c:.0%}", key='parcelas_confianza')
+        n_replicas = st.number_input("Réplicas bootstrap", min_value=200, max_value=100_000, value=REPLICAS_POR_DEFECTO, step=500, key='parcelas_replicas')
+        st.caption(f"Hectáreas del proyecto (sección 1): **{st.session_state.hectareas:,.2f} ha** (se reparten entre los estratos según sus parcelas, salvo que el archivo traiga 'Área Estrato (ha)').")
+
+    if trabajo_activo('parcelas') is not None:
+        st.info("⏳ Estimando en segundo plano (avance en la barra lateral). Puede seguir usando la aplicación.")
+    elif st.button("📐 Estimar", type="primary"):
+        fuente = fuente_archivo_datos(archivo, ruta_local)
+        if fuente is not None:
+            enviar_trabajo(
+                'parcelas', trabajo_estimar_parcelas, fuente, get_current_species_info(), st.session_state.hectareas,
+                float(confianza), int(n_replicas), indice_especies=obtener_indice_especies(),
+                descripcion="Estimación por parcelas"
+            )
+            st.rerun()
+
+    estimacion = st.session_state.estimacion_parcelas
+    if not estimacion:
+        return
+
+    total = estimacion['total']
+    nivel = f"{estimacion['confianza']:.0%}"
+    st.markdown("---")
+    st.subheader("Estimación del Proyecto")
+    col_total, col_ha, col_error, col_parcelas = st.columns(4)
+    col_total.metric("🌱 CO₂e Estimado", f"{total['co2e_ton']:,.2f} Ton", delta=f"± {total['ee_ton']:,.2f} Ton (EE)", delta_color="off")
+    col_ha.metric("📐 CO₂e por Hectárea", f"{total['co2e_ha']:,.2f} tCO₂e/ha", delta=f"{estimacion['hectareas']:,.2f} ha", delta_color="off")
+    col_error.metric("🎯 Error Relativo", f"{total['error_relativo']:,.2f}%")
+    col_parcelas.metric("🧾 Parcelas", f"{estimacion['parcelas']:,}", delta=f"-{estimacion['filas_descartadas']:,} árboles descartados", delta_color="off")
+    st.markdown(
+        f"**IC {nivel} (t de Student):** {total['ic_inferior']:,.2f} – {total['ic_superior']:,.2f} Ton · "
+        f"**IC {nivel} (bootstrap percentil):** {total['ic_boot_inferior']:,.2f} – {total['ic_boot_superior']:,.2f} Ton"
+    )
+    st.caption("La estimación queda disponible en la sección 3 (GAP) como captura con intervalo de confianza.")
+
+    if estimacion['especies_no_reconocidas']:
+        especies_txt = ", ".join(f"{nombre} ({conteo:,})" for nombre, conteo in estimacion['especies_no_reconocidas'].items())
+        st.warning(f"⚠️ Especies sin densidad en la BD (árboles descartados, la estimación las subestima): {especies_txt}. Regístrelas en la sección 4.")
+    if estimacion['especies_resueltas']:
+        with st.expander(f"🔤 Nombres de especie resueltos por sinónimo o similitud ({len(estimacion['especies_resueltas']):,})"):
+            st.dataframe(
+                pd.DataFrame(list(estimacion['especies_resueltas'].items()), columns=['Nombre en el Archivo', 'Especie del Registro']),
+                hide_index=True, use_container_width=True
+            )
+
+    formato_2 = lambda columnas: {col: st.column_config.NumberColumn(format="%.2f") for col in columnas}
+    st.subheader("Por Estrato (Sitio)")
+    df_estrato = estimacion['por_estrato']
+    st.dataframe(df_estrato, hide_index=True, use_container_width=True, column_config=formato_2(df_estrato.columns[2:]))
+    st.subheader("Por Especie")
+    df_especie = estimacion['por_especie']
+    st.dataframe(df_especie, hide_index=True, use_container_width=True, column_config=formato_2(df_especie.columns[1:]))
+
+    fig_bootstrap, fig_especies = obtener_figura('figs_parcelas', st.session_state.parcelas_version, lambda: construir_figuras_parcelas(estimacion))
+    col_bootstrap, col_especies = st.columns(2)
+    col_bootstrap.plotly_chart(fig_bootstrap, use_container_width=True, key='graf_parcelas_bootstrap')
+    col_especies.plotly_chart(fig_especies, use_container_width=True, key='graf_parcelas_especies')
+
+
+# --- SUPERVIVENCIA Y REPOSICIÓN ---
+FILAS_LOTES_SUPERVIVENCIA = 1000 # Lotes mostrados en la tabla por lote (el resultado completo queda en la sesión)
+
+def construir_figuras_supervivencia(simulacion):
+    """CO2e proyectado con su banda de simulaciones frente al supuesto sin mortalidad, y árboles vivos con el costo acumulado."""
+    import plotly.graph_objects as go
+
+    df = simulacion['anual']
+    bajo, alto = (f"P{c * 100:g}" for c in CUANTILES_SUPERVIVENCIA)
+    fig_co2e = go.Figure([
+        go.Scatter(x=df['Año'], y=df[f'CO2e {alto} (Ton)'], mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'),
+        go.Scatter(x=df['Año'], y=df[f'CO2e {bajo} (Ton)'], mode='lines', line=dict(width=0), fill='tonexty', fillcolor='rgba(46,139,87,0.25)', name=f'{bajo}–{alto}'),
+        go.Scatter(x=df['Año'], y=df['CO2e Media (Ton)'], mode='lines', line=dict(color='#2E8B57'), name='CO₂e con mortalidad (media)'),
+        go.Scatter(x=df['Año'], y=df['CO2e sin Mortalidad (Ton)'], mode='lines', line=dict(color='gray', dash='dash'), name='Sin mortalidad (inventario)'),
+    ])
+    fig_co2e.update_layout(title='Stock de CO₂e Proyectado', xaxis_title='Año', yaxis_title='CO₂e (Ton)', legend=dict(orientation='h', y=-0.2))
+
+    fig_vivos = go.Figure([
+        go.Scatter(x=df['Año'], y=df[f'Árboles Vivos {alto}'], mode='lines', line=dict(width=0), showlegend=False, hoverinfo='skip'),
+        go.Scatter(x=df['Año'], y=df[f'Árboles Vivos {bajo}'], mode='lines', line=dict(width=0), fill='tonexty', fillcolor='rgba(65,105,225,0.25)', name=f'{bajo}–{alto}'),
+        go.Scatter(x=df['Año'], y=df['Árboles Vivos Media'], mode='lines', line=dict(color='royalblue'), name='Árboles vivos (media)'),
+        go.Scatter(x=df['Año'], y=df['Costo Acumulado Media (S/)'], mode='lines', line=dict(color='darkorange'), name='Costo de reposición acumulado (S/)', yaxis='y2'),
+    ])
+    fig_vivos.update_layout(
+        title='Árboles Vivos y Costo de Reposición', xaxis_title='Año',
+        yaxis=dict(title='Árboles'), yaxis2=dict(title='Costo Acumulado (S/)', overlaying='y', side='right'),
+        legend=dict(orientation='h', y=-0.2),
+    )
+    return fig_co2e, fig_vivos
+
+
+def render_supervivencia():
+    """Simulación estocástica de la mortalidad anual por especie y de la reposición con plantones."""
+    st.title("10. Supervivencia y Reposición 🌱")
+    st.info(
+        "El inventario supone que todos los árboles de cada lote sobreviven. Aquí cada lote pierde árboles cada año con la "
+        f"mortalidad de su especie (mayor durante los primeros {ANIOS_ESTABLECIMIENTO} años) y se repone con plantones según la "
+        "política elegida, al Precio Plantón de la especie (sección 4). Cada simulación sortea las muertes de todos los lotes "
+        "y años; el resultado es la distribución de los árboles vivos, el CO₂e y el costo de reposición por año."
+    )
+
+    df_inventario_completo = recalcular_inventario_completo(st.session_state.inventario_list)
+    if df_inventario_completo.empty:
+        st.warning("Registre lotes en la sección 1 para simular su supervivencia.")
+        return
+
+    st.markdown("##### Mortalidad Anual por Especie")
+    especies = sorted(df_inventario_completo['Especie'].unique())
+    df_tasas = st.data_editor(
+        pd.DataFrame({
+            'Especie': especies,
+            'Establecimiento (%)': MORTALIDAD_ESTABLECIMIENTO_POR_DEFECTO * 100,
+            'Adulta (%)': MORTALIDAD_ADULTA_POR_DEFECTO * 100,
+        }),
+        disabled=['Especie'], hide_index=True, use_container_width=True, key='supervivencia_tasas',
+        column_config={col: st.column_config.NumberColumn(min_value=0.0, max_value=100.0, step=0.5, format="%.1f") for col in ['Establecimiento (%)', 'Adulta (%)']},
+    )
+    tasas_mortalidad = {
+        fila[0]: (fila[1] / 100, fila[2] / 100)
+        for fila in df_tasas.fillna({'Establecimiento (%)': MORTALIDAD_ESTABLECIMIENTO_POR_DEFECTO * 100, 'Adulta (%)': MORTALIDAD_ADULTA_POR_DEFECTO * 100}).itertuples(index=False)
+    }
+
+    col_politica, col_parametro, col_horizonte, col_simulaciones = st.columns(4)
+    tipo = col_politica.selectbox("Política de reposición", list(POLITICAS_REPOSICION), format_func=POLITICAS_REPOSICION.get, index=1, key='supervivencia_politica')
+    politica = {'tipo': tipo, 'anios': 0, 'umbral': 0.0}
+    if tipo == 'anual':
+        politica['anios'] = int(col_parametro.number_input("Reponer durante (años, 0 = todo el horizonte)", min_value=0, max_value=100, value=3, step=1, key='supervivencia_anios'))
+    elif tipo == 'umbral':
+        politica['umbral'] = col_parametro.number_input("Umbral de supervivencia (%)", min_value=1.0, max_value=100.0, value=80.0, step=5.0, key='supervivencia_umbral') / 100
+    horizonte = int(col_horizonte.number_input("Horizonte (años)", min_value=1, max_value=100, value=HORIZONTE_POR_DEFECTO, step=1, key='supervivencia_horizonte'))
+    n_simulaciones = int(col_simulaciones.number_input("Simulaciones", min_value=50, max_value=20_000, value=SIMULACIONES_POR_DEFECTO, step=50, key='supervivencia_simulaciones'))
+    col_semilla, col_plantada = st.columns([1, 3])
+    semilla = int(col_semilla.number_input("Semilla", min_value=0, value=SEMILLA_SUPERVIVENCIA, step=1, key='supervivencia_semilla', help="La misma semilla reproduce exactamente las mismas simulaciones."))
+    cantidad_es_plantada = col_plantada.checkbox(
+        "La 'Cantidad' de cada lote son los árboles plantados (aplicar también la mortalidad desde la plantación hasta hoy)",
+        value=False, key='supervivencia_plantada'
+    )
+
+    if trabajo_activo('supervivencia') is not None:
+        st.info("⏳ Simulando en segundo plano (avance en la barra lateral). Puede seguir usando la aplicación.")
+    elif st.button("🎲 Simular", type="primary"):
+        current_species_info = get_current_species_info()
+        cache_disco = obtener_cache_disco()
+        clave = clave_contenido(
+            'supervivencia', clave_inventario_sesion(), clave_especies_sesion(),
+            tasas_mortalidad, politica, horizonte, n_simulaciones, semilla, cantidad_es_plantada
+        )
+        simulacion = cache_disco.obtener(clave)
+        if simulacion is not None: # Misma simulación ya calculada (en esta u otra sesión, o antes de un reinicio)
+            st.session_state.simulacion_supervivencia = simulacion
+            st.session_state.supervivencia_version += 1
+        else:
+            enviar_trabajo(
+                'supervivencia', trabajo_simular_supervivencia, df_inventario_completo, current_species_info, tasas_mortalidad,
+                politica, horizonte, n_simulaciones, semilla, cantidad_es_plantada, cache=cache_disco, clave_cache=clave,
+                descripcion="Simulación de supervivencia"
+            )
+        st.rerun()
+
+    simulacion = st.session_state.simulacion_supervivencia
+    if not simulacion:
+        return
+
+    resumen = simulacion['resumen']
+    bajo, alto = (f"P{c * 100:g}" for c in CUANTILES_SUPERVIVENCIA)
+    horizonte_sim = simulacion['horizonte']
+    st.markdown("---")
+    st.subheader(f"Resultado a {horizonte_sim} Años ({simulacion['simulaciones']:,} simulaciones · {POLITICAS_REPOSICION[simulacion['politica']['tipo']]})")
+    col_vivos, col_co2e, col_reduccion, col_costo = st.columns(4)
+    col_vivos.metric("🌳 Árboles Vivos", f"{resumen['vivos_final']:,.0f}", delta=f"de {resumen['arboles_inicio']:,.0f} hoy", delta_color="off")
+    col_co2e.metric("🌱 CO₂e Proyectado", f"{resumen['co2e_final']:,.2f} Ton", delta=f"{bajo}–{alto}: {resumen['co2e_final_bajo']:,.0f}–{resumen['co2e_final_alto']:,.0f}", delta_color="off")
+    reduccion = (1 - resumen['co2e_final'] / resumen['co2e_sin_mortalidad']) * 100 if resumen['co2e_sin_mortalidad'] > 0 else 0.0
+    col_reduccion.metric("📉 Frente a Sin Mortalidad", f"-{reduccion:,.1f}%", delta=f"{resumen['co2e_sin_mortalidad']:,.2f} Ton sin mortalidad", delta_color="off")
+    col_costo.metric("💵 Costo de Reposición", f"S/{resumen['costo_total']:,.0f}", delta=f"{resumen['repuestos_total']:,.0f} plantones · {alto}: S/{resumen['costo_total_alto']:,.0f}", delta_color="off")
+
+    fig_co2e, fig_vivos = obtener_figura('figs_supervivencia', st.session_state.supervivencia_version, lambda: construir_figuras_supervivencia(simulacion))
+    col_fig_co2e, col_fig_vivos = st.columns(2)
+    col_fig_co2e.plotly_chart(fig_co2e, use_container_width=True, key='graf_supervivencia_co2e')
+    col_fig_vivos.plotly_chart(fig_vivos, use_container_width=True, key='graf_supervivencia_vivos')
+
+    formato_2 = lambda columnas: {col: st.column_config.NumberColumn(format="%.2f") for col in columnas}
+    st.subheader("Por Año")
+    df_anual = simulacion['anual']
+    st.dataframe(df_anual, hide_index=True, use_container_width=True, column_config=formato_2(df_anual.columns[1:]))
+    with st.expander("📦 Supervivencia por Lote (media al final del horizonte)"):
+        df_lotes = simulacion['lotes']
+        st.dataframe(df_lotes.head(FILAS_LOTES_SUPERVIVENCIA), hide_index=True, use_container_width=True, column_config=formato_2(df_lotes.columns[2:]))
+        if len(df_lotes) > FILAS_LOTES_SUPERVIVENCIA:
+            st.caption(f"Se muestran los primeros {FILAS_LOTES_SUPERVIVENCIA:,} de {len(df_lotes):,} lotes.")
+
+
+# --- TABLERO PUBLICADO (SOLO LECTURA) ---
+FIGURAS_TABLERO = ['fig_co2e', 'fig_arboles', 'fig_costo', 'fig_agua']
+
+def publicar_tablero(df_inventario_completo):
+    """Congela los totales, los agregados por especie y la huella corporativa actuales. Retorna el ID publicado."""
+    agregado_especie, _ = obtener_agregados_especie(df_inventario_completo)
+    totales = {
+        'arboles': df_inventario_completo['Cantidad'].sum(),
+        'co2e_ton': get_co2e_total_seguro(df_inventario_completo),
+        'costo': get_costo_total_seguro(df_inventario_completo),
+        'agua_l': get_agua_total_seguro(df_inventario_completo),
+    }
+    sede = st.session_state.sede_proyecto
+    artefacto = construir_publicacion(
+        st.session_state.proyecto, st.session_state.hectareas, None if sede == SIN_SEDE else sede,
+        st.session_state.riego_controlado_check, balance_hidrico_activo(), totales, agregado_especie, HUELLA_CORPORATIVA
+    )
+    return guardar_publicacion(artefacto)
+
+
+@st.cache_resource(show_spinner=False, max_entries=256)
+def obtener_vista_publicacion(id_publicacion):
+    """
+    Artefacto y figuras de una publicación, una vez por proceso: las publicaciones son inmutables,
+    así que todos los visores comparten la misma lectura y las mismas figuras. Retorna (artefacto, figuras).
+    Lanza ValueError si la publicación no existe o no es válida (los errores no se memorizan).
+    """
+    artefacto = cargar_publicacion(id_publicacion)
+    df_graficos = especies_publicadas(artefacto)
+    figuras = {nombre: construir_figura_especie(nombre, df_graficos) for nombre in FIGURAS_TABLERO} if not df_graficos.empty else {}
+    return artefacto, figuras
+
+
+def render_tablero_publicado(id_publicacion):
+    """Visor de solo lectura: totales, gráficos por especie y GAP del artefacto publicado (sin motor ni estado de sesión)."""
+    try:
+        artefacto, figuras = obtener_vista_publicacion(id_publicacion)
+    except ValueError as e:
+        print(f"Error al abrir la publicación {id_publicacion}: {e}")
+        st.error(f"No se pudo abrir el tablero publicado: {e}")
+        return
+
+    totales = artefacto['totales']
+    st.title(f"🌳 {artefacto['proyecto'] or 'Proyecto sin nombre'}")
+    detalles = [f"Publicado: {artefacto['publicado'].replace('T', ' ')}"]
+    if artefacto['hectareas'] > 0:
+        detalles.append(f"{artefacto['hectareas']:,.1f} ha")
+    if artefacto['sede']:
+        detalles.append(f"Sede: {artefacto['sede']}")
+    st.caption(" · ".join(detalles) + " · Vista de solo lectura")
+
+    col_arboles, col_co2e, col_costo, col_agua = st.columns(4)
+    col_arboles.metric("🌳 Total Árboles", f"{totales['arboles']:,.0f} Árboles")
+    col_co2e.metric("🌱 Captura CO₂e (Actual)", f"{totales['co2e_ton']:,.2f} Toneladas")
+    col_costo.metric("💰 Costo Total (Acumulado) S/", f"S/{totales['costo']:,.2f}")
+    agua_label = "💧 Consumo Agua (Anual, Balance Hídrico) L" if artefacto['riego'] and artefacto['balance_hidrico'] else "💧 Consumo Agua (Anual) L"
+    col_agua.metric(agua_label, f"{totales['agua_l']:,.0f} Litros")
+
+    tab_especies, tab_gap = st.tabs(["📈 Gráficos por Especie", "📊 GAP vs. Huella Corporativa"])
+    with tab_especies:
+        if not figuras:
+            st.warning("El proyecto publicado no tiene lotes.")
+        else:
+            col_graf1, col_graf2 = st.columns(2)
+            col_graf1.plotly_chart(figuras['fig_co2e'], use_container_width=True, key='pub_co2e')
+            col_graf2.plotly_chart(figuras['fig_arboles'], use_container_width=True, key='pub_arboles')
+            col_costo_graf, col_agua_graf = st.columns(2)
+            col_costo_graf.plotly_chart(figuras['fig_costo'], use_container_width=True, key='pub_costo')
+            col_agua_graf.plotly_chart(figuras['fig_agua'], use_container_width=True, key='pub_agua')
+    with tab_gap:
+        if totales['co2e_ton'] <= 0:
+            st.warning("⚠️ El proyecto publicado no tiene CO2e registrado.")
+        else:
+            render_analisis_gap(totales['co2e_ton'] / 1000.0, artefacto['huella_corporativa'])
 
 
 def main_app():
     """Define la estructura de la barra lateral y el contenido principal."""
+    id_publicacion = st.query_params.get('publicacion')
+    if id_publicacion:
+        # Visor de solo lectura: sin estado de sesión, sin motor y sin registro de memoria
+        render_tablero_publicado(id_publicacion)
+        return
+
+    restaurar_sesion_desde_disco() # Antes de inicializar: el estado descargado no debe reemplazarse por uno vacío
     inicializar_estado_de_sesion()
-    
-    df_inventario_completo = recalcular_inventario_completo(st.session_state.inventario_list)
-    co2e_total_sidebar = get_co2e_total_seguro(df_inventario_completo)
+    recoger_trabajos_finalizados()
+    sincronizar_proyecto_compartido() # Escribe lo pendiente y trae lo de los demás antes de calcular los totales
     
     # 1. Barra Lateral (Sidebar)
     with st.sidebar:
@@ -1183,7 +3676,13 @@ def main_app():
             "1. Cálculo de Progreso", 
             "2. Potencial Máximo", 
             "3. GAP CPSSA", 
-            "4. Gestión de Especie" 
+            "4. Gestión de Especie",
+            "5. Censo por Árbol",
+            "6. Mapa de Captura",
+            "7. Créditos y VAN",
+            "8. Portafolio",
+            "9. Estimación por Parcelas",
+            "10. Supervivencia y Reposición"
         ]
         
         for option in options:
@@ -1201,8 +3700,26 @@ def main_app():
         # Métricas en el sidebar
         st.markdown("---")
         st.caption(f"Proyecto: {st.session_state.proyecto if st.session_state.proyecto else 'Sin nombre'}")
-        st.metric("CO2e Inventario (Progreso)", f"{co2e_total_sidebar:,.2f} Ton") 
-        
+        metrica_co2e = st.empty()
+
+    # La navegación ya está dibujada: con un inventario grande, la métrica y la barra de avance
+    # muestran el total aproximado mientras se calcula el exacto (y un clic interrumpe el cálculo)
+    barra_avance = st.empty()
+    df_inventario_completo = recalcular_inventario_completo(
+        st.session_state.inventario_list, al_avanzar=avance_recalculo_en(metrica_co2e, barra_avance)
+    )
+    barra_avance.empty()
+    co2e_total_sidebar = get_co2e_total_seguro(df_inventario_completo)
+    metrica_co2e.metric("CO2e Inventario (Progreso)", f"{co2e_total_sidebar:,.2f} Ton")
+
+    with st.sidebar:
+        if st.session_state.compartido_proyecto:
+            render_sincronizacion_compartida()
+        if st.session_state.trabajos_sesion:
+            st.markdown("---")
+            render_trabajos_en_curso()
+        render_avisos_trabajos()
+
         st.markdown("---")
         if st.button("🔄 Reiniciar Aplicación (Borrar Datos de Sesión)", type="secondary"):
             reiniciar_app_completo()
@@ -1218,6 +3735,18 @@ def main_app():
         render_gap_cpassa()
     elif selection == "4. Gestión de Especie":
         render_gestion_especie()
+    elif selection == "5. Censo por Árbol":
+        render_censo_arboles()
+    elif selection == "6. Mapa de Captura":
+        render_mapa_captura()
+    elif selection == "7. Créditos y VAN":
+        render_creditos_van()
+    elif selection == "8. Portafolio":
+        render_portafolio()
+    elif selection == "9. Estimación por Parcelas":
+        render_estimacion_parcelas()
+    elif selection == "10. Supervivencia y Reposición":
+        render_supervivencia()
     
     # Pie de página
     st.caption("---")
@@ -1228,5 +3757,9 @@ def main_app():
         "Para dudas y consultas adicionales, escribir al: **ftrujillo@cpsaa.com.pe**"
     )
 
+    render_tiempos_arranque(registrar_tiempos_arranque())
+    render_panel_memoria()
+    registrar_memoria_sesion()
+
 if __name__ == "__main__":
     main_app()
\ No newline at end of file
@@ -0,0 +1,330 @@
+"""
+API HTTP local del motor de CO2e para integraciones (ERP, SIG).
+
+Expone el mismo motor que usa la app (motor_co2e), por lo que los resultados coinciden con los
+de la sección 1. Las peticiones pequeñas que llegan al mismo tiempo se agrupan (coalescen) en un
+solo lote que se evalúa con las fórmulas vectorizadas (calcular_co2_vectorizado): sin el JSON de
+detalle, el resultado difiere del de recalcular_inventario a lo sumo en el redondeo de la última
+cifra (potencia de numpy frente a la escalar, error relativo < 1e-12). Con "detalle": true se usa
+recalcular_inventario, idéntico a la app.
+
+Uso:
+    python api_co2e.py --puerto 8765 --trabajadores 4
+
+Endpoints (JSON, UTF-8):
+    GET  /salud       -> estado y versión del motor
+    POST /lote        -> {"lote": {...}, "riego": false, "detalle": false}
+    POST /lotes       -> {"lotes": [{...}, ...], "riego": false, "detalle": false}
+    POST /inventario  -> {"lotes": [{...}, ...], "riego": false} (incluye totales del proyecto)
+
+Cada lote usa las mismas claves que el inventario de la app ('Especie', 'Cantidad', 'DAP (cm)',
+'Altura (m)', 'Años Plantados', ...). Si faltan 'Densidad (ρ)', 'Consumo Agua Unitario (L/año)'
+o 'Precio Plantón Unitario (S/)' se toman de la especie, igual que al añadir un lote en la app.
+Un campo numérico que no es un número (ni un texto numérico) rechaza solo esa petición (400).
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from motor_co2e import (
+    FACTOR_CARBONO, FACTOR_KG_A_TON, FACTOR_L_A_M3, PRECIO_AGUA_POR_M3, VERSION_MOTOR,
+    calcular_co2_vectorizado, columnas_salida, df_columns_numeric, fusionar_info_especies, recalcular_inventario,
+)
+
+PUERTO_POR_DEFECTO = 8765
+MAX_LOTES_POR_GRUPO = 4_096 # Tamaño máximo de un lote coalescido
+VENTANA_COALESCENCIA_S = 0.002 # Espera máxima de un trabajador libre para juntar peticiones pequeñas
+MAX_CUERPO_BYTES = 256 * 1024 * 1024
+
+INFO_ESPECIES = fusionar_info_especies(None) # Especies base (DENSIDADES_BASE) + Datos Manuales
+
+
+def _numero(valor, campo):
+    if valor is None or (isinstance(valor, (int, float)) and not isinstance(valor, bool)):
+        return valor
+    if isinstance(valor, str):
+        try:
+            return float(valor)
+        except ValueError:
+            pass
+    raise ValueError(f"'{campo}' debe ser numérico (recibido: {json.dumps(valor, ensure_ascii=False)[:50]}).")
+
+
+def normalizar_lote(lote):
+    """
+    Valida los campos numéricos (los textos numéricos pasan a float) y completa Densidad, Agua y
+    Precio desde la especie cuando no vienen en el lote (como agregar_lote). Lanza ValueError si
+    el lote no es válido: se valida antes de coalescer, para que un lote malo no afecte a otros.
+    """
+    if not isinstance(lote, dict):
+        raise ValueError("Cada lote debe ser un objeto JSON.")
+    lote = dict(lote)
+    especie = lote.get('Especie')
+    if especie is not None and not isinstance(especie, str):
+        raise ValueError("'Especie' debe ser un texto.")
+    for campo in df_columns_numeric:
+        if campo in lote:
+            lote[campo] = _numero(lote[campo], campo)
+    info = INFO_ESPECIES.get(especie)
+    if info is not None:
+        lote.setdefault('Densidad (ρ)', info['Densidad'])
+        lote.setdefault('Consumo Agua Unitario (L/año)', info['Agua_L_Anio'])
+        lote.setdefault('Precio Plantón Unitario (S/)', info['Precio_Plantón'])
+    elif 'Densidad (ρ)' not in lote:
+        raise ValueError(f"Especie desconocida '{lote.get('Especie')}': indique 'Densidad (ρ)'.")
+    return lote
+
+
+def _columna(lotes, campo):
+    valores = np.array([lote.get(campo) for lote in lotes], dtype=float) # None -> NaN
+    return np.where(np.isnan(valores), 0.0, valores) # Como recalcular_inventario (fillna(0))
+
+
+def evaluar_lotes_vectorizado(lotes, riego_activado):
+    """
+    Resultados de recalcular_inventario (sin detalle) para lotes normalizados, con arreglos de
+    numpy y sin DataFrames: el costo fijo por llamada es de microsegundos y no de ~10 ms.
+    """
+    cantidad = _columna(lotes, 'Cantidad')
+    _, _, biomasa_kg, co2e_kg = calcular_co2_vectorizado(
+        _columna(lotes, 'Densidad (ρ)'), _columna(lotes, 'DAP (cm)'), _columna(lotes, 'Altura (m)')
+    )
+    costo = cantidad * _columna(lotes, 'Precio Plantón Unitario (S/)')
+    if riego_activado:
+        agua_l = cantidad * _columna(lotes, 'Consumo Agua Unitario (L/año)')
+        costo = costo + agua_l / FACTOR_L_A_M3 * PRECIO_AGUA_POR_M3 * _columna(lotes, 'Años Plantados')
+    else:
+        agua_l = np.zeros(len(lotes))
+    columnas = (
+        biomasa_kg * cantidad / FACTOR_KG_A_TON,
+        biomasa_kg * FACTOR_CARBONO * cantidad / FACTOR_KG_A_TON,
+        co2e_kg * cantidad / FACTOR_KG_A_TON,
+        agua_l,
+        costo,
+    )
+    return [dict(zip(columnas_salida, fila)) for fila in zip(*(columna.tolist() for columna in columnas))]
+
+
+def evaluar_lotes(lotes, riego_activado, incluir_detalle):
+    """Evalúa una lista de lotes con el motor y retorna una lista de diccionarios de resultados."""
+    if not incluir_detalle:
+        return evaluar_lotes_vectorizado(lotes, riego_activado)
+    df = recalcular_inventario(lotes, riego_activado=riego_activado, incluir_detalle=incluir_detalle)
+    columnas = columnas_salida + (['Detalle Cálculo'] if incluir_detalle else [])
+    return df[columnas].to_dict('records')
+
+
+class PeticionPendiente:
+    """Petición en espera dentro del coalescedor."""
+
+    def __init__(self, lotes, riego_activado, incluir_detalle):
+        self.lotes = lotes
+        self.clave = (bool(riego_activado), bool(incluir_detalle))
+        self.futuro = Future()
+
+
+class CoalescedorLotes:
+    """
+    Agrupa peticiones concurrentes pequeñas en lotes vectorizados.
+
+    Cada uno de los `trabajadores` hilos colectores toma de la cola todo lo pendiente (hasta
+    MAX_LOTES_POR_GRUPO lotes; si la cola está vacía espera hasta VENTANA_COALESCENCIA_S por más),
+    lo agrupa por opciones (riego, detalle) y evalúa cada grupo en el pool. Mientras todos los
+    colectores están ocupados las peticiones se acumulan en la cola, y el siguiente que queda
+    libre se las lleva juntas: bajo carga los lotes crecen solos hasta `max_lotes`
+    (contrapresión). Las peticiones grandes se envían directamente al pool.
+    """
+
+    def __init__(self, trabajadores=4, usar_procesos=False, max_lotes=MAX_LOTES_POR_GRUPO, ventana_s=VENTANA_COALESCENCIA_S):
+        self.max_lotes = max_lotes
+        self.ventana_s = ventana_s
+        pool = ProcessPoolExecutor if usar_procesos else ThreadPoolExecutor
+        self._pool = pool(max_workers=trabajadores)
+        self._cola = queue.Queue()
+        self._candado = threading.Lock()
+        self.grupos_evaluados = 0 # Para medir el tamaño medio de los lotes coalescidos
+        self.lotes_coalescidos = 0
+        self._hilos = [
+            threading.Thread(target=self._despachar, name=f"coalescedor-lotes-{i}", daemon=True)
+            for i in range(trabajadores)
+        ]
+        for hilo in self._hilos:
+            hilo.start()
+
+    def evaluar(self, lotes, riego_activado=False, incluir_detalle=False):
+        """Encola la evaluación de `lotes` y retorna un Future con la lista de resultados."""
+        if len(lotes) >= self.max_lotes:
+            return self._pool.submit(evaluar_lotes, lotes, bool(riego_activado), bool(incluir_detalle))
+        peticion = PeticionPendiente(lotes, riego_activado, incluir_detalle)
+        self._cola.put(peticion)
+        return peticion.futuro
+
+    def cerrar(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _despachar(self):
+        while True:
+            pendientes = [self._cola.get()]
+            total = len(pendientes[0].lotes)
+            limite = time.monotonic() + self.ventana_s
+            while total < self.max_lotes:
+                try:
+                    peticion = self._cola.get_nowait() # Lo acumulado mientras los colectores estaban ocupados
+                except queue.Empty:
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        break
+                    try:
+                        peticion = self._cola.get(timeout=restante)
+                    except queue.Empty:
+                        break
+                pendientes.append(peticion)
+                total += len(peticion.lotes)
+
+            grupos = {}
+            for peticion in pendientes:
+                grupos.setdefault(peticion.clave, []).append(peticion)
+            with self._candado:
+                self.grupos_evaluados += len(grupos)
+                self.lotes_coalescidos += total
+            for (riego_activado, incluir_detalle), grupo in grupos.items():
+                self._evaluar_grupo(grupo, riego_activado, incluir_detalle)
+
+    def _evaluar_grupo(self, grupo, riego_activado, incluir_detalle):
+        """
+        Evalúa un grupo coalescido y devuelve a cada petición su tramo de resultados. Si el grupo
+        falla se divide en mitades y se reintenta: solo las peticiones que fallan por sí solas
+        reciben el error, las demás obtienen su resultado.
+        """
+        lotes = [lote for peticion in grupo for lote in peticion.lotes]
+        try:
+            resultados = self._pool.submit(evaluar_lotes, lotes, riego_activado, incluir_detalle).result()
+        except Exception as error:
+            if len(grupo) == 1:
+                grupo[0].futuro.set_exception(error)
+                return
+            mitad = len(grupo) // 2
+            self._evaluar_grupo(grupo[:mitad], riego_activado, incluir_detalle)
+            self._evaluar_grupo(grupo[mitad:], riego_activado, incluir_detalle)
+            return
+        inicio = 0
+        for peticion in grupo:
+            fin = inicio + len(peticion.lotes)
+            peticion.futuro.set_result(resultados[inicio:fin])
+            inicio = fin
+
+
+def totales_inventario(lotes, resultados):
+    """Totales del proyecto, con las mismas sumas que las métricas de la sección 1 (Cantidad vacía = 0)."""
+    total_arboles = float(_columna(lotes, 'Cantidad').sum()) if lotes else 0
+    return {
+        'Total Árboles': int(total_arboles) if float(total_arboles).is_integer() else total_arboles,
+        'CO2e Total (Ton)': sum(r['CO2e Lote (Ton)'] for r in resultados),
+        'Agua Total Anual (L)': sum(r['Consumo Agua Total Lote (L)'] for r in resultados),
+        'Costo Total (S/)': sum(r['Costo Total Lote (S/)'] for r in resultados),
+    }
+
+
+class ManejadorAPI(BaseHTTPRequestHandler):
+    """Manejador HTTP/1.1 (conexiones persistentes) de los endpoints de la API."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True # Encabezados y cuerpo van en dos escrituras: sin esto, cada respuesta espera el ACK retardado (~40 ms)
+    coalescedor = None # Se asigna en crear_servidor
+
+    def log_message(self, formato, *args):
+        pass # Sin log por petición (alto volumen)
+
+    def _responder(self, estado, cuerpo):
+        self._enviar(estado, json.dumps(cuerpo, ensure_ascii=False).encode('utf-8'))
+
+    def _enviar(self, estado, datos):
+        self.send_response(estado)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+
+    def _leer_json(self):
+        longitud = int(self.headers.get('Content-Length', 0))
+        if longitud <= 0 or longitud > MAX_CUERPO_BYTES:
+            raise ValueError("Cuerpo de la petición vacío o demasiado grande.")
+        return json.loads(self.rfile.read(longitud))
+
+    def do_GET(self):
+        if self.path == '/salud':
+            self._responder(200, {'estado': 'ok', 'version_motor': VERSION_MOTOR})
+        else:
+            self._responder(404, {'error': f"Ruta no encontrada: {self.path}"})
+
+    def do_POST(self):
+        if self.path not in ('/lote', '/lotes', '/inventario'):
+            self._responder(404, {'error': f"Ruta no encontrada: {self.path}"})
+            return
+        try:
+            cuerpo = self._leer_json()
+            if self.path == '/lote':
+                lotes = [normalizar_lote(cuerpo.get('lote'))]
+            else:
+                lotes = [normalizar_lote(lote) for lote in cuerpo.get('lotes', [])]
+            riego = bool(cuerpo.get('riego', False))
+            detalle = bool(cuerpo.get('detalle', False))
+        except (ValueError, AttributeError) as e: # json.JSONDecodeError es un ValueError
+            self._responder(400, {'error': str(e)})
+            return
+
+        # Cualquier error posterior a la validación responde 500 (nunca cierra la conexión sin respuesta)
+        try:
+            resultados = self.coalescedor.evaluar(lotes, riego, detalle).result() if lotes else []
+            if self.path == '/lote':
+                respuesta = {'resultado': resultados[0]}
+            elif self.path == '/lotes':
+                respuesta = {'resultados': resultados}
+            else:
+                respuesta = {'resultados': resultados, 'totales': totales_inventario(lotes, resultados)}
+            datos = json.dumps(respuesta, ensure_ascii=False).encode('utf-8')
+        except Exception as e:
+            self._responder(500, {'error': f"Error del motor de cálculo: {e}"})
+            return
+        self._enviar(200, datos)
+
+
+class ServidorAPI(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # Cola de conexiones entrantes (la de socketserver, 5, descarta conexiones con muchos clientes)
+
+
+def crear_servidor(host='127.0.0.1', puerto=PUERTO_POR_DEFECTO, trabajadores=4, usar_procesos=False):
+    """Crea el servidor HTTP (sin iniciarlo) con su coalescedor de lotes."""
+    manejador = type('ManejadorAPIConfigurado', (ManejadorAPI,), {
+        'coalescedor': CoalescedorLotes(trabajadores=trabajadores, usar_procesos=usar_procesos),
+    })
+    return ServidorAPI((host, puerto), manejador)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="API HTTP local del motor de CO2e.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--puerto', type=int, default=PUERTO_POR_DEFECTO)
+    parser.add_argument('--trabajadores', type=int, default=4, help="Tamaño del pool que evalúa los lotes coalescidos.")
+    parser.add_argument('--procesos', action='store_true', help="Usar un pool de procesos en lugar de hilos.")
+    args = parser.parse_args()
+
+    servidor = crear_servidor(args.host, args.puerto, args.trabajadores, args.procesos)
+    print(f"API CO2e (motor {VERSION_MOTOR}) escuchando en http://{args.host}:{args.puerto}")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+Simulador mensual de balance hídrico para el riego de los lotes.
+
+Reemplaza la cifra anual fija (Agua_L_Anio × Cantidad) por la demanda de riego de cada lote en
+cada mes, a partir de un clima mensual local por sitio (precipitación y evapotranspiración):
+
+    Pe[s, m]       = precipitación efectiva (método USDA-SCS mensual)
+    déficit[s, m]  = max(0, Kc × ETo[s, m] − Pe[s, m]) / eficiencia        (mm = L/m²)
+    demanda[l, m]  = Cantidad[l] × ÁreaCopa(DAP[l]) × déficit[sitio(l), m]  (L)
+
+El déficit depende solo del sitio y de los parámetros, por lo que se calcula (y se memoriza)
+una vez por sitio; la demanda del inventario es una sola operación de arreglos lotes × meses.
+
+Formato del CSV de clima (una fila por sitio y mes):
+    Sitio, Mes (1-12) o Fecha (serie mensual; se promedia por mes calendario),
+    Precipitación (mm), ETo (mm) y, opcionalmente, Latitud y Longitud de la estación.
+"""
+import numpy as np
+import pandas as pd
+
+MESES = 12
+NOMBRES_MESES = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic']
+KC_POR_DEFECTO = 0.75 # Coeficiente de cultivo de árboles jóvenes (FAO-56, rango típico 0.6 - 0.9)
+EFICIENCIA_RIEGO_POR_DEFECTO = 0.85 # Riego por goteo
+# Diámetro de copa (m) = A + B × DAP (cm): aproximación genérica para especies latifoliadas jóvenes
+COPA_FACTOR_A = 0.6
+COPA_FACTOR_B = 0.14
+CLIMA_COLUMNAS_REQUERIDAS = ['Sitio', 'Precipitación (mm)', 'ETo (mm)']
+
+
+def leer_clima_mensual(fuente):
+    """
+    Lee el CSV de clima y lo reduce a una climatología de 12 meses por sitio.
+    Retorna un dict con 'sitios' (lista), 'P' y 'ETo' (arreglos sitios × 12, mm) y 'lat'/'lon' (NaN si no hay).
+    """
+    df = pd.read_csv(fuente)
+    faltantes = [col for col in CLIMA_COLUMNAS_REQUERIDAS if col not in df.columns]
+    if 'Mes' not in df.columns and 'Fecha' not in df.columns:
+        faltantes.append('Mes o Fecha')
+    if faltantes:
+        raise ValueError(f"El archivo de clima no contiene las columnas requeridas: {', '.join(faltantes)}")
+
+    df['Sitio'] = df['Sitio'].astype(str).str.strip()
+    df['Mes'] = pd.to_numeric(df['Mes'], errors='coerce') if 'Mes' in df.columns else pd.to_datetime(df['Fecha'], errors='coerce').dt.month
+    for col in ['Precipitación (mm)', 'ETo (mm)']:
+        df[col] = pd.to_numeric(df[col], errors='coerce')
+    df = df.dropna(subset=['Mes', 'Precipitación (mm)', 'ETo (mm)'])
+    df = df[df['Mes'].between(1, MESES)]
+    if df.empty:
+        raise ValueError("El archivo de clima no tiene filas mensuales válidas.")
+
+    climatologia = df.groupby(['Sitio', df['Mes'].astype(int)])[['Precipitación (mm)', 'ETo (mm)']].mean()
+    meses_completos = pd.MultiIndex.from_product([climatologia.index.levels[0], range(1, MESES + 1)], names=['Sitio', 'Mes'])
+    incompletos = sorted(set(meses_completos.difference(climatologia.index).get_level_values('Sitio')))
+    if incompletos:
+        raise ValueError(f"Sitios sin los 12 meses de clima: {', '.join(incompletos)}")
+    climatologia = climatologia.reindex(meses_completos)
+    sitios = list(climatologia.index.levels[0])
+
+    coordenadas = pd.DataFrame(index=sitios, columns=['Latitud', 'Longitud'], dtype=float)
+    if 'Latitud' in df.columns and 'Longitud' in df.columns:
+        coordenadas = df.groupby('Sitio')[['Latitud', 'Longitud']].mean().reindex(sitios)
+
+    return {
+        'sitios': sitios,
+        'P': climatologia['Precipitación (mm)'].to_numpy().reshape(len(sitios), MESES),
+        'ETo': climatologia['ETo (mm)'].to_numpy().reshape(len(sitios), MESES),
+        'lat': coordenadas['Latitud'].to_numpy(dtype=float),
+        'lon': coordenadas['Longitud'].to_numpy(dtype=float),
+    }
+
+
+def precipitacion_efectiva(p_mm):
+    """Precipitación efectiva mensual (USDA-SCS): la fracción de la lluvia que aprovecha la planta."""
+    p_mm = np.asarray(p_mm, dtype=float)
+    return np.where(p_mm < 250.0, p_mm * (125.0 - 0.2 * p_mm) / 125.0, 125.0 + 0.1 * p_mm)
+
+
+def deficit_por_sitio(clima, kc=KC_POR_DEFECTO, eficiencia=EFICIENCIA_RIEGO_POR_DEFECTO):
+    """Lámina de riego bruta mensual por sitio (sitios × 12, mm = L por m² de copa)."""
+    return np.maximum(kc * clima['ETo'] - precipitacion_efectiva(clima['P']), 0.0) / eficiencia
+
+
+def area_copa_m2(dap_cm):
+    diametro_copa = COPA_FACTOR_A + COPA_FACTOR_B * np.asarray(dap_cm, dtype=float)
+    return np.pi * (diametro_copa / 2.0) ** 2
+
+
+def asignar_sitios(lat, lon, clima, sitio_por_defecto):
+    """
+    Índice de sitio de cada lote: la estación más cercana si el lote y las estaciones tienen
+    coordenadas; si no, `sitio_por_defecto`.
+    """
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    indices = np.full(len(lat), clima['sitios'].index(sitio_por_defecto), dtype=np.int64)
+    estaciones = np.flatnonzero(np.isfinite(clima['lat']) & np.isfinite(clima['lon']))
+    con_coordenadas = np.isfinite(lat) & np.isfinite(lon)
+    if len(estaciones) and con_coordenadas.any():
+        # Distancia equirectangular (suficiente para elegir la estación más cercana)
+        lat_l, lon_l = lat[con_coordenadas, None], lon[con_coordenadas, None]
+        dx = (clima['lon'][estaciones] - lon_l) * np.cos(np.radians(lat_l))
+        dy = clima['lat'][estaciones] - lat_l
+        indices[con_coordenadas] = estaciones[np.argmin(dx ** 2 + dy ** 2, axis=1)]
+    return indices
+
+
+def demanda_mensual_lotes(cantidad, dap_cm, indices_sitio, deficit):
+    """Demanda de riego (L) de cada lote en cada mes: arreglo lotes × 12."""
+    copa_total = np.asarray(cantidad, dtype=float) * area_copa_m2(dap_cm)
+    return copa_total[:, None] * deficit[indices_sitio]
@@ -0,0 +1,149 @@
+"""
+Control de calidad de las mediciones de los lotes (detección de valores atípicos).
+
+Evalúa todos los lotes a la vez, con operaciones de arreglos agrupadas por especie (códigos de
+pd.factorize + np.bincount / groupby), sin recorrer los lotes uno por uno:
+
+  - Relación altura–diámetro: ajuste log(H) = a + b·log(DAP) por especie (global si la especie
+    tiene pocos lotes) y z-score robusto del residuo; además, esbeltez (H/DAP) fuera de rango.
+  - Máximos de la especie: DAP o Altura por encima de DAP_Max / Altura_Max (con tolerancia).
+  - Crecimiento imposible: DAP o Altura mayores que lo alcanzable en 'Años Plantados'
+    (tamaño máximo del plantón + años × crecimiento anual máximo de la especie). Los lotes con
+    edad 0 o desconocida no se evalúan: el censo y la importación usan 0 cuando falta la edad.
+  - Atípicos dentro de la especie: z-score robusto (mediana y MAD) del DAP y de la Altura.
+
+z-score robusto (Iglewicz y Hoaglin): z = 0.6745 × (x − mediana) / MAD; atípico si |z| > 3.5.
+
+Las alertas de cada lote se codifican en bits (ALERTAS) y se traducen a texto una vez por
+combinación distinta, de modo que un millón de lotes se evalúa en segundos.
+"""
+import numpy as np
+import pandas as pd
+
+# Bit -> (columna booleana, descripción)
+ALERTAS = {
+    1: ('Alerta Altura-DAP', 'Relación altura-DAP atípica'),
+    2: ('Alerta Esbeltez', 'Esbeltez (H/DAP) fuera de rango'),
+    4: ('Alerta DAP Máximo', 'DAP sobre el máximo de la especie'),
+    8: ('Alerta Altura Máxima', 'Altura sobre el máximo de la especie'),
+    16: ('Alerta Crecimiento', 'Crecimiento imposible para los años plantados'),
+    32: ('Alerta Atípico Especie', 'DAP o altura atípicos en la especie'),
+}
+Z_ROBUSTO_MAX = 3.5
+MIN_LOTES_ESPECIE = 5 # Lotes mínimos de una especie para ajustar su propia relación y sus z-scores
+ESBELTEZ_MIN, ESBELTEZ_MAX = 5.0, 200.0 # H (m) / DAP (m): fuera de este rango el árbol no es físicamente plausible
+TOLERANCIA_MAXIMOS = 0.10 # Se admite un 10% sobre los máximos de la especie
+DAP_PLANTON_MAX_CM = 3.0 # Tamaño máximo razonable al plantar (base del crecimiento alcanzable)
+ALTURA_PLANTON_MAX_M = 1.5
+FACTOR_CRECIMIENTO_MAX = 3.0 # Crecimiento anual máximo = 3 × el promedio de la especie (máximo / tiempo de madurez)
+INCREMENTO_DAP_MAX_CM_ANIO = 5.0 # Sin máximos de la especie: crecimiento anual máximo genérico
+INCREMENTO_ALTURA_MAX_M_ANIO = 3.0
+ESPECIE_MANUAL = 'Densidad/Datos Manuales'
+COLUMNA_RESUMEN = 'Alertas Calidad'
+
+
+def _sumas_por_grupo(codigos, n_grupos, *valores):
+    return [np.bincount(codigos, weights=v, minlength=n_grupos) for v in valores]
+
+
+def z_robusto_por_grupo(valores, codigos, n_grupos, validos):
+    """
+    z-score robusto de `valores` dentro de cada grupo (solo filas `validas`). Los grupos con menos
+    de MIN_LOTES_ESPECIE filas o MAD nula reciben z = 0.
+    """
+    serie = pd.Series(np.where(validos, valores, np.nan))
+    grupos = pd.Series(codigos)
+    mediana = serie.groupby(grupos).transform('median').to_numpy()
+    mad = (serie - mediana).abs().groupby(grupos).transform('median').to_numpy()
+    conteo = np.bincount(codigos[validos], minlength=n_grupos)[codigos]
+    usable = validos & (conteo >= MIN_LOTES_ESPECIE) & (mad > 0)
+    z = np.zeros(len(valores))
+    z[usable] = 0.6745 * (valores[usable] - mediana[usable]) / mad[usable]
+    return z
+
+
+def residuo_altura_dap(log_dap, log_altura, codigos, n_grupos, validos):
+    """Residuo de log(H) respecto del ajuste log(H) = a + b·log(DAP) de su especie (o global si tiene pocos lotes)."""
+    peso = validos.astype(float)
+    x, y = np.where(validos, log_dap, 0.0), np.where(validos, log_altura, 0.0)
+    n, sx, sy, sxx, sxy = _sumas_por_grupo(codigos, n_grupos, peso, x, y, x * x, x * y)
+    var = sxx - sx * sx / np.maximum(n, 1)
+    cov = sxy - sx * sy / np.maximum(n, 1)
+
+    n_g, sx_g, sy_g = n.sum(), sx.sum(), sy.sum()
+    var_g = sxx.sum() - sx_g * sx_g / max(n_g, 1)
+    b_global = (sxy.sum() - sx_g * sy_g / max(n_g, 1)) / var_g if var_g > 1e-12 else 0.0
+    a_global = (sy_g - b_global * sx_g) / max(n_g, 1)
+
+    propia = (n >= MIN_LOTES_ESPECIE) & (var > 1e-12)
+    b = np.where(propia, cov / np.where(propia, var, 1.0), b_global)
+    a = np.where(propia, (sy - b * sx) / np.maximum(n, 1), a_global)
+    return log_altura - (a[codigos] + b[codigos] * log_dap)
+
+
+def evaluar_calidad_lotes(df_inventario, species_info):
+    """
+    Alertas de calidad de cada lote del inventario (mismo índice). Retorna un DataFrame con una
+    columna booleana por alerta (ALERTAS), 'Código Alertas' (bits) y 'Alertas Calidad' (texto).
+    """
+    especie = df_inventario['Especie'].astype(str).to_numpy()
+    dap = pd.to_numeric(df_inventario['DAP (cm)'], errors='coerce').to_numpy(dtype=float)
+    altura = pd.to_numeric(df_inventario['Altura (m)'], errors='coerce').to_numpy(dtype=float)
+    anios = pd.to_numeric(df_inventario['Años Plantados'], errors='coerce').fillna(0).to_numpy(dtype=float)
+    validos = (dap > 0) & (altura > 0)
+
+    codigos, especies = pd.factorize(especie)
+    n_grupos = len(especies)
+    codigo_alertas = np.zeros(len(df_inventario), dtype=np.int64)
+
+    # 1. Relación altura-diámetro y esbeltez
+    log_dap = np.log(np.where(validos, dap, 1.0))
+    log_altura = np.log(np.where(validos, altura, 1.0))
+    residuo = residuo_altura_dap(log_dap, log_altura, codigos, n_grupos, validos)
+    z_hd = z_robusto_por_grupo(residuo, codigos, n_grupos, validos)
+    codigo_alertas |= np.where(np.abs(z_hd) > Z_ROBUSTO_MAX, 1, 0)
+    esbeltez = np.where(validos, altura / np.where(validos, dap, 1.0) * 100.0, np.nan)
+    codigo_alertas |= np.where(validos & ((esbeltez < ESBELTEZ_MIN) | (esbeltez > ESBELTEZ_MAX)), 2, 0)
+
+    # 2. Máximos de la especie (por especie distinta; las especies desconocidas y los datos manuales no se evalúan)
+    maximos = np.zeros((n_grupos, 3))
+    for k, nombre in enumerate(especies):
+        info = species_info.get(nombre)
+        if info is not None and nombre != ESPECIE_MANUAL:
+            maximos[k] = (info['DAP_Max'], info['Altura_Max'], info['Tiempo_Max_Anios'])
+    dap_max, altura_max, tiempo_max = maximos[codigos, 0], maximos[codigos, 1], maximos[codigos, 2]
+    codigo_alertas |= np.where((dap_max > 0) & (dap > dap_max * (1 + TOLERANCIA_MAXIMOS)), 4, 0)
+    codigo_alertas |= np.where((altura_max > 0) & (altura > altura_max * (1 + TOLERANCIA_MAXIMOS)), 8, 0)
+
+    # 3. Crecimiento imposible para la edad (solo con edad conocida: 0 es también "sin edad")
+    edad_conocida = anios > 0
+    con_ritmo = (tiempo_max > 0) & (dap_max > 0) & (altura_max > 0)
+    ritmo_dap = np.where(con_ritmo, FACTOR_CRECIMIENTO_MAX * dap_max / np.where(con_ritmo, tiempo_max, 1.0), INCREMENTO_DAP_MAX_CM_ANIO)
+    ritmo_altura = np.where(con_ritmo, FACTOR_CRECIMIENTO_MAX * altura_max / np.where(con_ritmo, tiempo_max, 1.0), INCREMENTO_ALTURA_MAX_M_ANIO)
+    imposible = (dap > DAP_PLANTON_MAX_CM + anios * ritmo_dap) | (altura > ALTURA_PLANTON_MAX_M + anios * ritmo_altura)
+    codigo_alertas |= np.where(validos & edad_conocida & imposible, 16, 0)
+
+    # 4. Atípicos dentro de la especie
+    z_dap = z_robusto_por_grupo(dap, codigos, n_grupos, validos)
+    z_altura = z_robusto_por_grupo(altura, codigos, n_grupos, validos)
+    codigo_alertas |= np.where((np.abs(z_dap) > Z_ROBUSTO_MAX) | (np.abs(z_altura) > Z_ROBUSTO_MAX), 32, 0)
+
+    resultado = pd.DataFrame({columna: (codigo_alertas & bit) > 0 for bit, (columna, _) in ALERTAS.items()}, index=df_inventario.index)
+    resultado['Código Alertas'] = codigo_alertas
+    resultado[COLUMNA_RESUMEN] = texto_alertas(codigo_alertas)
+    return resultado
+
+
+def texto_alertas(codigo_alertas):
+    """Descripción de las alertas de cada lote (una traducción por combinación distinta de bits)."""
+    unicos, inversa = np.unique(codigo_alertas, return_inverse=True)
+    textos = np.array(['; '.join(descripcion for bit, (_, descripcion) in ALERTAS.items() if codigo & bit) for codigo in unicos], dtype=object)
+    return textos[inversa]
+
+
+def resumen_alertas(df_calidad):
+    """Lotes con cada alerta (para el resumen del tablero y del Excel)."""
+    return pd.DataFrame({
+        'Alerta': [descripcion for _, descripcion in ALERTAS.values()],
+        'Lotes': [int(df_calidad[columna].sum()) for columna, _ in ALERTAS.values()],
+    })
@@ -0,0 +1,176 @@
+"""
+Calendario de emisión de créditos de carbono y VAN del proyecto en un horizonte de varios años.
+
+Crecimiento: el DAP y la Altura de cada lote avanzan linealmente desde la medición actual
+(a la edad 'Años Plantados') hasta los máximos de la especie (DAP_Max, Altura_Max) al llegar a
+Tiempo_Max_Anios, y se mantienen después. El stock de CO2e por árbol en cada año sale de la
+misma fórmula del motor (calcular_co2_vectorizado); su incremento anual es la captura bruta.
+
+Por año y lote:
+    captura bruta  = Δ stock × Cantidad
+    buffer         = captura bruta × fracción del buffer pool (reserva de no permanencia)
+    créditos netos = captura bruta − buffer; se emiten acumulados en cada año de verificación
+    costos         = plantones (año 0, opcional) + agua anual (según el riego del inventario)
+    flujo          = créditos emitidos × precio[escenario, año] − costos
+    VAN            = Σ flujo × (1 + tasa)^-año
+
+El tensor lotes × años × escenarios de precio no se materializa: los ingresos descontados por
+lote y escenario se obtienen con una sola contracción (einsum) de la matriz de créditos
+(lotes × años) con la de precios (escenarios × años), y los totales anuales sumando primero
+sobre los lotes. La memoria queda en O(lotes × años).
+"""
+import numpy as np
+import pandas as pd
+
+from motor_co2e import FACTOR_KG_A_TON, FACTOR_L_A_M3, PRECIO_AGUA_POR_M3, calcular_co2_vectorizado
+
+HORIZONTE_POR_DEFECTO = 30 # Años
+BUFFER_POOL_POR_DEFECTO = 0.20 # Fracción de la captura retenida como reserva de no permanencia
+TASA_DESCUENTO_POR_DEFECTO = 0.08
+PERIODO_VERIFICACION_POR_DEFECTO = 5 # Años entre verificaciones (emisiones)
+# Escenario: (precio inicial en S/ por tCO2e, crecimiento anual del precio)
+ESCENARIOS_PRECIO_POR_DEFECTO = {
+    'Conservador': (40.0, 0.00),
+    'Base': (60.0, 0.03),
+    'Optimista': (90.0, 0.05),
+}
+ESPECIE_MANUAL = 'Densidad/Datos Manuales'
+
+
+def parametros_crecimiento(df_inventario, species_info):
+    """
+    Máximos de crecimiento por lote (DAP_Max, Altura_Max, Tiempo_Max_Anios), con el mismo criterio
+    del potencial máximo: datos manuales usan los máximos por defecto y las especies desconocidas
+    no crecen (se quedan en su medición actual).
+    """
+    info_manual = species_info.get(ESPECIE_MANUAL, {'DAP_Max': 0.0, 'Altura_Max': 0.0, 'Tiempo_Max_Anios': 0})
+    especies = df_inventario['Especie']
+    maximos = {}
+    for campo, actual in [('DAP_Max', 'DAP (cm)'), ('Altura_Max', 'Altura (m)'), ('Tiempo_Max_Anios', None)]:
+        por_especie = {nombre: datos[campo] for nombre, datos in species_info.items() if nombre != ESPECIE_MANUAL}
+        valores = especies.map(por_especie)
+        valores = valores.where(especies != ESPECIE_MANUAL, info_manual[campo])
+        relleno = df_inventario[actual] if actual else 0
+        maximos[campo] = pd.to_numeric(valores, errors='coerce').fillna(relleno).to_numpy(dtype=float)
+    return maximos['DAP_Max'], maximos['Altura_Max'], maximos['Tiempo_Max_Anios']
+
+
+def proyectar_stock_co2e(rho, dap_cm, altura_m, anios_plantados, dap_max, altura_max, tiempo_max, horizonte):
+    """Stock de CO2e por árbol (kg) en los años 0..horizonte desde hoy: arreglo lotes × (horizonte + 1)."""
+    dap_cm, altura_m = np.asarray(dap_cm, dtype=float), np.asarray(altura_m, dtype=float)
+    restantes = np.asarray(tiempo_max, dtype=float) - np.asarray(anios_plantados, dtype=float)
+    anios = np.arange(horizonte + 1, dtype=float)
+    # Fracción del crecimiento pendiente alcanzada en cada año (0 si el lote ya llegó a su edad máxima)
+    fraccion = np.where(restantes[:, None] > 0, np.minimum(anios / np.maximum(restantes, 1.0)[:, None], 1.0), 0.0)
+    dap = dap_cm[:, None] + fraccion * np.maximum(np.asarray(dap_max, dtype=float) - dap_cm, 0.0)[:, None]
+    altura = altura_m[:, None] + fraccion * np.maximum(np.asarray(altura_max, dtype=float) - altura_m, 0.0)[:, None]
+    _, _, _, co2e_kg = calcular_co2_vectorizado(np.asarray(rho, dtype=float)[:, None], dap, altura)
+    return co2e_kg
+
+
+def matriz_emision(horizonte, periodo_verificacion):
+    """
+    Matriz (años × años) que lleva los créditos netos de cada año al año de verificación en que
+    se emiten: múltiplos de `periodo_verificacion` y el último año del horizonte.
+    """
+    anios = np.arange(horizonte + 1)
+    emision = np.minimum(-(-anios // periodo_verificacion) * periodo_verificacion, horizonte)
+    return (emision[:, None] == anios[None, :]).astype(float)
+
+
+def precios_escenarios(escenarios, horizonte):
+    """Precio (S/ por tCO2e) por escenario y año: arreglo escenarios × (horizonte + 1)."""
+    iniciales = np.array([precio for precio, _ in escenarios.values()], dtype=float)
+    crecimientos = np.array([crecimiento for _, crecimiento in escenarios.values()], dtype=float)
+    return iniciales[:, None] * (1.0 + crecimientos[:, None]) ** np.arange(horizonte + 1)
+
+
+def anio_recuperacion(van_acumulado):
+    """Primer año desde el cual el VAN acumulado ya no vuelve a ser negativo (None si no se recupera en el horizonte)."""
+    negativos = np.flatnonzero(van_acumulado < 0)
+    if len(negativos) == 0:
+        return 0
+    if negativos[-1] == len(van_acumulado) - 1:
+        return None
+    return int(negativos[-1] + 1)
+
+
+def calcular_flujos_creditos(df_inventario, species_info, horizonte=HORIZONTE_POR_DEFECTO, buffer_pool=BUFFER_POOL_POR_DEFECTO,
+                             periodo_verificacion=PERIODO_VERIFICACION_POR_DEFECTO, tasa_descuento=TASA_DESCUENTO_POR_DEFECTO,
+                             escenarios=None, incluir_plantones=True):
+    """
+    Créditos, costos, flujos y VAN del inventario recalculado (salida de recalcular_inventario).
+    Retorna un dict con:
+      'anual'  : DataFrame por escenario y año (captura, buffer, créditos emitidos, ingresos, costos, flujos, VAN acumulado)
+      'resumen': DataFrame por escenario (créditos totales, VAN, año de recuperación)
+      'lotes'  : DataFrame por lote (captura y créditos del horizonte, VAN por escenario)
+    """
+    escenarios = ESCENARIOS_PRECIO_POR_DEFECTO if escenarios is None else escenarios
+    nombres = list(escenarios.keys())
+    anios = np.arange(horizonte + 1)
+
+    df = df_inventario
+    cantidad = df['Cantidad'].to_numpy(dtype=float)
+    dap_max, altura_max, tiempo_max = parametros_crecimiento(df, species_info)
+    stock_kg = proyectar_stock_co2e(df['Densidad (ρ)'], df['DAP (cm)'], df['Altura (m)'], df['Años Plantados'], dap_max, altura_max, tiempo_max, horizonte)
+
+    # Lotes × años (año 0 = hoy, sin captura nueva)
+    captura_ton = np.zeros((len(df), horizonte + 1))
+    captura_ton[:, 1:] = np.diff(stock_kg, axis=1) * cantidad[:, None] / FACTOR_KG_A_TON
+    buffer_ton = captura_ton * buffer_pool
+    emitidos_ton = (captura_ton - buffer_ton) @ matriz_emision(horizonte, periodo_verificacion)
+
+    costo_agua_anual = df['Consumo Agua Total Lote (L)'].to_numpy(dtype=float) / FACTOR_L_A_M3 * PRECIO_AGUA_POR_M3
+    costos = np.zeros((len(df), horizonte + 1))
+    costos[:, 1:] = costo_agua_anual[:, None]
+    if incluir_plantones:
+        costos[:, 0] = cantidad * df['Precio Plantón Unitario (S/)'].to_numpy(dtype=float)
+
+    precios = precios_escenarios(escenarios, horizonte) # escenarios × años
+    descuento = (1.0 + tasa_descuento) ** -anios.astype(float)
+
+    # VAN por lote y escenario: contracción lotes × años × escenarios en una sola pasada
+    van_lotes = np.einsum('la,sa->ls', emitidos_ton * descuento, precios) - (costos @ descuento)[:, None]
+
+    # Totales anuales (se suma primero sobre los lotes)
+    emitidos_anio = emitidos_ton.sum(axis=0)
+    costos_anio = costos.sum(axis=0)
+    ingresos = emitidos_anio[None, :] * precios
+    flujos = ingresos - costos_anio[None, :]
+    descontados = flujos * descuento[None, :]
+    van_acumulado = np.cumsum(descontados, axis=1)
+
+    n_escenarios = len(nombres)
+    anual = pd.DataFrame({
+        'Escenario': np.repeat(nombres, horizonte + 1),
+        'Año': np.tile(anios, n_escenarios),
+        'Captura Bruta (tCO2e)': np.tile(captura_ton.sum(axis=0), n_escenarios),
+        'Buffer Pool (tCO2e)': np.tile(buffer_ton.sum(axis=0), n_escenarios),
+        'Créditos Emitidos (tCO2e)': np.tile(emitidos_anio, n_escenarios),
+        'Precio (S/ por tCO2e)': precios.ravel(),
+        'Ingresos (S/)': ingresos.ravel(),
+        'Costo Plantones (S/)': np.tile(np.where(anios == 0, costos_anio, 0.0), n_escenarios),
+        'Costo Agua (S/)': np.tile(np.where(anios > 0, costos_anio, 0.0), n_escenarios),
+        'Flujo Neto (S/)': flujos.ravel(),
+        'Flujo Descontado (S/)': descontados.ravel(),
+        'VAN Acumulado (S/)': van_acumulado.ravel(),
+    })
+
+    resumen = pd.DataFrame({
+        'Escenario': nombres,
+        'Créditos Emitidos (tCO2e)': emitidos_anio.sum(),
+        'Ingresos (S/)': ingresos.sum(axis=1),
+        'Costos (S/)': costos_anio.sum(),
+        'VAN (S/)': van_acumulado[:, -1],
+        'Año de Recuperación': pd.array([anio_recuperacion(fila) for fila in van_acumulado], dtype='Int64'),
+    })
+
+    lotes = pd.DataFrame({
+        'ID Lote': df['ID Lote'].to_numpy() if 'ID Lote' in df.columns else np.arange(1, len(df) + 1),
+        'Especie': df['Especie'].to_numpy(),
+        'Cantidad': cantidad,
+        'Captura Horizonte (tCO2e)': captura_ton.sum(axis=1),
+        'Créditos Emitidos (tCO2e)': emitidos_ton.sum(axis=1),
+        **{f'VAN {nombre} (S/)': van_lotes[:, i] for i, nombre in enumerate(nombres)},
+    })
+    return {'anual': anual, 'resumen': resumen, 'lotes': lotes}
@@ -0,0 +1,117 @@
+"""
+Año de cruce (carbono neutralidad) del proyecto frente a la huella corporativa de cada sede.
+
+Captura: stock de CO2e del proyecto en cada año del horizonte, con el mismo modelo de crecimiento
+de los créditos de carbono (creditos_carbono.proyectar_stock_co2e: DAP y Altura avanzan
+linealmente hasta los máximos de la especie). Año 0 = hoy, igual que la captura del GAP.
+
+Emisiones: emisiones anuales de cada sede con una tasa de variación anual por grupo de empresas:
+    E[sede, año] = E0[sede] × (1 + tasa[grupo])^año
+
+Cruce: primer año en que la captura acumulada del proyecto alcanza las emisiones anuales de la
+sede (o la suma de las sedes de un grupo). Con emisiones crecientes y una captura que se satura
+al llegar a los máximos, la brecha puede volver a abrirse: 'Se Mantiene' indica si la cobertura
+se sostiene hasta el final del horizonte.
+
+Todo es vectorizado: la captura se calcula una vez por lotes distintos (por bloques, para acotar
+la memoria) y la comparación sedes × años es una sola operación de arreglos.
+"""
+import numpy as np
+import pandas as pd
+
+from creditos_carbono import parametros_crecimiento, proyectar_stock_co2e
+from motor_co2e import FACTOR_KG_A_TON
+
+TAMANO_BLOQUE = 50_000 # Lotes distintos por bloque de la proyección (bloque × años en memoria)
+TON_POR_MILES = 1000.0
+
+
+def proyectar_captura_proyecto(df_inventario, species_info, horizonte, tamano_bloque=TAMANO_BLOQUE):
+    """Stock total de CO2e del proyecto (tCO2e) en los años 0..horizonte."""
+    if df_inventario.empty:
+        return np.zeros(horizonte + 1)
+    dap_max, altura_max, tiempo_max = parametros_crecimiento(df_inventario, species_info)
+    # Los lotes con los mismos parámetros crecen igual: se proyecta una vez por combinación distinta
+    parametros = pd.DataFrame({
+        'rho': df_inventario['Densidad (ρ)'].to_numpy(dtype=float),
+        'dap': df_inventario['DAP (cm)'].to_numpy(dtype=float),
+        'altura': df_inventario['Altura (m)'].to_numpy(dtype=float),
+        'anios': df_inventario['Años Plantados'].to_numpy(dtype=float),
+        'dap_max': dap_max, 'altura_max': altura_max, 'tiempo_max': tiempo_max,
+        'cantidad': df_inventario['Cantidad'].to_numpy(dtype=float),
+    })
+    distintos = parametros.groupby(list(parametros.columns[:-1]), sort=False)['cantidad'].sum().reset_index()
+
+    stock_ton = np.zeros(horizonte + 1)
+    for inicio in range(0, len(distintos), tamano_bloque):
+        bloque = distintos.iloc[inicio:inicio + tamano_bloque]
+        stock_kg = proyectar_stock_co2e(
+            bloque['rho'], bloque['dap'], bloque['altura'], bloque['anios'],
+            bloque['dap_max'], bloque['altura_max'], bloque['tiempo_max'], horizonte
+        )
+        stock_ton += bloque['cantidad'].to_numpy() @ stock_kg / FACTOR_KG_A_TON
+    return stock_ton
+
+
+def proyectar_emisiones(emisiones_base, tasas, horizonte):
+    """Emisiones anuales (mismas unidades que `emisiones_base`): arreglo sedes × (horizonte + 1)."""
+    return np.asarray(emisiones_base, dtype=float)[:, None] * (1.0 + np.asarray(tasas, dtype=float)[:, None]) ** np.arange(horizonte + 1)
+
+
+def anios_cruce(captura, emisiones):
+    """
+    Primer año en que captura >= emisiones en cada fila (-1 si no ocurre en el horizonte) y si la
+    cobertura se mantiene desde ese año hasta el final.
+    """
+    cubierto = captura[None, :] >= emisiones
+    alguno = cubierto.any(axis=1)
+    primero = np.where(alguno, cubierto.argmax(axis=1), -1)
+    descubierto = ~cubierto
+    ultimo_descubierto = np.where(descubierto.any(axis=1), cubierto.shape[1] - 1 - descubierto[:, ::-1].argmax(axis=1), -1)
+    return primero, alguno & (ultimo_descubierto < primero)
+
+
+def _tabla_cruce(nombres, emisiones, captura, anio_inicial):
+    primero, sostenido = anios_cruce(captura, emisiones)
+    anio_cruce = pd.Series(np.where(primero >= 0, primero, np.nan)).astype('Int64').array
+    return pd.DataFrame({
+        'Emisiones Año 0 (tCO2e)': emisiones[:, 0],
+        f'Emisiones Año {emisiones.shape[1] - 1} (tCO2e)': emisiones[:, -1],
+        'Cobertura Hoy (%)': np.where(emisiones[:, 0] > 0, captura[0] / np.where(emisiones[:, 0] > 0, emisiones[:, 0], 1.0) * 100, np.nan),
+        'Cobertura Horizonte (%)': np.where(emisiones[:, -1] > 0, captura[-1] / np.where(emisiones[:, -1] > 0, emisiones[:, -1], 1.0) * 100, np.nan),
+        'Año de Cruce': anio_cruce,
+        'Año Calendario': anio_cruce + anio_inicial,
+        'Se Mantiene': sostenido,
+    }, index=pd.Index(nombres))
+
+
+def analizar_cruce(captura, huella_corporativa, grupos, tasas_grupo, anio_inicial):
+    """
+    Cruce por sede y por grupo. `huella_corporativa`: sede -> miles de tCO2e anuales; `grupos`:
+    grupo -> lista de sedes; `tasas_grupo`: grupo -> tasa anual (fracción, p. ej. -0.02).
+    Retorna {'sedes': DataFrame, 'grupos': DataFrame, 'emisiones_grupos': grupos × años (tCO2e)}.
+    """
+    horizonte = len(captura) - 1
+    sedes = list(huella_corporativa.keys())
+    grupo_de_sede = {sede: grupo for grupo, miembros in grupos.items() for sede in miembros}
+    grupo_sedes = [grupo_de_sede.get(sede, '') for sede in sedes]
+    base = np.array([huella_corporativa[sede] for sede in sedes]) * TON_POR_MILES
+    tasas = np.array([tasas_grupo.get(grupo, 0.0) for grupo in grupo_sedes])
+    emisiones = proyectar_emisiones(base, tasas, horizonte)
+
+    # Grupos: suma de sus sedes con una matriz indicadora (grupos × sedes)
+    nombres_grupos = list(grupos.keys())
+    indicadora = np.array([[grupo == nombre for grupo in grupo_sedes] for nombre in nombres_grupos], dtype=float).reshape(len(nombres_grupos), len(sedes))
+    emisiones_grupos = indicadora @ emisiones
+
+    df_sedes = _tabla_cruce(sedes, emisiones, captura, anio_inicial)
+    df_sedes.insert(0, 'Grupo', grupo_sedes)
+    df_sedes.insert(1, 'Tasa Anual (%)', tasas * 100)
+    df_grupos = _tabla_cruce(nombres_grupos, emisiones_grupos, captura, anio_inicial)
+    df_grupos.insert(0, 'Sedes', indicadora.sum(axis=1).astype(int))
+    df_grupos.insert(1, 'Tasa Anual (%)', [tasas_grupo.get(nombre, 0.0) * 100 for nombre in nombres_grupos])
+    return {
+        'sedes': df_sedes.rename_axis('Sede').reset_index(),
+        'grupos': df_grupos.rename_axis('Grupo').reset_index(),
+        'emisiones_grupos': emisiones_grupos,
+    }
@@ -0,0 +1,265 @@
+"""
+Exportación Excel de la memoria de cálculo (sin Streamlit: la usan la app y la prueba de rendimiento).
+
+Dos modos para la evidencia del cálculo (MODOS_EVIDENCIA):
+  - 'hojas': una hoja por combinación distinta de (ρ, DAP, Altura) con las ecuaciones sustituidas
+    (construir_tabla_evidencia); los lotes idénticos la comparten. Con mediciones de campo casi
+    todas las combinaciones son distintas y el archivo crece con ~30 filas y una hoja por lote.
+  - 'formulas': una hoja de parámetros (AGB_FACTOR_A, AGB_FACTOR_B, FACTOR_BGB_SECO, FACTOR_CARBONO,
+    FACTOR_CO2E y FACTOR_KG_A_TON, como nombres definidos del libro) y una fila por lote con
+    fórmulas de Excel que los referencian, generadas desde las plantillas de
+    COLUMNAS_EVIDENCIA_FORMULAS. El auditor puede cambiar un parámetro o una medición y Excel
+    recalcula; cada fórmula lleva además el valor calculado por el motor, para que el archivo se lea
+    sin recalcular. El tamaño y el tiempo de escritura crecen con ~13 celdas por lote.
+"""
+import io
+import json
+
+import numpy as np
+import pandas as pd
+
+from motor_co2e import (
+    AGB_FACTOR_A, AGB_FACTOR_B, FACTOR_BGB_SECO, FACTOR_CARBONO, FACTOR_CO2E, FACTOR_KG_A_TON, calcular_co2_vectorizado,
+)
+from trabajos_fondo import TrabajoCancelado
+
+MAX_LOTES_REFERENCIADOS_EVIDENCIA = 50 # IDs listados en la cabecera de cada hoja de evidencia
+MODOS_EVIDENCIA = {
+    'hojas': "Hojas con ecuaciones sustituidas (una por combinación de datos)",
+    'formulas': "Fórmulas vivas (una fila por lote, compacto)",
+}
+HOJA_PARAMETROS = '3_Parámetros'
+HOJA_EVIDENCIA_FORMULAS = '3_Evidencia Fórmulas'
+PARAMETROS_EVIDENCIA = [ # (nombre definido en el libro, valor, descripción)
+    ('AGB_FACTOR_A', AGB_FACTOR_A, "Coeficiente de Chave et al. (2014): AGB = A × (ρ × D² × H)^B"),
+    ('AGB_FACTOR_B', AGB_FACTOR_B, "Exponente de Chave et al. (2014)"),
+    ('FACTOR_BGB_SECO', FACTOR_BGB_SECO, "Biomasa subterránea como fracción de la aérea"),
+    ('FACTOR_CARBONO', FACTOR_CARBONO, "Fracción de carbono de la biomasa seca"),
+    ('FACTOR_CO2E', FACTOR_CO2E, "Conversión de carbono a CO2 equivalente (44/12)"),
+    ('FACTOR_KG_A_TON', FACTOR_KG_A_TON, "kg por tonelada"),
+]
+# Columnas de entrada de la hoja de fórmulas: B..E (A = ID Lote), en este orden
+COLUMNAS_ENTRADA_FORMULAS = ['Cantidad', 'Densidad (ρ)', 'DAP (cm)', 'Altura (m)']
+# Columnas calculadas (F..K): encabezado y plantilla de la fórmula ({f} = fila de Excel)
+COLUMNAS_EVIDENCIA_FORMULAS = [
+    ('AGB (kg/árbol)', '=IF(AND(C{f}>0,D{f}>0,E{f}>0),AGB_FACTOR_A*(C{f}*D{f}^2*E{f})^AGB_FACTOR_B,0)'),
+    ('BGB (kg/árbol)', '=F{f}*FACTOR_BGB_SECO'),
+    ('Biomasa Total (kg/árbol)', '=F{f}+G{f}'),
+    ('Carbono (kg/árbol)', '=H{f}*FACTOR_CARBONO'),
+    ('CO2e (kg/árbol)', '=I{f}*FACTOR_CO2E'),
+    ('CO2e Lote (Ton)', '=J{f}*B{f}/FACTOR_KG_A_TON'),
+]
+FILAS_POR_AVANCE = 20_000 # Filas de la hoja de fórmulas entre avisos de progreso (y comprobaciones de cancelación)
+
+
+def construir_tabla_evidencia(detalle_dict):
+    """Convierte el detalle JSON de calcular_co2_arbol en filas (Sección, Métrica/Paso, Valor, Unidad, Ecuación/Detalle)."""
+    data_lote = []
+    
+    # Estructurar los inputs
+    for item in detalle_dict.get('Inputs', []):
+        data_lote.append(['INPUT', item['Métrica'], item['Valor'], item['Unidad'], ''])
+        
+    # Estructurar los pasos de cálculo
+    orden = ['AGB_Aerea_kg', 'BGB_Subterranea_kg', 'Biomasa_Total_kg', 'Carbono_kg', 'CO2e_kg']
+    seccion_nombres = {
+        'AGB_Aerea_kg': '1. Biomasa Aérea (AGB)', 
+        'BGB_Subterranea_kg': '2. Biomasa Subterránea (BGB)',
+        'Biomasa_Total_kg': '3. Biomasa Total', 
+        'Carbono_kg': '4. Carbono Capturado',
+        'CO2e_kg': '5. CO2 Equivalente Capturado'
+    }
+    
+    for key in orden:
+        data_lote.append([seccion_nombres[key], '---', '---', '---', '---']) # Separador
+        for item in detalle_dict.get(key, []):
+            paso = item.get('Paso', '')
+            ecuacion = item.get('Ecuación', item.get('Fórmula', ''))
+            valor = item.get('Valor', '')
+            unidad = item.get('Unidad', '')
+            
+            if valor != '':
+                data_lote.append([seccion_nombres[key], paso, valor, unidad, ''])
+            elif ecuacion != '':
+                data_lote.append([seccion_nombres[key], paso, 'ECUACIÓN/SUSTITUCIÓN', '', ecuacion])
+    return data_lote
+
+
+def preparar_hojas_evidencia(df_inventario):
+    """
+    Agrupa los lotes por su JSON de detalle (idéntico para entradas idénticas) y prepara una
+    hoja de evidencia por grupo. Retorna (lista de (nombre_hoja, DataFrame), hoja asignada a cada lote).
+    """
+    hoja_por_lote = [''] * len(df_inventario)
+    if df_inventario.empty or 'Detalle Cálculo' not in df_inventario.columns:
+        return [], hoja_por_lote
+
+    # Si el detalle es NaN o no es string (error de migración de sesión), el lote queda sin hoja
+    detalles = df_inventario['Detalle Cálculo'].where(df_inventario['Detalle Cálculo'].map(lambda d: isinstance(d, str)))
+    codigos, detalles_unicos = pd.factorize(detalles)
+    ids = df_inventario['ID Lote'] if 'ID Lote' in df_inventario.columns else pd.Series('', index=df_inventario.index)
+    etiquetas = np.array([
+        id_lote if isinstance(id_lote, str) and id_lote else f"Lote {i+1}"
+        for i, id_lote in enumerate(ids)
+    ], dtype=object)
+
+    # Lotes de cada grupo, en una sola pasada (orden estable por código)
+    orden = np.argsort(codigos, kind='stable')
+    cortes = np.searchsorted(codigos[orden], np.arange(len(detalles_unicos) + 1))
+    nombre_por_codigo = [''] * len(detalles_unicos)
+
+    hojas = []
+    for k, detalle_json in enumerate(detalles_unicos):
+        try:
+            detalle_dict = json.loads(detalle_json)
+        except json.JSONDecodeError:
+            print(f"Error al decodificar JSON de la evidencia {k+1}. Los lotes asociados tienen datos incorrectos.")
+            continue
+
+        lotes_grupo = etiquetas[orden[cortes[k]:cortes[k + 1]]]
+        referencia = ", ".join(lotes_grupo[:MAX_LOTES_REFERENCIADOS_EVIDENCIA])
+        if len(lotes_grupo) > MAX_LOTES_REFERENCIADOS_EVIDENCIA:
+            referencia += f" ... (+{len(lotes_grupo) - MAX_LOTES_REFERENCIADOS_EVIDENCIA} lotes)"
+
+        data_lote = [['REFERENCIA', 'Lotes que usan esta evidencia', len(lotes_grupo), 'lotes', referencia]]
+        data_lote.extend(construir_tabla_evidencia(detalle_dict))
+        df_detalle = pd.DataFrame(data_lote, columns=['Sección', 'Métrica/Paso', 'Valor', 'Unidad', 'Ecuación/Detalle'])
+
+        nombre_hoja = f'3_Evidencia_{k+1}'
+        hojas.append((nombre_hoja, df_detalle))
+        nombre_por_codigo[k] = nombre_hoja
+
+    hoja_por_lote = [nombre_por_codigo[c] if c >= 0 else '' for c in codigos]
+    return hojas, hoja_por_lote
+
+
+def escribir_evidencia_formulas(writer, df_inventario, avanzar=None):
+    """
+    Escribe la hoja de parámetros y la hoja de fórmulas (una fila por lote, en el orden del
+    inventario: el lote i queda en la fila i + 2) en el libro de `writer` (pd.ExcelWriter con xlsxwriter).
+    `avanzar(fraccion, mensaje)` recibe el avance cada FILAS_POR_AVANCE lotes.
+    """
+    libro = writer.book
+    negrita = libro.add_format({'bold': True})
+
+    hoja_parametros = libro.add_worksheet(HOJA_PARAMETROS)
+    hoja_parametros.write_row(0, 0, ['Parámetro', 'Valor', 'Descripción'], negrita)
+    for i, (nombre, valor, descripcion) in enumerate(PARAMETROS_EVIDENCIA, start=1):
+        hoja_parametros.write_string(i, 0, nombre)
+        hoja_parametros.write_number(i, 1, valor)
+        hoja_parametros.write_string(i, 2, descripcion)
+        libro.define_name(nombre, f"='{HOJA_PARAMETROS}'!$B${i + 1}")
+
+    n = len(df_inventario)
+    entradas = [df_inventario[columna].to_numpy(dtype=float) for columna in COLUMNAS_ENTRADA_FORMULAS]
+    cantidad, rho, dap, altura = entradas
+    agb, bgb, biomasa, co2e_arbol = calcular_co2_vectorizado(rho, dap, altura)
+    valores = [agb, bgb, biomasa, biomasa * FACTOR_CARBONO, co2e_arbol, co2e_arbol * cantidad / FACTOR_KG_A_TON]
+    co2e_motor = df_inventario['CO2e Lote (Ton)'].to_numpy(dtype=float)
+    ids = df_inventario['ID Lote'].astype(str).tolist() if 'ID Lote' in df_inventario.columns else [f"Lote {i + 1}" for i in range(n)]
+
+    # Totales para el auditor: la suma de las fórmulas frente a la del motor
+    fila_totales = len(PARAMETROS_EVIDENCIA) + 2
+    ultima = n + 1
+    hoja_parametros.write_string(fila_totales, 0, 'CO2e Total (Ton) - fórmulas', negrita)
+    hoja_parametros.write_formula(fila_totales, 1, f"=SUM('{HOJA_EVIDENCIA_FORMULAS}'!K2:K{ultima})", None, float(valores[-1].sum()))
+    hoja_parametros.write_string(fila_totales + 1, 0, 'CO2e Total (Ton) - motor', negrita)
+    hoja_parametros.write_formula(fila_totales + 1, 1, f"=SUM('{HOJA_EVIDENCIA_FORMULAS}'!L2:L{ultima})", None, float(co2e_motor.sum()))
+    hoja_parametros.set_column(0, 0, 30)
+    hoja_parametros.set_column(2, 2, 60)
+
+    hoja = libro.add_worksheet(HOJA_EVIDENCIA_FORMULAS)
+    encabezados = ['ID Lote'] + COLUMNAS_ENTRADA_FORMULAS + [titulo for titulo, _ in COLUMNAS_EVIDENCIA_FORMULAS] + ['CO2e Motor (Ton)', 'Diferencia (Ton)']
+    hoja.write_row(0, 0, encabezados, negrita)
+    hoja.freeze_panes(1, 1)
+    plantillas = [plantilla for _, plantilla in COLUMNAS_EVIDENCIA_FORMULAS]
+    columna_motor = 1 + len(COLUMNAS_ENTRADA_FORMULAS) + len(plantillas)
+    escribir_numero, escribir_formula = hoja.write_number, hoja.write_formula
+    for i in range(n):
+        if avanzar is not None and i % FILAS_POR_AVANCE == 0:
+            avanzar(i / n, f"Fórmulas de evidencia: lote {i:,} de {n:,}...")
+        fila, f = i + 1, i + 2
+        hoja.write_string(fila, 0, ids[i])
+        for c, valores_entrada in enumerate(entradas, start=1):
+            escribir_numero(fila, c, valores_entrada[i])
+        for c, (plantilla, calculados) in enumerate(zip(plantillas, valores), start=1 + len(entradas)):
+            escribir_formula(fila, c, plantilla.format(f=f), None, calculados[i])
+        escribir_numero(fila, columna_motor, co2e_motor[i])
+        escribir_formula(fila, columna_motor + 1, f"=K{f}-L{f}", None, valores[-1][i] - co2e_motor[i])
+
+
+# --- MODIFICACIÓN CLAVE: generar_excel_memoria para incluir hojas de detalle ---
+# (Se mantiene la lógica para incluir detalle JSON en el Excel)
+def generar_excel_memoria(df_inventario, proyecto, hectareas, total_arboles, total_co2e_ton, total_agua_l, total_costo, df_historial=None, df_resumen_calidad=None, on_progreso=None, cancelado=None, modo_evidencia='hojas'):
+    """
+    Genera el archivo Excel en memoria con el resumen, el inventario detallado, el detalle de cálculo,
+    si se entrega `df_historial`, el historial de cambios del inventario (traza de auditoría) y, si se
+    entrega `df_resumen_calidad`, el resumen de alertas de calidad (el detalle por lote va en el inventario).
+    `on_progreso(fraccion, mensaje)` recibe el avance por partes y `cancelado()` se consulta entre
+    partes (lanza TrabajoCancelado), para ejecutarlo como trabajo en segundo plano.
+    `modo_evidencia`: 'hojas' o 'formulas' (ver MODOS_EVIDENCIA).
+    """
+    def avanzar(fraccion, mensaje):
+        if cancelado is not None and cancelado():
+            raise TrabajoCancelado()
+        if on_progreso is not None:
+            on_progreso(fraccion, mensaje)
+
+    output = io.BytesIO()
+    writer = pd.ExcelWriter(output, engine='xlsxwriter')
+    
+    # 0. Agrupar la evidencia: una hoja por cada JSON de detalle distinto, referenciada por los lotes
+    #    (con fórmulas, el lote i tiene su fila i + 2 en la hoja de fórmulas: no hay nada que agrupar)
+    avanzar(0.0, "Agrupando evidencia de cálculo...")
+    if modo_evidencia == 'formulas':
+        hojas_evidencia, hoja_por_lote = [], [HOJA_EVIDENCIA_FORMULAS] * len(df_inventario)
+    else:
+        hojas_evidencia, hoja_por_lote = preparar_hojas_evidencia(df_inventario)
+    avanzar(0.2, "Escribiendo inventario detallado...")
+
+    # 1. Preparar Inventario Detallado (sin Detalle Cálculo JSON)
+    cols_to_drop = ['Detalle Cálculo']
+    df_inventario_download = df_inventario.drop(columns=cols_to_drop, errors='ignore')
+    df_inventario_download['Hoja Evidencia'] = hoja_por_lote
+    if modo_evidencia == 'formulas':
+        df_inventario_download['Fila Evidencia'] = np.arange(2, len(df_inventario) + 2)
+    df_inventario_download.to_excel(writer, sheet_name='1_Inventario Detallado', index=False)
+    avanzar(0.45, "Escribiendo resumen del proyecto...")
+    
+    # 2. Resumen del Proyecto
+    df_resumen = pd.DataFrame({
+        'Métrica': ['Proyecto', 'Fecha', 'Hectáreas (ha)', 'Total Árboles', 'CO2e Total (Ton)', 'CO2e Total (Kg)', 'Agua Total Anual (L)', 'Costo Total Acumulado (S/)'], 
+        'Valor': [ 
+            proyecto if proyecto else "Sin Nombre", 
+            str(pd.Timestamp.today().normalize().date()), 
+            f"{hectareas:.1f}", 
+            f"{total_arboles:.0f}", 
+            f"{total_co2e_ton:.2f}", 
+            f"{total_co2e_ton * FACTOR_KG_A_TON:.2f}", 
+            f"{total_agua_l:,.0f}", 
+            f"S/{total_costo:,.2f}" 
+        ]
+    })
+    df_resumen.to_excel(writer, sheet_name='2_Resumen Proyecto', index=False)
+    
+    # 3. Detalle de Cálculo (Evidencia) - Parámetros y fórmulas por lote, o una hoja por tupla distinta
+    #    de entradas (los lotes idénticos la comparten)
+    if modo_evidencia == 'formulas':
+        escribir_evidencia_formulas(writer, df_inventario, lambda fraccion, mensaje: avanzar(0.5 + 0.4 * fraccion, mensaje))
+    for k, (nombre_hoja, df_detalle) in enumerate(hojas_evidencia):
+        avanzar(0.5 + 0.4 * k / len(hojas_evidencia), f"Hoja de evidencia {k+1} de {len(hojas_evidencia)}...")
+        df_detalle.to_excel(writer, sheet_name=nombre_hoja, index=False)
+
+    # 4. Historial de cambios del inventario (auditoría para la verificación)
+    if df_historial is not None and not df_historial.empty:
+        avanzar(0.9, "Escribiendo historial de cambios...")
+        df_historial.to_excel(writer, sheet_name='4_Historial Cambios', index=False)
+
+    # 5. Control de calidad de las mediciones
+    if df_resumen_calidad is not None:
+        df_resumen_calidad.to_excel(writer, sheet_name='5_Calidad Datos', index=False)
+
+    avanzar(0.95, "Cerrando el archivo...")
+    writer.close()
+    processed_data = output.getvalue()
+    return processed_data
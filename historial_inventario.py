@@ -0,0 +1,145 @@
+"""
+Historial del inventario: log de eventos de solo-anexión con instantáneas periódicas.
+
+Cada cambio del inventario (añadir, importar, editar, eliminar, limpiar) se registra como un
+evento con las operaciones que lo componen, lo que permite:
+  - Deshacer / rehacer sin límite: se aplica la inversa (o la original) de un solo evento,
+    sin reproducir el historial. Deshacer y rehacer también quedan registrados como eventos.
+  - Estado al evento N: se parte de la instantánea más cercana (cada INTERVALO_INSTANTANEA
+    eventos) y se reproducen como máximo INTERVALO_INSTANTANEA - 1 eventos.
+  - Auditoría: el log nunca se reescribe, por lo que sirve de traza para la verificación de carbono.
+
+Operaciones (los lotes son dicts que NUNCA se modifican en el sitio; una edición los reemplaza):
+    ('insertar', posicion, lotes)              inserta la tupla `lotes` en `posicion`
+    ('quitar', posicion, lotes)                quita los len(lotes) lotes desde `posicion`
+    ('reemplazar', posicion, antes, despues)   sustituye el lote `antes` por `despues`
+    ('mediciones', agregadas, quitadas)        opaca para el historial: la aplica quien lo usa
+"""
+import pandas as pd
+
+INTERVALO_INSTANTANEA = 50
+
+
+def invertir_operacion(operacion):
+    tipo = operacion[0]
+    if tipo == 'insertar':
+        return ('quitar', operacion[1], operacion[2])
+    if tipo == 'quitar':
+        return ('insertar', operacion[1], operacion[2])
+    if tipo == 'reemplazar':
+        return ('reemplazar', operacion[1], operacion[3], operacion[2])
+    return (tipo, operacion[2], operacion[1]) # 'mediciones': intercambia agregadas/quitadas
+
+
+def invertir_operaciones(operaciones):
+    return tuple(invertir_operacion(op) for op in reversed(operaciones))
+
+
+def aplicar_operaciones(lotes, operaciones):
+    """Aplica las operaciones de lotes sobre la lista `lotes` (en el sitio); ignora las opacas."""
+    for operacion in operaciones:
+        tipo, posicion = operacion[0], operacion[1]
+        if tipo == 'insertar':
+            lotes[posicion:posicion] = operacion[2]
+        elif tipo == 'quitar':
+            del lotes[posicion:posicion + len(operacion[2])]
+        elif tipo == 'reemplazar':
+            lotes[posicion] = operacion[3]
+
+
+def resumir_operaciones(operaciones):
+    """Lotes añadidos/quitados/editados y variación de árboles de un evento."""
+    resumen = {'Lotes +': 0, 'Lotes -': 0, 'Lotes Editados': 0, 'Δ Árboles': 0}
+    for operacion in operaciones:
+        if operacion[0] == 'insertar':
+            resumen['Lotes +'] += len(operacion[2])
+            resumen['Δ Árboles'] += sum(lote.get('Cantidad', 0) for lote in operacion[2])
+        elif operacion[0] == 'quitar':
+            resumen['Lotes -'] += len(operacion[2])
+            resumen['Δ Árboles'] -= sum(lote.get('Cantidad', 0) for lote in operacion[2])
+        elif operacion[0] == 'reemplazar':
+            resumen['Lotes Editados'] += 1
+            resumen['Δ Árboles'] += operacion[3].get('Cantidad', 0) - operacion[2].get('Cantidad', 0)
+    return resumen
+
+
+class HistorialInventario:
+    """Log de eventos del inventario con pilas de deshacer/rehacer e instantáneas periódicas."""
+
+    def __init__(self, lotes_iniciales=(), intervalo_instantanea=INTERVALO_INSTANTANEA):
+        self.intervalo = intervalo_instantanea
+        self.eventos = [] # eventos[n - 1] es el evento n
+        self._instantaneas = {0: tuple(lotes_iniciales)}
+        self._deshacer = [] # Números de evento que se pueden revertir (tope = último)
+        self._rehacer = [] # Números de evento revertidos que se pueden volver a aplicar
+
+    @property
+    def ultimo_evento(self):
+        return len(self.eventos)
+
+    @property
+    def puede_deshacer(self):
+        return bool(self._deshacer)
+
+    @property
+    def puede_rehacer(self):
+        return bool(self._rehacer)
+
+    def _anexar(self, lotes, accion, operaciones, referencia=None):
+        aplicar_operaciones(lotes, operaciones)
+        evento = {
+            'n': len(self.eventos) + 1,
+            'fecha': pd.Timestamp.now().isoformat(timespec='seconds'),
+            'accion': accion,
+            'operaciones': tuple(operaciones),
+            'referencia': referencia,
+            'resumen': resumir_operaciones(operaciones),
+        }
+        self.eventos.append(evento)
+        if evento['n'] % self.intervalo == 0:
+            self._instantaneas[evento['n']] = tuple(lotes)
+        return evento
+
+    def registrar(self, lotes, accion, operaciones):
+        """Aplica un cambio del usuario sobre `lotes` y lo anexa al log. Vacía la pila de rehacer."""
+        evento = self._anexar(lotes, accion, operaciones)
+        self._deshacer.append(evento['n'])
+        self._rehacer.clear()
+        return evento
+
+    def deshacer(self, lotes):
+        """Revierte el último cambio vigente. Retorna el evento anexado, o None si no hay nada que deshacer."""
+        if not self._deshacer:
+            return None
+        n = self._deshacer.pop()
+        original = self.eventos[n - 1]
+        evento = self._anexar(lotes, f"Deshacer #{n} ({original['accion']})", invertir_operaciones(original['operaciones']), referencia=n)
+        self._rehacer.append(n)
+        return evento
+
+    def rehacer(self, lotes):
+        """Vuelve a aplicar el último cambio deshecho. Retorna el evento anexado, o None."""
+        if not self._rehacer:
+            return None
+        n = self._rehacer.pop()
+        original = self.eventos[n - 1]
+        evento = self._anexar(lotes, f"Rehacer #{n} ({original['accion']})", original['operaciones'], referencia=n)
+        self._deshacer.append(evento['n'])
+        return evento
+
+    def estado_en(self, n):
+        """Lista de lotes tal como quedó tras el evento `n` (0 = estado inicial del historial)."""
+        n = max(0, min(n, len(self.eventos)))
+        base = (n // self.intervalo) * self.intervalo
+        lotes = list(self._instantaneas[base])
+        for evento in self.eventos[base:n]:
+            aplicar_operaciones(lotes, evento['operaciones'])
+        return lotes
+
+    def tabla_auditoria(self):
+        """Log completo como DataFrame (un evento por fila) para mostrar o exportar."""
+        filas = [
+            {'Evento': evento['n'], 'Fecha': evento['fecha'], 'Acción': evento['accion'], **evento['resumen']}
+            for evento in self.eventos
+        ]
+        return pd.DataFrame(filas, columns=['Evento', 'Fecha', 'Acción', 'Lotes +', 'Lotes -', 'Lotes Editados', 'Δ Árboles'])
@@ -0,0 +1,146 @@
+"""
+Índice espacial por teselas para lotes y árboles geolocalizados.
+
+Los puntos se agregan en una grilla lat/lon regular en pirámide: en el nivel z cada tesela mide
+360 / 2**z grados (nivel 18 ≈ 150 m en el ecuador) y la tesela padre de (tx, ty) es (tx // 2, ty // 2).
+Los agregados (puntos, árboles, CO2e, costo y centroide) se calculan una sola vez, del nivel más
+fino hacia arriba, por lo que las consultas no vuelven a recorrer los puntos:
+
+  - teselas(nivel, bbox): solo las teselas visibles del nivel (corte por columnas tx ordenadas).
+  - consultar_bbox / consultar_radio: totales con resolución de la tesela más fina (una tesela
+    cuenta si su centroide cae dentro del rectángulo o del radio).
+  - nivel_para(bbox, max_teselas): nivel más detallado que no supera `max_teselas` visibles.
+
+Para censos de millones de árboles, agregar_celdas se aplica por bloques y los parciales se suman
+(sumar_celdas) antes de construir el índice con IndiceEspacial(celdas).
+"""
+import numpy as np
+import pandas as pd
+
+NIVEL_MIN = 4
+NIVEL_MAX = 18
+RADIO_TIERRA_KM = 6371.0088
+KM_POR_GRADO_LAT = 111.195
+COLUMNAS_SUMA = ['Puntos', 'Árboles', 'CO2e (Ton)', 'Costo (S/)', 'Suma Lat', 'Suma Lon']
+
+
+def tamano_tesela(nivel):
+    """Lado de la tesela (grados) en el nivel indicado."""
+    return 360.0 / (1 << nivel)
+
+
+def teselas_de(lat, lon, nivel):
+    t = tamano_tesela(nivel)
+    return np.floor((lon + 180.0) / t).astype(np.int64), np.floor((lat + 90.0) / t).astype(np.int64)
+
+
+def coordenadas_validas(lat, lon):
+    return np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+
+
+def agregar_celdas(lat, lon, arboles, co2e_ton, costo):
+    """
+    Agrega puntos en las teselas del nivel más fino. Los puntos sin coordenadas válidas se ignoran.
+    Retorna un DataFrame indexado por (tx, ty) con las columnas de COLUMNAS_SUMA.
+    """
+    lat, lon = np.asarray(lat, dtype=float), np.asarray(lon, dtype=float)
+    validos = coordenadas_validas(lat, lon)
+    tx, ty = teselas_de(lat[validos], lon[validos], NIVEL_MAX)
+    df = pd.DataFrame({
+        'tx': tx,
+        'ty': ty,
+        'Puntos': 1,
+        'Árboles': np.asarray(arboles, dtype=float)[validos],
+        'CO2e (Ton)': np.asarray(co2e_ton, dtype=float)[validos],
+        'Costo (S/)': np.asarray(costo, dtype=float)[validos],
+        'Suma Lat': lat[validos],
+        'Suma Lon': lon[validos],
+    })
+    return df.groupby(['tx', 'ty']).sum()
+
+
+def sumar_celdas(acumulado, parcial):
+    """Suma dos agregados de agregar_celdas (acumulado puede ser None)."""
+    return parcial if acumulado is None else acumulado.add(parcial, fill_value=0)
+
+
+def distancia_km(lat1, lon1, lat2, lon2):
+    """Distancia de gran círculo (haversine), vectorizada."""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * RADIO_TIERRA_KM * np.arcsin(np.sqrt(a))
+
+
+def bbox_alrededor(lat, lon, ancho_km, alto_km=None):
+    """Rectángulo (lat_min, lat_max, lon_min, lon_max) centrado en (lat, lon)."""
+    alto_km = ancho_km if alto_km is None else alto_km
+    dlat = alto_km / 2 / KM_POR_GRADO_LAT
+    dlon = ancho_km / 2 / (KM_POR_GRADO_LAT * max(np.cos(np.radians(lat)), 1e-6))
+    return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+class IndiceEspacial:
+    """Pirámide de teselas agregadas (NIVEL_MIN..NIVEL_MAX), construida una vez a partir de las celdas finas."""
+
+    def __init__(self, celdas):
+        self.niveles = {}
+        df = celdas.reset_index()[['tx', 'ty'] + COLUMNAS_SUMA] if celdas is not None else pd.DataFrame(columns=['tx', 'ty'] + COLUMNAS_SUMA)
+        for nivel in range(NIVEL_MAX, NIVEL_MIN - 1, -1):
+            if nivel < NIVEL_MAX:
+                df = df.assign(tx=df['tx'] // 2, ty=df['ty'] // 2).groupby(['tx', 'ty'], as_index=False).sum()
+            else:
+                df = df.sort_values(['tx', 'ty'], kind='stable')
+            self.niveles[nivel] = {col: df[col].to_numpy() for col in df.columns}
+
+    @classmethod
+    def desde_puntos(cls, lat, lon, arboles, co2e_ton, costo):
+        return cls(agregar_celdas(lat, lon, arboles, co2e_ton, costo))
+
+    @property
+    def vacio(self):
+        return len(self.niveles[NIVEL_MAX]['tx']) == 0
+
+    def _rango(self, nivel, lat_min, lat_max, lon_min, lon_max):
+        """Posiciones (en el nivel) de las teselas que intersectan el rectángulo."""
+        datos = self.niveles[nivel]
+        t = tamano_tesela(nivel)
+        tx_min, tx_max = np.floor((lon_min + 180.0) / t), np.floor((lon_max + 180.0) / t)
+        ty_min, ty_max = np.floor((lat_min + 90.0) / t), np.floor((lat_max + 90.0) / t)
+        # Las teselas están ordenadas por (tx, ty): solo se examinan las columnas tx visibles
+        inicio, fin = np.searchsorted(datos['tx'], [tx_min, tx_max + 1])
+        ty = datos['ty'][inicio:fin]
+        return inicio + np.flatnonzero((ty >= ty_min) & (ty <= ty_max))
+
+    def contar_teselas(self, nivel, lat_min, lat_max, lon_min, lon_max):
+        return len(self._rango(nivel, lat_min, lat_max, lon_min, lon_max))
+
+    def nivel_para(self, lat_min, lat_max, lon_min, lon_max, max_teselas):
+        """Nivel más detallado cuya cantidad de teselas visibles no supera `max_teselas`."""
+        for nivel in range(NIVEL_MAX, NIVEL_MIN - 1, -1):
+            if self.contar_teselas(nivel, lat_min, lat_max, lon_min, lon_max) <= max_teselas:
+                return nivel
+        return NIVEL_MIN
+
+    def teselas(self, nivel, lat_min=-90.0, lat_max=90.0, lon_min=-180.0, lon_max=180.0):
+        """Teselas (clusters) visibles del nivel con sus sumas y centroide (Latitud, Longitud)."""
+        datos = self.niveles[nivel]
+        pos = self._rango(nivel, lat_min, lat_max, lon_min, lon_max)
+        df = pd.DataFrame({col: valores[pos] for col, valores in datos.items()})
+        df['Latitud'] = df['Suma Lat'] / df['Puntos']
+        df['Longitud'] = df['Suma Lon'] / df['Puntos']
+        return df.drop(columns=['Suma Lat', 'Suma Lon'])
+
+    def _totales(self, df):
+        return {col: float(df[col].sum()) for col in ['Puntos', 'Árboles', 'CO2e (Ton)', 'Costo (S/)']} | {'Teselas': len(df)}
+
+    def consultar_bbox(self, lat_min, lat_max, lon_min, lon_max):
+        """Totales de las teselas finas cuyo centroide cae dentro del rectángulo."""
+        df = self.teselas(NIVEL_MAX, lat_min, lat_max, lon_min, lon_max)
+        dentro = df['Latitud'].between(lat_min, lat_max) & df['Longitud'].between(lon_min, lon_max)
+        return self._totales(df[dentro])
+
+    def consultar_radio(self, lat, lon, radio_km):
+        """Totales de las teselas finas cuyo centroide está a `radio_km` o menos de (lat, lon)."""
+        df = self.teselas(NIVEL_MAX, *bbox_alrededor(lat, lon, 2 * radio_km))
+        dentro = distancia_km(lat, lon, df['Latitud'].to_numpy(), df['Longitud'].to_numpy()) <= radio_km
+        return self._totales(df[dentro])
@@ -0,0 +1,270 @@
+"""
+Índice de nombres de especies e importación de bases externas de densidad de la madera.
+
+El registro de especies puede crecer a decenas de miles de nombres (p. ej. la Global Wood
+Density Database). El índice resuelve nombres científicos, comunes y sinónimos sin recorrer el
+registro en cada búsqueda:
+
+  - Prefijo: alias normalizados ordenados; un prefijo es un rango contiguo (bisect, O(log n)).
+  - Prefijo por palabra: tokens ordenados de cada alias ("tiliac" encuentra "Hibiscus tiliaceus").
+  - Difuso: índice invertido de trigramas; los candidatos se puntúan por coeficiente de Dice
+    (conteo de trigramas compartidos con np.bincount) y los mejores se confirman con difflib.
+
+La normalización ignora mayúsculas, tildes y signos ("Álamo (Populus alba)" ≈ "alamo populus alba").
+Los nombres del registro con la forma "Común (Científico)" se indexan también por cada parte.
+
+Formato del CSV de densidades (una o varias filas por especie; se promedian):
+    Nombre Científico (o Especie / Binomial / Species), Densidad (g/cm³) (o cualquier columna de
+    "wood density" / "WD") y, opcionalmente, Nombre Común y Sinónimos (separados por ';' o '|').
+"""
+import bisect
+import difflib
+import itertools
+import re
+import unicodedata
+
+import numpy as np
+import pandas as pd
+
+LIMITE_RESULTADOS = 50 # Sugerencias de la búsqueda incremental
+UMBRAL_COINCIDENCIA = 0.85 # Similitud mínima (difflib) para resolver un nombre de forma difusa
+CANDIDATOS_DIFUSOS = 20 # Candidatos por trigramas que se confirman con difflib
+DENSIDAD_MIN, DENSIDAD_MAX = 0.05, 1.6 # g/cm³: fuera de este rango el registro se descarta
+
+COLUMNAS_CIENTIFICO = ['nombre cientifico', 'especie', 'binomial', 'species', 'scientific name']
+COLUMNAS_COMUN = ['nombre comun', 'common name', 'vernacular name']
+COLUMNAS_SINONIMOS = ['sinonimos', 'synonyms']
+SEPARADOR_SINONIMOS = r'[;|]'
+PATRON_COMUN_CIENTIFICO = re.compile(r'^(.*?)\s*\((.+)\)\s*$')
+
+
+def normalizar_nombre(texto):
+    """Minúsculas, sin tildes y solo letras/dígitos separados por un espacio."""
+    texto = unicodedata.normalize('NFKD', str(texto)).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(re.findall(r'[a-z0-9]+', texto))
+
+
+def normalizar_serie(nombres):
+    """normalizar_nombre vectorizado para una Serie de nombres."""
+    return (
+        nombres.astype(str).str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii').str.lower()
+        .str.replace(r'[^a-z0-9]+', ' ', regex=True).str.strip()
+    )
+
+
+def partes_nombre(nombre):
+    """Nombre completo y, si tiene la forma "Común (Científico)", cada parte por separado."""
+    coincidencia = PATRON_COMUN_CIENTIFICO.match(nombre)
+    return [nombre] if coincidencia is None else [nombre, coincidencia.group(1), coincidencia.group(2)]
+
+
+def trigramas(texto_normalizado):
+    texto = f"  {texto_normalizado} "
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+class IndiceEspecies:
+    """Índice inmutable de los nombres del registro (se reconstruye cuando cambia el registro)."""
+
+    def __init__(self, especies, alias=None):
+        """`especies`: nombres del registro; `alias`: dict especie -> lista de nombres alternativos."""
+        self.especies = list(especies)
+        posicion = {especie: i for i, especie in enumerate(self.especies)}
+        textos, destinos = [], []
+        for i, especie in enumerate(self.especies):
+            for parte in partes_nombre(especie):
+                textos.append(parte)
+                destinos.append(i)
+        for especie, nombres in (alias or {}).items():
+            if especie in posicion:
+                textos.extend(nombres)
+                destinos.extend([posicion[especie]] * len(nombres))
+
+        df = pd.DataFrame({'alias': normalizar_serie(pd.Series(textos, dtype=object)), 'especie': destinos})
+        df = df[df['alias'] != ''].drop_duplicates()
+        # Exacto: el primer registro de un alias gana (los nombres del registro van antes que los sinónimos)
+        self._exactos = dict(zip(df['alias'].iloc[::-1], df['especie'].iloc[::-1]))
+
+        df = df.sort_values('alias', kind='stable', ignore_index=True)
+        self._alias = df['alias'].tolist()
+        self._alias_especie = df['especie'].to_numpy()
+
+        palabras = df['alias'].str.split().explode()
+        palabras = pd.DataFrame({'palabra': palabras.to_numpy(), 'alias': palabras.index.to_numpy()}).sort_values('palabra', kind='stable')
+        self._palabras = palabras['palabra'].tolist()
+        self._palabras_alias = palabras['alias'].to_numpy()
+
+        # Índice invertido de trigramas: posting list (ids de alias, ordenados) por trigrama
+        gramas_por_alias = [trigramas(texto) for texto in self._alias]
+        self._n_trigramas = np.fromiter(map(len, gramas_por_alias), dtype=np.int32, count=len(self._alias))
+        codigos, gramas = pd.factorize(pd.Series(list(itertools.chain.from_iterable(gramas_por_alias)), dtype=object))
+        orden = np.argsort(codigos, kind='stable')
+        ids = np.repeat(np.arange(len(self._alias), dtype=np.int32), self._n_trigramas)[orden]
+        limites = np.searchsorted(codigos[orden], np.arange(len(gramas) + 1))
+        self._trigramas = {grama: ids[limites[k]:limites[k + 1]] for k, grama in enumerate(gramas)}
+
+    def __len__(self):
+        return len(self.especies)
+
+    def _rango_prefijo(self, ordenados, prefijo):
+        return bisect.bisect_left(ordenados, prefijo), bisect.bisect_left(ordenados, prefijo + '\x7f')
+
+    def _candidatos_difusos(self, consulta, limite):
+        """Ids de alias con más trigramas en común con la consulta (coeficiente de Dice), de mayor a menor."""
+        gramas = [grama for grama in trigramas(consulta) if grama in self._trigramas]
+        if not gramas:
+            return np.empty(0, dtype=np.int64)
+        compartidos = np.bincount(np.concatenate([self._trigramas[grama] for grama in gramas]), minlength=len(self._alias))
+        dice = 2.0 * compartidos / (self._n_trigramas + len(trigramas(consulta)))
+        limite = min(limite, int((compartidos > 0).sum()))
+        mejores = np.argpartition(-dice, limite - 1)[:limite]
+        return mejores[np.argsort(-dice[mejores], kind='stable')]
+
+    def buscar(self, consulta, limite=LIMITE_RESULTADOS):
+        """
+        Sugerencias para la búsqueda incremental, sin repetir especies: coincidencia exacta,
+        prefijo del nombre, prefijo de cada palabra y, si faltan, coincidencias difusas.
+        """
+        texto = normalizar_nombre(consulta)
+        if not texto:
+            return []
+        resultados = {}
+
+        def agregar(ids_especie):
+            for i in ids_especie:
+                resultados.setdefault(self.especies[i], None)
+                if len(resultados) >= limite:
+                    return True
+            return False
+
+        if texto in self._exactos and agregar([self._exactos[texto]]):
+            return list(resultados)
+        inicio, fin = self._rango_prefijo(self._alias, texto)
+        if agregar(self._alias_especie[inicio:min(fin, inicio + limite * 4)]):
+            return list(resultados)
+
+        # Todas las palabras de la consulta deben ser prefijo de alguna palabra del alias
+        consulta_palabras = texto.split()
+        inicio, fin = self._rango_prefijo(self._palabras, max(consulta_palabras, key=len))
+        coincidentes = []
+        for id_alias in self._palabras_alias[inicio:fin]:
+            palabras_alias = self._alias[id_alias].split()
+            if all(any(p.startswith(q) for p in palabras_alias) for q in consulta_palabras):
+                coincidentes.append(self._alias_especie[id_alias])
+                if len(coincidentes) >= limite * 4:
+                    break
+        if agregar(coincidentes):
+            return list(resultados)
+
+        if len(texto) >= 3:
+            agregar(self._alias_especie[self._candidatos_difusos(texto, limite)])
+        return list(resultados)
+
+    def exacta(self, nombre):
+        """Especie del registro cuyo nombre o alias coincide exactamente (tras normalizar), o None."""
+        id_especie = self._exactos.get(normalizar_nombre(nombre))
+        return None if id_especie is None else self.especies[id_especie]
+
+    def resolver(self, nombre, umbral=UMBRAL_COINCIDENCIA):
+        """(especie del registro, similitud) para un nombre; (None, mejor similitud) si ninguna alcanza el umbral."""
+        texto = normalizar_nombre(nombre)
+        if not texto:
+            return None, 0.0
+        if texto in self._exactos:
+            return self.especies[self._exactos[texto]], 1.0
+        mejor, puntaje = None, 0.0
+        for id_alias in self._candidatos_difusos(texto, CANDIDATOS_DIFUSOS):
+            similitud = difflib.SequenceMatcher(None, texto, self._alias[id_alias]).ratio()
+            if similitud > puntaje:
+                mejor, puntaje = self.especies[self._alias_especie[id_alias]], similitud
+        return (mejor, puntaje) if puntaje >= umbral else (None, puntaje)
+
+    def resolver_nombres(self, nombres, umbral=UMBRAL_COINCIDENCIA):
+        """resolver() para muchos nombres (importaciones masivas): cada nombre distinto se resuelve una vez."""
+        return {nombre: self.resolver(nombre, umbral) for nombre in pd.unique(pd.Series(list(nombres), dtype=object))}
+
+
+def _buscar_columna(df, candidatas, contiene=()):
+    por_normalizado = {normalizar_nombre(col): col for col in df.columns}
+    for candidata in candidatas:
+        if candidata in por_normalizado:
+            return por_normalizado[candidata]
+    for normalizado, col in por_normalizado.items():
+        if any(fragmento in normalizado.split() or normalizado.startswith(fragmento) for fragmento in contiene):
+            return col
+    return None
+
+
+def leer_base_densidades(fuente):
+    """
+    Lee un CSV de densidades de la madera y lo reduce a una fila por especie (densidad promedio).
+    Retorna (DataFrame con 'Nombre Científico', 'Nombre Común', 'Densidad (g/cm³)', 'Sinónimos' y
+    'Registros', filas descartadas). Lanza ValueError si faltan las columnas de nombre o densidad.
+    """
+    df = pd.read_csv(fuente, dtype=str, keep_default_na=False, na_values=[''])
+    col_cientifico = _buscar_columna(df, COLUMNAS_CIENTIFICO)
+    col_densidad = _buscar_columna(df, ['densidad g cm3', 'densidad'], contiene=('densidad', 'wood density', 'wd'))
+    if col_cientifico is None or col_densidad is None:
+        raise ValueError("El archivo debe contener una columna de nombre científico (Nombre Científico, Especie o Binomial) y una de densidad (Densidad (g/cm³) o Wood density).")
+    col_comun = _buscar_columna(df, COLUMNAS_COMUN)
+    col_sinonimos = _buscar_columna(df, COLUMNAS_SINONIMOS)
+
+    base = pd.DataFrame({
+        'Nombre Científico': df[col_cientifico].str.strip(),
+        'Nombre Común': df[col_comun].str.strip() if col_comun else None,
+        'Densidad (g/cm³)': pd.to_numeric(df[col_densidad].str.replace(',', '.', regex=False), errors='coerce'),
+        'Sinónimos': df[col_sinonimos] if col_sinonimos else None,
+    })
+    validas = base['Nombre Científico'].notna() & base['Densidad (g/cm³)'].between(DENSIDAD_MIN, DENSIDAD_MAX)
+    descartadas = int((~validas).sum())
+    base = base[validas]
+    base['clave'] = normalizar_serie(base['Nombre Científico'])
+
+    sinonimos = {}
+    lista = base['Sinónimos'].dropna().str.split(SEPARADOR_SINONIMOS).explode().str.strip()
+    lista = pd.DataFrame({'clave': base['clave'].reindex(lista.index), 'sinonimo': lista}).loc[lambda d: d['sinonimo'] != ''].drop_duplicates()
+    for clave, sinonimo in zip(lista['clave'], lista['sinonimo']):
+        sinonimos.setdefault(clave, []).append(sinonimo)
+    agrupado = base.groupby('clave', sort=False).agg(**{
+        'Nombre Científico': ('Nombre Científico', 'first'),
+        'Nombre Común': ('Nombre Común', 'first'),
+        'Densidad (g/cm³)': ('Densidad (g/cm³)', 'mean'),
+        'Registros': ('Densidad (g/cm³)', 'size'),
+    })
+    agrupado['Sinónimos'] = [tuple(sinonimos.get(clave, ())) for clave in agrupado.index]
+    return agrupado.reset_index(drop=True), descartadas
+
+
+def incorporar_base_densidades(df_bd, base, indice, valores_por_defecto):
+    """
+    Añade al registro (tabla de especies) las especies de `base` que aún no están en él. Una especie
+    ya registrada (por nombre científico o sinónimo exacto) no se modifica: sus nombres nuevos pasan
+    a ser alias. Las nuevas se nombran "Común (Científico)" si hay nombre común.
+    `valores_por_defecto` completa las columnas que la base no trae (agua, precio y máximos).
+    Retorna (nueva tabla de especies, alias nuevos {especie: [nombres]}, especies añadidas, especies ya registradas).
+    """
+    alias_nuevos = {}
+    filas_nuevas = []
+    registradas = set(df_bd['Especie'])
+    existentes = 0
+    for cientifico, comun, densidad, sinonimos in base[['Nombre Científico', 'Nombre Común', 'Densidad (g/cm³)', 'Sinónimos']].itertuples(index=False):
+        comun = comun if isinstance(comun, str) and comun else None
+        nombres = [cientifico, *sinonimos] + ([comun] if comun else [])
+        existente = next((especie for especie in map(indice.exacta, nombres[:1 + len(sinonimos)]) if especie is not None), None)
+        if existente is not None:
+            existentes += 1
+            alias_nuevos.setdefault(existente, []).extend(nombres)
+            continue
+        especie = f"{comun} ({cientifico})" if comun else cientifico
+        if especie in registradas:
+            continue
+        registradas.add(especie)
+        filas_nuevas.append((especie, densidad))
+        if sinonimos:
+            alias_nuevos[especie] = list(sinonimos)
+
+    nuevas = pd.DataFrame(filas_nuevas, columns=['Especie', 'Densidad (g/cm³)'])
+    for columna, valor in valores_por_defecto.items():
+        nuevas[columna] = valor
+    df_nuevo = pd.concat([df_bd, nuevas.reindex(columns=df_bd.columns)], ignore_index=True)
+    return df_nuevo, alias_nuevos, len(nuevas), existentes
@@ -0,0 +1,248 @@
+"""
+Contabilidad de memoria por sesión y descarga a disco de las sesiones inactivas.
+
+Cada sesión de Streamlit guarda su inventario, historial, censo y cachés en RAM. El registro
+(uno por proceso) mide el estado de cada sesión al final de sus ejecuciones y, cuando la suma
+supera el presupuesto, descarga a disco (pickle comprimido con zlib) el estado grande de las
+sesiones inactivas, empezando por la más grande:
+
+  - CLAVES_DESCARGABLES se escriben en un archivo por sesión y se quitan de su session_state.
+  - Las cachés (claves 'cache_*' y CLAVES_CACHE) se descartan: se reconstruyen al volver.
+
+Al volver, la sesión se restaura antes de inicializar su estado (restaurar), por lo que el
+usuario no nota la diferencia salvo por la lectura del archivo. La descarga y la restauración
+toman el candado de la sesión, y la descarga omite las sesiones en ejecución (entre restaurar y
+finalizar) y vuelve a comprobar la inactividad con el candado tomado, de modo que una sesión
+nunca pierde su estado mientras se ejecuta. Una ejecución interrumpida por un error deja la
+sesión marcada hasta su siguiente ejecución completa: en la duda, no se descarga.
+
+Configuración por variables de entorno: NBS_PRESUPUESTO_MEMORIA_MB, NBS_INACTIVIDAD_S y
+NBS_DIRECTORIO_SESIONES.
+"""
+import os
+import pickle
+import sys
+import tempfile
+import threading
+import time
+import zlib
+
+import numpy as np
+import pandas as pd
+
+PRESUPUESTO_MB_POR_DEFECTO = float(os.environ.get('NBS_PRESUPUESTO_MEMORIA_MB', 2048))
+INACTIVIDAD_S_POR_DEFECTO = float(os.environ.get('NBS_INACTIVIDAD_S', 600)) # Sesión inactiva tras 10 min sin ejecutarse
+DIRECTORIO_POR_DEFECTO = os.environ.get('NBS_DIRECTORIO_SESIONES', os.path.join(tempfile.gettempdir(), 'nbs_sesiones'))
+INTERVALO_MEDICION_S = 30 # Una sesión se vuelve a medir como máximo cada 30 s (o si cambian sus versiones)
+MUESTRA_ELEMENTOS = 200 # Listas y tuplas largas se miden por muestreo
+NIVEL_COMPRESION = 1 # zlib: la velocidad importa más que el tamaño del archivo
+
+CLAVES_DESCARGABLES = (
+    'inventario_list', 'mediciones', 'historial_inventario', 'especies_bd', 'especies_alias',
+    'censo_resultado', 'clima_mensual', 'portafolio_resultado', 'estimacion_parcelas', 'simulacion_supervivencia',
+)
+CLAVES_CACHE = ('excel_generado',)
+CLAVES_VERSION = ('inventario_version', 'mediciones_version', 'especies_version', 'censo_version', 'clima_version', 'portafolio_version', 'parcelas_version', 'supervivencia_version')
+
+
+def es_cache(clave):
+    return clave.startswith('cache_') or clave in CLAVES_CACHE
+
+
+def tamano_objeto(objeto, vistos=None):
+    """
+    Tamaño aproximado en bytes de un objeto y lo que referencia. Los objetos compartidos se cuentan
+    una sola vez (p. ej. los lotes que el historial comparte con el inventario).
+    """
+    vistos = set() if vistos is None else vistos
+    if id(objeto) in vistos:
+        return 0
+    vistos.add(id(objeto))
+
+    if isinstance(objeto, (pd.DataFrame, pd.Series, pd.Index)):
+        uso = objeto.memory_usage(deep=True) # DataFrame: por columna; Series/Index: total
+        return int(uso.sum() if isinstance(uso, pd.Series) else uso)
+    if isinstance(objeto, np.ndarray):
+        return int(objeto.nbytes)
+    if isinstance(objeto, (str, bytes, bytearray, int, float, bool, type(None))):
+        return sys.getsizeof(objeto)
+    if isinstance(objeto, dict):
+        return sys.getsizeof(objeto) + sum(tamano_objeto(k, vistos) + tamano_objeto(v, vistos) for k, v in objeto.items())
+    if isinstance(objeto, (list, tuple, set, frozenset)):
+        elementos = list(objeto) if isinstance(objeto, (set, frozenset)) else objeto
+        if len(elementos) > MUESTRA_ELEMENTOS:
+            paso = len(elementos) / MUESTRA_ELEMENTOS
+            muestra = sum(tamano_objeto(elementos[int(i * paso)], vistos) for i in range(MUESTRA_ELEMENTOS))
+            return sys.getsizeof(objeto) + int(muestra * paso)
+        return sys.getsizeof(objeto) + sum(tamano_objeto(e, vistos) for e in elementos)
+    if hasattr(objeto, '__dict__'):
+        return sys.getsizeof(objeto) + tamano_objeto(vars(objeto), vistos)
+    return sys.getsizeof(objeto)
+
+
+def medir_estado(estado):
+    """Tamaño por clave (bytes) de un dict de estado de sesión, de mayor a menor."""
+    vistos = set()
+    tamanos = {clave: tamano_objeto(valor, vistos) for clave, valor in estado.items()}
+    return dict(sorted(tamanos.items(), key=lambda item: -item[1]))
+
+
+class RegistroMemoria:
+    """Sesiones del proceso con su uso de memoria; descarga a disco las inactivas al superar el presupuesto."""
+
+    def __init__(self, presupuesto_mb=PRESUPUESTO_MB_POR_DEFECTO, inactividad_s=INACTIVIDAD_S_POR_DEFECTO, directorio=DIRECTORIO_POR_DEFECTO,
+                 sesion_activa=None):
+        """`sesion_activa(id_sesion) -> bool` permite olvidar las sesiones cerradas (None: ninguna se olvida)."""
+        self.presupuesto_bytes = presupuesto_mb * 1024 ** 2
+        self.inactividad_s = inactividad_s
+        self.directorio = directorio
+        self.sesion_activa = sesion_activa
+        self._sesiones = {}
+        self._lock = threading.Lock()
+        self._descargando = threading.Lock() # Una sola pasada de descarga a la vez
+
+    def _entrada(self, id_sesion, estado):
+        # El SafeSessionState de la ejecución se recrea en cada rerun: se registra el SessionState que envuelve
+        estado = getattr(estado, '_state', estado)
+        with self._lock:
+            entrada = self._sesiones.get(id_sesion)
+            if entrada is None or entrada['estado'] is not estado:
+                if entrada is not None and entrada['ruta'] is not None and os.path.exists(entrada['ruta']):
+                    os.remove(entrada['ruta']) # Archivo de un estado anterior con el mismo ID
+                entrada = {
+                    'estado': estado, 'lock': threading.Lock(), 'ultimo_acceso': time.time(), 'en_ejecucion': False,
+                    'tamanos': {}, 'total': 0, 'firma': None, 'medido': 0.0, 'ruta': None, 'en_disco': 0,
+                }
+                self._sesiones[id_sesion] = entrada
+            return entrada
+
+    def restaurar(self, id_sesion, estado):
+        """
+        Marca la sesión como activa y, si su estado estaba en disco, lo vuelve a cargar.
+        Debe llamarse al inicio de cada ejecución, antes de inicializar el estado. Retorna True si restauró.
+        """
+        entrada = self._entrada(id_sesion, estado)
+        estado = entrada['estado']
+        with entrada['lock']:
+            entrada['ultimo_acceso'] = time.time()
+            entrada['en_ejecucion'] = True
+            ruta = entrada['ruta']
+            if ruta is None:
+                return False
+            with open(ruta, 'rb') as f:
+                datos = pickle.loads(zlib.decompress(f.read()))
+            for clave, valor in datos.items():
+                estado[clave] = valor
+            os.remove(ruta)
+            entrada['ruta'] = None
+            entrada['en_disco'] = 0
+            entrada['firma'] = None # Se vuelve a medir al final de la ejecución
+            return True
+
+    def finalizar(self, id_sesion, estado, valores):
+        """
+        Al final de una ejecución: actualiza el acceso, mide la sesión si cambió (o pasó
+        INTERVALO_MEDICION_S) y, si el total supera el presupuesto, lanza una descarga en segundo plano.
+        `valores` es el dict de estado de la sesión (claves de usuario).
+        """
+        entrada = self._entrada(id_sesion, estado)
+        ahora = time.time()
+        entrada['ultimo_acceso'] = ahora
+        entrada['en_ejecucion'] = False
+        firma = tuple(valores.get(clave) for clave in CLAVES_VERSION) + (len(valores.get('cache_figuras', {})),)
+        if firma != entrada['firma'] or ahora - entrada['medido'] > INTERVALO_MEDICION_S:
+            entrada['tamanos'] = medir_estado(valores)
+            entrada['total'] = sum(entrada['tamanos'].values())
+            entrada['firma'] = firma
+            entrada['medido'] = ahora
+        if self.total_en_memoria() > self.presupuesto_bytes and not self._descargando.locked():
+            threading.Thread(target=self.descargar_inactivas, name='descarga-sesiones', daemon=True).start()
+
+    def total_en_memoria(self):
+        with self._lock:
+            return sum(e['total'] for e in self._sesiones.values() if e['ruta'] is None)
+
+    def descargar_inactivas(self):
+        """Descarga sesiones inactivas (de mayor a menor) hasta volver bajo el presupuesto. Retorna cuántas descargó."""
+        if not self._descargando.acquire(blocking=False):
+            return 0
+        try:
+            self._purgar_cerradas()
+            with self._lock:
+                candidatas = sorted(
+                    (item for item in self._sesiones.items() if item[1]['ruta'] is None),
+                    key=lambda item: -item[1]['total']
+                )
+            descargadas = 0
+            for id_sesion, entrada in candidatas:
+                if self.total_en_memoria() <= self.presupuesto_bytes:
+                    break
+                if self._descargar(id_sesion, entrada):
+                    descargadas += 1
+            return descargadas
+        finally:
+            self._descargando.release()
+
+    def _descargar(self, id_sesion, entrada):
+        if not entrada['lock'].acquire(blocking=False):
+            return False # La sesión se está restaurando o ejecutando
+        try:
+            estado = entrada['estado']
+            # Se vuelve a comprobar con el candado tomado: restaurar() actualiza el acceso con el mismo candado
+            if entrada['en_ejecucion'] or time.time() - entrada['ultimo_acceso'] < self.inactividad_s:
+                return False
+            valores = estado.filtered_state
+            datos = {clave: valores[clave] for clave in CLAVES_DESCARGABLES if clave in valores}
+            try:
+                contenido = zlib.compress(pickle.dumps(datos, protocol=pickle.HIGHEST_PROTOCOL), NIVEL_COMPRESION)
+            except (pickle.PicklingError, TypeError, AttributeError) as e:
+                print(f"No se pudo descargar la sesión {id_sesion} a disco: {e}")
+                return False
+            os.makedirs(self.directorio, exist_ok=True)
+            ruta = os.path.join(self.directorio, f"{id_sesion}.pkl.z")
+            with open(ruta, 'wb') as f:
+                f.write(contenido)
+            for clave in list(datos) + [clave for clave in valores if es_cache(clave)]:
+                del estado[clave]
+            entrada['ruta'] = ruta
+            entrada['en_disco'] = len(contenido)
+            entrada['tamanos'] = {}
+            entrada['total'] = 0
+            return True
+        finally:
+            entrada['lock'].release()
+
+    def _purgar_cerradas(self):
+        """Olvida las sesiones cerradas (libera la referencia a su estado) y borra sus archivos."""
+        if self.sesion_activa is None:
+            return
+        with self._lock:
+            cerradas = [id_sesion for id_sesion in self._sesiones if not self.sesion_activa(id_sesion)]
+            for id_sesion in cerradas:
+                ruta = self._sesiones.pop(id_sesion)['ruta']
+                if ruta is not None and os.path.exists(ruta):
+                    os.remove(ruta)
+
+    def tamanos_de(self, id_sesion):
+        with self._lock:
+            entrada = self._sesiones.get(id_sesion)
+            return dict(entrada['tamanos']) if entrada else {}
+
+    def tabla_sesiones(self):
+        """Una fila por sesión del proceso, de mayor a menor uso de memoria."""
+        self._purgar_cerradas()
+        ahora = time.time()
+        with self._lock:
+            filas = [
+                {
+                    'Sesión': id_sesion[:8],
+                    'Memoria (MB)': e['total'] / 1024 ** 2,
+                    'En Disco (MB)': e['en_disco'] / 1024 ** 2,
+                    'Estado': 'En disco' if e['ruta'] else 'En memoria',
+                    'Inactiva (min)': (ahora - e['ultimo_acceso']) / 60,
+                    'Mayor Clave': next(iter(e['tamanos']), ''),
+                }
+                for id_sesion, e in self._sesiones.items()
+            ]
+        df = pd.DataFrame(filas, columns=['Sesión', 'Memoria (MB)', 'En Disco (MB)', 'Estado', 'Inactiva (min)', 'Mayor Clave'])
+        return df.sort_values('Memoria (MB)', ascending=False, ignore_index=True)
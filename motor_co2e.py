@@ -0,0 +1,527 @@
+"""
+Motor de cálculo de CO2e, agua y costo de la Plataforma de Gestión NBS.
+
+Contiene las constantes, la base de datos de especies y las funciones de cálculo puras
+(sin Streamlit), para que la app (Home.py) y los servicios externos (api_co2e.py)
+obtengan exactamente los mismos resultados.
+"""
+import json
+
+import numpy as np
+import pandas as pd
+
+VERSION_MOTOR = "1.0" # Cambiar si cambian las fórmulas o constantes (invalida resultados guardados)
+
+# --- CONSTANTES GLOBALES Y BASES DE DATOS ---
+FACTOR_CARBONO = 0.47
+FACTOR_CO2E = 3.67
+FACTOR_BGB_SECO = 0.28
+AGB_FACTOR_A = 0.112
+AGB_FACTOR_B = 0.916
+FACTOR_KG_A_TON = 1000 # Constante para conversión
+
+# CONSTANTES PARA COSTOS 
+PRECIO_AGUA_POR_M3 = 3.0 # Precio fijo del m3 de agua en Perú (3 Soles)
+FACTOR_L_A_M3 = 1000 # 1 m3 = 1000 Litros
+
+# BASE DE DATOS INICIAL DE DENSIDADES, AGUA Y COSTO
+# [MODIFICACIÓN] Adición de DAP Máximo, Altura Máxima y Tiempo Máximo (bibliografía)
+DENSIDADES_BASE = {
+    # --- Especies Originales (Ajustadas a nuevos campos) ---
+    'Eucalipto Torrellana (Corymbia torelliana)': {'Densidad': 0.46, 'Agua_L_Anio': 1500, 'Precio_Plantón': 5.00, 'DAP_Max': 45.0, 'Altura_Max': 35.0, 'Tiempo_Max_Anios': 20}, 
+    'Majoe (Hibiscus tiliaceus)': {'Densidad': 0.57, 'Agua_L_Anio': 1200, 'Precio_Plantón': 5.00, 'DAP_Max': 25.0, 'Altura_Max': 15.0, 'Tiempo_Max_Anios': 15}, 
+    'Molle (Schinus molle)': {'Densidad': 0.44, 'Agua_L_Anio': 900, 'Precio_Plantón': 6.00, 'DAP_Max': 30.0, 'Altura_Max': 20.0, 'Tiempo_Max_Anios': 25},
+    'Algarrobo (Prosopis pallida)': {'Densidad': 0.53, 'Agua_L_Anio': 800, 'Precio_Plantón': 4.00, 'DAP_Max': 40.0, 'Altura_Max': 18.0, 'Tiempo_Max_Anios': 30},
+    
+    # --- [NUEVAS ESPECIES AGREGADAS DE LA TABLA] ---
+    # Usaremos Densidad Básica como Densidad (ρ) para el potencial
+    # Valores de Agua y Precio por defecto si no se indican.
+    # Eucalipto Torrellana (Corymbia torelliana) - Actualizado con la tabla (DAP, Altura, Tiempo)
+    
+    'Shaina (Colubrina glandulosa Perkins)': {'Densidad': 0.63, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 40.0, 'Altura_Max': 20.0, 'Tiempo_Max_Anios': 28},
+    'Limoncillo (Melicoccus bijugatus)': {'Densidad': 0.68, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 40.0, 'Altura_Max': 18.0, 'Tiempo_Max_Anios': 33},
+    'Capirona (Calycophyllum decorticáns)': {'Densidad': 0.78, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 38.0, 'Altura_Max': 25.0, 'Tiempo_Max_Anios': 23},
+    'Bolaina (Guazuma crinita)': {'Densidad': 0.48, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 25.0, 'Altura_Max': 20.0, 'Tiempo_Max_Anios': 10},
+    'Amasisa (Erythrina fusca)': {'Densidad': 0.38, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 33.0, 'Altura_Max': 15.0, 'Tiempo_Max_Anios': 15},
+    'Moena (Ocotea aciphylla)': {'Densidad': 0.58, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 65.0, 'Altura_Max': 33.0, 'Tiempo_Max_Anios': 45},
+    'Huayruro (Ormosia coccinea)': {'Densidad': 0.73, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 70.0, 'Altura_Max': 33.0, 'Tiempo_Max_Anios': 65},
+    'Paliperro (Miconia barbeyana Cogniaux)': {'Densidad': 0.58, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 40.0, 'Altura_Max': 20.0, 'Tiempo_Max_Anios': 28},
+    'Cedro (Cedrela odorata)': {'Densidad': 0.43, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 55.0, 'Altura_Max': 30.0, 'Tiempo_Max_Anios': 28},
+    'Guayacán (Guaiacum officinale)': {'Densidad': 0.54, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 5.00, 'DAP_Max': 45.0, 'Altura_Max': 12.0, 'Tiempo_Max_Anios': 60},
+}
+
+# --- DEFINICIÓN DE TIPOS DE COLUMNAS ---
+df_columns_types = {
+    'ID Lote': str, # Identificador estable del lote (ver generar_id_lote)
+    'Especie': str, 'Cantidad': int, 'DAP (cm)': float, 'Altura (m)': float, 
+    'Densidad (ρ)': float, 'Años Plantados': int, 'Consumo Agua Unitario (L/año)': float, 
+    'Precio Plantón Unitario (S/)': float, 
+    'Detalle Cálculo': str,
+    'Latitud': float, 'Longitud': float, # Opcionales (grados decimales WGS84); NaN si el lote no está geolocalizado
+}
+df_columns_numeric = ['Cantidad', 'DAP (cm)', 'Altura (m)', 'Densidad (ρ)', 'Años Plantados', 'Consumo Agua Unitario (L/año)', 'Precio Plantón Unitario (S/)'] 
+columnas_coordenadas = ['Latitud', 'Longitud'] # Numéricas, pero sin relleno con 0 (0,0 es una coordenada válida)
+
+columnas_salida = ['Biomasa Lote (Ton)', 'Carbono Lote (Ton)', 'CO2e Lote (Ton)', 'Consumo Agua Total Lote (L)', 'Costo Total Lote (S/)']
+
+# --- FUNCIÓN CRÍTICA: DINÁMICA DE ESPECIES ---
+def fusionar_info_especies(df_bd):
+    """
+    Genera un diccionario de información de especies (Densidad, Agua, Precio, Maximos) 
+    fusionando las especies base con las especies añadidas/modificadas por el usuario (df_bd).
+    """
+    current_info = {
+        # [FIX: POTENCIAL MÁXIMO V2] Incluir los nuevos campos máximos
+        name: {
+            'Densidad': data['Densidad'], 
+            'Agua_L_Anio': data['Agua_L_Anio'], 
+            'Precio_Plantón': data['Precio_Plantón'],
+            'DAP_Max': data['DAP_Max'],
+            'Altura_Max': data['Altura_Max'],
+            'Tiempo_Max_Anios': data['Tiempo_Max_Anios']
+        }
+        for name, data in DENSIDADES_BASE.items()
+    }
+    
+    if df_bd is None or df_bd.empty:
+        # [FIX: POTENCIAL MÁXIMO V2] Defaults para datos manuales
+        current_info['Densidad/Datos Manuales'] = {'Densidad': 0.0, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 0.0, 'DAP_Max': 20.0, 'Altura_Max': 10.0, 'Tiempo_Max_Anios': 10}
+        return current_info
+        
+    df_unique_info = df_bd.drop_duplicates(subset=['Especie'], keep='last')
+
+    # Conversión segura por columna (vectorizada: la BD puede tener decenas de miles de especies importadas)
+    def columna(nombre):
+        if nombre not in df_unique_info.columns:
+            return pd.Series(0.0, index=df_unique_info.index)
+        return pd.to_numeric(df_unique_info[nombre], errors='coerce')
+
+    def no_negativa(valores):
+        return valores.where(valores >= 0, 0.0) # NaN también se reemplaza
+
+    densidad = columna('Densidad (g/cm³)')
+    validas = densidad.notna() & (densidad > 0)
+    campos = {
+        'Densidad': densidad[validas],
+        'Agua_L_Anio': no_negativa(columna('Consumo Agua (L/año)'))[validas],
+        'Precio_Plantón': no_negativa(columna('Precio Plantón (S/)'))[validas],
+        # [FIX: POTENCIAL MÁXIMO V2] Asegurar la conversión de los nuevos campos
+        'DAP_Max': no_negativa(columna('DAP Máximo (cm)'))[validas],
+        'Altura_Max': no_negativa(columna('Altura Máxima (m)'))[validas],
+        'Tiempo_Max_Anios': no_negativa(columna('Tiempo Máximo (años)'))[validas].astype(int),
+    }
+    for especie_name, *valores in zip(df_unique_info['Especie'][validas], *(serie.tolist() for serie in campos.values())):
+        current_info[especie_name] = dict(zip(campos, valores))
+    
+    # [FIX: POTENCIAL MÁXIMO V2] Defaults para datos manuales
+    current_info['Densidad/Datos Manuales'] = {'Densidad': 0.0, 'Agua_L_Anio': 0.0, 'Precio_Plantón': 0.0, 'DAP_Max': 20.0, 'Altura_Max': 10.0, 'Tiempo_Max_Anios': 10}
+    
+    return current_info
+
+
+# --- FUNCIONES DE CÁLCULO Y MANEJO DE INVENTARIO ---
+
+def get_co2e_total_seguro(df):
+    """Calcula la suma total de CO2e capturado."""
+    if df.empty or 'CO2e Lote (Ton)' not in df.columns:
+        return 0.0
+    return df['CO2e Lote (Ton)'].sum()
+
+def get_costo_total_seguro(df):
+    """Calcula la suma total del costo del proyecto."""
+    if df.empty or 'Costo Total Lote (S/)' not in df.columns:
+        return 0.0
+    return df['Costo Total Lote (S/)'].sum()
+
+def get_agua_total_seguro(df):
+    """Calcula la suma total de consumo de agua (Anual)."""
+    if df.empty or 'Consumo Agua Total Lote (L)' not in df.columns:
+        return 0.0
+    return df['Consumo Agua Total Lote (L)'].sum()
+
+
+def calcular_co2_arbol_valores(rho, dap_cm, altura_m):
+    """
+    Parte numérica de calcular_co2_arbol: (AGB, BGB, Biomasa Total, CO2e) por árbol en KILOGRAMOS,
+    sin generar el detalle JSON. Mismas operaciones escalares, por lo que los resultados son idénticos.
+    """
+    if rho <= 0 or dap_cm <= 0 or altura_m <= 0:
+        return 0.0, 0.0, 0.0, 0.0
+        
+    # Calcular AGB (Above-Ground Biomass) en kg
+    # Fórmula: AGB = AGB_FACTOR_A × (ρ × D² × H)^AGB_FACTOR_B (Chave et al. 2014)
+    # rho: Densidad (g/cm³), dap_cm: Diámetro (cm), altura_m: Altura (m)
+    agb_kg = AGB_FACTOR_A * ((rho * (dap_cm**2) * altura_m)**AGB_FACTOR_B)
+    
+    # Calcular BGB (Below-Ground Biomass) en kg
+    bgb_kg = agb_kg * FACTOR_BGB_SECO
+    
+    # Biomasa total (AGB + BGB)
+    biomasa_total = agb_kg + bgb_kg
+    
+    # Carbono total
+    carbono_total = biomasa_total * FACTOR_CARBONO
+    
+    # CO2 equivalente
+    co2e_total = carbono_total * FACTOR_CO2E
+    
+    return agb_kg, bgb_kg, biomasa_total, co2e_total
+
+
+# --- MODIFICACIÓN CLAVE: calcular_co2_arbol para retornar JSON de detalle ---
+def calcular_co2_arbol(rho, dap_cm, altura_m):
+    """
+    Calcula la biomasa, carbono y CO2e por árbol en KILOGRAMOS 
+    y genera un diccionario de detalle con fórmulas para su posterior uso en Excel.
+    """
+    
+    # 1. Validación de entradas
+    if rho <= 0 or dap_cm <= 0 or altura_m <= 0:
+        detalle = {
+            "ERROR": "Valores de entrada (DAP, Altura o Densidad) deben ser mayores a cero para el cálculo."
+        }
+        return 0.0, 0.0, 0.0, 0.0, json.dumps(detalle)
+        
+    agb_kg, bgb_kg, biomasa_total, co2e_total = calcular_co2_arbol_valores(rho, dap_cm, altura_m)
+    carbono_total = biomasa_total * FACTOR_CARBONO
+    
+    # Generación del detalle técnico como diccionario para convertir a JSON
+    detalle_calculo = {
+        "Inputs": [
+            {"Métrica": "Densidad (ρ)", "Valor": rho, "Unidad": "g/cm³"},
+            {"Métrica": "DAP (D)", "Valor": dap_cm, "Unidad": "cm"},
+            {"Métrica": "Altura (H)", "Valor": altura_m, "Unidad": "m"}
+        ],
+        "AGB_Aerea_kg": [
+            {"Paso": "Fórmula (Chave et al. 2014)", "Ecuación": f"AGB = {AGB_FACTOR_A} × (ρ × D² × H)^{AGB_FACTOR_B}"},
+            {"Paso": "Sustitución", "Ecuación": f"AGB = {AGB_FACTOR_A:.3f} × ({rho:.3f} × {dap_cm:.2f}² × {altura_m:.2f})^{AGB_FACTOR_B:.3f}"},
+            {"Paso": "Resultado AGB", "Valor": agb_kg, "Unidad": "kg"}
+        ],
+        "BGB_Subterranea_kg": [
+            {"Paso": "Fórmula", "Ecuación": f"BGB = AGB × {FACTOR_BGB_SECO}"},
+            {"Paso": "Sustitución", "Ecuación": f"BGB = {agb_kg:.4f} × {FACTOR_BGB_SECO}"},
+            {"Paso": "Resultado BGB", "Valor": bgb_kg, "Unidad": "kg"}
+        ],
+        "Biomasa_Total_kg": [
+            {"Paso": "Fórmula", "Ecuación": "Biomasa Total = AGB + BGB"},
+            {"Paso": "Resultado Biomasa Total", "Valor": biomasa_total, "Unidad": "kg"}
+        ],
+        "Carbono_kg": [
+            {"Paso": "Fórmula", "Ecuación": f"Carbono = Biomasa Total × {FACTOR_CARBONO}"},
+            {"Paso": "Sustitución", "Ecuación": f"Carbono = {biomasa_total:.4f} × {FACTOR_CARBONO}"},
+            {"Paso": "Resultado Carbono", "Valor": carbono_total, "Unidad": "kg"}
+        ],
+        "CO2e_kg": [
+            {"Paso": "Fórmula", "Ecuación": f"CO2e = Carbono × {FACTOR_CO2E}"},
+            {"Paso": "Sustitución", "Ecuación": f"CO2e = {carbono_total:.4f} × {FACTOR_CO2E}"},
+            {"Paso": "Resultado CO2e (Unitario)", "Valor": co2e_total, "Unidad": "kg"}
+        ]
+    }
+    
+    return agb_kg, bgb_kg, biomasa_total, co2e_total, json.dumps(detalle_calculo)
+
+
+# --- DEDUPLICACIÓN DE LOTES IDÉNTICOS ---
+def calcular_por_tuplas_distintas(rho, dap_cm, altura_m, incluir_detalle=True, memo=None):
+    """
+    Aplica calcular_co2_arbol una sola vez por cada tupla distinta (ρ, DAP, Altura) y
+    dispersa los resultados a todas las filas. El trabajo escala con el número de tuplas
+    distintas, no con el número de lotes.
+    Retorna arreglos (AGB, BGB, Biomasa, CO2e) por árbol en kg y la lista de JSON de detalle
+    (las filas idénticas comparten la misma cadena). Con incluir_detalle=False no se genera
+    el JSON y la lista de detalle contiene None.
+    `memo` (dict tupla -> resultado, siempre con el mismo incluir_detalle) se comparte entre
+    llamadas sucesivas, p. ej. los bloques de un mismo inventario: cada tupla se calcula una vez.
+    """
+    claves = pd.DataFrame({'rho': np.asarray(rho, dtype=float), 'dap': np.asarray(dap_cm, dtype=float), 'altura': np.asarray(altura_m, dtype=float)})
+    codigos = claves.groupby(['rho', 'dap', 'altura'], sort=False).ngroup().to_numpy()
+    unicos = claves.drop_duplicates()
+
+    calcular = calcular_co2_arbol if incluir_detalle else (lambda r, d, h: calcular_co2_arbol_valores(r, d, h) + (None,))
+    if memo is None:
+        resultados_unicos = [calcular(r, d, h) for r, d, h in unicos.itertuples(index=False)]
+    else:
+        resultados_unicos = []
+        for tupla in unicos.itertuples(index=False, name=None):
+            resultado = memo.get(tupla)
+            if resultado is None:
+                resultado = memo[tupla] = calcular(*tupla)
+            resultados_unicos.append(resultado)
+    agb, bgb, biomasa, co2e, detalles = zip(*resultados_unicos) if resultados_unicos else ((),) * 5
+
+    return (
+        np.asarray(agb, dtype=float)[codigos],
+        np.asarray(bgb, dtype=float)[codigos],
+        np.asarray(biomasa, dtype=float)[codigos],
+        np.asarray(co2e, dtype=float)[codigos],
+        [detalles[c] for c in codigos],
+    )
+
+
+# --- FUNCIÓN DE RECÁLCULO SEGURO (CRÍTICA) ---
+def recalcular_inventario(inventario_list, riego_activado=False, incluir_detalle=True, agua_anual_lote_l=None, memo_tuplas=None):
+    """
+    Toma la lista de entradas (List[Dict]) y genera un DataFrame completo y limpio, 
+    incluyendo CO2e, Consumo de Agua y Costo Total (Plantones + Agua Acumulada).
+    Con riego_activado=False el consumo de agua y su costo son cero.
+    `agua_anual_lote_l` (arreglo por lote, p. ej. del balance hídrico mensual) reemplaza
+    la cifra fija Cantidad × Consumo Agua Unitario cuando el riego está activado.
+    `memo_tuplas`: ver calcular_por_tuplas_distintas.
+    """
+    if not inventario_list:
+        # Crear un DF vacío con todas las columnas esperadas
+        all_cols = list(df_columns_types.keys()) + columnas_salida
+        dtype_map = {**df_columns_types, **dict.fromkeys(columnas_salida, float)}
+        dtype_map = {k: v for k, v in dtype_map.items() if k in all_cols}
+        return pd.DataFrame(columns=all_cols).astype(dtype_map)
+
+
+    # 1. Crear DF base
+    df_base = pd.DataFrame(inventario_list)
+    df_calculado = df_base.copy()
+    
+    # [FIX: CORRECCIÓN DE ERROR JSON] Eliminamos la columna Detalle Cálculo del input (si existe) 
+    # para asegurar que siempre se use la nueva cadena JSON calculada y evitar TypeErrors de valores NaN/None.
+    if 'Detalle Cálculo' in df_calculado.columns:
+        df_calculado = df_calculado.drop(columns=['Detalle Cálculo'])
+    
+    # 2. FIX CRÍTICO: Asegurar que todas las columnas de entrada requeridas existan
+    required_input_cols = [col for col in df_columns_types.keys() if col != 'Detalle Cálculo'] # Excluimos Detalle Cálculo
+    for col in required_input_cols:
+        if col not in df_calculado.columns:
+            if col in columnas_coordenadas:
+                default_val = np.nan
+            elif df_columns_types[col] == str:
+                default_val = ""
+            elif df_columns_types[col] == int:
+                default_val = 0
+            else: # float
+                default_val = 0.0
+            df_calculado[col] = default_val
+    
+    # 3. Asegurar que todas las columnas numéricas sean números
+    for col in df_columns_numeric:
+        df_calculado[col] = pd.to_numeric(df_calculado[col], errors='coerce').fillna(0)
+    for col in columnas_coordenadas:
+        df_calculado[col] = pd.to_numeric(df_calculado[col], errors='coerce')
+    
+    # 1. Cálculo de CO2e por árbol (kg), una sola vez por cada tupla distinta (ρ, DAP, Altura):
+    # los lotes idénticos comparten el resultado y la cadena JSON de detalle.
+    _, _, biomasa_uni_kg, co2e_uni_kg, detalle = calcular_por_tuplas_distintas(
+        df_calculado['Densidad (ρ)'], df_calculado['DAP (cm)'], df_calculado['Altura (m)'], # <<< DAP y Altura MEDIDOS
+        incluir_detalle=incluir_detalle, memo=memo_tuplas
+    )
+    cantidad = df_calculado['Cantidad'].to_numpy()
+    
+    # 2. Conversión a TONELADAS y Lote
+    biomasa_lote_ton = (biomasa_uni_kg * cantidad) / FACTOR_KG_A_TON
+    carbono_lote_ton = (biomasa_uni_kg * FACTOR_CARBONO * cantidad) / FACTOR_KG_A_TON
+    co2e_lote_ton = (co2e_uni_kg * cantidad) / FACTOR_KG_A_TON
+
+    # 3. Costo y Agua
+    costo_planton_lote = cantidad * df_calculado['Precio Plantón Unitario (S/)'].to_numpy()
+    
+    # --- LÓGICA DE RIEGO CONDICIONAL ---
+    if riego_activado:
+        consumo_agua_uni = df_calculado['Consumo Agua Unitario (L/año)'].to_numpy()
+        años_para_costo = df_calculado['Años Plantados'].to_numpy()
+    else:
+        # Si el riego no está activado, el consumo de agua y su costo son CERO.
+        consumo_agua_uni = 0.0
+        años_para_costo = 0 
+        
+    consumo_agua_lote_l = cantidad * consumo_agua_uni
+    if riego_activado and agua_anual_lote_l is not None:
+        consumo_agua_lote_l = np.asarray(agua_anual_lote_l, dtype=float)
+    
+    # Calcular el costo de agua por UN AÑO (operación anual)
+    volumen_agua_lote_m3_anual = consumo_agua_lote_l / FACTOR_L_A_M3
+    costo_agua_anual_lote = volumen_agua_lote_m3_anual * PRECIO_AGUA_POR_M3
+    
+    # Costo de agua acumulado: Costo Anual * Años Plantados (solo si riego_activado)
+    costo_agua_acumulado_lote = costo_agua_anual_lote * años_para_costo
+    
+    # Costo total = Costo Plantones (Inversión Inicial) + Costo Agua (Operación Acumulada)
+    costo_total_lote = costo_planton_lote + costo_agua_acumulado_lote
+    # --- FIN DE LÓGICA DE RIEGO CONDICIONAL ---
+    
+    resultados_calculo = {
+        'Biomasa Lote (Ton)': biomasa_lote_ton,
+        'Carbono Lote (Ton)': carbono_lote_ton,
+        'CO2e Lote (Ton)': co2e_lote_ton,
+        'Consumo Agua Total Lote (L)': consumo_agua_lote_l,
+        'Costo Total Lote (S/)': costo_total_lote, 
+        'Detalle Cálculo': detalle # JSON string
+    }
+
+    # 4. Unir los resultados
+    df_resultados = pd.DataFrame(resultados_calculo)
+    df_final = pd.concat([df_calculado.reset_index(drop=True), df_resultados], axis=1)
+    
+    # 5. Aplicar tipos de datos para las columnas de salida
+    dtype_map = {col: float for col in columnas_salida if col in df_final.columns}
+    df_final = df_final.astype(dtype_map)
+
+    return df_final
+
+
+# --- RECÁLCULO POR BLOQUES (INVENTARIOS GRANDES) ---
+TAMANO_BLOQUE_RECALCULO = 50_000 # Lotes por bloque del recálculo progresivo
+LOTES_MUESTRA_ESTIMACION = 5_000 # Lotes de la muestra sistemática para el total aproximado inicial
+
+
+def estimar_co2e_muestra(inventario_list, lotes_muestra=LOTES_MUESTRA_ESTIMACION):
+    """
+    Muestra sistemática del inventario: un lote de cada `paso`, desde el primero, calculado sin
+    JSON de detalle. Retorna (paso, CO2e por lote de la muestra en t). Con ~5 mil lotes cuesta
+    unas decenas de ms y, como la muestra recorre toda la lista, su extrapolación no depende
+    del orden en que se cargaron los lotes.
+    """
+    paso = max(1, len(inventario_list) // lotes_muestra)
+    df_muestra = recalcular_inventario(inventario_list[::paso], incluir_detalle=False)
+    return paso, df_muestra['CO2e Lote (Ton)'].to_numpy()
+
+
+def estimar_co2e_restante(muestra, inicio, total_lotes):
+    """CO2e estimado (t) de los lotes [inicio, total_lotes): media de los puntos de la muestra en ese rango × lotes."""
+    paso, co2e_muestra = muestra
+    puntos = co2e_muestra[-(-inicio // paso):] # El primer punto de la muestra con posición >= inicio
+    if inicio >= total_lotes or len(puntos) == 0:
+        return 0.0
+    return float(puntos.mean()) * (total_lotes - inicio)
+
+
+def recalcular_inventario_por_bloques(inventario_list, riego_activado=False, agua_anual_lote_l=None,
+                                      tamano_bloque=TAMANO_BLOQUE_RECALCULO, al_avanzar=None, estado=None, muestra=None):
+    """
+    Mismo resultado que recalcular_inventario, calculado por bloques contiguos de lotes que
+    comparten el memo de tuplas (cada tupla distinta se calcula una sola vez en todo el inventario).
+
+    Al empezar y después de cada bloque llama a al_avanzar(procesados, total, co2e_exacto, co2e_estimado):
+    co2e_exacto (t) es la suma de los bloques terminados y co2e_estimado le suma la extrapolación
+    de la muestra (estimar_co2e_muestra) a los lotes que faltan; con el último bloque coinciden.
+
+    `estado` (dict) guarda los bloques terminados y el memo: si el cálculo se interrumpe (una
+    excepción lanzada desde al_avanzar, p. ej. la de Streamlit ante una nueva interacción), otra
+    llamada con el mismo `estado` y la misma lista continúa desde el primer bloque pendiente.
+    """
+    total = len(inventario_list)
+    if estado is None:
+        estado = {}
+    bloques = estado.setdefault('bloques', [])
+    memo = estado.setdefault('memo_tuplas', {})
+    if al_avanzar is not None and muestra is None:
+        muestra = estimar_co2e_muestra(inventario_list)
+    agua = None if agua_anual_lote_l is None else np.asarray(agua_anual_lote_l, dtype=float)
+
+    inicio = sum(len(bloque) for bloque in bloques)
+    co2e_exacto = sum(get_co2e_total_seguro(bloque) for bloque in bloques)
+    if al_avanzar is not None:
+        al_avanzar(inicio, total, co2e_exacto, co2e_exacto + estimar_co2e_restante(muestra, inicio, total))
+    while inicio < total:
+        fin = min(inicio + tamano_bloque, total)
+        bloque = recalcular_inventario(
+            inventario_list[inicio:fin], riego_activado=riego_activado,
+            agua_anual_lote_l=None if agua is None else agua[inicio:fin], memo_tuplas=memo
+        )
+        bloques.append(bloque)
+        co2e_exacto += get_co2e_total_seguro(bloque)
+        inicio = fin
+        if al_avanzar is not None:
+            al_avanzar(inicio, total, co2e_exacto, co2e_exacto + estimar_co2e_restante(muestra, inicio, total))
+
+    if len(bloques) <= 1:
+        return bloques[0] if bloques else recalcular_inventario([])
+    return pd.concat(bloques, ignore_index=True)
+
+
+# [FIX: POTENCIAL MÁXIMO V2] Función modificada para usar valores max de la especie
+def calcular_potencial_maximo_lotes(inventario_list, current_species_info):
+    """
+    Calcula el CO2e potencial máximo utilizando los valores máximos de DAP y Altura 
+    propios de cada especie en los lotes del inventario.
+    """
+    if not inventario_list:
+        return pd.DataFrame()
+
+    df_potencial = pd.DataFrame(inventario_list)
+    
+    # Asegurar la conversión segura de columnas requeridas
+    for col in ['Cantidad', 'Densidad (ρ)']:
+        df_potencial[col] = pd.to_numeric(df_potencial[col], errors='coerce').fillna(0)
+
+    # --- Lógica de Asignación de Valores Máximos (por columnas, sin recorrer los lotes) ---
+    # Especie registrada: sus máximos. Datos manuales: máximos por defecto y la densidad del lote si es válida.
+    # Especie no encontrada: se usan el DAP y la Altura medidos (es menos potencial) y no tiene tiempo máximo.
+    especies = df_potencial['Especie']
+    manual = (especies == 'Densidad/Datos Manuales').to_numpy()
+    info_manual = current_species_info.get('Densidad/Datos Manuales', {'Densidad': 0.0, 'DAP_Max': 0.0, 'Altura_Max': 0.0, 'Tiempo_Max_Anios': 0})
+    registradas = {nombre: info for nombre, info in current_species_info.items() if info and nombre != 'Densidad/Datos Manuales'}
+
+    def maximo(campo):
+        """Valor de `campo` de la especie de cada lote (NaN si no está registrada) y el de los datos manuales."""
+        valores = especies.map({nombre: info[campo] for nombre, info in registradas.items()}).to_numpy(dtype=float)
+        return np.where(manual, info_manual[campo], valores)
+
+    rho_lote = df_potencial['Densidad (ρ)'].to_numpy(dtype=float)
+    rho = maximo('Densidad')
+    registrada = ~np.isnan(rho) & ~manual
+    rho = np.where(manual, np.where(rho_lote > 0, rho_lote, info_manual['Densidad']), np.where(registrada, rho, rho_lote))
+    dap = np.where(registrada | manual, maximo('DAP_Max'), pd.to_numeric(df_potencial['DAP (cm)'], errors='coerce'))
+    altura = np.where(registrada | manual, maximo('Altura_Max'), pd.to_numeric(df_potencial['Altura (m)'], errors='coerce'))
+    tiempo_max = pd.Series(np.where(registrada | manual, maximo('Tiempo_Max_Anios'), 0.0))
+    if (tiempo_max % 1 == 0).all():
+        tiempo_max = tiempo_max.astype(np.int64)
+
+    cantidad = df_potencial['Cantidad'].to_numpy()
+    invalidos = (dap <= 0) | (altura <= 0) | (rho <= 0) | (cantidad <= 0)
+
+    # El CO2e se calcula después, una vez por tupla distinta (ρ, DAP, Altura)
+    df_resultados = pd.DataFrame({
+        'Especie': especies.to_numpy(),
+        'Cantidad': cantidad,
+        'Densidad (ρ)': rho,
+        'DAP Potencial (cm)': dap,
+        'Altura Potencial (m)': altura,
+        'Tiempo Máximo (años)': tiempo_max.to_numpy(),
+        'CO2e Lote Potencial (Ton)': 0.0,
+        'Detalle Cálculo': np.where(invalidos, "ERROR: Valores DAP/Altura/Densidad/Cantidad deben ser > 0 para el cálculo potencial.", ""), # JSON string
+    })
+
+    validos = (
+        (df_resultados['DAP Potencial (cm)'] > 0) & (df_resultados['Altura Potencial (m)'] > 0)
+        & (df_resultados['Densidad (ρ)'] > 0) & (df_resultados['Cantidad'] > 0)
+    ).to_numpy()
+    if validos.any():
+        df_validos = df_resultados[validos]
+        # 1. Cálculo de CO2e (Biomasa, Carbono, CO2e por árbol en kg)
+        _, _, _, co2e_uni_kg, detalles = calcular_por_tuplas_distintas(
+            df_validos['Densidad (ρ)'], df_validos['DAP Potencial (cm)'], df_validos['Altura Potencial (m)']
+        )
+        # 2. Conversión a TONELADAS y Lote
+        df_resultados.loc[validos, 'CO2e Lote Potencial (Ton)'] = (co2e_uni_kg * df_validos['Cantidad'].to_numpy()) / FACTOR_KG_A_TON
+        df_resultados.loc[validos, 'Detalle Cálculo'] = detalles
+
+    return df_resultados
+
+
+# --- CÁLCULO VECTORIZADO (CENSO Y CAMPAÑAS) ---
+def calcular_co2_vectorizado(rho, dap_cm, altura_m):
+    """
+    Versión vectorizada de calcular_co2_arbol (misma fórmula de Chave et al. 2014).
+    Recibe arreglos y retorna (AGB, BGB, Biomasa Total, CO2e) por árbol en KILOGRAMOS.
+    Los árboles con DAP, Altura o Densidad <= 0 devuelven 0.0.
+    """
+    rho = np.asarray(rho, dtype=float)
+    dap_cm = np.asarray(dap_cm, dtype=float)
+    altura_m = np.asarray(altura_m, dtype=float)
+
+    validos = (rho > 0) & (dap_cm > 0) & (altura_m > 0)
+    termino = np.where(validos, rho * (dap_cm**2) * altura_m, 0.0)
+
+    agb_kg = np.where(validos, AGB_FACTOR_A * (termino**AGB_FACTOR_B), 0.0)
+    bgb_kg = agb_kg * FACTOR_BGB_SECO
+    biomasa_total = agb_kg + bgb_kg
+    co2e_total = biomasa_total * FACTOR_CARBONO * FACTOR_CO2E
+
+    return agb_kg, bgb_kg, biomasa_total, co2e_total
@@ -0,0 +1,342 @@
+"""
+Estimación por parcelas de muestreo: extrapolación del CO2e medido en parcelas a las hectáreas
+del proyecto, con error estándar e intervalos de confianza.
+
+Archivo de parcelas (CSV, una fila por árbol medido):
+    Parcela, Área Parcela (m²), Especie, DAP (cm), Altura (m)
+    opcionales: Estrato (sitio; sin ella todo el proyecto es un estrato), Árboles (si la fila
+    representa varios árboles iguales), Área Estrato (ha) (si falta, las hectáreas del proyecto
+    se reparten entre los estratos en proporción a sus parcelas)
+
+Estimador estratificado (muestreo aleatorio estratificado de parcelas):
+    y[p, s] = CO2e de la especie s en la parcela p / área de la parcela   (tCO2e/ha)
+    ȳ[h, s] = media de y en las n_h parcelas del estrato h;  s²[h, s] su varianza
+    T[s]    = Σ_h A_h · ȳ[h, s]            (A_h: hectáreas del estrato)
+    Var(T)  = Σ_h A_h² · s²[h] / n_h
+    IC      = T ± t(gl) · √Var(T), con gl de Satterthwaite
+
+Cada especie se estima como un dominio (las parcelas sin la especie aportan 0) y el total del
+proyecto con la suma por parcela, de modo que incluye la covarianza entre especies. Medias y
+varianzas se calculan para todas las especies a la vez con una matriz parcelas × especies.
+
+Bootstrap: remuestreo con reposición de las parcelas dentro de cada estrato (IC percentil). Las
+réplicas se reparten por bloques en un pool de procesos; cada bloque usa su propia semilla
+(SeedSequence.spawn), por lo que el resultado es reproducible para una semilla dada.
+"""
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from statistics import NormalDist
+
+import numpy as np
+import pandas as pd
+
+from motor_co2e import FACTOR_KG_A_TON, calcular_co2_vectorizado
+from trabajos_fondo import TrabajoCancelado
+
+PARCELAS_COLUMNAS_REQUERIDAS = ['Parcela', 'Área Parcela (m²)', 'Especie', 'DAP (cm)', 'Altura (m)']
+M2_POR_HA = 10_000
+CONFIANZA_POR_DEFECTO = 0.95
+REPLICAS_POR_DEFECTO = 2000
+REPLICAS_POR_BLOQUE = 250 # Réplicas de bootstrap por tarea del pool (acota la memoria de cada proceso)
+SEMILLA_POR_DEFECTO = 2024
+ESTRATO_UNICO = 'Proyecto'
+TOTAL = 'Total'
+
+
+def _beta_incompleta(x, a, b):
+    """Beta incompleta regularizada I_x(a, b) (fracción continua de Lentz, Numerical Recipes 6.4)."""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    if x > (a + 1.0) / (a + b + 2.0): # La fracción converge rápido en este lado; se usa la simetría
+        return 1.0 - _beta_incompleta(1.0 - x, b, a)
+    frente = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log1p(-x)) / a
+    minimo = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > minimo else minimo)
+    fraccion = d
+    for m in range(1, 300):
+        for numerador in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerador * d
+            d = 1.0 / (d if abs(d) > minimo else minimo)
+            c = 1.0 + numerador / c
+            c = c if abs(c) > minimo else minimo
+            fraccion *= c * d
+        if abs(c * d - 1.0) < 1e-15:
+            break
+    return frente * fraccion
+
+
+def _cola_t(t, gl):
+    """P(T > t) de la t de Student con gl grados de libertad (t >= 0)."""
+    return 0.5 * _beta_incompleta(gl / (gl + t * t), gl / 2.0, 0.5)
+
+
+def _densidad_t(t, gl):
+    return math.exp(math.lgamma((gl + 1) / 2) - math.lgamma(gl / 2) - 0.5 * math.log(gl * math.pi)
+                    - (gl + 1) / 2 * math.log1p(t * t / gl))
+
+
+def cuantil_t(gl, confianza):
+    """
+    Cuantil bilateral de la t de Student: t tal que P(|T| <= t) = confianza. Con gl = 1 y gl = 2
+    usa las fórmulas cerradas; con otros gl (también no enteros, p. ej. de Satterthwaite) invierte
+    la distribución exacta (Newton con respaldo de bisección). Con gl infinitos o no definidos
+    retorna el cuantil normal.
+    """
+    p = 0.5 + confianza / 2
+    z = NormalDist().inv_cdf(p)
+    if not gl or not math.isfinite(gl):
+        return z
+    gl = max(gl, 1.0)
+    if gl == 1:
+        return math.tan(math.pi * (p - 0.5))
+    if gl == 2:
+        return (2 * p - 1) * math.sqrt(2 / (1 - (2 * p - 1) ** 2))
+    cola = 1.0 - p
+    bajo, alto = z, 2.0 * z # t(gl) >= z; se amplía el intervalo hasta encerrar el cuantil
+    while _cola_t(alto, gl) > cola:
+        bajo, alto = alto, 2.0 * alto
+    t = 0.5 * (bajo + alto)
+    for _ in range(100):
+        exceso = _cola_t(t, gl) - cola
+        if exceso > 0:
+            bajo = t
+        else:
+            alto = t
+        siguiente = t + exceso / _densidad_t(t, gl)
+        if not bajo < siguiente < alto:
+            siguiente = 0.5 * (bajo + alto)
+        if abs(siguiente - t) < 1e-12 * t:
+            return siguiente
+        t = siguiente
+    return t
+
+
+def leer_parcelas(fuente):
+    """Lee el archivo de parcelas. Lanza ValueError si faltan columnas."""
+    df = pd.read_csv(fuente)
+    faltantes = [col for col in PARCELAS_COLUMNAS_REQUERIDAS if col not in df.columns]
+    if faltantes:
+        raise ValueError(f"El archivo de parcelas no contiene las columnas requeridas: {', '.join(faltantes)}")
+    return df
+
+
+def matriz_parcelas(df_arboles, current_species_info, indice_especies=None):
+    """
+    CO2e por hectárea de cada parcela y especie. Retorna un diccionario con:
+      'y': DataFrame parcelas × especies (tCO2e/ha), 'estrato': estrato de cada parcela,
+      'area_m2': área de cada parcela, 'areas_estrato': hectáreas declaradas por estrato (o None),
+      conteos de control, especies no reconocidas y nombres resueltos.
+    Los árboles sin densidad o con mediciones no válidas se descartan; su parcela se conserva
+    (una parcela sin árboles válidos aporta 0, como una parcela vacía).
+    """
+    densidades = {nombre: info['Densidad'] for nombre, info in current_species_info.items() if info['Densidad'] > 0}
+
+    parcela = df_arboles['Parcela'].astype(str).str.strip()
+    especie = df_arboles['Especie'].astype(str).str.strip()
+    especies_resueltas = {}
+    if indice_especies is not None:
+        nuevas = [nombre for nombre in especie.unique() if nombre not in densidades]
+        for nombre, (destino, _) in indice_especies.resolver_nombres(nuevas).items():
+            if destino in densidades:
+                especies_resueltas[nombre] = destino
+        especie = especie.map(especies_resueltas).fillna(especie)
+
+    area_m2 = pd.to_numeric(df_arboles['Área Parcela (m²)'], errors='coerce')
+    if 'Estrato' in df_arboles.columns:
+        estrato = df_arboles['Estrato'].fillna(ESTRATO_UNICO).astype(str).str.strip()
+    else:
+        estrato = pd.Series(ESTRATO_UNICO, index=df_arboles.index)
+    arboles = pd.to_numeric(df_arboles['Árboles'], errors='coerce').fillna(1).to_numpy(dtype=float) if 'Árboles' in df_arboles.columns else np.ones(len(df_arboles))
+
+    # Atributos de la parcela (primer valor; el área y el estrato deben ser únicos por parcela)
+    por_parcela = pd.DataFrame({'Parcela': parcela, 'Estrato': estrato, 'Área (m²)': area_m2}).groupby('Parcela', sort=True)
+    atributos = por_parcela.first()
+    inconsistentes = (por_parcela['Área (m²)'].nunique() > 1) | (por_parcela['Estrato'].nunique() > 1)
+    if inconsistentes.any():
+        raise ValueError(f"Parcelas con área o estrato distintos entre filas: {', '.join(inconsistentes[inconsistentes].index[:10])}")
+    sin_area = ~(atributos['Área (m²)'] > 0)
+    if sin_area.any():
+        raise ValueError(f"Parcelas sin área válida: {', '.join(atributos.index[sin_area][:10])}")
+
+    areas_estrato = None
+    if 'Área Estrato (ha)' in df_arboles.columns:
+        areas_estrato = pd.to_numeric(df_arboles['Área Estrato (ha)'], errors='coerce').groupby(estrato).max()
+        if not (areas_estrato > 0).all():
+            raise ValueError("La columna 'Área Estrato (ha)' debe tener un área positiva para cada estrato.")
+
+    dap = pd.to_numeric(df_arboles['DAP (cm)'], errors='coerce').to_numpy(dtype=float)
+    altura = pd.to_numeric(df_arboles['Altura (m)'], errors='coerce').to_numpy(dtype=float)
+    rho = especie.map(densidades).to_numpy(dtype=float)
+    sin_densidad = np.isnan(rho)
+    especies_no_reconocidas = {nombre: int(conteo) for nombre, conteo in especie[sin_densidad].value_counts().items()}
+    validos = ~sin_densidad & (dap > 0) & (altura > 0) & (arboles > 0)
+
+    _, _, _, co2e_kg = calcular_co2_vectorizado(rho[validos], dap[validos], altura[validos])
+    area_arbol_ha = parcela[validos].map(atributos['Área (m²)']).to_numpy(dtype=float) / M2_POR_HA
+    co2e_ha = co2e_kg * arboles[validos] / FACTOR_KG_A_TON / area_arbol_ha
+
+    y = pd.DataFrame({'Parcela': parcela[validos].to_numpy(), 'Especie': especie[validos].to_numpy(), 'CO2e': co2e_ha})
+    y = y.pivot_table(index='Parcela', columns='Especie', values='CO2e', aggfunc='sum', fill_value=0.0)
+    y = y.reindex(atributos.index, fill_value=0.0)
+    y.columns.name = None
+
+    return {
+        'y': y,
+        'estrato': atributos['Estrato'],
+        'area_m2': atributos['Área (m²)'],
+        'areas_estrato': areas_estrato,
+        'filas_leidas': len(df_arboles),
+        'filas_descartadas': int((~validos).sum()),
+        'especies_no_reconocidas': especies_no_reconocidas,
+        'especies_resueltas': especies_resueltas,
+    }
+
+
+def asignar_areas_estrato(estrato_parcelas, hectareas, areas_declaradas=None):
+    """Hectáreas de cada estrato: las declaradas o, si no hay, las del proyecto repartidas según las parcelas."""
+    if areas_declaradas is not None:
+        return areas_declaradas.astype(float)
+    if not hectareas or hectareas <= 0:
+        raise ValueError("Indique las hectáreas del proyecto (sección 1) o la columna 'Área Estrato (ha)' en el archivo.")
+    conteo = estrato_parcelas.value_counts()
+    return (conteo / conteo.sum() * float(hectareas)).astype(float)
+
+
+def estimar_estratificado(y, estrato_parcelas, areas_estrato, confianza=CONFIANZA_POR_DEFECTO):
+    """
+    Estimador estratificado para todas las columnas de `y` a la vez (especies y 'Total').
+    Retorna (tabla por estrato, tabla por columna) con media por ha, total, error estándar e IC.
+    """
+    y = y.assign(**{TOTAL: y.sum(axis=1)})
+    grupos = y.groupby(estrato_parcelas.to_numpy())
+    n_h = grupos.size().astype(float)
+    media_h = grupos.mean()
+    var_h = grupos.var(ddof=1).fillna(0.0) # Un estrato con una sola parcela no aporta varianza
+    a_h = areas_estrato.reindex(media_h.index).to_numpy(dtype=float)[:, None]
+
+    total = (a_h * media_h).sum()
+    componente = a_h**2 * var_h / n_h.to_numpy()[:, None] # Var(T) por estrato
+    varianza = componente.sum()
+    # Grados de libertad de Satterthwaite (estratos con n_h > 1)
+    gl_h = (n_h - 1).to_numpy()[:, None]
+    denominador = (componente**2 / np.where(gl_h > 0, gl_h, np.inf)).sum()
+    gl = (varianza**2 / denominador.where(denominador > 0)).fillna(np.inf)
+    ee = np.sqrt(varianza)
+    t = gl.map(lambda g: cuantil_t(g, confianza))
+    area_total = a_h.sum()
+
+    por_columna = pd.DataFrame({
+        'CO2e (tCO2e/ha)': total / area_total,
+        'CO2e Total (Ton)': total,
+        'Error Estándar (Ton)': ee,
+        'Error Relativo (%)': np.where(total > 0, ee / total.where(total > 0) * 100, np.nan),
+        'IC Inferior (Ton)': (total - t * ee).clip(lower=0.0),
+        'IC Superior (Ton)': total + t * ee,
+    })
+    por_columna.index.name = 'Especie'
+
+    t_h = np.array([cuantil_t(g, confianza) for g in (n_h - 1).to_numpy()])
+    ee_h = np.sqrt(var_h[TOTAL] / n_h)
+    por_estrato = pd.DataFrame({
+        'Parcelas': n_h.astype(int),
+        'Área (ha)': a_h[:, 0],
+        'CO2e (tCO2e/ha)': media_h[TOTAL],
+        'Error Estándar (tCO2e/ha)': ee_h,
+        'IC Inferior (tCO2e/ha)': (media_h[TOTAL] - t_h * ee_h).clip(lower=0.0),
+        'IC Superior (tCO2e/ha)': media_h[TOTAL] + t_h * ee_h,
+        'CO2e Total (Ton)': a_h[:, 0] * media_h[TOTAL],
+    })
+    por_estrato.index.name = 'Estrato'
+    return por_estrato, por_columna
+
+
+def replicas_bootstrap(bloques_estrato, areas, n_replicas, semilla):
+    """
+    Réplicas de bootstrap (se ejecuta en los procesos del pool). `bloques_estrato` es la lista de
+    matrices parcelas × columnas de cada estrato y `areas` sus hectáreas. Retorna una matriz
+    réplicas × columnas con el total estimado en cada réplica.
+    """
+    rng = np.random.default_rng(semilla)
+    totales = np.zeros((n_replicas, bloques_estrato[0].shape[1]))
+    for bloque, area in zip(bloques_estrato, areas):
+        indices = rng.integers(0, len(bloque), size=(n_replicas, len(bloque)))
+        totales += area * bloque[indices].mean(axis=1)
+    return totales
+
+
+def bootstrap_paralelo(y, estrato_parcelas, areas_estrato, n_replicas=REPLICAS_POR_DEFECTO, semilla=SEMILLA_POR_DEFECTO, trabajadores=None, on_progreso=None, cancelado=None):
+    """
+    Distribución bootstrap del total (columnas de `y` más 'Total'), calculada por bloques de
+    REPLICAS_POR_BLOQUE réplicas en un pool de procesos. Retorna un DataFrame réplicas × columnas.
+    Si `cancelado()` retorna True entre bloques, cancela los pendientes y lanza TrabajoCancelado.
+    """
+    y = y.assign(**{TOTAL: y.sum(axis=1)})
+    matriz = y.to_numpy(dtype=float)
+    codigos = estrato_parcelas.to_numpy()
+    estratos = list(pd.unique(codigos))
+    bloques_estrato = [matriz[codigos == estrato] for estrato in estratos]
+    areas = [float(areas_estrato[estrato]) for estrato in estratos]
+
+    tamanos = [min(REPLICAS_POR_BLOQUE, n_replicas - inicio) for inicio in range(0, n_replicas, REPLICAS_POR_BLOQUE)]
+    semillas = np.random.SeedSequence(semilla).spawn(len(tamanos))
+    resultados = [None] * len(tamanos)
+    with ProcessPoolExecutor(max_workers=trabajadores or os.cpu_count() or 1) as pool:
+        futuros = {pool.submit(replicas_bootstrap, bloques_estrato, areas, tamano, semilla_bloque): i for i, (tamano, semilla_bloque) in enumerate(zip(tamanos, semillas))}
+        for completados, futuro in enumerate(as_completed(futuros), start=1):
+            if cancelado is not None and cancelado():
+                for pendiente in futuros:
+                    pendiente.cancel()
+                raise TrabajoCancelado()
+            resultados[futuros[futuro]] = futuro.result()
+            if on_progreso is not None:
+                on_progreso(completados / len(futuros))
+    return pd.DataFrame(np.vstack(resultados), columns=y.columns)
+
+
+def estimar_parcelas(df_arboles, current_species_info, hectareas, confianza=CONFIANZA_POR_DEFECTO, n_replicas=REPLICAS_POR_DEFECTO, semilla=SEMILLA_POR_DEFECTO, indice_especies=None, on_progreso=None, cancelado=None):
+    """
+    Estimación completa: matriz de parcelas, estimador estratificado y bootstrap. Retorna un
+    diccionario con las tablas por estrato y por especie, el total del proyecto (con IC analítico
+    y bootstrap), la distribución bootstrap del total y los conteos de control.
+    """
+    datos = matriz_parcelas(df_arboles, current_species_info, indice_especies=indice_especies)
+    y, estrato = datos['y'], datos['estrato']
+    areas = asignar_areas_estrato(estrato, hectareas, datos['areas_estrato'])
+    faltantes = sorted(set(estrato) - set(areas.index))
+    if faltantes:
+        raise ValueError(f"Estratos sin área: {', '.join(faltantes)}")
+
+    por_estrato, por_columna = estimar_estratificado(y, estrato, areas, confianza)
+    replicas = bootstrap_paralelo(y, estrato, areas, n_replicas=n_replicas, semilla=semilla, on_progreso=on_progreso, cancelado=cancelado)
+    alfa = (1 - confianza) / 2
+    por_columna['IC Bootstrap Inferior (Ton)'] = replicas.quantile(alfa)
+    por_columna['IC Bootstrap Superior (Ton)'] = replicas.quantile(1 - alfa)
+
+    total = por_columna.loc[TOTAL]
+    return {
+        'por_estrato': por_estrato.reset_index(),
+        'por_especie': por_columna.drop(index=TOTAL).sort_values('CO2e Total (Ton)', ascending=False).reset_index(),
+        'total': {
+            'co2e_ton': float(total['CO2e Total (Ton)']),
+            'co2e_ha': float(total['CO2e (tCO2e/ha)']),
+            'ee_ton': float(total['Error Estándar (Ton)']),
+            'error_relativo': float(total['Error Relativo (%)']),
+            'ic_inferior': float(total['IC Inferior (Ton)']),
+            'ic_superior': float(total['IC Superior (Ton)']),
+            'ic_boot_inferior': float(total['IC Bootstrap Inferior (Ton)']),
+            'ic_boot_superior': float(total['IC Bootstrap Superior (Ton)']),
+        },
+        'replicas_total': replicas[TOTAL].to_numpy(),
+        'confianza': confianza,
+        'hectareas': float(areas.sum()),
+        'parcelas': len(y),
+        'filas_leidas': datos['filas_leidas'],
+        'filas_descartadas': datos['filas_descartadas'],
+        'especies_no_reconocidas': datos['especies_no_reconocidas'],
+        'especies_resueltas': datos['especies_resueltas'],
+    }
@@ -0,0 +1,228 @@
+"""
+Archivos de proyecto y portafolio multi-proyecto.
+
+Formato de archivo (.json, UTF-8):
+    {
+      "formato": "proyecto-nbs", "version": 1, "version_motor": "...",
+      "proyecto": "...", "hectareas": 0.0, "sede": "Planta Piura" | null, "riego": true,
+      "lotes": [{...}, ...],                  # lotes del inventario (sin 'Detalle Cálculo')
+      "agua_anual_lotes_l": [...] | null,     # agua anual por lote si venía del balance hídrico
+      "mediciones": [{...}, ...]              # campañas de medición (ID Lote, Fecha ISO y columnas)
+    }
+
+El portafolio resume cada archivo con el motor (recalcular_inventario) en un pool de procesos
+(un proceso por núcleo) y memoriza los resúmenes por huella SHA-256 del contenido y versión del
+motor: al volver a abrir el portafolio solo se recalculan los archivos nuevos o modificados
+(y, con la caché en disco, tampoco tras reiniciar el servidor).
+"""
+import hashlib
+import json
+import math
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from cache_disco import clave_contenido
+from motor_co2e import VERSION_MOTOR, columnas_coordenadas, df_columns_numeric, df_columns_types, recalcular_inventario
+
+FORMATO_PROYECTO = 'proyecto-nbs'
+VERSION_FORMATO = 1
+# Errores de un archivo de proyecto mal formado (leer_proyecto valida la estructura; los valores
+# de los lotes pueden fallar aún en el motor)
+ERRORES_ARCHIVO_PROYECTO = (ValueError, KeyError, TypeError, AttributeError)
+COLUMNAS_RESUMEN = ['Proyecto', 'Sede', 'Hectáreas', 'Riego', 'Lotes', 'Árboles', 'CO2e (Ton)', 'Agua Anual (L)', 'Costo (S/)']
+
+
+def _valor_json(valor):
+    """Convierte escalares de numpy/pandas a tipos JSON (NaN -> null)."""
+    if isinstance(valor, (np.integer,)):
+        return int(valor)
+    if isinstance(valor, (float, np.floating)):
+        return None if math.isnan(valor) else float(valor)
+    if isinstance(valor, pd.Timestamp):
+        return valor.isoformat()
+    return valor
+
+
+def serializar_proyecto(proyecto, hectareas, riego_activado, lotes, mediciones=None, sede=None, agua_anual_lote_l=None):
+    """Contenido (bytes) del archivo de proyecto. `mediciones` es el almacén (índice ID Lote, Fecha)."""
+    datos = {
+        'formato': FORMATO_PROYECTO,
+        'version': VERSION_FORMATO,
+        'version_motor': VERSION_MOTOR,
+        'proyecto': proyecto,
+        'hectareas': float(hectareas or 0.0),
+        'sede': sede,
+        'riego': bool(riego_activado),
+        'lotes': [
+            {clave: _valor_json(valor) for clave, valor in lote.items() if clave != 'Detalle Cálculo'}
+            for lote in lotes
+        ],
+        'agua_anual_lotes_l': None if agua_anual_lote_l is None else [_valor_json(v) for v in agua_anual_lote_l],
+        'mediciones': [] if mediciones is None else [
+            {clave: _valor_json(valor) for clave, valor in fila.items()}
+            for fila in mediciones.reset_index().to_dict('records')
+        ],
+    }
+    return json.dumps(datos, ensure_ascii=False, indent=1).encode('utf-8')
+
+
+def leer_proyecto(contenido):
+    """Valida y decodifica un archivo de proyecto. Lanza ValueError si el archivo no es válido."""
+    try:
+        datos = json.loads(contenido)
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"no es un JSON válido ({e})")
+    if not isinstance(datos, dict) or datos.get('formato') != FORMATO_PROYECTO:
+        raise ValueError("no es un archivo de proyecto de la plataforma")
+    version = datos.get('version', 0)
+    if not isinstance(version, int) or isinstance(version, bool):
+        raise ValueError(f"versión de formato inválida: {version!r}")
+    if version > VERSION_FORMATO:
+        raise ValueError(f"versión de formato {version} no soportada")
+    if not isinstance(datos.get('lotes'), list) or not all(isinstance(lote, dict) for lote in datos['lotes']):
+        raise ValueError("no contiene la lista de lotes (cada lote debe ser un objeto)")
+    agua = datos.setdefault('agua_anual_lotes_l', None)
+    if agua is not None and not isinstance(agua, list):
+        raise ValueError("el agua anual por lote debe ser una lista")
+    if agua is not None and len(agua) != len(datos['lotes']):
+        raise ValueError("el agua anual por lote no coincide con la cantidad de lotes")
+    mediciones = datos.setdefault('mediciones', [])
+    if not isinstance(mediciones, list) or not all(isinstance(fila, dict) for fila in mediciones):
+        raise ValueError("las mediciones deben ser una lista de objetos")
+    try:
+        datos['hectareas'] = float(datos.get('hectareas') or 0.0)
+    except (TypeError, ValueError):
+        raise ValueError(f"hectáreas inválidas: {datos.get('hectareas')!r}")
+    datos['riego'] = bool(datos.get('riego', False))
+    for clave in ('proyecto', 'sede'):
+        if datos.get(clave) is not None and not isinstance(datos[clave], str):
+            raise ValueError(f"'{clave}' debe ser un texto")
+    for i, lote in enumerate(datos['lotes'], start=1):
+        _completar_lote(lote, i)
+    return datos
+
+
+def _completar_lote(lote, posicion):
+    """Completa las columnas de entrada que faltan con los valores por defecto del motor y valida las numéricas."""
+    for columna, tipo in df_columns_types.items():
+        if columna == 'Detalle Cálculo':
+            continue
+        valor = lote.get(columna)
+        if columna in columnas_coordenadas:
+            lote[columna] = np.nan if valor is None else valor
+        elif valor is None:
+            lote[columna] = '' if tipo == str else tipo(0)
+        elif columna in df_columns_numeric and (isinstance(valor, bool) or not isinstance(valor, (int, float))):
+            try:
+                lote[columna] = float(valor)
+            except (TypeError, ValueError):
+                raise ValueError(f"lote {posicion}: '{columna}' no es numérico ({valor!r})")
+
+
+def huella_contenido(contenido):
+    """Clave de caché de un archivo: su SHA-256 y la versión del motor."""
+    return f"{hashlib.sha256(contenido).hexdigest()}:{VERSION_MOTOR}"
+
+
+def resumir_proyecto(contenido):
+    """Totales de un archivo de proyecto (se ejecuta en los procesos del pool)."""
+    datos = leer_proyecto(contenido)
+    agua = datos['agua_anual_lotes_l']
+    df = recalcular_inventario(
+        datos['lotes'], riego_activado=datos['riego'], incluir_detalle=False,
+        agua_anual_lote_l=None if agua is None else np.array(agua, dtype=float)
+    )
+    return {
+        'Proyecto': datos.get('proyecto') or '',
+        'Sede': datos.get('sede') or '',
+        'Hectáreas': float(datos.get('hectareas') or 0.0),
+        'Riego': bool(datos['riego']),
+        'Lotes': len(df),
+        'Árboles': float(df['Cantidad'].sum()),
+        'CO2e (Ton)': float(df['CO2e Lote (Ton)'].sum()),
+        'Agua Anual (L)': float(df['Consumo Agua Total Lote (L)'].sum()),
+        'Costo (S/)': float(df['Costo Total Lote (S/)'].sum()),
+    }
+
+
+def resumir_proyecto_seguro(contenido):
+    """Como resumir_proyecto, pero un archivo inválido no detiene el portafolio: retorna {'Error': ...}."""
+    try:
+        return resumir_proyecto(contenido)
+    except ERRORES_ARCHIVO_PROYECTO as e:
+        return {'Error': str(e) or type(e).__name__}
+
+
+class ResumenesPortafolio:
+    """
+    Resúmenes por proyecto memorizados por huella de contenido, calculados en paralelo en un pool
+    de procesos que se crea al primer uso y se reutiliza entre aperturas del portafolio. Con
+    `cache_disco` (cache_disco.CacheDisco) los resúmenes también sobreviven a un reinicio.
+    """
+
+    def __init__(self, trabajadores=None, cache_disco=None):
+        self.trabajadores = trabajadores or os.cpu_count() or 1
+        self.cache_disco = cache_disco
+        self._resumenes = {}
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def _obtener_pool(self):
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.trabajadores)
+        return self._pool
+
+    def resumir(self, archivos, on_progreso=None):
+        """
+        Resume una lista de (nombre, contenido). Retorna (DataFrame con una fila por archivo,
+        cantidad de proyectos recalculados). Los archivos con contenido idéntico se calculan una vez.
+        """
+        claves = [huella_contenido(contenido) for _, contenido in archivos]
+        with self._lock:
+            pendientes = {clave: contenido for clave, (_, contenido) in zip(claves, archivos) if clave not in self._resumenes}
+        if self.cache_disco is not None:
+            for clave in list(pendientes):
+                resumen = self.cache_disco.obtener(clave_contenido('portafolio', clave))
+                if resumen is not None:
+                    with self._lock:
+                        self._resumenes[clave] = resumen
+                    del pendientes[clave]
+
+        if pendientes:
+            pool = self._obtener_pool()
+            futuros = {pool.submit(resumir_proyecto_seguro, contenido): clave for clave, contenido in pendientes.items()}
+            for i, futuro in enumerate(as_completed(futuros), start=1):
+                resumen = futuro.result()
+                with self._lock:
+                    self._resumenes[futuros[futuro]] = resumen
+                if self.cache_disco is not None and not resumen.get('Error'):
+                    self.cache_disco.guardar(clave_contenido('portafolio', futuros[futuro]), resumen, 'portafolio')
+                if on_progreso is not None:
+                    on_progreso(i / len(futuros))
+
+        with self._lock:
+            filas = [{'Archivo': nombre, **self._resumenes[clave]} for (nombre, _), clave in zip(archivos, claves)]
+        df = pd.DataFrame(filas, columns=['Archivo'] + COLUMNAS_RESUMEN + ['Error'])
+        return df, len(pendientes)
+
+    def cerrar(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+def cobertura_huella(df_resumen, huella_corporativa):
+    """
+    Cobertura de la huella corporativa (miles de tCO2e por sede) con la captura de los proyectos
+    asignados a cada sede. `df_resumen` contiene solo los proyectos válidos. Retorna un DataFrame por sede.
+    """
+    captura = df_resumen.groupby('Sede')['CO2e (Ton)'].sum()
+    df = pd.DataFrame({'Sede': list(huella_corporativa.keys()), 'Huella (Miles tCO2e)': list(huella_corporativa.values())})
+    df['Proyectos'] = df['Sede'].map(df_resumen.groupby('Sede').size()).fillna(0).astype(int)
+    df['Captura (Miles tCO2e)'] = df['Sede'].map(captura).fillna(0.0) / 1000.0
+    df['Compensado (%)'] = np.where(df['Huella (Miles tCO2e)'] > 0, df['Captura (Miles tCO2e)'] / df['Huella (Miles tCO2e)'] * 100, 0.0)
+    return df
@@ -0,0 +1,214 @@
+"""
+Proyectos compartidos: varios coordinadores añaden lotes y editan especies del mismo proyecto.
+
+Cada proyecto es una base SQLite propia (modo WAL) en el directorio de proyectos: las lecturas
+nunca esperan a las escrituras, y dos proyectos no comparten ningún candado. Dentro de un
+proyecto no hay candados de aplicación: cada sesión acumula sus cambios y los escribe por lotes
+en transacciones cortas (como máximo ESCRITURAS_POR_TRANSACCION filas), de modo que diez
+coordinadores añadiendo lotes a la vez solo se turnan durante milisegundos.
+
+Concurrencia optimista:
+  - Los lotes solo se anexan, por lo que dos sesiones nunca se pisan; un 'ID Lote' que ya existe
+    en el proyecto es un conflicto (el lote queda solo en la sesión que lo creó).
+  - Cada especie tiene una versión. Una edición lleva la versión que la sesión vio por última vez
+    y solo se aplica si sigue siendo la actual; si otra sesión la cambió antes, es un conflicto y
+    gana el valor del proyecto. Una especie eliminada queda como marca (datos NULL) con su versión.
+
+Cada escritura avanza la secuencia del proyecto; cambios_desde(secuencia) entrega solo lo escrito
+después, con lo que las demás sesiones actualizan sus totales de forma incremental.
+
+Configuración por variables de entorno: NBS_DIRECTORIO_PROYECTOS.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+
+import pandas as pd
+
+DIRECTORIO_POR_DEFECTO = os.environ.get('NBS_DIRECTORIO_PROYECTOS', os.path.join(tempfile.gettempdir(), 'nbs_proyectos'))
+ESPERA_BLOQUEO_S = 30 # Espera máxima por el candado de escritura de SQLite entre sesiones y procesos
+ESCRITURAS_POR_TRANSACCION = 5_000 # Filas por transacción: una importación grande no retiene el candado
+PARAMETROS_POR_CONSULTA = 500 # IDs por consulta IN (...) (límite de variables de SQLite)
+
+
+def nombre_archivo_proyecto(nombre):
+    """Archivo de la base de un proyecto: nombre legible y un sufijo del hash (nombres distintos nunca colisionan)."""
+    legible = re.sub(r'[^0-9A-Za-z_-]+', '_', nombre.strip())[:40].strip('_') or 'proyecto'
+    return f"{legible}-{hashlib.sha256(nombre.strip().encode('utf-8')).hexdigest()[:10]}.sqlite"
+
+
+def a_json(valores):
+    """dict -> JSON; los escalares de numpy pasan a tipos de Python y NaN se conserva (p. ej. coordenadas vacías)."""
+    return json.dumps(valores, ensure_ascii=False, default=lambda valor: valor.item())
+
+
+def lote_a_json(lote):
+    """Lote serializado para el proyecto (sin 'Detalle Cálculo': se regenera al leerlo)."""
+    return a_json({clave: valor for clave, valor in lote.items() if clave != 'Detalle Cálculo'})
+
+
+def cambios_especies(df_antes, df_despues):
+    """Especies añadidas o modificadas (especie -> fila como dict) y eliminadas (especie -> None) entre dos tablas."""
+    antes = df_antes.set_index('Especie')
+    despues = df_despues.set_index('Especie')
+    comunes = despues.index.intersection(antes.index)
+    viejas = antes.loc[comunes, despues.columns]
+    nuevas = despues.loc[comunes]
+    iguales = (viejas.eq(nuevas) | (viejas.isna() & nuevas.isna())).all(axis=1)
+    modificadas = comunes[~iguales.to_numpy()].append(despues.index.difference(antes.index))
+    cambios = {fila['Especie']: fila for fila in despues.loc[modificadas].reset_index().to_dict('records')}
+    cambios.update(dict.fromkeys(antes.index.difference(despues.index)))
+    return cambios
+
+
+def aplicar_cambios_especies(df_especies, cambios):
+    """Tabla de especies con los cambios del proyecto (especie -> fila o None); las existentes conservan su posición."""
+    tabla = df_especies.set_index('Especie')
+    filas = [datos for datos in cambios.values() if datos is not None]
+    actualizadas = pd.DataFrame(filas, columns=df_especies.columns).set_index('Especie') if filas else tabla.iloc[:0]
+    tabla = tabla.drop(index=[especie for especie, datos in cambios.items() if datos is None and especie in tabla.index])
+    comunes = actualizadas.index.intersection(tabla.index)
+    tabla.loc[comunes] = actualizadas.loc[comunes, tabla.columns]
+    agregadas = actualizadas.loc[~actualizadas.index.isin(tabla.index), tabla.columns]
+    return pd.concat([tabla, agregadas]).reset_index() if len(agregadas) else tabla.reset_index()
+
+
+class ProyectoCompartido:
+    """Base de un proyecto compartido. Una instancia sirve a todos los hilos (una conexión por hilo)."""
+
+    def __init__(self, nombre, directorio=DIRECTORIO_POR_DEFECTO):
+        self.nombre = nombre.strip()
+        os.makedirs(directorio, exist_ok=True)
+        self.ruta = os.path.join(directorio, nombre_archivo_proyecto(self.nombre))
+        self._local = threading.local()
+        with self._conexion() as con:
+            con.execute("CREATE TABLE IF NOT EXISTS meta (clave TEXT PRIMARY KEY, valor)")
+            con.execute("INSERT OR IGNORE INTO meta (clave, valor) VALUES ('secuencia', 0), ('nombre', ?)", (self.nombre,))
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS lotes ("
+                " secuencia INTEGER PRIMARY KEY, id_lote TEXT NOT NULL UNIQUE, datos TEXT NOT NULL,"
+                " autor TEXT NOT NULL, sesion TEXT NOT NULL, momento REAL NOT NULL)"
+            )
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS especies ("
+                " especie TEXT PRIMARY KEY, datos TEXT, version INTEGER NOT NULL, secuencia INTEGER NOT NULL,"
+                " autor TEXT NOT NULL, sesion TEXT NOT NULL, momento REAL NOT NULL)"
+            )
+            con.execute("CREATE INDEX IF NOT EXISTS especies_secuencia ON especies (secuencia)")
+
+    def _conexion(self):
+        con = getattr(self._local, 'conexion', None)
+        if con is None:
+            con = sqlite3.connect(self.ruta, timeout=ESPERA_BLOQUEO_S, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexion = con
+        return con
+
+    def _ids_existentes(self, con, ids):
+        existentes = set()
+        for inicio in range(0, len(ids), PARAMETROS_POR_CONSULTA):
+            parte = ids[inicio:inicio + PARAMETROS_POR_CONSULTA]
+            marcas = ','.join('?' * len(parte))
+            existentes.update(fila[0] for fila in con.execute(f"SELECT id_lote FROM lotes WHERE id_lote IN ({marcas})", parte))
+        return existentes
+
+    def escribir(self, lotes=(), especies=None, autor='', sesion=''):
+        """
+        Escribe un lote de cambios. `lotes`: dicts a anexar. `especies`: especie -> (datos | None
+        para eliminarla, versión vista por la sesión; 0 si nunca la vio en el proyecto).
+        Retorna {'secuencia', 'lotes' (aceptados), 'especies' (especie -> versión nueva),
+        'conflictos' (lista de dicts con 'tipo', 'clave' y 'motivo')}.
+        """
+        resultado = {'secuencia': None, 'lotes': 0, 'especies': {}, 'conflictos': []}
+        lotes = list(lotes)
+        especies = list((especies or {}).items())
+        for inicio in range(0, max(len(lotes), len(especies), 1), ESCRITURAS_POR_TRANSACCION):
+            fin = inicio + ESCRITURAS_POR_TRANSACCION
+            self._transaccion(lotes[inicio:fin], especies[inicio:fin], autor, sesion, resultado)
+        return resultado
+
+    def _transaccion(self, lotes, especies, autor, sesion, resultado):
+        con = self._conexion()
+        ahora = time.time()
+        con.execute("BEGIN IMMEDIATE") # El candado se toma solo durante la escritura de este lote
+        try:
+            secuencia = con.execute("SELECT valor FROM meta WHERE clave = 'secuencia'").fetchone()[0]
+
+            existentes = self._ids_existentes(con, [str(lote['ID Lote']) for lote in lotes])
+            filas = []
+            for lote in lotes:
+                id_lote = str(lote['ID Lote'])
+                if id_lote in existentes:
+                    resultado['conflictos'].append({'tipo': 'lote', 'clave': id_lote, 'motivo': "el ID ya existe en el proyecto"})
+                    continue
+                existentes.add(id_lote)
+                secuencia += 1
+                filas.append((secuencia, id_lote, lote_a_json(lote), autor, sesion, ahora))
+            con.executemany("INSERT INTO lotes (secuencia, id_lote, datos, autor, sesion, momento) VALUES (?, ?, ?, ?, ?, ?)", filas)
+            resultado['lotes'] += len(filas)
+
+            for especie, (datos, version_vista) in especies:
+                actual = con.execute("SELECT version, autor FROM especies WHERE especie = ?", (especie,)).fetchone()
+                version_actual = actual[0] if actual else 0
+                if version_actual != version_vista:
+                    resultado['conflictos'].append({
+                        'tipo': 'especie', 'clave': especie,
+                        'motivo': f"modificada por {(actual[1] if actual else '') or 'otra sesión'} (versión {version_actual}, esta sesión vio la {version_vista})",
+                    })
+                    continue
+                secuencia += 1
+                contenido = None if datos is None else a_json(datos)
+                con.execute(
+                    "INSERT OR REPLACE INTO especies (especie, datos, version, secuencia, autor, sesion, momento) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (especie, contenido, version_actual + 1, secuencia, autor, sesion, ahora)
+                )
+                resultado['especies'][especie] = version_actual + 1
+
+            con.execute("UPDATE meta SET valor = ? WHERE clave = 'secuencia'", (secuencia,))
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        resultado['secuencia'] = secuencia
+
+    def cambios_desde(self, secuencia):
+        """
+        Lo escrito después de `secuencia`, de una misma instantánea de la base:
+        {'secuencia': última, 'lotes': [(sesión, autor, lote)], 'especies': [(especie, datos | None, versión, sesión)]}.
+        """
+        con = self._conexion()
+        con.execute("BEGIN") # Lectura consistente (WAL: no bloquea ni espera a los escritores)
+        try:
+            ultima = con.execute("SELECT valor FROM meta WHERE clave = 'secuencia'").fetchone()[0]
+            lotes = [
+                (fila_sesion, fila_autor, json.loads(datos))
+                for fila_sesion, fila_autor, datos in con.execute(
+                    "SELECT sesion, autor, datos FROM lotes WHERE secuencia > ? ORDER BY secuencia", (secuencia,)
+                )
+            ]
+            especies = [
+                (especie, None if datos is None else json.loads(datos), version, fila_sesion)
+                for especie, datos, version, fila_sesion in con.execute(
+                    "SELECT especie, datos, version, sesion FROM especies WHERE secuencia > ? ORDER BY secuencia", (secuencia,)
+                )
+            ]
+        finally:
+            con.execute("COMMIT")
+        return {'secuencia': ultima, 'lotes': lotes, 'especies': especies}
+
+    def resumen(self):
+        """Lotes, especies editadas y lotes por autor del proyecto."""
+        con = self._conexion()
+        por_autor = dict(con.execute("SELECT autor, COUNT(*) FROM lotes GROUP BY autor ORDER BY COUNT(*) DESC").fetchall())
+        return {
+            'lotes': sum(por_autor.values()),
+            'especies': con.execute("SELECT COUNT(*) FROM especies WHERE datos IS NOT NULL").fetchone()[0],
+            'por_autor': por_autor,
+            'secuencia': con.execute("SELECT valor FROM meta WHERE clave = 'secuencia'").fetchone()[0],
+        }
@@ -0,0 +1,142 @@
+"""
+Prueba de carga de la API local (api_co2e.py).
+
+Lanza clientes concurrentes con conexiones HTTP persistentes que envían lotes aleatorios a
+/lote (o /lotes), mide rendimiento (lotes/s) y latencias, y verifica que cada respuesta
+coincide con motor_co2e.recalcular_inventario evaluado directamente (hasta el redondeo de la
+última cifra: la API usa las fórmulas vectorizadas, ver api_co2e.py).
+
+Uso:
+    python prueba_carga_api.py --servidor-local --clientes 32 --peticiones 200
+    python prueba_carga_api.py --url http://127.0.0.1:8765 --lotes-por-peticion 10
+"""
+import argparse
+import http.client
+import json
+import random
+import threading
+import time
+from urllib.parse import urlparse
+
+import numpy as np
+
+from api_co2e import crear_servidor, normalizar_lote
+from motor_co2e import DENSIDADES_BASE, columnas_salida, recalcular_inventario
+
+TOLERANCIA_RELATIVA = 1e-12 # Potencia vectorizada de numpy frente a la escalar del motor
+
+
+def lote_aleatorio(rng):
+    especie = rng.choice(list(DENSIDADES_BASE))
+    datos = DENSIDADES_BASE[especie]
+    return {
+        'Especie': especie,
+        'Cantidad': rng.randint(1, 500),
+        'Años Plantados': rng.randint(1, datos['Tiempo_Max_Anios']),
+        'DAP (cm)': round(rng.uniform(1.0, datos['DAP_Max']), 1),
+        'Altura (m)': round(rng.uniform(0.5, datos['Altura_Max']), 1),
+    }
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+
+def cliente(host, puerto, ruta, peticiones, lotes_por_peticion, semilla, latencias, enviados, errores):
+    rng = random.Random(semilla)
+    conexion = http.client.HTTPConnection(host, puerto, timeout=60)
+    for _ in range(peticiones):
+        lotes = [lote_aleatorio(rng) for _ in range(lotes_por_peticion)]
+        cuerpo = {'lote': lotes[0]} if ruta == '/lote' else {'lotes': lotes}
+        inicio = time.perf_counter()
+        try:
+            conexion.request('POST', ruta, body=json.dumps(cuerpo).encode('utf-8'),
+                             headers={'Content-Type': 'application/json'})
+            respuesta = conexion.getresponse()
+            datos = json.loads(respuesta.read())
+        except (OSError, http.client.HTTPException) as e:
+            errores.append(str(e))
+            conexion.close()
+            conexion = http.client.HTTPConnection(host, puerto, timeout=60)
+            continue
+        latencias.append(time.perf_counter() - inicio)
+        if respuesta.status != 200:
+            errores.append(datos.get('error', respuesta.status))
+            continue
+        resultados = [datos['resultado']] if ruta == '/lote' else datos['resultados']
+        enviados.append((lotes, resultados))
+    conexion.close()
+
+
+def verificar_paridad(enviados):
+    """
+    Compara cada resultado de la API con el motor evaluado directamente. Retorna los lotes que
+    difieren en más de TOLERANCIA_RELATIVA y la mayor diferencia relativa encontrada.
+    """
+    lotes = [normalizar_lote(lote) for lotes_peticion, _ in enviados for lote in lotes_peticion]
+    resultados_api = [r for _, resultados in enviados for r in resultados]
+    df_motor = recalcular_inventario(lotes, incluir_detalle=False)
+    esperados = df_motor[columnas_salida].to_numpy(dtype=float)
+    obtenidos = np.array([[r[columna] for columna in columnas_salida] for r in resultados_api], dtype=float).reshape(esperados.shape)
+    relativa = np.abs(obtenidos - esperados) / np.maximum(np.abs(esperados), np.finfo(float).tiny)
+    return int((relativa > TOLERANCIA_RELATIVA).any(axis=1).sum()), float(relativa.max(initial=0.0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API local de CO2e.")
+    parser.add_argument('--url', default='http://127.0.0.1:8765')
+    parser.add_argument('--servidor-local', action='store_true', help="Inicia la API en este proceso (puerto libre).")
+    parser.add_argument('--trabajadores', type=int, default=4)
+    parser.add_argument('--clientes', type=int, default=32)
+    parser.add_argument('--peticiones', type=int, default=200, help="Peticiones por cliente.")
+    parser.add_argument('--lotes-por-peticion', type=int, default=1)
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    servidor = None
+    if args.servidor_local:
+        servidor = crear_servidor('127.0.0.1', 0, trabajadores=args.trabajadores)
+        threading.Thread(target=servidor.serve_forever, daemon=True).start()
+        host, puerto = servidor.server_address[:2]
+    else:
+        url = urlparse(args.url)
+        host, puerto = url.hostname, url.port or 80
+
+    ruta = '/lote' if args.lotes_por_peticion == 1 else '/lotes'
+    latencias, enviados, errores = [], [], []
+    hilos = [
+        threading.Thread(target=cliente, args=(host, puerto, ruta, args.peticiones, args.lotes_por_peticion,
+                                               args.semilla + i, latencias, enviados, errores))
+        for i in range(args.clientes)
+    ]
+    inicio = time.perf_counter()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.perf_counter() - inicio
+
+    if servidor is not None:
+        coalescedor = servidor.RequestHandlerClass.coalescedor
+        if coalescedor.grupos_evaluados:
+            print(f"Lotes coalescidos: {coalescedor.lotes_coalescidos / coalescedor.grupos_evaluados:,.1f} por evaluación del motor ({coalescedor.grupos_evaluados:,} evaluaciones)")
+        servidor.shutdown()
+        servidor.server_close()
+
+    total_peticiones = len(latencias)
+    total_lotes = sum(len(lotes) for lotes, _ in enviados)
+    print(f"Peticiones: {total_peticiones} ({args.clientes} clientes, ruta {ruta}) en {duracion:.2f} s")
+    print(f"Rendimiento: {total_peticiones / duracion:,.0f} peticiones/s | {total_lotes / duracion:,.0f} lotes/s")
+    if latencias:
+        print("Latencia (ms): " + " | ".join(
+            f"p{p}={percentil(latencias, p) * 1000:.1f}" for p in (50, 95, 99)
+        ) + f" | máx={max(latencias) * 1000:.1f}")
+    print(f"Errores: {len(errores)}")
+    if enviados:
+        diferencias, maxima = verificar_paridad(enviados)
+        print(f"Paridad con el motor: {'OK' if diferencias == 0 else f'{diferencias} lotes distintos'} (diferencia relativa máx. {maxima:.1e})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+"""
+Verificación de muestreo_parcelas.cuantil_t contra la tabla publicada de la t de Student
+(cuantiles bilaterales, 3 decimales). Los intervalos de confianza por parcelas dependen de estos
+valores con muy pocos grados de libertad (2 o 3 parcelas por estrato).
+
+Uso:
+    python prueba_cuantil_t.py
+"""
+import sys
+
+from muestreo_parcelas import cuantil_t
+
+# confianza -> {grados de libertad: t}
+TABLA_T = {
+    0.90: {1: 6.314, 2: 2.920, 3: 2.353, 4: 2.132, 5: 2.015, 10: 1.812, 20: 1.725, 30: 1.697, 120: 1.658},
+    0.95: {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+           10: 2.228, 15: 2.131, 20: 2.086, 30: 2.042, 60: 2.000, 120: 1.980},
+    0.99: {1: 63.657, 2: 9.925, 3: 5.841, 4: 4.604, 5: 4.032, 10: 3.169, 20: 2.845, 30: 2.750, 120: 2.617},
+}
+TOLERANCIA = 0.0005 # Media unidad del tercer decimal de la tabla
+
+
+def main():
+    fallas = 0
+    for confianza, valores in TABLA_T.items():
+        for gl, esperado in valores.items():
+            obtenido = cuantil_t(gl, confianza)
+            if abs(obtenido - esperado) > TOLERANCIA:
+                fallas += 1
+                print(f"gl={gl:>4} confianza={confianza:.0%}: {obtenido:.4f} (tabla {esperado:.3f})")
+    total = sum(len(valores) for valores in TABLA_T.values())
+    print(f"Cuantiles t: {total - fallas} de {total} coinciden con la tabla")
+    return 1 if fallas else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
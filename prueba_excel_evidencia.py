@@ -0,0 +1,78 @@
+"""
+Comparación de la exportación Excel con evidencia por hojas y con fórmulas vivas (exportacion_excel.py).
+
+Genera inventarios aleatorios de campo (cada lote con su propio DAP y Altura, es decir, una
+combinación distinta de datos por lote), los calcula con motor_co2e.recalcular_inventario y mide
+el tamaño del archivo y el tiempo de escritura de generar_excel_memoria en ambos modos. Con
+--verificar relee la hoja de fórmulas y comprueba que sus valores coinciden con el motor.
+
+Uso:
+    python prueba_excel_evidencia.py --lotes 100 1000 5000
+    python prueba_excel_evidencia.py --lotes 20000 --modos formulas --verificar
+"""
+import argparse
+import io
+import random
+import time
+
+import pandas as pd
+
+from api_co2e import normalizar_lote
+from exportacion_excel import HOJA_EVIDENCIA_FORMULAS, MODOS_EVIDENCIA, generar_excel_memoria
+from motor_co2e import DENSIDADES_BASE, recalcular_inventario
+
+
+def lote_aleatorio(rng, i):
+    especie = rng.choice(list(DENSIDADES_BASE))
+    datos = DENSIDADES_BASE[especie]
+    return normalizar_lote({
+        'ID Lote': f"L{i:07d}",
+        'Especie': especie,
+        'Cantidad': rng.randint(1, 500),
+        'Años Plantados': rng.randint(1, datos['Tiempo_Max_Anios']),
+        'DAP (cm)': round(rng.uniform(1.0, datos['DAP_Max']), 1),
+        'Altura (m)': round(rng.uniform(0.5, datos['Altura_Max']), 1),
+    })
+
+
+def exportar(df_inventario, modo):
+    inicio = time.perf_counter()
+    datos = generar_excel_memoria(
+        df_inventario, "Prueba evidencia", 1.0, df_inventario['Cantidad'].sum(),
+        df_inventario['CO2e Lote (Ton)'].sum(), 0.0, 0.0, modo_evidencia=modo
+    )
+    return datos, time.perf_counter() - inicio
+
+
+def verificar_formulas(datos, df_inventario):
+    """Diferencia máxima (Ton) entre los valores de las fórmulas guardados en el archivo y el motor."""
+    hoja = pd.read_excel(io.BytesIO(datos), sheet_name=HOJA_EVIDENCIA_FORMULAS)
+    return float((hoja['CO2e Lote (Ton)'] - df_inventario['CO2e Lote (Ton)'].to_numpy()).abs().max())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tamaño y tiempo de la exportación Excel por modo de evidencia.")
+    parser.add_argument('--lotes', type=int, nargs='+', default=[100, 1000, 5000])
+    parser.add_argument('--modos', nargs='+', choices=list(MODOS_EVIDENCIA), default=list(MODOS_EVIDENCIA))
+    parser.add_argument('--verificar', action='store_true', help="Relee la hoja de fórmulas y la compara con el motor.")
+    parser.add_argument('--semilla', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.semilla)
+    for n in args.lotes:
+        df_inventario = recalcular_inventario([lote_aleatorio(rng, i) for i in range(n)])
+        resultados = {}
+        for modo in args.modos:
+            datos, duracion = exportar(df_inventario, modo)
+            resultados[modo] = (len(datos), duracion)
+            linea = f"{n:>8,} lotes | {modo:<8} | {len(datos) / 1024 ** 2:8.2f} MB | {duracion:7.2f} s"
+            if args.verificar and modo == 'formulas':
+                linea += f" | diferencia máx. con el motor: {verificar_formulas(datos, df_inventario):.2e} Ton"
+            print(linea)
+        if len(resultados) == 2:
+            (tamano_hojas, tiempo_hojas), (tamano_formulas, tiempo_formulas) = resultados['hojas'], resultados['formulas']
+            print(f"{'':>14} | fórmulas/hojas: tamaño ×{tamano_formulas / tamano_hojas:.2f}, tiempo ×{tiempo_formulas / tiempo_hojas:.2f}")
+
+
+if __name__ == '__main__':
+    main()
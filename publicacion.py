@@ -0,0 +1,97 @@
+"""
+Publicación de tableros de solo lectura.
+
+Publicar congela los agregados ya calculados de un proyecto (totales, agregados por especie y la
+huella corporativa usada por el GAP) en un artefacto JSON inmutable. El visor de solo lectura
+(?publicacion=<id>) lo sirve sin llamar al motor ni inicializar la sesión.
+
+El ID es el SHA-256 del contenido (incluye la fecha de publicación): un archivo publicado nunca
+se sobrescribe, por lo que el visor puede memorizarlo por ID para todo el proceso sin invalidarlo.
+
+Formato (.json, UTF-8):
+    {
+      "formato": "publicacion-nbs", "version": 1, "publicado": "2024-01-01T00:00:00",
+      "proyecto": "...", "hectareas": 0.0, "sede": "Planta Piura" | null,
+      "riego": true, "balance_hidrico": false,
+      "totales": {"arboles": 0.0, "co2e_ton": 0.0, "costo": 0.0, "agua_l": 0.0},
+      "especies": [{"Especie": "...", "Total_CO2e_Ton": 0.0, ...}, ...],
+      "huella_corporativa": {"Planta Pacasmayo": 1265.15, ...}
+    }
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+
+import pandas as pd
+
+FORMATO_PUBLICACION = 'publicacion-nbs'
+VERSION_PUBLICACION = 1
+DIRECTORIO_POR_DEFECTO = os.environ.get('NBS_DIRECTORIO_PUBLICACIONES', os.path.join(tempfile.gettempdir(), 'nbs_publicaciones'))
+LONGITUD_ID = 20 # Caracteres hexadecimales del SHA-256 usados como ID
+PATRON_ID = re.compile(rf'^[0-9a-f]{{{LONGITUD_ID}}}$')
+
+
+def construir_publicacion(proyecto, hectareas, sede, riego_activado, balance_activo, totales, agregado_especie, huella_corporativa):
+    """Artefacto (dict) a publicar. `agregado_especie` es el agregado por especie (índice 'Especie')."""
+    return {
+        'formato': FORMATO_PUBLICACION,
+        'version': VERSION_PUBLICACION,
+        'publicado': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'proyecto': proyecto,
+        'hectareas': float(hectareas or 0.0),
+        'sede': sede,
+        'riego': bool(riego_activado),
+        'balance_hidrico': bool(balance_activo),
+        'totales': {clave: float(valor) for clave, valor in totales.items()},
+        'especies': [
+            {clave: (valor if isinstance(valor, str) else float(valor)) for clave, valor in fila.items()}
+            for fila in agregado_especie.reset_index().to_dict('records')
+        ],
+        'huella_corporativa': {sede_hcc: float(valor) for sede_hcc, valor in huella_corporativa.items()},
+    }
+
+
+def ruta_publicacion(id_publicacion, directorio=DIRECTORIO_POR_DEFECTO):
+    """Ruta del archivo de una publicación. Lanza ValueError si el ID no tiene el formato esperado."""
+    if not PATRON_ID.match(id_publicacion or ''):
+        raise ValueError(f"ID de publicación no válido: {id_publicacion!r}")
+    return os.path.join(directorio, f"{id_publicacion}.json")
+
+
+def guardar_publicacion(artefacto, directorio=DIRECTORIO_POR_DEFECTO):
+    """Escribe el artefacto (si no existía ya) y retorna su ID."""
+    contenido = json.dumps(artefacto, ensure_ascii=False).encode('utf-8')
+    id_publicacion = hashlib.sha256(contenido).hexdigest()[:LONGITUD_ID]
+    ruta = ruta_publicacion(id_publicacion, directorio)
+    if not os.path.exists(ruta):
+        os.makedirs(directorio, exist_ok=True)
+        # Escritura atómica: un visor nunca lee un archivo a medio escribir
+        descriptor, temporal = tempfile.mkstemp(dir=directorio, suffix='.tmp')
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(contenido)
+        os.replace(temporal, ruta)
+    return id_publicacion
+
+
+def cargar_publicacion(id_publicacion, directorio=DIRECTORIO_POR_DEFECTO):
+    """Lee y valida una publicación. Lanza ValueError si no existe o no es válida."""
+    ruta = ruta_publicacion(id_publicacion, directorio)
+    try:
+        with open(ruta, 'rb') as f:
+            artefacto = json.loads(f.read())
+    except FileNotFoundError:
+        raise ValueError(f"la publicación {id_publicacion} no existe")
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError(f"la publicación {id_publicacion} está dañada ({e})")
+    if not isinstance(artefacto, dict) or artefacto.get('formato') != FORMATO_PUBLICACION:
+        raise ValueError(f"{id_publicacion} no es una publicación de la plataforma")
+    if artefacto.get('version', 0) > VERSION_PUBLICACION:
+        raise ValueError(f"versión de publicación {artefacto['version']} no soportada")
+    return artefacto
+
+
+def especies_publicadas(artefacto):
+    """Agregado por especie de la publicación como DataFrame (mismas columnas que el tablero)."""
+    return pd.DataFrame(artefacto['especies'])
@@ -0,0 +1,317 @@
+"""
+Simulación estocástica de la supervivencia y la reposición de los árboles de cada lote.
+
+El inventario supone que los 'Cantidad' árboles de un lote viven para siempre, lo que sobrestima
+el CO2e proyectado. Aquí cada lote es una cohorte que pierde árboles cada año con una mortalidad
+anual por especie (mayor durante el establecimiento) y, según la política, se repone con plantones:
+
+    vivos[t] ~ Binomial(vivos[t-1], 1 - m(edad))     m = mortalidad de establecimiento si
+                                                      edad < ANIOS_ESTABLECIMIENTO, si no adulta
+    reposición al final del año t (política):
+      'ninguna' : no se repone
+      'anual'   : se repone todo lo muerto hasta completar 'Cantidad' (los primeros `anios` años, 0 = todo el horizonte)
+      'umbral'  : se repone hasta 'Cantidad' solo cuando los vivos bajan de `umbral` × 'Cantidad'
+    costo[t]  = plantones repuestos × Precio_Plantón de la especie
+    CO2e[t]   = vivos originales × stock por árbol del lote (creditos_carbono.proyectar_stock_co2e)
+              + Σ plantones vivos de cada año de reposición × stock de un plantón de esa edad
+
+Cada cohorte de reposición conserva su año de plantación (su edad define su mortalidad y su stock).
+Las cohortes en establecimiento se sortean una por una; las ya adultas comparten la mortalidad, así
+que se sortea una sola binomial para todas (su suma es exacta) y los sobrevivientes se reparten
+entre ellas en proporción a su tamaño (el reparto por edad es su valor esperado), de modo que los
+sorteos por año no crecen con la cantidad de cohortes.
+
+Las simulaciones se evalúan como arreglos simulaciones × lotes (× cohortes de reposición) por
+bloques de lotes, para acotar la memoria. Con la política 'ninguna' o 'anual' los lotes con los
+mismos parámetros se simulan juntos (la suma de binomiales con la misma probabilidad es binomial y
+la reposición completa cada lote por igual); con 'umbral' cada lote decide por sí mismo.
+
+Las simulaciones se reparten por bloques en un pool de procesos (opcional); cada bloque usa su propia
+semilla (SeedSequence.spawn), por lo que el resultado para una semilla no depende de los procesos.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from creditos_carbono import ESPECIE_MANUAL, HORIZONTE_POR_DEFECTO, parametros_crecimiento, proyectar_stock_co2e
+from motor_co2e import FACTOR_KG_A_TON
+from trabajos_fondo import TrabajoCancelado
+
+MORTALIDAD_ESTABLECIMIENTO_POR_DEFECTO = 0.15 # Fracción anual durante los primeros años
+MORTALIDAD_ADULTA_POR_DEFECTO = 0.03 # Fracción anual después del establecimiento
+ANIOS_ESTABLECIMIENTO = 2
+DAP_PLANTON_CM = 1.0 # Tamaño de un plantón de reposición (año 0 de su cohorte)
+ALTURA_PLANTON_M = 0.5
+SIMULACIONES_POR_DEFECTO = 500
+SIMULACIONES_POR_BLOQUE = 50 # Simulaciones por tarea del pool
+CELDAS_POR_BLOQUE = 4_000_000 # Simulaciones × lotes × cohortes en memoria por bloque de lotes
+SEMILLA_POR_DEFECTO = 2024
+CUANTILES = (0.05, 0.95)
+POLITICAS_REPOSICION = {
+    'ninguna': 'Sin reposición',
+    'anual': 'Reponer las muertes cada año',
+    'umbral': 'Reponer al bajar de un umbral de supervivencia',
+}
+
+
+def tasas_por_lote(especies, tasas_mortalidad):
+    """Mortalidad de establecimiento y adulta de cada lote. `tasas_mortalidad`: especie -> (establecimiento, adulta)."""
+    establecimiento = especies.map({nombre: tasas[0] for nombre, tasas in tasas_mortalidad.items()})
+    adulta = especies.map({nombre: tasas[1] for nombre, tasas in tasas_mortalidad.items()})
+    return (
+        pd.to_numeric(establecimiento, errors='coerce').fillna(MORTALIDAD_ESTABLECIMIENTO_POR_DEFECTO).clip(0.0, 1.0).to_numpy(dtype=float),
+        pd.to_numeric(adulta, errors='coerce').fillna(MORTALIDAD_ADULTA_POR_DEFECTO).clip(0.0, 1.0).to_numpy(dtype=float),
+    )
+
+
+def supervivencia_hasta(anios, m_establecimiento, m_adulta):
+    """Probabilidad de que un árbol plantado hace `anios` años siga vivo."""
+    anios = np.asarray(anios, dtype=float)
+    anios_establecimiento = np.minimum(anios, ANIOS_ESTABLECIMIENTO)
+    return (1.0 - m_establecimiento) ** anios_establecimiento * (1.0 - m_adulta) ** np.maximum(anios - ANIOS_ESTABLECIMIENTO, 0.0)
+
+
+def ranuras_reposicion(politica, horizonte):
+    """Cantidad de años en que puede haber reposición (una cohorte por año)."""
+    if politica['tipo'] == 'ninguna':
+        return 0
+    if politica['tipo'] == 'anual' and politica.get('anios'):
+        return min(int(politica['anios']), horizonte)
+    return horizonte
+
+
+def preparar_cohortes(df_inventario, species_info, tasas_mortalidad, horizonte, agrupar=True, cantidad_es_plantada=False):
+    """
+    Arreglos de la simulación (un elemento por grupo de lotes idénticos, o por lote si `agrupar` es
+    False) y el grupo de cada lote. Con `cantidad_es_plantada` la 'Cantidad' son los árboles plantados
+    y los vivos de hoy se sortean con la supervivencia desde la plantación.
+    """
+    dap_max, altura_max, tiempo_max = parametros_crecimiento(df_inventario, species_info)
+    m_establecimiento, m_adulta = tasas_por_lote(df_inventario['Especie'], tasas_mortalidad)
+    precio_especie = df_inventario['Especie'].map({nombre: datos.get('Precio_Plantón') for nombre, datos in species_info.items() if nombre != ESPECIE_MANUAL})
+    precio = pd.to_numeric(precio_especie, errors='coerce').fillna(df_inventario['Precio Plantón Unitario (S/)']).to_numpy(dtype=float)
+    parametros = pd.DataFrame({
+        'rho': df_inventario['Densidad (ρ)'].to_numpy(dtype=float),
+        'dap': df_inventario['DAP (cm)'].to_numpy(dtype=float),
+        'altura': df_inventario['Altura (m)'].to_numpy(dtype=float),
+        'anios': df_inventario['Años Plantados'].to_numpy(dtype=float),
+        'dap_max': dap_max, 'altura_max': altura_max, 'tiempo_max': tiempo_max,
+        'm_establecimiento': m_establecimiento, 'm_adulta': m_adulta, 'precio': precio,
+        'cantidad': df_inventario['Cantidad'].to_numpy(dtype=np.int64),
+    })
+    if agrupar:
+        columnas = list(parametros.columns[:-1])
+        grupo = parametros.groupby(columnas, sort=False).ngroup().to_numpy()
+        distintos = parametros.groupby(columnas, sort=False)['cantidad'].sum().reset_index()
+    else:
+        grupo = np.arange(len(parametros))
+        distintos = parametros
+
+    stock_original = proyectar_stock_co2e(
+        distintos['rho'], distintos['dap'], distintos['altura'], distintos['anios'],
+        distintos['dap_max'], distintos['altura_max'], distintos['tiempo_max'], horizonte
+    ) / FACTOR_KG_A_TON
+    n = len(distintos)
+    stock_planton = proyectar_stock_co2e(
+        distintos['rho'], np.full(n, DAP_PLANTON_CM), np.full(n, ALTURA_PLANTON_M), np.zeros(n),
+        distintos['dap_max'], distintos['altura_max'], distintos['tiempo_max'], horizonte
+    ) / FACTOR_KG_A_TON
+    m_est, m_adu = distintos['m_establecimiento'].to_numpy(), distintos['m_adulta'].to_numpy()
+    datos = {
+        'cantidad': distintos['cantidad'].to_numpy(dtype=np.int64),
+        'anios': distintos['anios'].to_numpy(),
+        'm_establecimiento': m_est,
+        'm_adulta': m_adu,
+        'precio': distintos['precio'].to_numpy(),
+        'stock_original': stock_original,
+        'stock_planton': stock_planton,
+        'supervivencia_inicial': supervivencia_hasta(distintos['anios'], m_est, m_adu) if cantidad_es_plantada else None,
+    }
+    return datos, grupo
+
+
+def simular_bloque(datos, politica, n_simulaciones, semilla):
+    """
+    Simulaciones de un bloque (se ejecuta en los procesos del pool). Retorna los totales del proyecto
+    por simulación y año ('vivos', 'co2e', 'costo', 'repuestos': simulaciones × años) y la suma
+    sobre las simulaciones de los valores finales de cada grupo ('*_final_grupo').
+    """
+    rng = np.random.default_rng(semilla)
+    horizonte = datos['stock_original'].shape[1] - 1
+    ranuras = ranuras_reposicion(politica, horizonte)
+    n_grupos = len(datos['cantidad'])
+    totales = {nombre: np.zeros((n_simulaciones, horizonte + 1)) for nombre in ('vivos', 'co2e', 'costo', 'repuestos')}
+    finales = {nombre: np.zeros(n_grupos) for nombre in ('vivos_final_grupo', 'co2e_final_grupo', 'repuestos_final_grupo', 'costo_final_grupo')}
+    tamano = max(1, CELDAS_POR_BLOQUE // (n_simulaciones * (ranuras + 1)))
+
+    for inicio in range(0, n_grupos, tamano):
+        bloque = slice(inicio, inicio + tamano)
+        cantidad, edad_inicial, precio = datos['cantidad'][bloque], datos['anios'][bloque], datos['precio'][bloque]
+        sup_establecimiento, sup_adulta = 1.0 - datos['m_establecimiento'][bloque], 1.0 - datos['m_adulta'][bloque]
+        stock_original, stock_planton = datos['stock_original'][bloque], datos['stock_planton'][bloque]
+        if datos['supervivencia_inicial'] is None:
+            originales = np.broadcast_to(cantidad, (n_simulaciones, len(cantidad))).copy()
+        else:
+            originales = rng.binomial(cantidad, datos['supervivencia_inicial'][bloque], size=(n_simulaciones, len(cantidad)))
+        # Cohorte k: plantones repuestos al final del año k + 1 (reales: las adultas se reparten en proporción)
+        repuestos = np.zeros((n_simulaciones, len(cantidad), ranuras))
+        repuestos_lote = np.zeros((n_simulaciones, len(cantidad)))
+        costo_lote = np.zeros((n_simulaciones, len(cantidad)))
+        totales['vivos'][:, 0] += originales.sum(axis=1)
+        totales['co2e'][:, 0] += originales @ stock_original[:, 0]
+
+        for anio in range(1, horizonte + 1):
+            edad = edad_inicial + anio - 1
+            originales = rng.binomial(originales, np.where(edad < ANIOS_ESTABLECIMIENTO, sup_establecimiento, sup_adulta))
+            plantadas = min(anio - 1, ranuras)
+            adultas = min(max(anio - 1 - ANIOS_ESTABLECIMIENTO, 0), plantadas) # Cohortes con edad >= ANIOS_ESTABLECIMIENTO
+            if plantadas > adultas:
+                jovenes = repuestos[:, :, adultas:plantadas]
+                repuestos[:, :, adultas:plantadas] = rng.binomial(np.rint(jovenes).astype(np.int64), sup_establecimiento[:, None])
+            if adultas:
+                grupo_adulto = repuestos[:, :, :adultas].sum(axis=2)
+                sobrevivientes = rng.binomial(np.rint(grupo_adulto).astype(np.int64), sup_adulta)
+                factor = np.divide(sobrevivientes, grupo_adulto, out=np.zeros_like(grupo_adulto), where=grupo_adulto > 0)
+                repuestos[:, :, :adultas] *= factor[:, :, None]
+            vivos = originales + np.rint(repuestos[:, :, :plantadas].sum(axis=2)).astype(np.int64)
+
+            if anio <= ranuras:
+                deficit = cantidad - vivos
+                if politica['tipo'] == 'umbral':
+                    deficit = np.where(vivos < politica['umbral'] * cantidad, deficit, 0)
+                repuestos[:, :, anio - 1] = deficit
+                vivos = vivos + deficit
+                repuestos_lote += deficit
+                costo_lote += deficit * precio
+                totales['repuestos'][:, anio] += deficit.sum(axis=1)
+                totales['costo'][:, anio] += deficit @ precio
+
+            cohortes = min(anio, ranuras)
+            co2e_lote = originales * stock_original[:, anio]
+            if cohortes:
+                edades_stock = anio - np.arange(1, cohortes + 1)
+                co2e_lote = co2e_lote + np.einsum('slc,lc->sl', repuestos[:, :, :cohortes], stock_planton[:, edades_stock])
+            totales['vivos'][:, anio] += vivos.sum(axis=1)
+            totales['co2e'][:, anio] += co2e_lote.sum(axis=1)
+
+        if horizonte == 0:
+            vivos, co2e_lote = originales, originales * stock_original[:, 0]
+        finales['vivos_final_grupo'][bloque] = vivos.sum(axis=0)
+        finales['co2e_final_grupo'][bloque] = co2e_lote.sum(axis=0)
+        finales['repuestos_final_grupo'][bloque] = repuestos_lote.sum(axis=0)
+        finales['costo_final_grupo'][bloque] = costo_lote.sum(axis=0)
+    return {**totales, **finales}
+
+
+def simular_paralelo(datos, politica, n_simulaciones=SIMULACIONES_POR_DEFECTO, semilla=SEMILLA_POR_DEFECTO, trabajadores=None, on_progreso=None, cancelado=None):
+    """
+    Simulaciones por bloques de SIMULACIONES_POR_BLOQUE, en un pool de procesos (o en este proceso
+    con `trabajadores`=1). Combina los bloques en el orden de sus semillas. Si `cancelado()` retorna
+    True entre bloques, cancela los pendientes y lanza TrabajoCancelado.
+    """
+    tamanos = [min(SIMULACIONES_POR_BLOQUE, n_simulaciones - inicio) for inicio in range(0, n_simulaciones, SIMULACIONES_POR_BLOQUE)]
+    semillas = np.random.SeedSequence(semilla).spawn(len(tamanos))
+    resultados = [None] * len(tamanos)
+
+    def registrar(completados, i, resultado):
+        resultados[i] = resultado
+        if on_progreso is not None:
+            on_progreso(completados / len(tamanos))
+
+    trabajadores = trabajadores or os.cpu_count() or 1
+    if trabajadores == 1:
+        for i, (tamano, semilla_bloque) in enumerate(zip(tamanos, semillas)):
+            if cancelado is not None and cancelado():
+                raise TrabajoCancelado()
+            registrar(i + 1, i, simular_bloque(datos, politica, tamano, semilla_bloque))
+    else:
+        with ProcessPoolExecutor(max_workers=trabajadores) as pool:
+            futuros = {pool.submit(simular_bloque, datos, politica, tamano, semilla_bloque): i for i, (tamano, semilla_bloque) in enumerate(zip(tamanos, semillas))}
+            for completados, futuro in enumerate(as_completed(futuros), start=1):
+                if cancelado is not None and cancelado():
+                    for pendiente in futuros:
+                        pendiente.cancel()
+                    raise TrabajoCancelado()
+                registrar(completados, futuros[futuro], futuro.result())
+
+    combinado = {nombre: np.vstack([r[nombre] for r in resultados]) for nombre in ('vivos', 'co2e', 'costo', 'repuestos')}
+    for nombre in ('vivos_final_grupo', 'co2e_final_grupo', 'repuestos_final_grupo', 'costo_final_grupo'):
+        combinado[nombre] = sum(r[nombre] for r in resultados)
+    return combinado
+
+
+def _bandas(matriz, prefijo, unidad):
+    bajo, alto = CUANTILES
+    return {
+        f'{prefijo} Media{unidad}': matriz.mean(axis=0),
+        f'{prefijo} P{bajo * 100:g}{unidad}': np.quantile(matriz, bajo, axis=0),
+        f'{prefijo} P{alto * 100:g}{unidad}': np.quantile(matriz, alto, axis=0),
+    }
+
+
+def simular_supervivencia(df_inventario, species_info, tasas_mortalidad, politica, horizonte=HORIZONTE_POR_DEFECTO,
+                          n_simulaciones=SIMULACIONES_POR_DEFECTO, semilla=SEMILLA_POR_DEFECTO, cantidad_es_plantada=False,
+                          trabajadores=None, on_progreso=None, cancelado=None):
+    """
+    Simulación completa del inventario recalculado (salida de recalcular_inventario). `politica`:
+    {'tipo': 'ninguna' | 'anual' | 'umbral', 'anios': años con reposición (0 = todos), 'umbral': fracción}.
+    Retorna un dict con:
+      'anual'   : DataFrame por año (vivos, CO2e y costo acumulado: media y cuantiles; CO2e sin mortalidad)
+      'lotes'   : DataFrame por lote (valores medios al final del horizonte)
+      'resumen' : totales al final del horizonte
+      'co2e_final', 'costo_total': distribución por simulación (arreglos)
+    """
+    agrupar = politica['tipo'] != 'umbral'
+    datos, grupo = preparar_cohortes(df_inventario, species_info, tasas_mortalidad, horizonte, agrupar=agrupar, cantidad_es_plantada=cantidad_es_plantada)
+    sim = simular_paralelo(datos, politica, n_simulaciones=n_simulaciones, semilla=semilla, trabajadores=trabajadores, on_progreso=on_progreso, cancelado=cancelado)
+
+    co2e_sin_mortalidad = datos['cantidad'] @ datos['stock_original']
+    costo_acumulado = np.cumsum(sim['costo'], axis=1)
+    anual = pd.DataFrame({
+        'Año': np.arange(horizonte + 1),
+        **_bandas(sim['vivos'], 'Árboles Vivos', ''),
+        **_bandas(sim['co2e'], 'CO2e', ' (Ton)'),
+        'CO2e sin Mortalidad (Ton)': co2e_sin_mortalidad,
+        'Plantones Repuestos Media': sim['repuestos'].mean(axis=0),
+        'Costo Reposición Media (S/)': sim['costo'].mean(axis=0),
+        **_bandas(costo_acumulado, 'Costo Acumulado', ' (S/)'),
+    })
+
+    # Por lote: media del grupo repartida según la cantidad del lote (lotes del grupo son idénticos)
+    cantidad_lote = df_inventario['Cantidad'].to_numpy(dtype=float)
+    cantidad_grupo = datos['cantidad'].astype(float)[grupo]
+    parte = np.divide(cantidad_lote, cantidad_grupo, out=np.zeros_like(cantidad_lote), where=cantidad_grupo > 0) / n_simulaciones
+    vivos_final = sim['vivos_final_grupo'][grupo] * parte
+    lotes = pd.DataFrame({
+        'ID Lote': df_inventario['ID Lote'].to_numpy() if 'ID Lote' in df_inventario.columns else np.arange(1, len(df_inventario) + 1),
+        'Especie': df_inventario['Especie'].to_numpy(),
+        'Cantidad': cantidad_lote,
+        'Árboles Vivos Final (media)': vivos_final,
+        'Supervivencia Final (%)': np.divide(vivos_final, cantidad_lote, out=np.full_like(vivos_final, np.nan), where=cantidad_lote > 0) * 100,
+        'Plantones Repuestos (media)': sim['repuestos_final_grupo'][grupo] * parte,
+        'Costo Reposición (S/)': sim['costo_final_grupo'][grupo] * parte,
+        'CO2e Final (Ton)': sim['co2e_final_grupo'][grupo] * parte,
+        'CO2e Final sin Mortalidad (Ton)': cantidad_lote * datos['stock_original'][grupo, -1],
+    })
+
+    co2e_final, costo_total = sim['co2e'][:, -1], costo_acumulado[:, -1]
+    bajo, alto = CUANTILES
+    resumen = {
+        'vivos_final': float(sim['vivos'][:, -1].mean()),
+        'arboles_inicio': float(datos['cantidad'].sum()),
+        'co2e_final': float(co2e_final.mean()),
+        'co2e_final_bajo': float(np.quantile(co2e_final, bajo)),
+        'co2e_final_alto': float(np.quantile(co2e_final, alto)),
+        'co2e_sin_mortalidad': float(co2e_sin_mortalidad[-1]),
+        'costo_total': float(costo_total.mean()),
+        'costo_total_alto': float(np.quantile(costo_total, alto)),
+        'repuestos_total': float(sim['repuestos'].sum(axis=1).mean()),
+    }
+    return {
+        'anual': anual, 'lotes': lotes, 'resumen': resumen,
+        'co2e_final': co2e_final, 'costo_total': costo_total,
+        'simulaciones': n_simulaciones, 'horizonte': horizonte, 'politica': dict(politica), 'semilla': semilla,
+        'grupos_simulados': len(datos['cantidad']),
+    }
@@ -0,0 +1,72 @@
+"""
+Tabla virtualizada: orden y filtro en el servidor, y solo la ventana visible va al navegador.
+
+st.dataframe serializa la tabla completa (y un Styler, además, genera el formato de cada celda),
+por lo que una tabla de cientos de miles de filas se vuelve lenta y pesada. IndiceTabla guarda
+la tabla una vez por versión y responde a cada rerun con las posiciones de la ventana pedida:
+
+  - Orden: permutación estable por columna y sentido (argsort), calculada una vez y memorizada.
+  - Filtro por texto: se compara contra los valores distintos de cada columna de búsqueda
+    (pd.factorize) y se traduce a las filas con los códigos, sin recorrer cada celda.
+  - Ventana: posiciones[inicio:inicio + tamaño] de la permutación filtrada; solo esas filas
+    se copian a la tabla que se envía.
+"""
+import numpy as np
+import pandas as pd
+
+MAX_FILTROS_MEMORIZADOS = 8
+
+
+class IndiceTabla:
+    """Índice de orden y búsqueda sobre una tabla fija (una instancia por versión de la tabla)."""
+
+    def __init__(self, df, columnas_busqueda=()):
+        self.df = df
+        self._ordenes = {}
+        self._filtros = {}
+        self._categorias = {}
+        for columna in columnas_busqueda:
+            if columna in df.columns:
+                codigos, valores = pd.factorize(df[columna].astype(str), sort=False)
+                self._categorias[columna] = (codigos, pd.Series(valores))
+
+    def __len__(self):
+        return len(self.df)
+
+    def orden(self, columna, descendente=False):
+        """Posiciones de las filas ordenadas por `columna` (estable, valores vacíos al final). None = orden original."""
+        if columna is None:
+            return np.arange(len(self.df))
+        clave = (columna, descendente)
+        if clave not in self._ordenes:
+            serie = self.df[columna].reset_index(drop=True)
+            self._ordenes[clave] = serie.sort_values(ascending=not descendente, kind='stable', na_position='last').index.to_numpy()
+        return self._ordenes[clave]
+
+    def coincidencias(self, texto):
+        """Máscara de filas cuyo valor contiene `texto` (sin distinguir mayúsculas) en alguna columna de búsqueda."""
+        texto = (texto or '').strip()
+        if not texto:
+            return None
+        if texto not in self._filtros:
+            mascara = np.zeros(len(self.df), dtype=bool)
+            for codigos, valores in self._categorias.values():
+                encontrados = valores.str.contains(texto, case=False, regex=False).to_numpy()
+                mascara |= encontrados[codigos]
+            if len(self._filtros) >= MAX_FILTROS_MEMORIZADOS:
+                self._filtros.pop(next(iter(self._filtros)))
+            self._filtros[texto] = mascara
+        return self._filtros[texto]
+
+    def posiciones(self, columna_orden=None, descendente=False, texto=None, mascara=None):
+        """Posiciones (en orden) de las filas que pasan el filtro de texto y la máscara adicional."""
+        orden = self.orden(columna_orden, descendente)
+        filtro = self.coincidencias(texto)
+        if mascara is not None:
+            filtro = mascara if filtro is None else (filtro & mascara)
+        return orden if filtro is None else orden[filtro[orden]]
+
+    def ventana(self, posiciones, inicio, tamano, columnas=None):
+        """Filas de la ventana [inicio, inicio + tamaño) de `posiciones` (solo esas se copian)."""
+        filas = self.df.iloc[posiciones[inicio:inicio + tamano]]
+        return filas if columnas is None else filas[columnas]
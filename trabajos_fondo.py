@@ -0,0 +1,148 @@
+"""
+Trabajos en segundo plano (exportaciones, censos y simulaciones largas).
+
+Los trabajos se ejecutan en un pool de hilos fuera del hilo del script de Streamlit, por lo que
+la página sigue respondiendo y un clic del usuario (rerun) no los reinicia. Cada trabajo tiene
+un ID, informa su avance por partes, puede cancelarse y conserva su resultado hasta que la
+sesión que lo envió lo recoge.
+
+Las funciones de trabajo reciben un ContextoTrabajo como primer argumento:
+
+    def mi_trabajo(ctx, datos):
+        for i, parte in enumerate(partes):
+            ctx.verificar()                       # lanza TrabajoCancelado si se pidió cancelar
+            ...
+            ctx.reportar((i + 1) / len(partes), "Procesando...")
+        return resultado
+"""
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+TRABAJADORES_POR_DEFECTO = 2
+TTL_RESULTADOS_S = 3600 # Resultados no recogidos se descartan tras 1 hora
+
+PENDIENTE = 'pendiente'
+EN_CURSO = 'en curso'
+COMPLETADO = 'completado'
+CANCELADO = 'cancelado'
+ERROR = 'error'
+ESTADOS_FINALES = (COMPLETADO, CANCELADO, ERROR)
+
+
+class TrabajoCancelado(Exception):
+    """Se lanza dentro de un trabajo cuando el usuario pidió cancelarlo."""
+
+
+class ContextoTrabajo:
+    """Canal entre el trabajo y la UI: avance, mensaje y señal de cancelación."""
+
+    def __init__(self):
+        self.progreso = 0.0 # Fracción 0..1, o None si el avance total es desconocido
+        self.mensaje = ''
+        self._cancelar = threading.Event()
+
+    def reportar(self, progreso, mensaje=''):
+        self.progreso = progreso
+        self.mensaje = mensaje
+
+    def cancelado(self):
+        return self._cancelar.is_set()
+
+    def verificar(self):
+        if self._cancelar.is_set():
+            raise TrabajoCancelado()
+
+
+class Trabajo:
+    """Estado de un trabajo enviado al gestor."""
+
+    def __init__(self, id_trabajo, descripcion, propietario):
+        self.id = id_trabajo
+        self.descripcion = descripcion
+        self.propietario = propietario
+        self.estado = PENDIENTE
+        self.contexto = ContextoTrabajo()
+        self.resultado = None
+        self.error = None
+        self.creado = time.time()
+        self.terminado = None
+
+    @property
+    def progreso(self):
+        return self.contexto.progreso
+
+    @property
+    def mensaje(self):
+        return self.contexto.mensaje
+
+    @property
+    def finalizado(self):
+        return self.estado in ESTADOS_FINALES
+
+
+class GestorTrabajos:
+    """Pool de trabajos en segundo plano compartido por todas las sesiones del proceso."""
+
+    def __init__(self, trabajadores=TRABAJADORES_POR_DEFECTO, ttl_resultados_s=TTL_RESULTADOS_S):
+        self._pool = ThreadPoolExecutor(max_workers=trabajadores, thread_name_prefix='trabajo')
+        self._trabajos = {}
+        self._lock = threading.Lock()
+        self.ttl_resultados_s = ttl_resultados_s
+
+    def enviar(self, funcion, *args, descripcion='', propietario=None, **kwargs):
+        """Envía `funcion(ctx, *args, **kwargs)` al pool y retorna el ID del trabajo."""
+        self._purgar_expirados()
+        trabajo = Trabajo(uuid.uuid4().hex[:12], descripcion, propietario)
+        with self._lock:
+            self._trabajos[trabajo.id] = trabajo
+        self._pool.submit(self._ejecutar, trabajo, funcion, args, kwargs)
+        return trabajo.id
+
+    def _ejecutar(self, trabajo, funcion, args, kwargs):
+        if trabajo.contexto.cancelado():
+            estado = CANCELADO
+        else:
+            trabajo.estado = EN_CURSO
+            try:
+                trabajo.resultado = funcion(trabajo.contexto, *args, **kwargs)
+                estado = COMPLETADO
+                trabajo.contexto.reportar(1.0, trabajo.contexto.mensaje)
+            except TrabajoCancelado:
+                estado = CANCELADO
+            except Exception as e:
+                print(f"Error en el trabajo en segundo plano '{trabajo.descripcion}' ({trabajo.id}): {e}")
+                trabajo.error = e
+                estado = ERROR
+        # 'terminado' antes del estado final: otra sesión puede purgar en cuanto el trabajo figura como finalizado
+        trabajo.terminado = time.time()
+        trabajo.estado = estado
+
+    def obtener(self, id_trabajo):
+        """Retorna el Trabajo (o None si no existe o ya fue recogido)."""
+        with self._lock:
+            return self._trabajos.get(id_trabajo)
+
+    def trabajos_de(self, propietario):
+        with self._lock:
+            return [t for t in self._trabajos.values() if t.propietario == propietario]
+
+    def cancelar(self, id_trabajo):
+        trabajo = self.obtener(id_trabajo)
+        if trabajo is not None and not trabajo.finalizado:
+            trabajo.contexto._cancelar.set()
+
+    def recoger(self, id_trabajo):
+        """Retira un trabajo finalizado del gestor y lo retorna (el resultado deja de conservarse)."""
+        with self._lock:
+            trabajo = self._trabajos.get(id_trabajo)
+            if trabajo is None or not trabajo.finalizado:
+                return None
+            return self._trabajos.pop(id_trabajo)
+
+    def _purgar_expirados(self):
+        limite = time.time() - self.ttl_resultados_s
+        with self._lock:
+            for id_trabajo in [i for i, t in self._trabajos.items() if t.finalizado and t.terminado is not None and t.terminado < limite]:
+                del self._trabajos[id_trabajo]